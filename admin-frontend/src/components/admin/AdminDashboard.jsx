@@ -1,39 +1,15 @@
-import React, { useState, useEffect } from "react";
+import React, { useState } from "react";
 import Tabs from "./Tabs";
 import ConversationList from "./ConversationList";
 import ChatBox from "./ChatBox";
 import LogoutButton from "../auth/LogoutButton";
-import fetchWithAuth from "../../fetchWithAuth";
 
 const AdminDashboard = () => {
   const [activeTab, setActiveTab] = useState("open");
   const [selectedConversation, setSelectedConversation] = useState(null);
+  // Unviewed followup badge; pushed over /admin-ws (followup_count frames), never polled
   const [followupCount, setFollowupCount] = useState(0);
 
-  // Fetch unviewed followup count
-  const loadFollowupCount = async () => {
-    try {
-      const data = await fetchWithAuth("/admin/api/followups/unviewed-count");
-      setFollowupCount(data.count || 0);
-    } catch (err) {
-      console.error("Failed to fetch followup count:", err);
-    }
-  };
-
-  // Fetch followup count when dashboard loads
-  useEffect(() => {
-    loadFollowupCount();
-
-    // Refresh count every 30 seconds
-    const interval = setInterval(loadFollowupCount, 30000);
-    return () => clearInterval(interval);
-  }, []);
-
-  // Function to refresh followup count (passed to ChatBox)
-  const handleFollowupViewed = () => {
-    loadFollowupCount();
-  };
-
   return (
     <div className="h-screen flex flex-col">
       <div className="flex items-center justify-between p-4 border-b">
@@ -46,10 +22,10 @@ const AdminDashboard = () => {
         <ConversationList
           type={activeTab}
           onSelect={setSelectedConversation}
+          onFollowupCount={setFollowupCount}
         />
         <ChatBox
           conversation={selectedConversation}
-          onFollowupViewed={handleFollowupViewed}
         />
       </div>
     </div>
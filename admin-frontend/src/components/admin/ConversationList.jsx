@@ -1,8 +1,8 @@
 import React, { useEffect, useState, useRef } from "react";
 import fetchWithAuth from "../../fetchWithAuth";
 
-// Props: type (tab) and onSelect callback
-const ConversationList = ({ type = "open", onSelect = () => {} }) => {
+// Props: type (tab), onSelect callback and onFollowupCount (badge updates from /admin-ws)
+const ConversationList = ({ type = "open", onSelect = () => {}, onFollowupCount = () => {} }) => {
   const [conversations, setConversations] = useState([]);
   const [error, setError] = useState(null);
   const [selectedConvos, setSelectedConvos] = useState(new Set());
@@ -97,6 +97,32 @@ const ConversationList = ({ type = "open", onSelect = () => {} }) => {
             return;
           }
 
+          // unviewed followup badge: sent on connect and whenever the count changes
+          if (data && data.type === "followup_count") {
+            onFollowupCount(data.count || 0);
+            return;
+          }
+
+          // batched close (auto-close sweep): one frame listing every closed conversation
+          if (data && data.type === "conversations_closed" && Array.isArray(data.conversations)) {
+            if (type === "open" || type === "escalated") {
+              const closed = new Set(data.conversations.map((c) => `${c.user_id}-${c.channel}`));
+              setConversations((prev) => prev.filter((p) => !closed.has(`${p.user_id}-${p.channel}`)));
+            }
+            return;
+          }
+
+          // batched followup updates (bulk archive / bulk mark-viewed)
+          if (data && (data.type === "followups_archived" || data.type === "followups_viewed") && Array.isArray(data.ids)) {
+            if (type === "followups") {
+              const ids = new Set(data.ids);
+              setConversations((prev) => data.type === "followups_archived"
+                ? prev.filter((p) => !ids.has(p.id))
+                : prev.map((p) => (ids.has(p.id) ? { ...p, viewed: 1 } : p)));
+            }
+            return;
+          }
+
           // or server may send incremental enriched objects (no `type`)
           if (data && data.user_id) {
             setConversations((prev) => {
@@ -208,14 +234,11 @@ const ConversationList = ({ type = "open", onSelect = () => {} }) => {
       // For followups, the key is just the ID
       const followupIds = Array.from(selectedConvos).map(key => parseInt(key));
 
-      // Delete each followup
-      await Promise.all(
-        followupIds.map(id =>
-          fetchWithAuth(`/admin/api/followups/${id}`, {
-            method: "DELETE"
-          })
-        )
-      );
+      // Archive all selected followups in one request
+      await fetchWithAuth("/admin/api/followups/archive-bulk", {
+        method: "POST",
+        body: JSON.stringify({ ids: followupIds })
+      });
 
       alert(`Successfully deleted ${selectedConvos.size} followup(s)`);
       clearSelection();
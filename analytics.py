@@ -1,27 +1,7 @@
+from events import log_event as queue_event
 
-import json
-import sqlite3
-from datetime import datetime
 
-def log_event(user_id: int, tenant_id: int, event_type: str, data: dict = None):
-    try:
-        conn = sqlite3.connect("handoff.sqlite")
-        cursor = conn.cursor()
-
-        cursor.execute("""
-            INSERT INTO events (timestamp, user_id, tenant_id, event_type, data)
-            VALUES (?, ?, ?, ?, ?)
-        """, (
-            datetime.utcnow().isoformat(),
-            user_id,
-            tenant_id,
-            event_type,
-            json.dumps(data or {})
-        ))
-
-        conn.commit()
-        print(f"📊 Logged event: {event_type} for user {user_id}")
-    except Exception as e:
-        print(f"⚠️ Failed to log event: {e}")
-    finally:
-        conn.close()
+def log_event(user_id: int, tenant_id: int, event_type: str, data: dict = None, conversation_id: int = None):
+    """Queue an analytics event into the canonical events table (see events.py)"""
+    return queue_event(event_type, user_id=user_id, tenant_id=tenant_id,
+                       conversation_id=conversation_id, payload=data)
@@ -0,0 +1,150 @@
+"""
+Tiered message storage.
+
+Messages that belong to conversations closed for longer than a threshold are
+moved out of the hot ``messages`` table into a separate SQLite file
+(``<db>_archive.sqlite``) that is ATTACHed as ``archive``.  Readers query the
+``all_messages`` temp view, which is a UNION ALL over both tiers, so callers
+never need to know where a message lives.
+
+Message ids are preserved when rows are moved, so ``ORDER BY id`` is stable
+across tiers.  A batch commits to both files in one transaction, but in WAL
+mode SQLite does not make that atomic across files.  A crash can leave a
+row committed in the archive and still present in the hot table.  The view
+therefore takes such a row from the hot tier only, at the cost of one
+primary-key probe per archived row read.  The next batch finishes the move,
+because it re-selects the row and its INSERT OR IGNORE skips the copy.
+"""
+import logging
+import sqlite3
+from pathlib import Path
+
+import timestamps
+
+ARCHIVE_SCHEMA = "archive"
+
+
+def archive_path(db_path: str) -> str:
+    """Archive file that sits next to the hot database"""
+    p = Path(db_path)
+    return str(p.with_name(f"{p.stem}_archive{p.suffix or '.sqlite'}"))
+
+
+def is_attached(conn) -> bool:
+    return any(row[1] == ARCHIVE_SCHEMA for row in conn.execute("PRAGMA database_list").fetchall())
+
+
+def attach(conn, db_path: str):
+    """
+    Attach the archive database to ``conn`` and expose the ``all_messages``
+    temp view.  Must be called outside of a transaction.
+    """
+    if is_attached(conn):
+        return conn
+    conn.execute(f"ATTACH DATABASE ? AS {ARCHIVE_SCHEMA}", (archive_path(db_path),))
+    conn.execute(f"PRAGMA {ARCHIVE_SCHEMA}.auto_vacuum=INCREMENTAL")  # new files only, before WAL
+    conn.execute(f"PRAGMA {ARCHIVE_SCHEMA}.journal_mode=WAL")
+    init_schema(conn)
+    conn.execute("""
+        CREATE TEMP VIEW IF NOT EXISTS all_messages AS
+            SELECT id, conversation_id, user_id, channel, sender, text, ts, ts_ms, staff_id FROM main.messages
+            UNION ALL
+            SELECT id, conversation_id, user_id, channel, sender, text, ts, ts_ms, staff_id FROM archive.messages a
+            WHERE NOT EXISTS (SELECT 1 FROM main.messages m WHERE m.id = a.id)
+    """)
+    return conn
+
+
+def init_schema(conn):
+    """Create the archive tables (idempotent, archive must be attached)"""
+    conn.execute(f"""CREATE TABLE IF NOT EXISTS {ARCHIVE_SCHEMA}.messages (
+        id INTEGER PRIMARY KEY,
+        conversation_id INTEGER,
+        user_id TEXT, channel TEXT,
+        sender TEXT, text TEXT, ts TEXT,
+        archived_at TEXT
+    )""")
+    try:
+        conn.execute(f"ALTER TABLE {ARCHIVE_SCHEMA}.messages ADD COLUMN conversation_id INTEGER")
+        conn.execute(f"""UPDATE {ARCHIVE_SCHEMA}.messages SET conversation_id = (
+            SELECT cv.id FROM main.conversations cv
+            WHERE cv.user_id = messages.user_id AND cv.channel = messages.channel)""")
+    except sqlite3.OperationalError:
+        pass
+    conn.execute(f"DROP INDEX IF EXISTS {ARCHIVE_SCHEMA}.idx_archive_messages_convo")
+    conn.execute(f"""CREATE INDEX IF NOT EXISTS {ARCHIVE_SCHEMA}.idx_archive_messages_conversation
+        ON messages(conversation_id, id)""")
+    try:
+        conn.execute(f"ALTER TABLE {ARCHIVE_SCHEMA}.messages ADD COLUMN ts_ms INTEGER")
+        timestamps.backfill_column(conn, f"{ARCHIVE_SCHEMA}.messages", "ts", "ts_ms")
+    except sqlite3.OperationalError:
+        pass
+    try:
+        # Replying agent, kept so metrics.backfill can attribute archived conversations
+        conn.execute(f"ALTER TABLE {ARCHIVE_SCHEMA}.messages ADD COLUMN staff_id INTEGER")
+    except sqlite3.OperationalError:
+        pass
+    conn.execute(f"DROP INDEX IF EXISTS {ARCHIVE_SCHEMA}.idx_archive_messages_ts")
+    conn.execute(f"""CREATE INDEX IF NOT EXISTS {ARCHIVE_SCHEMA}.idx_archive_messages_ts_ms
+        ON messages(ts_ms)""")
+    conn.commit()
+
+
+def archive_batch(conn, closed_before_ms: int, batch_size: int, now: int) -> int:
+    """
+    Move up to ``batch_size`` hot messages of conversations closed before
+    ``closed_before_ms`` (epoch ms) into the archive in a single transaction,
+    stamped as archived at ``now`` (epoch ms).
+
+    Returns the number of messages moved (0 when there is nothing left).
+    """
+    c = conn.cursor()
+    c.execute("CREATE TEMP TABLE IF NOT EXISTS archive_batch (id INTEGER PRIMARY KEY)")
+    c.execute("DELETE FROM temp.archive_batch")
+    c.execute("""
+        INSERT INTO temp.archive_batch (id)
+        SELECT m.id
+        FROM main.messages m
+        JOIN main.conversations cv ON cv.id = m.conversation_id
+        WHERE cv.open = 0 AND cv.updated_at_ms < ?
+        ORDER BY m.id
+        LIMIT ?
+    """, (closed_before_ms, batch_size))
+    moved = c.rowcount
+    if moved <= 0:
+        conn.commit()
+        return 0
+
+    # INSERT OR IGNORE keeps a retried batch idempotent
+    c.execute(f"""
+        INSERT OR IGNORE INTO {ARCHIVE_SCHEMA}.messages (id, conversation_id, user_id, channel, sender, text, ts, ts_ms,
+                                                         staff_id, archived_at)
+        SELECT id, conversation_id, user_id, channel, sender, text, ts, ts_ms, staff_id, ?
+        FROM main.messages WHERE id IN (SELECT id FROM temp.archive_batch)
+    """, (timestamps.to_iso(now),))
+    c.execute("DELETE FROM main.messages WHERE id IN (SELECT id FROM temp.archive_batch)")
+    conn.commit()
+    logging.info(f"[archive] Moved {moved} messages to {ARCHIVE_SCHEMA} tier")
+    return moved
+
+
+def export_and_purge(conn, cutoff_ms: int, conversation_ids=()) -> list:
+    """
+    Return and delete, from both tiers, the messages older than ``cutoff_ms``
+    (epoch ms) plus every message of ``conversation_ids``.  Leaves the
+    transaction open for the caller's purge of dependent rows.
+    """
+    c = conn.cursor()
+    c.execute("CREATE TEMP TABLE IF NOT EXISTS purge_conversations (id INTEGER PRIMARY KEY)")
+    c.execute("DELETE FROM temp.purge_conversations")
+    c.executemany("INSERT OR IGNORE INTO temp.purge_conversations (id) VALUES (?)", [(i,) for i in conversation_ids])
+    c.execute("""SELECT * FROM all_messages
+                 WHERE ts_ms < ? OR conversation_id IN (SELECT id FROM temp.purge_conversations)
+                 ORDER BY id""", (cutoff_ms,))
+    msgs = [dict(r) for r in c.fetchall()]
+    for schema in ("main", ARCHIVE_SCHEMA):
+        c.execute(f"""DELETE FROM {schema}.messages
+                      WHERE ts_ms < ? OR conversation_id IN (SELECT id FROM temp.purge_conversations)""",
+                  (cutoff_ms,))
+    c.execute("DELETE FROM temp.purge_conversations")
+    return msgs
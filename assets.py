@@ -0,0 +1,278 @@
+"""
+Precompressed, cache-friendly static files.
+
+``PrecompressedStaticFiles`` is a drop-in ``StaticFiles`` that keeps small
+files in memory with their gzip (and, when the ``brotli`` package is
+installed, brotli) variants and a content-hash ETag, all computed once -
+at startup via ``warm()``, or at build time as ``.gz``/``.br`` sidecar
+files that are picked up instead of compressing again:
+
+    python assets.py admin-frontend/dist chatbot.js chatbot.min.js
+
+Each request negotiates ``Accept-Encoding``, answers ``If-None-Match`` with
+a 304, and gets ``Cache-Control``:
+
+  * fingerprinted Vite output (``assets/name-<hash>.js``) - immutable, 1 year
+  * everything else - ``no-cache`` (always revalidated against the ETag),
+    unless the mount passes its own policy
+
+A file that changes on disk (size or mtime) is re-read on its next request.
+"""
+import argparse
+import gzip
+import hashlib
+import logging
+import mimetypes
+import os
+import re
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, Optional, Union
+
+from fastapi.staticfiles import StaticFiles
+from starlette.datastructures import Headers
+from starlette.responses import FileResponse, Response
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - optional, gzip only
+    brotli = None
+
+# Files up to this size are held in memory with their variants
+MEMORY_FILE_MAX_BYTES = int(os.getenv("STATIC_MEMORY_FILE_MAX_BYTES", str(1024 * 1024)))
+# Total in-memory budget (identity + compressed bodies), least recently used evicted first
+MEMORY_CACHE_MAX_BYTES = int(os.getenv("STATIC_MEMORY_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+MIN_COMPRESS_BYTES = 512
+
+IMMUTABLE = "public, max-age=31536000, immutable"
+REVALIDATE = "no-cache"
+
+# Vite emits assets/<name>-<8 char hash>.<ext>
+FINGERPRINTED = re.compile(r"(^|/)assets/[^/]+-[A-Za-z0-9_-]{8,}\.[a-z0-9]+$")
+
+COMPRESSIBLE_TYPES = ("text/", "application/javascript", "application/json", "application/xml",
+                      "application/manifest+json", "image/svg+xml")
+
+SIDECARS = {"br": ".br", "gzip": ".gz"}
+
+
+def default_cache_control(rel_path: str) -> str:
+    return IMMUTABLE if FINGERPRINTED.search(rel_path.replace(os.sep, "/")) else REVALIDATE
+
+
+def guess_media_type(path: str) -> str:
+    return mimetypes.guess_type(path)[0] or "text/plain"
+
+
+def _compressible(media_type: str) -> bool:
+    return media_type.startswith(COMPRESSIBLE_TYPES)
+
+
+def _compress(data: bytes) -> Dict[str, bytes]:
+    variants = {}
+    if brotli is not None:
+        variants["br"] = brotli.compress(data, quality=11)
+    variants["gzip"] = gzip.compress(data, compresslevel=9, mtime=0)
+    # Not worth a Vary'd variant if it barely shrinks
+    return {enc: body for enc, body in variants.items() if len(body) < len(data) * 0.9}
+
+
+def negotiate(accept_encoding: str, available) -> str:
+    """Pick br, then gzip, if offered with q > 0; identity otherwise"""
+    prefs = {}
+    for part in accept_encoding.split(","):
+        name, _, params = part.partition(";")
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        prefs[name.strip().lower()] = q
+    for encoding in ("br", "gzip"):
+        if encoding in available and prefs.get(encoding, prefs.get("*", 0)) > 0:
+            return encoding
+    return "identity"
+
+
+class _Asset:
+    __slots__ = ("path", "signature", "etag", "media_type", "variants", "sizes", "nbytes")
+
+    def __init__(self, path: str, signature: tuple, etag: str, media_type: str,
+                 variants: Dict[str, Union[bytes, str]], sizes: Dict[str, int]):
+        self.path = path
+        self.signature = signature
+        self.etag = etag
+        self.media_type = media_type
+        self.variants = variants  # encoding -> body bytes (in memory) or file path
+        self.sizes = sizes
+        self.nbytes = sum(len(v) for v in variants.values() if isinstance(v, bytes))
+
+
+def _signature(stat_result: os.stat_result) -> tuple:
+    return stat_result.st_size, stat_result.st_mtime_ns
+
+
+def build_asset(path: str, stat_result: os.stat_result, media_type: str) -> _Asset:
+    """Hash the file and collect its variants (sidecars first, else compress if small)"""
+    digest = hashlib.sha256()
+    small = stat_result.st_size <= MEMORY_FILE_MAX_BYTES
+    with open(path, "rb") as f:
+        if small:
+            data = f.read()
+            digest.update(data)
+        else:
+            data = None
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                digest.update(chunk)
+    etag = digest.hexdigest()[:20]
+
+    variants: Dict[str, Union[bytes, str]] = {"identity": data if small else path}
+    sizes = {"identity": stat_result.st_size}
+    if _compressible(media_type) and stat_result.st_size >= MIN_COMPRESS_BYTES:
+        for encoding, suffix in SIDECARS.items():
+            sidecar = path + suffix
+            try:
+                sidecar_stat = os.stat(sidecar)
+            except OSError:
+                continue
+            if sidecar_stat.st_mtime_ns < stat_result.st_mtime_ns:
+                continue  # stale: the source changed after the build step
+            if small and sidecar_stat.st_size <= MEMORY_FILE_MAX_BYTES:
+                with open(sidecar, "rb") as f:
+                    variants[encoding] = f.read()
+            else:
+                variants[encoding] = sidecar
+            sizes[encoding] = sidecar_stat.st_size
+        if small and len(variants) == 1:
+            for encoding, body in _compress(data).items():
+                variants[encoding] = body
+                sizes[encoding] = len(body)
+    return _Asset(path, _signature(stat_result), etag, media_type, variants, sizes)
+
+
+class AssetCache:
+    """LRU of built assets, bounded by the bytes held in memory"""
+    def __init__(self, max_bytes: int = MEMORY_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self._assets: "OrderedDict[str, _Asset]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "builds": 0, "not_modified": 0, "bytes_sent": 0, "bytes_saved": 0}
+
+    def get(self, path: str, stat_result: os.stat_result, media_type: str) -> _Asset:
+        with self._lock:
+            asset = self._assets.get(path)
+            if asset is not None and asset.signature == _signature(stat_result):
+                self._assets.move_to_end(path)
+                self.stats["hits"] += 1
+                return asset
+        asset = build_asset(path, stat_result, media_type)
+        with self._lock:
+            self.stats["builds"] += 1
+            old = self._assets.pop(path, None)
+            if old is not None:
+                self.nbytes -= old.nbytes
+            self._assets[path] = asset
+            self.nbytes += asset.nbytes
+            while self.nbytes > self.max_bytes and len(self._assets) > 1:
+                _, evicted = self._assets.popitem(last=False)
+                self.nbytes -= evicted.nbytes
+        return asset
+
+
+def _etag_matches(if_none_match: str, etag: str) -> bool:
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip().removeprefix("W/").strip('"')
+        if candidate == "*" or candidate.split("-", 1)[0] == etag:
+            return True
+    return False
+
+
+class PrecompressedStaticFiles(StaticFiles):
+    def __init__(self, *args, cache_control: Optional[Callable[[str], str]] = None,
+                 cache: Optional[AssetCache] = None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.cache_control = cache_control or default_cache_control
+        self.cache = cache or AssetCache()
+
+    def warm(self) -> int:
+        """Build every file up front so no request pays for hashing or compression"""
+        built = 0
+        for directory in self.all_directories:
+            for root, _, files in os.walk(directory):
+                for name in files:
+                    path = os.path.join(root, name)
+                    if name.endswith((".gz", ".br")) and os.path.exists(path[:-3]):
+                        continue  # sidecar of a file we serve
+                    self.cache.get(path, os.stat(path), guess_media_type(path))
+                    built += 1
+        return built
+
+    def _rel_path(self, full_path: str) -> str:
+        for directory in self.all_directories:
+            directory = os.path.realpath(directory)
+            if full_path.startswith(directory + os.sep):
+                return full_path[len(directory) + 1:]
+        return os.path.basename(full_path)
+
+    def file_response(self, full_path, stat_result: os.stat_result, scope, status_code: int = 200) -> Response:
+        full_path = str(full_path)
+        asset = self.cache.get(full_path, stat_result, guess_media_type(full_path))
+        request_headers = Headers(scope=scope)
+
+        encoding = negotiate(request_headers.get("accept-encoding", ""), asset.variants)
+        etag = f'"{asset.etag}"' if encoding == "identity" else f'"{asset.etag}-{encoding}"'
+        headers = {"ETag": etag, "Cache-Control": self.cache_control(self._rel_path(full_path))}
+        if len(asset.variants) > 1:
+            headers["Vary"] = "Accept-Encoding"
+
+        if_none_match = request_headers.get("if-none-match")
+        if status_code == 200 and if_none_match and _etag_matches(if_none_match, asset.etag):
+            self.cache.stats["not_modified"] += 1
+            return Response(status_code=304, headers=headers)
+
+        if encoding != "identity":
+            headers["Content-Encoding"] = encoding
+        self.cache.stats["bytes_sent"] += asset.sizes[encoding]
+        self.cache.stats["bytes_saved"] += asset.sizes["identity"] - asset.sizes[encoding]
+
+        body = asset.variants[encoding]
+        if not isinstance(body, bytes):
+            # Large file: stream from disk (the source itself or its sidecar)
+            return FileResponse(body, status_code=status_code, headers=headers, media_type=asset.media_type)
+        if scope["method"] == "HEAD":
+            headers["Content-Length"] = str(len(body))
+            return Response(status_code=status_code, headers=headers, media_type=asset.media_type)
+        return Response(body, status_code=status_code, headers=headers, media_type=asset.media_type)
+
+
+def write_sidecars(path: str) -> Dict[str, int]:
+    """Write .gz/.br next to a file (build step); returns the variant sizes"""
+    with open(path, "rb") as f:
+        data = f.read()
+    sizes = {"identity": len(data)}
+    for encoding, body in _compress(data).items():
+        with open(path + SIDECARS[encoding], "wb") as f:
+            f.write(body)
+        sizes[encoding] = len(body)
+    return sizes
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Precompress static assets (.gz / .br sidecars)")
+    parser.add_argument("paths", nargs="+", help="files or directories")
+    args = parser.parse_args()
+
+    if brotli is None:
+        logging.warning("brotli not installed - writing gzip sidecars only")
+    for target in args.paths:
+        files = [target] if os.path.isfile(target) else [
+            os.path.join(root, name) for root, _, names in os.walk(target) for name in names
+            if not name.endswith((".gz", ".br"))]
+        for path in files:
+            if not _compressible(guess_media_type(path)) or os.stat(path).st_size < MIN_COMPRESS_BYTES:
+                continue
+            sizes = write_sidecars(path)
+            print(f"✅ {path}: " + ", ".join(f"{enc} {n:,} B" for enc, n in sizes.items()))
@@ -2,18 +2,18 @@ from fastapi import APIRouter, Depends, HTTPException
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from pydantic import BaseModel
 from typing import Optional
-from jose import jwt
 from datetime import datetime, timedelta
-from passlib.context import CryptContext
+from functools import lru_cache
 from pathlib import Path
 import sqlite3
 import os
-import json
 import logging
 
 from dotenv import load_dotenv
 load_dotenv()
 
+from events import log_event as queue_event
+
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -33,8 +33,13 @@ ACCESS_TOKEN_EXPIRE_MINUTES = 60 * 24 * 3
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/api/v1/auth/login")
 
-# Initialize password context at module level (more efficient)
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# jose (cryptography backend) and passlib/bcrypt are imported on first use,
+# keeping them off the cold-start path
+@lru_cache(maxsize=1)
+def get_pwd_context():
+    """Shared bcrypt password context, built once on first use"""
+    from passlib.context import CryptContext
+    return CryptContext(schemes=["bcrypt"], deprecated="auto")
 
 # Database path helper - matches server.py logic
 def get_db_path():
@@ -69,13 +74,14 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     to_encode = data.copy()
     expire = datetime.utcnow() + (expires_delta or timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES))
     to_encode.update({"exp": expire})
+    from jose import jwt
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
 
 def verify_password(plain_password, hashed_password):
     """Verify a plain password against a hashed password"""
-    return pwd_context.verify(plain_password, hashed_password)
+    return get_pwd_context().verify(plain_password, hashed_password)
 
 
 def get_user_by_email(email: str):
@@ -107,6 +113,7 @@ def get_user_by_email(email: str):
 
 
 def get_current_user(token: str = Depends(oauth2_scheme)) -> TokenData:
+    from jose import jwt
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         return TokenData(**payload)
@@ -123,20 +130,8 @@ def require_role(required_roles: list):
 
 
 def log_event(user_id: int, tenant_id: int, type: str, payload: dict):
-    """Log an event to the database"""
-    try:
-        db_path = get_db_path()
-        conn = sqlite3.connect(db_path)
-        cursor = conn.cursor()
-        cursor.execute(
-            "INSERT INTO events (user_id, tenant_id, type, payload, ts) VALUES (?, ?, ?, ?, datetime('now'))",
-            (user_id, tenant_id, type, json.dumps(payload))
-        )
-        conn.commit()
-        conn.close()
-    except Exception as e:
-        logger.error(f"Failed to log event: {e}")
-        # Don't raise - logging failure shouldn't break the main flow
+    """Queue an audit event; written in batches by the events module"""
+    queue_event(type, user_id=user_id, tenant_id=tenant_id, payload=payload)
 
 
 @router.post("/login", response_model=Token)
@@ -0,0 +1,290 @@
+"""
+Online, non-blocking backups of the SQLite store.
+
+``BackupService.create`` copies every database file of the store (the
+primary DB, tenant shards and their archive tiers) with SQLite's online
+backup API.  It copies ``BACKUP_PAGES_PER_STEP`` pages per step and sleeps
+between steps, so copying takes at most ``BACKUP_MAX_DUTY`` of wall time.
+The source connection holds one WAL read transaction for the whole copy.
+The copy is therefore a consistent snapshot, writers are never blocked,
+and concurrent writes never force the backup to restart.
+
+Each copy is integrity-checked, gzipped and described in a manifest:
+
+    backups/20250101T030000Z/manifest.json
+    backups/20250101T030000Z/handoff.sqlite.gz
+    backups/20250101T030000Z/handoff_archive.sqlite.gz
+
+Only the newest ``BACKUP_KEEP`` snapshots are kept.
+
+    python backup.py create [--db /data/handoff.sqlite]
+    python backup.py list
+    python backup.py restore 20250101T030000Z --yes    # with the service stopped
+"""
+import argparse
+import datetime
+import gzip
+import hashlib
+import json
+import logging
+import os
+import shutil
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Dict, List, Optional
+
+BACKUP_DIR = os.getenv("BACKUP_DIR", "")  # default: backups/ next to the database
+BACKUP_PAGES_PER_STEP = int(os.getenv("BACKUP_PAGES_PER_STEP", "256"))
+# Fraction of wall time spent copying; the rest is slept between steps
+BACKUP_MAX_DUTY = float(os.getenv("BACKUP_MAX_DUTY", "0.5"))
+BACKUP_KEEP = int(os.getenv("BACKUP_KEEP", "7"))
+COMPRESS_LEVEL = 6
+CHUNK = 1 << 20
+
+
+def default_db_path() -> str:
+    if os.path.exists("/data"):
+        return "/data/handoff.sqlite"
+    return str(Path(__file__).parent / "handoff.sqlite")
+
+
+def default_dir(db_path: str) -> str:
+    return BACKUP_DIR or str(Path(db_path).parent / "backups")
+
+
+def store_files(db_path: str) -> List[str]:
+    """The primary DB and its siblings: archive tier, tenant shards and their archives"""
+    p = Path(db_path)
+    suffix = p.suffix or ".sqlite"
+    files = [p, p.with_name(f"{p.stem}_archive{suffix}")]
+    files += sorted(p.parent.glob(f"{p.stem}_tenant_*{suffix}"))
+    return [str(f) for f in files if f.is_file()]
+
+
+def _sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(CHUNK), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _quick_check(path: str) -> str:
+    conn = sqlite3.connect(path)
+    try:
+        return conn.execute("PRAGMA quick_check").fetchone()[0]
+    finally:
+        conn.close()
+
+
+def copy_online(src_path: str, dest_path: str, pages: int = BACKUP_PAGES_PER_STEP,
+                max_duty: float = BACKUP_MAX_DUTY) -> Dict[str, float]:
+    """Copy a live database page by page from one read snapshot; returns step statistics"""
+    src = sqlite3.connect(src_path, isolation_level=None, check_same_thread=False)
+    dst = sqlite3.connect(dest_path)
+    stats = {"steps": 0, "pages": 0, "max_step_ms": 0.0, "copy_ms": 0.0, "slept_ms": 0.0}
+    try:
+        src.execute("PRAGMA query_only=1")
+        # Pin one WAL snapshot: other connections' commits neither show up nor restart the copy
+        src.execute("BEGIN")
+        src.execute("SELECT COUNT(*) FROM sqlite_master").fetchone()
+        step_started = time.perf_counter()
+
+        def progress(status, remaining, total):
+            nonlocal step_started
+            step = time.perf_counter() - step_started
+            stats["steps"] += 1
+            stats["pages"] = total
+            stats["copy_ms"] += step * 1000
+            stats["max_step_ms"] = max(stats["max_step_ms"], step * 1000)
+            if remaining and 0 < max_duty < 1:
+                pause = step * (1 - max_duty) / max_duty
+                stats["slept_ms"] += pause * 1000
+                time.sleep(pause)
+            step_started = time.perf_counter()
+
+        src.backup(dst, pages=pages, progress=progress)
+        src.execute("ROLLBACK")
+    finally:
+        dst.close()
+        src.close()
+    return {k: round(v, 2) if isinstance(v, float) else v for k, v in stats.items()}
+
+
+def _gzip(src_path: str, dest_path: str):
+    with open(src_path, "rb") as src, gzip.open(dest_path, "wb", compresslevel=COMPRESS_LEVEL) as dst:
+        shutil.copyfileobj(src, dst, CHUNK)
+
+
+def list_snapshots(backup_dir: str) -> List[dict]:
+    """Complete snapshots, newest first"""
+    snapshots = []
+    if not os.path.isdir(backup_dir):
+        return snapshots
+    for name in sorted(os.listdir(backup_dir), reverse=True):
+        manifest = os.path.join(backup_dir, name, "manifest.json")
+        if os.path.isfile(manifest):
+            with open(manifest) as f:
+                snapshots.append(json.load(f))
+    return snapshots
+
+
+def prune(backup_dir: str, keep: int = BACKUP_KEEP) -> List[str]:
+    """Delete all but the newest ``keep`` snapshots, and abandoned unfinished ones"""
+    removed = []
+    if not os.path.isdir(backup_dir):
+        return removed
+    complete = [s["id"] for s in list_snapshots(backup_dir)]
+    for name in os.listdir(backup_dir):
+        path = os.path.join(backup_dir, name)
+        if not os.path.isdir(path):
+            continue
+        # A .partial left behind by a crash (not one another worker is still writing)
+        abandoned = name.endswith(".partial") and time.time() - os.path.getmtime(path) > 86400
+        if abandoned or (name in complete and complete.index(name) >= keep):
+            shutil.rmtree(path, ignore_errors=True)
+            removed.append(name)
+    return removed
+
+
+class BackupService:
+    """Creates snapshots one at a time and keeps statistics about the last run"""
+    def __init__(self, backup_dir, pages: int = BACKUP_PAGES_PER_STEP,
+                 max_duty: float = BACKUP_MAX_DUTY, keep: int = BACKUP_KEEP):
+        self.backup_dir = backup_dir  # str, or a callable returning one
+        self.pages = pages
+        self.max_duty = max_duty
+        self.keep = keep
+        self._running = threading.Lock()
+        self.stats = {"snapshots": 0, "failures": 0, "last": None, "running": False}
+
+    @property
+    def directory(self) -> str:
+        return self.backup_dir() if callable(self.backup_dir) else self.backup_dir
+
+    def create(self, files: List[str]) -> dict:
+        """Snapshot ``files``; raises RuntimeError if a backup is already running"""
+        if not self._running.acquire(blocking=False):
+            raise RuntimeError("a backup is already running")
+        self.stats["running"] = True
+        try:
+            manifest = self._create(files)
+            self.stats["snapshots"] += 1
+            self.stats["last"] = {k: manifest[k] for k in ("id", "duration_ms", "bytes", "compressed_bytes",
+                                                           "max_step_ms")}
+            return manifest
+        except Exception:
+            self.stats["failures"] += 1
+            raise
+        finally:
+            self.stats["running"] = False
+            self._running.release()
+
+    def _create(self, files: List[str]) -> dict:
+        started = time.perf_counter()
+        snapshot_id = datetime.datetime.utcnow().strftime("%Y%m%dT%H%M%SZ")
+        final_dir = os.path.join(self.directory, snapshot_id)
+        suffix = 1
+        while os.path.exists(final_dir):  # more than one snapshot in a second
+            final_dir = os.path.join(self.directory, f"{snapshot_id}-{suffix}")
+            suffix += 1
+        snapshot_id = os.path.basename(final_dir)
+        work_dir = final_dir + ".partial"
+        os.makedirs(work_dir, exist_ok=True)
+        try:
+            entries = []
+            for src_path in files:
+                name = os.path.basename(src_path)
+                copy_path = os.path.join(work_dir, name)
+                copy_stats = copy_online(src_path, copy_path, self.pages, self.max_duty)
+                check = _quick_check(copy_path)
+                if check != "ok":
+                    raise RuntimeError(f"backup of {name} failed quick_check: {check}")
+                entry = {"name": name, "source": os.path.abspath(src_path), "bytes": os.path.getsize(copy_path),
+                         "sha256": _sha256(copy_path), **copy_stats}
+                _gzip(copy_path, copy_path + ".gz")
+                os.remove(copy_path)
+                entry["compressed_bytes"] = os.path.getsize(copy_path + ".gz")
+                entries.append(entry)
+
+            manifest = {
+                "id": snapshot_id,
+                "created_at": datetime.datetime.utcnow().isoformat() + "Z",
+                "files": entries,
+                "bytes": sum(e["bytes"] for e in entries),
+                "compressed_bytes": sum(e["compressed_bytes"] for e in entries),
+                "max_step_ms": max((e["max_step_ms"] for e in entries), default=0.0),
+                "duration_ms": round((time.perf_counter() - started) * 1000, 1),
+            }
+            with open(os.path.join(work_dir, "manifest.json"), "w") as f:
+                json.dump(manifest, f, indent=2)
+            os.replace(work_dir, final_dir)
+        except BaseException:
+            shutil.rmtree(work_dir, ignore_errors=True)
+            raise
+        prune(self.directory, self.keep)
+        logging.info(f"[backup] snapshot {snapshot_id}: {len(entries)} files, {manifest['bytes']:,} -> "
+                     f"{manifest['compressed_bytes']:,} bytes in {manifest['duration_ms']:.0f} ms")
+        return manifest
+
+
+def restore(backup_dir: str, snapshot_id: str, target_dir: Optional[str] = None) -> List[str]:
+    """
+    Replace the database files with a snapshot.  Run with the service
+    stopped: stale -wal/-shm files of the targets are removed.
+    """
+    snapshot_dir = os.path.join(backup_dir, snapshot_id)
+    with open(os.path.join(snapshot_dir, "manifest.json")) as f:
+        manifest = json.load(f)
+
+    staged = []
+    for entry in manifest["files"]:
+        target = os.path.join(target_dir, entry["name"]) if target_dir else entry["source"]
+        tmp = target + ".restoring"
+        os.makedirs(os.path.dirname(os.path.abspath(target)), exist_ok=True)
+        with gzip.open(os.path.join(snapshot_dir, entry["name"] + ".gz"), "rb") as src, open(tmp, "wb") as dst:
+            shutil.copyfileobj(src, dst, CHUNK)
+        if _sha256(tmp) != entry["sha256"] or _quick_check(tmp) != "ok":
+            for path in [tmp] + [t for t, _ in staged]:
+                os.remove(path)
+            raise RuntimeError(f"snapshot file {entry['name']} is corrupt; nothing was restored")
+        staged.append((tmp, target))
+
+    # Every file verified: swap them in
+    for tmp, target in staged:
+        for sidecar in (target + "-wal", target + "-shm"):
+            if os.path.exists(sidecar):
+                os.remove(sidecar)
+        os.replace(tmp, target)
+    return [target for _, target in staged]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Online SQLite backups")
+    parser.add_argument("--db", default=default_db_path(), help="primary database (siblings are included)")
+    parser.add_argument("--dir", help="backup directory (default: BACKUP_DIR or backups/ next to the database)")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("create", help="take a snapshot now")
+    sub.add_parser("list", help="list snapshots")
+    restore_parser = sub.add_parser("restore", help="restore a snapshot (stop the service first)")
+    restore_parser.add_argument("snapshot", help="snapshot id, e.g. 20250101T030000Z")
+    restore_parser.add_argument("--target-dir", help="restore into this directory instead of the original paths")
+    restore_parser.add_argument("--yes", action="store_true", help="overwrite existing database files")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    backup_dir = args.dir or default_dir(args.db)
+
+    if args.command == "create":
+        manifest = BackupService(backup_dir).create(store_files(args.db))
+        print(f"✅ {manifest['id']}: {manifest['bytes']:,} -> {manifest['compressed_bytes']:,} bytes "
+              f"in {manifest['duration_ms']:.0f} ms ({backup_dir})")
+    elif args.command == "list":
+        for s in list_snapshots(backup_dir):
+            print(f"{s['id']}  {len(s['files'])} files  {s['bytes']:>14,} B  {s['compressed_bytes']:>14,} B gz")
+    elif args.command == "restore":
+        if not args.target_dir and not args.yes:
+            parser.error("restoring over the live database files needs --yes (stop the service first)")
+        for path in restore(backup_dir, args.snapshot, args.target_dir):
+            print(f"✅ restored {path}")
@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+"""
+Ingestion latency while an online backup runs, and a restore round trip.
+
+Seeds a throwaway store, then times add_message (one write every --interval
+ms) first with no backup and then during backup.BackupService.create.
+Finally it restores the snapshot into a scratch directory and compares
+row counts.
+
+    python3 bench_backup.py --messages 200000 --pages 256 --duty 0.5
+"""
+import argparse
+import contextlib
+import io
+import logging
+import os
+import sqlite3
+import statistics
+import tempfile
+import threading
+import time
+
+
+def percentile(samples, p):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * p))]
+
+
+def ingest(server, stop, interval_ms, samples):
+    i = 0
+    while not stop.is_set():
+        started = time.perf_counter()
+        server.add_message("bench-live", "webchat", "user", f"live {i}")
+        samples.append((time.perf_counter() - started) * 1000)
+        i += 1
+        time.sleep(interval_ms / 1000)
+
+
+def report(label, samples):
+    print(f"   {label:16} n={len(samples):5}  p50 {statistics.median(samples):6.2f} ms  "
+          f"p99 {percentile(samples, 0.99):6.2f} ms  max {max(samples):7.2f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--messages", type=int, default=200000, help="seeded messages")
+    parser.add_argument("--pages", type=int, default=256, help="pages per backup step")
+    parser.add_argument("--duty", type=float, default=0.5, help="max fraction of time spent copying")
+    parser.add_argument("--interval", type=float, default=2.0, help="ms between ingested messages")
+    parser.add_argument("--baseline-seconds", type=float, default=3.0)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp()
+    os.chdir(workdir)
+    logging.disable(logging.CRITICAL)
+    with contextlib.redirect_stdout(io.StringIO()):
+        import backup
+        import server
+    server.DB_PATH = os.path.join(workdir, "handoff.sqlite")
+    server.db_init()
+    server.ensure_conversation("bench-live", "webchat")
+    now = server.timestamps.now_ms()
+    with server.db() as conn:
+        conn.executemany(
+            "INSERT INTO messages (user_id, channel, sender, text, ts, ts_ms) VALUES (?, 'webchat', 'user', ?, ?, ?)",
+            ((f"v{i % 5000}", f"seeded message {i} " + "lorem ipsum " * 8, server.timestamps.to_iso(now), now)
+             for i in range(args.messages)))
+    db_bytes = sum(os.path.getsize(f) for f in backup.store_files(server.DB_PATH))
+
+    service = backup.BackupService(os.path.join(workdir, "backups"), pages=args.pages, max_duty=args.duty)
+    print("=" * 72)
+    print(f"ONLINE BACKUP BENCHMARK ({args.messages:,} messages, {db_bytes / 1e6:.1f} MB, "
+          f"{args.pages} pages/step, duty {args.duty})")
+    print("=" * 72)
+
+    baseline, during = [], []
+    stop = threading.Event()
+    writer = threading.Thread(target=ingest, args=(server, stop, args.interval, baseline))
+    writer.start()
+    time.sleep(args.baseline_seconds)
+    stop.set()
+    writer.join()
+
+    stop = threading.Event()
+    writer = threading.Thread(target=ingest, args=(server, stop, args.interval, during))
+    writer.start()
+    manifest = service.create(backup.store_files(server.DB_PATH))
+    stop.set()
+    writer.join()
+
+    report("no backup", baseline)
+    report("during backup", during)
+    print(f"\nsnapshot {manifest['id']}: {manifest['bytes'] / 1e6:.1f} MB -> {manifest['compressed_bytes'] / 1e6:.1f} MB gz "
+          f"in {manifest['duration_ms'] / 1000:.1f} s (longest step {manifest['max_step_ms']:.1f} ms)")
+
+    restored_dir = os.path.join(workdir, "restored")
+    backup.restore(service.directory, manifest["id"], restored_dir)
+    restored = sqlite3.connect(os.path.join(restored_dir, "handoff.sqlite"))
+    restored_count = restored.execute("SELECT COUNT(*) FROM messages").fetchone()[0]
+    with server.db_read() as conn:
+        live_count = conn.execute("SELECT COUNT(*) FROM messages").fetchone()[0]
+    print(f"restore: {restored_count:,} messages in the snapshot, {live_count:,} live "
+          f"({live_count - restored_count} written after the snapshot began)")
+
+
+if __name__ == "__main__":
+    main()
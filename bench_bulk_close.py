@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+"""
+Compare closing conversations one at a time (set_assignment per row, the
+old /handoff/close-bulk loop) with close_conversations(), which does the
+whole set in one transaction.
+
+    python3 bench_bulk_close.py --conversations 5000
+"""
+import argparse
+import datetime
+import logging
+import os
+import sqlite3
+import tempfile
+import time
+
+
+def seed(server, n):
+    ts = datetime.datetime.utcnow().isoformat() + "Z"
+    with server.db() as conn:
+        conn.execute("DELETE FROM conversations")
+        conn.execute("DELETE FROM conversation_metrics")
+        conn.executemany(
+            "INSERT INTO conversations (user_id, channel, open, updated_at, created_at, tenant_id) VALUES (?, 'webchat', 1, ?, ?, 1)",
+            [(f"visitor-{i}", ts, ts) for i in range(n)],
+        )
+        conn.execute("INSERT INTO conversation_metrics (conversation_id, tenant_id, updated_at) SELECT id, 1, ? FROM conversations", (ts,))
+        conn.commit()
+    return [(f"visitor-{i}", "webchat") for i in range(n)]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--conversations", type=int, default=5000)
+    args = parser.parse_args()
+    n = args.conversations
+
+    os.chdir(tempfile.mkdtemp())
+    import server
+
+    server.DB_PATH = os.path.join(os.getcwd(), "bench_bulk.sqlite")
+    logging.disable(logging.INFO)
+    server.db_init()
+
+    print("=" * 60)
+    print(f"BULK CLOSE BENCHMARK ({n:,} conversations)")
+    print("=" * 60)
+
+    targets = seed(server, n)
+    start = time.perf_counter()
+    for user_id, channel in targets:
+        server.set_assignment(user_id, channel, None, False)
+    loop_s = time.perf_counter() - start
+    print(f"\n🐢 set_assignment per row:   {loop_s * 1000:10.1f} ms ({loop_s / n * 1e6:.0f} µs/conversation)")
+
+    targets = seed(server, n)
+    start = time.perf_counter()
+    closed = server.close_conversations(targets)
+    bulk_s = time.perf_counter() - start
+    print(f"⚡ close_conversations():    {bulk_s * 1000:10.1f} ms ({bulk_s / n * 1e6:.0f} µs/conversation)")
+
+    conn = sqlite3.connect(server.DB_PATH)
+    still_open = conn.execute("SELECT COUNT(*) FROM conversations WHERE open=1").fetchone()[0]
+    stamped = conn.execute("SELECT COUNT(*) FROM conversations WHERE closed_at IS NOT NULL").fetchone()[0]
+    conn.close()
+    print(f"\n✅ closed={len(closed):,} still_open={still_open} closed_at stamped={stamped:,}, "
+          f"speedup ≈ {loop_s / bulk_s:,.0f}x")
+
+
+if __name__ == "__main__":
+    main()
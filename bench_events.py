@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+"""
+Compare the per-request cost of audit event logging:
+
+  * old path  - open connection, INSERT one row, commit, close (per event)
+  * new path  - events.log_event() into the in-memory buffer, flushed in bulk
+
+    python3 bench_events.py --events 20000
+"""
+import argparse
+import json
+import os
+import sqlite3
+import tempfile
+import time
+
+import events
+
+
+def make_db():
+    path = os.path.join(tempfile.mkdtemp(), "bench_events.sqlite")
+    conn = sqlite3.connect(path)
+    events.init_schema(conn)
+    conn.commit()
+    conn.close()
+    return path
+
+
+def old_log_event(db_path, user_id, tenant_id, type, payload):
+    conn = sqlite3.connect(db_path)
+    conn.execute(
+        "INSERT INTO events (user_id, tenant_id, type, payload, ts) VALUES (?, ?, ?, ?, datetime('now'))",
+        (user_id, tenant_id, type, json.dumps(payload)),
+    )
+    conn.commit()
+    conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--events", type=int, default=20_000)
+    args = parser.parse_args()
+    n = args.events
+
+    print("=" * 60)
+    print(f"EVENT LOGGING BENCHMARK ({n:,} events)")
+    print("=" * 60)
+
+    path = make_db()
+    start = time.perf_counter()
+    for i in range(n):
+        old_log_event(path, i % 10, 1, "auth_checked", {"email": "staff@example.com"})
+    old_us = (time.perf_counter() - start) / n * 1e6
+    print(f"\n🐢 synchronous insert+commit: {old_us:10.1f} µs/event (paid inside the request)")
+
+    path = make_db()
+    writer = events.EventWriter(path, max_buffer=n + 1)
+    start = time.perf_counter()
+    for i in range(n):
+        writer.log("auth_checked", user_id=i % 10, tenant_id=1, payload={"email": "staff@example.com"})
+    new_us = (time.perf_counter() - start) / n * 1e6
+    print(f"⚡ buffered log_event():     {new_us:10.1f} µs/event (paid inside the request)")
+
+    start = time.perf_counter()
+    written = writer.flush()
+    flush_s = time.perf_counter() - start
+    print(f"📦 background bulk flush:    {flush_s / max(written, 1) * 1e6:10.1f} µs/event "
+          f"({written:,} rows in {flush_s * 1000:.0f} ms)")
+
+    conn = sqlite3.connect(path)
+    stored = conn.execute("SELECT COUNT(*) FROM events").fetchone()[0]
+    conn.close()
+    print(f"\n✅ {stored:,} events stored, request-path speedup ≈ {old_us / new_us:,.0f}x")
+
+
+if __name__ == "__main__":
+    main()
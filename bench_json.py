@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+"""
+Compare JSON encoding paths for the admin list endpoints and WebSocket
+broadcasts:
+
+  * REST body    - FastAPI default (jsonable_encoder + stdlib JSONResponse)
+                   vs codec.FastJSONResponse (orjson when installed)
+  * msgpack      - same payload as a msgpack frame (if installed)
+  * broadcast    - encoding per socket vs encoding once per broadcast
+
+    python3 bench_json.py --rows 10000 --sockets 200
+"""
+import argparse
+import time
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+
+import codec
+
+
+def make_history(n):
+    return {"history": [{
+        "id": i,
+        "user_id": f"visitor-{i % 700}",
+        "channel": "webchat",
+        "sender": "user" if i % 2 else "staff",
+        "message": "Hi, I'd like to book an appointment for next week please 🙂",
+        "ts": "2026-10-19T12:34:56.789000Z",
+        "assigned_staff": "+15550001234",
+        "source": "archive",
+    } for i in range(n)]}
+
+
+def timed(fn, repeat=5):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - start)
+    return best * 1000, result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=10_000)
+    parser.add_argument("--sockets", type=int, default=200)
+    args = parser.parse_args()
+
+    print("=" * 60)
+    print(f"JSON BENCHMARK ({args.rows:,} history rows, {args.sockets} admin sockets)")
+    print(f"orjson: {'yes' if codec.orjson else 'no (stdlib json fallback)'}   "
+          f"msgpack: {'yes' if codec.msgpack else 'no'}")
+    print("=" * 60)
+
+    payload = make_history(args.rows)
+
+    old_ms, old_body = timed(lambda: JSONResponse(jsonable_encoder(payload)).body)
+    new_ms, new_body = timed(lambda: codec.FastJSONResponse(payload).body)
+    print(f"\nREST body ({len(new_body) / 1024:,.0f} KiB):")
+    print(f"   jsonable_encoder + json   {old_ms:9.2f} ms")
+    print(f"   FastJSONResponse          {new_ms:9.2f} ms   speedup ≈ {old_ms / max(new_ms, 1e-6):,.1f}x")
+
+    if codec.msgpack is not None:
+        mp_ms, frame = timed(lambda: codec.encode_frame(payload, codec.MSGPACK_SUBPROTOCOL))
+        print(f"   msgpack frame             {mp_ms:9.2f} ms   ({len(frame) / 1024:,.0f} KiB)")
+
+    event = {"type": "message", "user_id": "visitor-1", "channel": "webchat",
+             "sender": "user", "text": "hello", "ts": "2026-10-19T12:34:56.789000Z"}
+    per_socket_ms, _ = timed(lambda: [JSONResponse(jsonable_encoder(event)).body.decode()
+                                      for _ in range(args.sockets)])
+    once_ms, _ = timed(lambda: [codec.encode_frame(event)] * args.sockets)
+    print(f"\nbroadcast to {args.sockets} sockets:")
+    print(f"   encode per socket         {per_socket_ms:9.3f} ms")
+    print(f"   encode once               {once_ms:9.3f} ms   speedup ≈ {per_socket_ms / max(once_ms, 1e-6):,.1f}x")
+
+
+if __name__ == "__main__":
+    main()
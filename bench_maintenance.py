@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+"""
+Query latency and file size before a purge, after it, and after maintenance.
+
+Seeds a throwaway store where most conversations, messages and history
+rows are older than the 30 day purge cutoff.  Then it runs the two purge
+endpoints, export_and_purge_history and export_and_delete_history, and
+then forced maintenance passes until the freelist is empty.  While the
+passes run, a writer thread times add_message to show the slices stay
+short.
+
+    python3 bench_maintenance.py --conversations 20000 --messages 200000 --old 0.8
+"""
+import argparse
+import contextlib
+import io
+import logging
+import os
+import statistics
+import tempfile
+import threading
+import time
+
+
+def timed(fn, repeat):
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - started) * 1000)
+    return statistics.median(samples)
+
+
+def day_counts(server):
+    with server.db_read_tiered() as conn:
+        return conn.execute("SELECT user_id, COUNT(*) FROM all_messages WHERE ts_ms >= ? GROUP BY user_id",
+                            (server.timestamps.ago_ms(days=1),)).fetchall()
+
+
+def measure(server, label, repeat):
+    server.shard_router.close()  # fresh readers: no page cache carried over from the previous phase
+    files = server.maintenance_files()
+    queries = {
+        "messages": lambda: server.get_messages("recent-0", "webchat"),
+        "history": server.history_payload,
+        "closed": lambda: server.conversations_payload("closed"),
+        "day_counts": lambda: day_counts(server),
+    }
+    latencies = {name: timed(fn, repeat) for name, fn in queries.items()}
+    size = sum(f["bytes"] + f["wal_bytes"] for f in files.values())
+    free = sum(f["free_bytes"] for f in files.values())
+    pages = sum(f["pages"] for f in files.values())
+    free_pages = sum(f["free_pages"] for f in files.values())
+    print(f"{label:18} {size / 1e6:8.1f} MB {free / 1e6:8.1f} MB {free_pages / max(pages, 1):7.1%}   "
+          + "  ".join(f"{latencies[name]:8.2f}" for name in queries))
+    return size
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--conversations", type=int, default=20000)
+    parser.add_argument("--messages", type=int, default=200000)
+    parser.add_argument("--old", type=float, default=0.8, help="share of rows past the purge cutoff")
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp()
+    os.chdir(workdir)
+    logging.disable(logging.CRITICAL)
+    with contextlib.redirect_stdout(io.StringIO()):
+        import server
+    server.DB_PATH = os.path.join(workdir, "handoff.sqlite")
+    server.db_init()
+
+    ts = server.timestamps
+    now = ts.now_ms()
+    old = ts.ago_ms(days=60)
+    n_old = int(args.conversations * args.old)
+
+    def user(i):
+        return f"old-{i}" if i < n_old else f"recent-{i - n_old}"
+
+    def when(i):
+        return old - i if i < n_old else now - i
+
+    with server.db_tiered() as conn:
+        conn.executemany(
+            "INSERT INTO conversations (user_id, channel, open, updated_at, updated_at_ms) VALUES (?, 'webchat', 0, ?, ?)",
+            ((user(i), ts.to_iso(when(i)), when(i)) for i in range(args.conversations)))
+        conn.executemany(
+            "INSERT INTO messages (user_id, channel, sender, text, ts, ts_ms) VALUES (?, 'webchat', 'user', ?, ?, ?)",
+            ((user(c), f"message {i} " + "lorem ipsum " * 8, ts.to_iso(when(c)), when(c))
+             for i in range(args.messages) for c in [i % args.conversations]))
+        conn.executemany(
+            "INSERT INTO history (user_id, channel, name, contact, message, ts, migrated_at, migrated_at_ms) "
+            "VALUES (?, 'webchat', 'Visitor', 'N/A', ?, ?, ?, ?)",
+            ((user(i), "followup " * 20, ts.to_iso(when(i)), ts.to_iso(when(i)), when(i))
+             for i in range(args.conversations)))
+
+    print("=" * 96)
+    print(f"MAINTENANCE BENCHMARK ({args.conversations:,} conversations, {args.messages:,} messages, "
+          f"{args.old:.0%} purged; median of {args.repeat}, ms)")
+    print("=" * 96)
+    print(f"{'':18} {'size':>11} {'free':>11} {'frag':>7}   {'messages':>8}  {'history':>8}  "
+          f"{'closed':>8}  {'day_cnts':>8}")
+    measure(server, "before purge", args.repeat)
+
+    started = time.perf_counter()
+    server.export_and_purge_history()
+    server.export_and_delete_history()
+    purge_ms = (time.perf_counter() - started) * 1000
+    measure(server, "after purge", args.repeat)
+
+    stop = threading.Event()
+    baseline, writes = [], []
+
+    def ingest(samples):
+        i = 0
+        while not stop.is_set():
+            started = time.perf_counter()
+            server.add_message("bench-live", "webchat", "user", f"live {i}")
+            samples.append((time.perf_counter() - started) * 1000)
+            i += 1
+            time.sleep(0.002)
+
+    server.ensure_conversation("bench-live", "webchat")
+    writer = threading.Thread(target=ingest, args=(baseline,))
+    writer.start()
+    time.sleep(1)
+    stop.set()
+    writer.join()
+
+    stop.clear()
+    writer = threading.Thread(target=ingest, args=(writes,))
+    writer.start()
+    started = time.perf_counter()
+    passes = []
+    try:
+        while True:
+            report = server.maintenance_pass(server.DEFAULT_TENANT_ID, force=True)
+            passes.append(report)
+            if not report["pages_reclaimed"]:
+                break
+    finally:
+        stop.set()
+        writer.join()
+    maintenance_ms = (time.perf_counter() - started) * 1000
+    measure(server, "after maintenance", args.repeat)
+
+    print(f"\npurge took {purge_ms:.0f} ms; maintenance: {len(passes)} passes in {maintenance_ms:.0f} ms, "
+          f"{sum(p['bytes_reclaimed'] for p in passes) / 1e6:.1f} MB reclaimed, "
+          f"{sum(p['slices'] for p in passes)} slices, longest {max(p['max_slice_ms'] for p in passes):.1f} ms")
+    for label, samples in (("without maintenance", baseline), ("during maintenance", writes)):
+        ordered = sorted(samples)
+        print(f"add_message {label:20} n={len(samples):4}  p50 {statistics.median(samples):5.2f} ms  "
+              f"p99 {ordered[int(len(ordered) * 0.99)]:6.2f} ms  max {ordered[-1]:6.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,211 @@
+#!/usr/bin/env python3
+"""
+Benchmark the ingestion rate limits (ratelimit.py).
+
+1. Cost of a check: a hot key, and a stream of distinct keys.  Idle
+   eviction should keep the bucket table well under its cap
+2. Flood: the app runs under uvicorn in a subprocess against a throwaway
+   database.  --visitors legitimate visitors each POST /webchat about once
+   a second, each from their own address.  Meanwhile a single address
+   posts --flood-rate requests a second under rotating visitor ids, over
+   at most --flooders keep-alive connections.  The flood rate is fixed
+   (open loop), so faster rejections do not just turn into more flood
+   requests.  The flood client writes prebuilt requests on raw sockets;
+   it shares the machine with the server and must stay cheap.
+   --dashboards admin dashboards are connected and receive every
+   broadcast.  The visitors' latency is
+   measured three ways: without the flood, under the flood with the
+   limits lifted, and under the flood with the default limits.
+
+Addresses come from X-Forwarded-For, which the server trusts from
+127.0.0.1 (the default TRUSTED_PROXY_NETWORKS), like behind Render's proxy.
+
+    python3 bench_rate_limit.py --seconds 15 --visitors 20 --flood-rate 500 --dashboards 10
+"""
+import argparse
+import asyncio
+import os
+import random
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import ratelimit
+
+SERVER = """
+import os, sys, logging, contextlib, io
+sys.path.insert(0, {root!r})
+logging.disable(logging.WARNING)
+with contextlib.redirect_stdout(io.StringIO()):
+    import server
+server.DB_PATH = {db!r}
+server.DEBUG_ADMIN_PUSH = False
+import builtins
+builtins.print = lambda *a, **k: None  # per-message "No admin push tokens" chatter
+import uvicorn
+uvicorn.run(server.app, host="127.0.0.1", port={port}, log_level="error", backlog=4096)
+"""
+
+SECRET = "bench-secret"
+UNLIMITED = {"RATE_LIMIT_VISITOR_PER_SECOND": "1e9", "RATE_LIMIT_VISITOR_BURST": "1e9",
+             "RATE_LIMIT_IP_PER_SECOND": "1e9", "RATE_LIMIT_IP_BURST": "1e9"}
+
+
+def bench_checks(n: int):
+    limiter = ratelimit.RateLimiter(*ratelimit.IP_LIMIT)
+    started = time.perf_counter()
+    for _ in range(n):
+        ratelimit.check([(limiter, "203.0.113.7")])
+    hot = (time.perf_counter() - started) / n * 1e9
+
+    limiter = ratelimit.RateLimiter(*ratelimit.IP_LIMIT, max_buckets=100_000)
+    keys = [f"10.{i >> 16 & 255}.{i >> 8 & 255}.{i & 255}" for i in range(n)]
+    started = time.perf_counter()
+    for key in keys:
+        ratelimit.check([(limiter, key)])
+    distinct = (time.perf_counter() - started) / n * 1e9
+    print(f"{'check, one hot key:':31} {hot:7.0f} ns")
+    print(f"check, {n:>9,} distinct keys: {distinct:7.0f} ns   buckets kept {len(limiter.buckets):,} "
+          f"(cap {limiter.max_buckets:,}, {limiter.stats['evicted_cap']:,} evicted)")
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_server(extra_env: dict):
+    root = os.path.dirname(os.path.abspath(__file__))
+    port = free_port()
+    code = SERVER.format(root=root, db=os.path.join(tempfile.mkdtemp(), "handoff.sqlite"), port=port)
+    proc = subprocess.Popen([sys.executable, "-c", code], cwd=tempfile.gettempdir(),
+                            env=dict(os.environ, JWT_SECRET=SECRET, **extra_env), stdout=subprocess.DEVNULL)
+    for _ in range(100):
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=0.2).close()
+            break
+        except OSError:
+            time.sleep(0.2)
+    return proc, f"http://127.0.0.1:{port}"
+
+
+def admin_token() -> str:
+    from jose import jwt
+
+    return jwt.encode({"id": 1, "tenant_id": 1, "email": "bench@example.com", "name": "bench", "role": "admin",
+                       "exp": int(time.time()) + 3600}, SECRET, algorithm="HS256")
+
+
+async def run_scenario(base: str, args, flood: bool):
+    import httpx
+    import websockets
+
+    latencies, flood_status, dashboard_frames = [], {}, [0]
+
+    async def dashboard(ws):
+        async for _ in ws:
+            dashboard_frames[0] += 1
+
+    dashboards = [await websockets.connect(f"{base.replace('http', 'ws')}/admin-ws?token={admin_token()}")
+                  for _ in range(args.dashboards)]
+    readers = [asyncio.create_task(dashboard(ws)) for ws in dashboards]
+    stop = time.perf_counter() + args.seconds
+
+    async def visitor(i, client):
+        headers = {"X-Forwarded-For": f"198.51.100.{i + 1}"}
+        await asyncio.sleep(random.random())
+        while time.perf_counter() < stop:
+            started = time.perf_counter()
+            r = await client.post(f"{base}/webchat", json={"user_id": f"visitor-{i}", "text": "hello"},
+                                  headers=headers)
+            latencies.append((time.perf_counter() - started) * 1000)
+            assert r.status_code == 200, r.status_code
+            await asyncio.sleep(max(1 - (time.perf_counter() - started), 0))
+
+    async def flood_connection(queue):
+        host, port = base.rsplit("/", 1)[1].split(":")
+        reader, writer = await asyncio.open_connection(host, int(port))
+        while True:
+            n = await queue.get()
+            body = f'{{"user_id": "flood-{n}", "text": "spam"}}'.encode()
+            writer.write(b"POST /webchat HTTP/1.1\r\nHost: bench\r\nX-Forwarded-For: 203.0.113.7\r\n"
+                         b"Content-Type: application/json\r\nContent-Length: %d\r\n\r\n%s" % (len(body), body))
+            head = await reader.readuntil(b"\r\n\r\n")
+            code = int(head[9:12])
+            length = int(head.lower().split(b"content-length:")[1].split(b"\r\n")[0])
+            await reader.readexactly(length)
+            flood_status[code] = flood_status.get(code, 0) + 1
+            queue.task_done()
+
+    async def flood_loop():
+        # Unbounded backlog would hide saturation: requests nobody can send in time are counted, not queued
+        queue = asyncio.Queue(maxsize=args.flooders)
+        connections = [asyncio.create_task(flood_connection(queue)) for _ in range(args.flooders)]
+        sent, started = 0, time.perf_counter()
+        while time.perf_counter() < stop:
+            await asyncio.sleep(0.01)
+            due = int((time.perf_counter() - started) * args.flood_rate)
+            for n in range(sent, due):
+                try:
+                    queue.put_nowait(n)
+                except asyncio.QueueFull:
+                    flood_status["not sent"] = flood_status.get("not sent", 0) + 1
+            sent = due
+        await queue.join()
+        for task in connections:
+            task.cancel()
+
+    async with httpx.AsyncClient(timeout=60) as client:
+        tasks = [visitor(i, client) for i in range(args.visitors)]
+        if flood:
+            tasks.append(flood_loop())
+        await asyncio.gather(*tasks)
+    for ws, reader in zip(dashboards, readers):
+        reader.cancel()
+        await ws.close()
+    return latencies, flood_status, dashboard_frames[0] / max(args.dashboards, 1)
+
+
+def report(label, latencies, flood_status, frames, seconds):
+    q = statistics.quantiles(latencies, n=100)
+    flood = ", ".join(f"{code}: {n / seconds:.0f}/s" for code, n in sorted(flood_status.items(), key=str)) or "-"
+    print(f"{label:24} {len(latencies):6} {q[49]:8.1f} {q[94]:8.1f} {q[98]:8.1f} {max(latencies):8.1f} "
+          f"{frames / seconds:9.0f}   {flood}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--seconds", type=float, default=15)
+    parser.add_argument("--visitors", type=int, default=20, help="legitimate visitors, one message a second each")
+    parser.add_argument("--flood-rate", type=float, default=500, help="flood requests per second from one address")
+    parser.add_argument("--flooders", type=int, default=100, help="flood connections")
+    parser.add_argument("--dashboards", type=int, default=10, help="connected admin dashboards")
+    parser.add_argument("--checks", type=int, default=1_000_000)
+    args = parser.parse_args()
+
+    print("=" * 100)
+    print("RATE LIMIT BENCHMARK")
+    print("=" * 100)
+    bench_checks(args.checks)
+    print()
+    print(f"{args.visitors} visitors at ~1 msg/s, flood of {args.flood_rate:g} req/s from one address, "
+          f"{args.dashboards} dashboards, {args.seconds:g} s each (latency of visitor POST /webchat, ms)")
+    print(f"{'scenario':24} {'reqs':>6} {'p50':>8} {'p95':>8} {'p99':>8} {'max':>8} {'frames/s':>9}   flood responses")
+    for label, env, flood in (("no flood", {}, False),
+                              ("flood, no limits", UNLIMITED, True),
+                              ("flood, default limits", {}, True)):
+        proc, base = start_server(env)
+        try:
+            latencies, flood_status, frames = asyncio.run(run_scenario(base, args, flood))
+        finally:
+            proc.terminate()
+            proc.wait(10)
+        report(label, latencies, flood_status, frames, args.seconds)
+
+
+if __name__ == "__main__":
+    main()
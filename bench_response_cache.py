@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+"""
+Measure the admin list endpoints through the write-generation cache:
+
+  * full build  - query + render on every request (cache invalidated each time)
+  * cached body - generation unchanged, rendered bytes served from memory
+  * 304         - client revalidates with If-None-Match
+
+Runs the app in-process against a throwaway database.
+
+    python3 bench_response_cache.py --conversations 5000 --history 5000
+"""
+import argparse
+import contextlib
+import io
+import logging
+import os
+import statistics
+import tempfile
+import time
+
+
+def measure(client, path, headers, n, before=None):
+    samples = []
+    for _ in range(n):
+        if before:
+            before()
+        start = time.perf_counter()
+        r = client.get(path, headers=headers)
+        samples.append((time.perf_counter() - start) * 1000)
+    return statistics.median(samples), r
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--conversations", type=int, default=5000)
+    parser.add_argument("--history", type=int, default=5000)
+    parser.add_argument("--requests", type=int, default=50)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp()
+    os.chdir(workdir)
+    logging.disable(logging.CRITICAL)
+    with contextlib.redirect_stdout(io.StringIO()):
+        import auth
+        import respcache
+        import server
+        from fastapi.testclient import TestClient
+    server.DB_PATH = os.path.join(workdir, "bench.sqlite")
+    server.db_init()
+
+    now = server.timestamps.now_ms()
+    with server.db() as conn:
+        conn.executemany(
+            "INSERT INTO conversations (user_id, channel, open, updated_at, updated_at_ms) VALUES (?, 'webchat', ?, ?, ?)",
+            ((f"v{i}", i % 10 == 0, server.timestamps.to_iso(now - i * 1000), now - i * 1000)
+             for i in range(args.conversations)))
+        conn.executemany(
+            "INSERT INTO history (user_id, channel, name, contact, message, ts, migrated_at, migrated_at_ms) "
+            "VALUES (?, 'webchat', 'Visitor', 'Email: a@b.c, Phone: 555', 'Please call me back', ?, ?, ?)",
+            ((f"h{i}", server.timestamps.to_iso(now), server.timestamps.to_iso(now - i * 1000), now - i * 1000)
+             for i in range(args.history)))
+        conn.commit()
+
+    def invalidate():
+        with server.db() as conn:
+            respcache.bump(conn)
+            conn.commit()
+
+    token = auth.create_access_token({"sub": "bench@x", "id": 1, "email": "bench@x", "role": "admin",
+                                      "tenant_id": 1, "name": "Bench"})
+    headers = {"Authorization": f"Bearer {token}"}
+    client = TestClient(server.app)
+
+    print("=" * 60)
+    print(f"RESPONSE CACHE BENCHMARK ({args.conversations:,} conversations, {args.history:,} history rows)")
+    print("=" * 60)
+    for path in ("/admin/api/history", "/admin/api/conversations?status=closed", "/admin/api/followups"):
+        full_ms, r = measure(client, path, headers, args.requests, before=invalidate)
+        cached_ms, r = measure(client, path, headers, args.requests)
+        etag = r.headers["etag"]
+        not_modified_ms, r304 = measure(client, path, {**headers, "If-None-Match": etag}, args.requests)
+        assert r304.status_code == 304
+        print(f"\n{path} ({len(r.content) / 1024:,.0f} KiB):")
+        print(f"   full build    {full_ms:8.2f} ms")
+        print(f"   cached body   {cached_ms:8.2f} ms   speedup ≈ {full_ms / max(cached_ms, 1e-6):,.1f}x")
+        print(f"   304           {not_modified_ms:8.2f} ms   speedup ≈ {full_ms / max(not_modified_ms, 1e-6):,.1f}x")
+    print(f"\ncache stats: {server.response_cache.stats}")
+
+
+if __name__ == "__main__":
+    main()
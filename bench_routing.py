@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+"""
+Benchmark the shift-rota routing engine.
+
+Generates a rota with many overlapping shifts and staff, then measures
+assignments per second for each policy with a realistic mix of closes
+(releases) interleaved.
+
+    python3 bench_routing.py --staff 2000 --assignments 200000
+"""
+import argparse
+import datetime
+import json
+import os
+import random
+import tempfile
+import time
+
+import routing
+
+
+def make_rota(path, staff, shifts, rng):
+    rota = []
+    for i in range(shifts):
+        start = rng.randrange(0, 24 * 60, 30)
+        length = rng.choice([240, 360, 480])
+        end = (start + length) % (24 * 60)
+        rota.append({
+            "name": f"shift-{i}",
+            "start": f"{start // 60:02d}:{start % 60:02d}",
+            "end": f"{end // 60:02d}:{end % 60:02d}",
+            "numbers": [f"+1555{n:07d}" for n in rng.sample(range(staff), max(1, staff // shifts * 2))],
+        })
+    with open(path, "w") as f:
+        json.dump(rota, f)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--staff", type=int, default=2000)
+    parser.add_argument("--shifts", type=int, default=48)
+    parser.add_argument("--assignments", type=int, default=200_000)
+    args = parser.parse_args()
+
+    rng = random.Random(7)
+    path = os.path.join(tempfile.mkdtemp(), "shift_config.json")
+    make_rota(path, args.staff, args.shifts, rng)
+
+    print("=" * 60)
+    print(f"ROUTING BENCHMARK ({args.staff} staff, {args.shifts} shifts)")
+    print("=" * 60)
+
+    base = datetime.datetime(2025, 1, 1)
+    times = [base + datetime.timedelta(minutes=rng.randrange(24 * 60)) for _ in range(1024)]
+
+    for policy in ("least_loaded", "round_robin"):
+        start = time.perf_counter()
+        router = routing.ShiftRouter(path, policy, timezone=None, reload_check_seconds=3600)
+        build_ms = (time.perf_counter() - start) * 1000
+
+        open_convos = []
+        start = time.perf_counter()
+        for i in range(args.assignments):
+            staff = router.assign(times[i & 1023])
+            if staff:
+                open_convos.append(staff)
+            # roughly steady state: close about as many as we open
+            if len(open_convos) > 5000:
+                router.release(open_convos.pop(rng.randrange(len(open_convos))))
+        elapsed = time.perf_counter() - start
+
+        loads = [v for v in router.loads.values() if v]
+        print(f"\n{policy}:")
+        print(f"   index build     {build_ms:8.2f} ms ({len(router._intervals)} intervals)")
+        print(f"   assignments/s   {args.assignments / elapsed:12,.0f}")
+        print(f"   load spread     min={min(loads) if loads else 0} max={max(loads) if loads else 0}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+"""
+Benchmark the FTS5 search index at realistic sizes.
+
+Builds a throwaway database with N synthetic messages (default 1,000,000),
+indexes them through search.py and reports index build throughput plus
+query latency for a few typical admin searches.
+
+    python3 bench_search.py --rows 2000000
+"""
+import argparse
+import os
+import random
+import sqlite3
+import statistics
+import tempfile
+import time
+
+import search
+
+WORDS = ("refund billing appointment cancel reschedule insurance invoice delivery "
+         "password login account order payment shipping tracking urgent callback "
+         "thanks hello please help issue question doctor clinic prescription").split()
+
+
+def synthetic_text(rng):
+    return " ".join(rng.choice(WORDS) for _ in range(rng.randint(4, 20)))
+
+
+def timed_queries(conn, query, runs=20, page_size=20):
+    samples = []
+    for i in range(runs):
+        start = time.perf_counter()
+        search.search(conn, query, 1, limit=page_size, offset=(i % 5) * page_size)
+        samples.append((time.perf_counter() - start) * 1000)
+    samples.sort()
+    return statistics.median(samples), samples[int(len(samples) * 0.95) - 1]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--batch", type=int, default=10_000)
+    args = parser.parse_args()
+
+    print("=" * 60)
+    print(f"FTS5 SEARCH BENCHMARK ({args.rows:,} messages)")
+    print("=" * 60)
+
+    path = os.path.join(tempfile.mkdtemp(), "bench_search.sqlite")
+    conn = sqlite3.connect(path)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    search.init_schema(conn)
+
+    rng = random.Random(42)
+    start = time.perf_counter()
+    for base in range(0, args.rows, args.batch):
+        conn.executemany(
+            f"INSERT INTO {search.SEARCH_TABLE} (rowid, body, tenant_id, user_id, channel, ts) VALUES (?,?,?,?,?,?)",
+            [(search.rowid_for("message", i), synthetic_text(rng), 1 + (i % 3),
+              f"visitor-{i % 50_000}", "webchat", "2025-01-01T00:00:00Z")
+             for i in range(base, min(base + args.batch, args.rows))],
+        )
+        conn.commit()
+    build_s = time.perf_counter() - start
+    print(f"\n📥 Indexed {args.rows:,} rows in {build_s:.1f}s ({args.rows / build_s:,.0f} rows/s)")
+
+    start = time.perf_counter()
+    conn.execute(f"INSERT INTO {search.SEARCH_TABLE}({search.SEARCH_TABLE}) VALUES ('optimize')")
+    conn.commit()
+    print(f"🧹 optimize: {time.perf_counter() - start:.1f}s, "
+          f"file size {os.path.getsize(path) / 1_048_576:.0f} MiB")
+
+    # Incremental maintenance cost, as paid by add_message
+    start = time.perf_counter()
+    for i in range(args.rows, args.rows + 1000):
+        search.index_message(conn, i, 1, "visitor-x", "webchat", synthetic_text(rng), "2025-01-01T00:00:00Z")
+        conn.commit()
+    print(f"✍️  incremental index_message + commit: {(time.perf_counter() - start):.3f} ms/op avg over 1000")
+
+    print("\n🔎 Query latency (tenant-scoped, ranked, paginated):")
+    for query in ("refund", "insurance invoice", "presc", "urgent callback doctor"):
+        p50, p95 = timed_queries(conn, query)
+        print(f"   {query!r:28} p50={p50:7.2f} ms  p95={p95:7.2f} ms")
+
+    conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+"""
+Concurrent write throughput with every tenant in one SQLite file versus one
+shard per tenant (TENANT_SHARDS).
+
+One writer thread per tenant stores messages through server.add_message,
+i.e. the same insert + search index + metrics + cache bump transaction a
+live message costs.  With a single file the writers queue on its lock;
+with shards each tenant commits to its own file.
+
+    python3 bench_shards.py --tenants 1 2 4 8 --messages 300
+"""
+import argparse
+import contextlib
+import io
+import logging
+import os
+import tempfile
+import threading
+import time
+
+
+def run(server, shards, workdir: str, enabled: bool, tenants: int, messages: int) -> float:
+    server.DB_PATH = os.path.join(workdir, f"{'sharded' if enabled else 'single'}-{tenants}.sqlite")
+    server.shard_router.close()
+    server.shard_router.enabled = enabled
+    server.db_init()
+    with server.db() as conn:
+        conn.executemany("INSERT OR IGNORE INTO tenants (id, name) VALUES (?, ?)",
+                         ((t, f"Tenant {t}") for t in range(2, tenants + 1)))
+    tenant_ids = server.shard_router.tenants() if enabled else list(range(1, tenants + 1))
+    for tenant_id in tenant_ids:
+        with shards.use_tenant(tenant_id):
+            server.ensure_conversation(f"visitor-{tenant_id}", "webchat")
+
+    errors = []
+    barrier = threading.Barrier(len(tenant_ids) + 1)
+
+    def writer(tenant_id):
+        with shards.use_tenant(tenant_id):
+            barrier.wait()
+            for i in range(messages):
+                try:
+                    server.add_message(f"visitor-{tenant_id}", "webchat", "user", f"message {i}")
+                except Exception as e:
+                    errors.append(e)
+
+    threads = [threading.Thread(target=writer, args=(t,)) for t in tenant_ids]
+    for t in threads:
+        t.start()
+    barrier.wait()
+    started = time.perf_counter()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - started
+    if errors:
+        print(f"   ({len(errors)} writes failed, e.g. {errors[0]})")
+    return (len(tenant_ids) * messages - len(errors)) / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--tenants", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--messages", type=int, default=300, help="per tenant")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp()
+    os.chdir(workdir)
+    logging.disable(logging.CRITICAL)
+    with contextlib.redirect_stdout(io.StringIO()):
+        import server
+        import shards
+
+    print("=" * 60)
+    print(f"SHARDED WRITE BENCHMARK ({args.messages} messages per tenant)")
+    print("=" * 60)
+    print(f"{'tenants':>8} {'one file':>14} {'per tenant':>14} {'speedup':>9}")
+    for tenants in args.tenants:
+        single = run(server, shards, workdir, False, tenants, args.messages)
+        sharded = run(server, shards, workdir, True, tenants, args.messages)
+        print(f"{tenants:>8} {single:>10,.0f} m/s {sharded:>10,.0f} m/s {sharded / single:>8.1f}x")
+
+
+if __name__ == "__main__":
+    main()
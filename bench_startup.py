@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+"""
+Import and startup time of server.py, each run in a fresh interpreter:
+
+  * import       - ``import server`` (heavy clients should stay lazy)
+  * cold startup - startup hooks against a new database (schema + admin seed)
+  * warm startup - same database again; schema version current, init skipped
+  * first request - startup complete -> first response (GET /health)
+
+Medians over --runs.  With --max-import-ms / --max-startup-ms it exits 1
+when a median exceeds the budget, so it can gate CI against regressions.
+
+    python3 bench_startup.py --runs 5 --max-import-ms 1500 --max-startup-ms 500
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+
+ROOT = Path(__file__).parent
+HEAVY_MODULES = ("twilio", "jose", "passlib", "httpx", "requests")
+
+# Runs in the child interpreter; prints one JSON line
+CHILD = r"""
+import contextlib, io, json, logging, os, sys, time
+logging.disable(logging.CRITICAL)
+t0 = time.perf_counter()
+with contextlib.redirect_stdout(io.StringIO()):
+    import server
+import_ms = (time.perf_counter() - t0) * 1000
+loaded = [m for m in sys.argv[2].split(",") if m in sys.modules]
+server.DB_PATH = sys.argv[1]
+
+from fastapi.testclient import TestClient
+t0 = time.perf_counter()
+with contextlib.redirect_stdout(io.StringIO()):
+    client = TestClient(server.app)
+    client.__enter__()
+startup_ms = (time.perf_counter() - t0) * 1000
+t0 = time.perf_counter()
+status = client.get("/health").status_code
+first_request_ms = (time.perf_counter() - t0) * 1000
+print(json.dumps({"import_ms": import_ms, "startup_ms": startup_ms, "first_request_ms": first_request_ms,
+                  "status": status, "heavy_loaded": loaded, "timeline": server.startup.timeline.summary()}))
+os._exit(0)
+"""
+
+
+def run_child(db_path, env):
+    out = subprocess.run([sys.executable, "-c", CHILD, db_path, ",".join(HEAVY_MODULES)],
+                         cwd=ROOT, env=env, capture_output=True, text=True, check=True).stdout
+    return json.loads(out.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--max-import-ms", type=float)
+    parser.add_argument("--max-startup-ms", type=float, help="budget for a warm startup")
+    parser.add_argument("--slow", action="store_true", help="FAST_STARTUP=0 (previous behaviour)")
+    args = parser.parse_args()
+
+    env = {**os.environ, "FAST_STARTUP": "0" if args.slow else "1"}
+    cold, warm = [], []
+    for _ in range(args.runs):
+        with tempfile.TemporaryDirectory() as workdir:
+            db_path = os.path.join(workdir, "bench.sqlite")
+            cold.append(run_child(db_path, env))
+            warm.append(run_child(db_path, env))
+
+    def median(runs, key):
+        return statistics.median(r[key] for r in runs)
+
+    print("=" * 60)
+    print(f"STARTUP BENCHMARK ({args.runs} runs, FAST_STARTUP={env['FAST_STARTUP']})")
+    print("=" * 60)
+    import_ms = median(cold + warm, "import_ms")
+    warm_ms = median(warm, "startup_ms")
+    print(f"import server       {import_ms:8.1f} ms")
+    print(f"cold startup        {median(cold, 'startup_ms'):8.1f} ms   (new database)")
+    print(f"warm startup        {warm_ms:8.1f} ms   (schema current)")
+    print(f"first request       {median(warm, 'first_request_ms'):8.1f} ms   (status {warm[-1]['status']})")
+    print(f"heavy modules imported by server.py: {', '.join(warm[-1]['heavy_loaded']) or 'none'}")
+    print(f"last timeline (ms since process start): {warm[-1]['timeline']['marks']}")
+
+    failed = False
+    if args.max_import_ms is not None and import_ms > args.max_import_ms:
+        print(f"❌ import {import_ms:.1f} ms > budget {args.max_import_ms:.0f} ms")
+        failed = True
+    if args.max_startup_ms is not None and warm_ms > args.max_startup_ms:
+        print(f"❌ warm startup {warm_ms:.1f} ms > budget {args.max_startup_ms:.0f} ms")
+        failed = True
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
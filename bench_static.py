@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+"""
+Bytes on the wire and in-process time-to-first-byte for static assets:
+plain StaticFiles versus assets.PrecompressedStaticFiles (gzip/brotli
+variants held in memory, 304 revalidation).
+
+Serves chatbot.js / chatbot.min.js and, if it has been built, every file
+in admin-frontend/dist.
+
+    python3 bench_static.py --requests 200
+"""
+import argparse
+import os
+import statistics
+import time
+from pathlib import Path
+
+from fastapi import FastAPI
+from fastapi.staticfiles import StaticFiles
+from fastapi.testclient import TestClient
+
+import assets
+
+ROOT = Path(__file__).parent
+BROWSER_ENCODINGS = "gzip, deflate, br"
+
+
+def ttfb_ms(client, path, headers, n):
+    samples = []
+    for _ in range(n):
+        start = time.perf_counter()
+        with client.stream("GET", path, headers=headers) as r:
+            chunks = r.iter_raw()
+            next(chunks, None)
+            samples.append((time.perf_counter() - start) * 1000)
+            for _ in chunks:
+                pass
+    return statistics.median(samples), r
+
+
+def wire_bytes(client, path, headers):
+    with client.stream("GET", path, headers=headers) as r:
+        return sum(len(chunk) for chunk in r.iter_raw()), r.headers.get("content-encoding", "identity")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=200)
+    args = parser.parse_args()
+
+    dist = ROOT / "admin-frontend" / "dist"
+    targets = [("widget", "chatbot.js"), ("widget", "chatbot.min.js")]
+    if dist.exists():
+        targets += [("admin-app", str(p.relative_to(dist))) for p in sorted(dist.rglob("*"))
+                    if p.is_file() and p.suffix not in (".gz", ".br")]
+
+    plain, fast = FastAPI(), FastAPI()
+    plain.mount("/widget", StaticFiles(directory=ROOT))
+    fast_widget = assets.PrecompressedStaticFiles(directory=ROOT)
+    fast.mount("/widget", fast_widget)
+    if dist.exists():
+        plain.mount("/admin-app", StaticFiles(directory=dist, html=True))
+        fast_dist = assets.PrecompressedStaticFiles(directory=dist, html=True)
+        fast_dist.warm()
+        fast.mount("/admin-app", fast_dist)
+    plain_client, fast_client = TestClient(plain), TestClient(fast)
+
+    print("=" * 72)
+    print(f"STATIC ASSET BENCHMARK (brotli: {'yes' if assets.brotli else 'no, gzip only'})")
+    print("=" * 72)
+    print(f"{'file':40} {'plain':>9} {'served':>9} {'enc':>5}   {'plain ttfb':>10} {'new ttfb':>9} {'304':>7}")
+
+    total_plain = total_fast = 0
+    headers = {"Accept-Encoding": BROWSER_ENCODINGS}
+    for mount, rel in targets:
+        path = f"/{mount}/{rel}"
+        plain_bytes, _ = wire_bytes(plain_client, path, headers)
+        fast_bytes, encoding = wire_bytes(fast_client, path, headers)
+        plain_ms, _ = ttfb_ms(plain_client, path, headers, args.requests)
+        fast_ms, r = ttfb_ms(fast_client, path, headers, args.requests)
+        revalidate_ms, r304 = ttfb_ms(fast_client, path, {**headers, "If-None-Match": r.headers["etag"]}, args.requests)
+        assert r304.status_code == 304
+        total_plain += plain_bytes
+        total_fast += fast_bytes
+        label = rel if len(rel) <= 40 else "…" + rel[-39:]
+        print(f"{label:40} {plain_bytes:9,} {fast_bytes:9,} {encoding:>5}   "
+              f"{plain_ms:8.3f}ms {fast_ms:7.3f}ms {revalidate_ms:5.3f}ms")
+
+    print(f"\ntotal bytes: {total_plain:,} -> {total_fast:,} "
+          f"({100 * (1 - total_fast / max(total_plain, 1)):.0f}% saved per cold page load)")
+    if not dist.exists():
+        print("(admin-frontend/dist not built - run 'npm run build' to include the SPA)")
+
+
+if __name__ == "__main__":
+    os.chdir(ROOT)
+    main()
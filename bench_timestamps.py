@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+"""
+Compare ISO-8601 string timestamps with the indexed epoch-ms columns:
+
+  * escalation pass  - old: fetch every open conversation and parse
+                       updated_at in Python; new: SQL-side due filter on
+                       conversations(open, updated_at_ms)
+  * range scan       - messages in a 24h window, ISO string column vs ts_ms
+  * cutoff delete    - history rows older than 30 days (counted, not deleted)
+
+Also reports how long the one-off backfill migration takes.
+
+    python3 bench_timestamps.py --conversations 100000 --messages 1000000
+"""
+import argparse
+import datetime
+import os
+import random
+import sqlite3
+import tempfile
+import time
+
+import timestamps
+
+
+def iso(dt):
+    return dt.isoformat() + "Z"
+
+
+def make_db(n_convos, n_messages, n_history, rng):
+    path = os.path.join(tempfile.mkdtemp(), "bench_ts.sqlite")
+    conn = sqlite3.connect(path)
+    conn.execute("""CREATE TABLE conversations (id INTEGER PRIMARY KEY, user_id TEXT, channel TEXT, open INTEGER,
+                    updated_at TEXT, patience_sent INTEGER DEFAULT 0, final_sent INTEGER DEFAULT 0,
+                    escalation_active INTEGER DEFAULT 1)""")
+    conn.execute("CREATE TABLE messages (id INTEGER PRIMARY KEY, user_id TEXT, channel TEXT, sender TEXT, text TEXT, ts TEXT)")
+    conn.execute("CREATE TABLE followups (id INTEGER PRIMARY KEY, ts TEXT)")
+    conn.execute("CREATE TABLE history (id INTEGER PRIMARY KEY, message TEXT, ts TEXT, migrated_at TEXT)")
+    # What the old schema had for open-conversation scans
+    conn.execute("CREATE INDEX idx_conversations_open_updated ON conversations(open, updated_at)")
+
+    now = datetime.datetime.utcnow()
+    span = 90 * 86400
+    conn.executemany(
+        "INSERT INTO conversations (user_id, channel, open, updated_at, patience_sent, final_sent) VALUES (?, 'webchat', ?, ?, ?, ?)",
+        ((f"v{i}", int(rng.random() < 0.05), iso(now - datetime.timedelta(seconds=rng.randrange(span))),
+          int(rng.random() < 0.9), int(rng.random() < 0.9)) for i in range(n_convos)))
+    conn.executemany(
+        "INSERT INTO messages (user_id, channel, sender, text, ts) VALUES (?, 'webchat', 'user', 'hello', ?)",
+        ((f"v{rng.randrange(n_convos)}", iso(now - datetime.timedelta(seconds=rng.randrange(span))))
+         for _ in range(n_messages)))
+    conn.executemany(
+        "INSERT INTO history (message, ts, migrated_at) VALUES ('m', ?, ?)",
+        ((iso(now), iso(now - datetime.timedelta(seconds=rng.randrange(span)))) for _ in range(n_history)))
+    conn.commit()
+    return conn
+
+
+def timed(fn, repeat=5):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - start)
+    return best * 1000, result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--conversations", type=int, default=100_000)
+    parser.add_argument("--messages", type=int, default=1_000_000)
+    parser.add_argument("--history", type=int, default=100_000)
+    args = parser.parse_args()
+
+    print("=" * 60)
+    print(f"TIMESTAMP BENCHMARK ({args.conversations:,} conversations, {args.messages:,} messages)")
+    print("=" * 60)
+
+    conn = make_db(args.conversations, args.messages, args.history, random.Random(3))
+
+    start = time.perf_counter()
+    timestamps.init_schema(conn)
+    conn.commit()
+    print(f"\n🛠  migration (add *_ms + backfill + indexes): {(time.perf_counter() - start) * 1000:,.0f} ms")
+    # keep the old index around so the "before" numbers are fair
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_conversations_open_updated ON conversations(open, updated_at)")
+
+    now = datetime.datetime.utcnow()
+    now_ms = timestamps.now_ms()
+
+    def escalation_old():
+        due = 0
+        for updated_at, patience_sent, final_sent, active in conn.execute(
+                "SELECT updated_at, patience_sent, final_sent, escalation_active FROM conversations WHERE open=1"):
+            if not active:
+                continue
+            delta = (now - datetime.datetime.fromisoformat(updated_at.replace("Z", ""))).total_seconds()
+            if (delta >= 30 and not patience_sent) or (delta >= 120 and not final_sent):
+                due += 1
+        return due
+
+    def escalation_new():
+        return len(conn.execute("""
+            SELECT id, ? - updated_at_ms FROM conversations
+            WHERE open=1 AND updated_at_ms <= ? AND COALESCE(escalation_active, 1) = 1
+              AND ((COALESCE(patience_sent, 0) = 0 AND updated_at_ms <= ?)
+                OR (COALESCE(final_sent, 0) = 0 AND updated_at_ms <= ?))
+        """, (now_ms, now_ms - 30_000, now_ms - 30_000, now_ms - 120_000)).fetchall())
+
+    lo, hi = now - datetime.timedelta(days=31), now - datetime.timedelta(days=30)
+    lo_ms, hi_ms = timestamps.from_iso(iso(lo)), timestamps.from_iso(iso(hi))
+    cutoff = now - datetime.timedelta(days=30)
+    cutoff_ms = timestamps.from_iso(iso(cutoff))
+
+    cases = [
+        ("escalation pass", escalation_old, escalation_new),
+        ("24h message range",
+         lambda: conn.execute("SELECT COUNT(*) FROM messages WHERE ts >= ? AND ts < ?", (iso(lo), iso(hi))).fetchone()[0],
+         lambda: conn.execute("SELECT COUNT(*) FROM messages WHERE ts_ms >= ? AND ts_ms < ?", (lo_ms, hi_ms)).fetchone()[0]),
+        ("history 30d cutoff",
+         lambda: conn.execute("SELECT COUNT(*) FROM history WHERE migrated_at < ?", (iso(cutoff),)).fetchone()[0],
+         lambda: conn.execute("SELECT COUNT(*) FROM history WHERE migrated_at_ms < ?", (cutoff_ms,)).fetchone()[0]),
+    ]
+    for label, old, new in cases:
+        old_ms, old_n = timed(old)
+        new_ms, new_n = timed(new)
+        print(f"\n{label}:")
+        print(f"   ISO strings  {old_ms:9.2f} ms  ({old_n:,} rows)")
+        print(f"   epoch ms     {new_ms:9.2f} ms  ({new_n:,} rows)   speedup ≈ {old_ms / max(new_ms, 1e-6):,.1f}x")
+
+
+if __name__ == "__main__":
+    main()
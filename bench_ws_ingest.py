@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+"""
+Compare per-message latency and server CPU for visitor messages sent via
+POST /webchat versus frames on the already-open /ws/{user_id} socket.
+
+Runs the app in-process against a throwaway database, so the numbers cover
+the full ASGI + validation + ingestion path without network noise.
+
+    python3 bench_ws_ingest.py --messages 500
+"""
+import argparse
+import contextlib
+import io
+import logging
+import os
+import statistics
+import tempfile
+import time
+
+
+def summarize(label, samples_ms, cpu_s, n):
+    samples_ms.sort()
+    print(f"{label:18} p50={statistics.median(samples_ms):7.2f} ms  "
+          f"p95={samples_ms[int(n * 0.95) - 1]:7.2f} ms  cpu={cpu_s / n * 1000:6.2f} ms/msg")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--messages", type=int, default=500)
+    args = parser.parse_args()
+    n = args.messages
+
+    os.chdir(tempfile.mkdtemp())
+    import server
+    from fastapi.testclient import TestClient
+
+    server.DB_PATH = os.path.join(os.getcwd(), "bench_ws.sqlite")
+    server.DEBUG_ADMIN_PUSH = False
+    logging.disable(logging.INFO)
+
+    print("=" * 60)
+    print(f"VISITOR INGESTION: POST vs WEBSOCKET ({n} messages each)")
+    print("=" * 60)
+
+    # notify_admins_new_message prints once per message; keep the report readable
+    quiet = contextlib.redirect_stdout(io.StringIO())
+    results = []
+    with TestClient(server.app) as client, quiet:
+        # HTTP POST per message (the old widget path)
+        samples, cpu0 = [], time.process_time()
+        for i in range(n):
+            start = time.perf_counter()
+            r = client.post("/webchat", json={"user_id": "bench-post", "channel": "webchat",
+                                              "text": f"hello {i}", "client_id": f"p{i}"})
+            assert r.status_code == 200
+            samples.append((time.perf_counter() - start) * 1000)
+        results.append(("POST /webchat", samples, time.process_time() - cpu0))
+
+        # Frames on the open visitor socket
+        with client.websocket_connect("/ws/bench-ws") as ws:
+            samples, cpu0 = [], time.process_time()
+            for i in range(n):
+                start = time.perf_counter()
+                ws.send_json({"type": "message", "text": f"hello {i}", "client_id": f"w{i}"})
+                while True:
+                    frame = ws.receive_json()
+                    if frame.get("type") == "ack":
+                        break
+                samples.append((time.perf_counter() - start) * 1000)
+            results.append(("WS message frame", samples, time.process_time() - cpu0))
+
+            # Resend of an acknowledged message is deduped on client_id
+            ws.send_json({"type": "message", "text": "hello 0", "client_id": "w0"})
+            while True:
+                frame = ws.receive_json()
+                if frame.get("type") == "ack":
+                    break
+            duplicate = frame["duplicate"]
+
+    for label, samples, cpu in results:
+        summarize(label, samples, cpu, n)
+    print(f"\n🔁 resend of w0 -> duplicate={duplicate}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+"""
+Soak the visitor socket lifecycle with thousands of real sockets.
+
+Starts the app under uvicorn in a subprocess against a throwaway database,
+with short heartbeat settings.  uvicorn's protocol-level pings are turned
+off, so only the app-level ping/pong of liveness.py can find dead sockets.
+permessage-deflate is off as in render.yaml (--deflate turns it back on to
+compare: its zlib state costs about 90 KB per socket).  Each round then:
+
+1. opens --sockets visitor sockets (--writers of them send one message, so
+   both bound and unbound visitors are covered)
+2. lets --abandon of them go silent.  They stop answering pings, like a
+   suspended laptop or a half-open connection, and the server has to evict
+   them as dead
+3. closes the rest from the client side
+
+Server RSS and /admin/api/connections are sampled after every phase.
+Memory is bounded if RSS levels off across rounds and the routing tables
+are empty after each one.
+
+    python3 bench_ws_soak.py --sockets 10000 --rounds 3 --abandon 0.3
+"""
+import argparse
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+SERVER = """
+import os, sys, logging, contextlib, io
+sys.path.insert(0, {root!r})
+logging.disable(logging.WARNING)
+with contextlib.redirect_stdout(io.StringIO()):
+    import server
+server.DB_PATH = {db!r}
+server.DEBUG_ADMIN_PUSH = False
+import uvicorn
+uvicorn.run(server.app, host="127.0.0.1", port={port}, log_level="error", ws_ping_interval=None, backlog=4096,
+            ws_per_message_deflate={deflate})
+"""
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def rss_mb(pid: int) -> float:
+    with open(f"/proc/{pid}/statm") as f:
+        return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 1e6
+
+
+async def visitor(url, user_id, write, abandon, connected, release, stats):
+    import websockets
+
+    try:
+        ws = await websockets.connect(f"{url}/ws/{user_id}", open_timeout=30, close_timeout=1)
+    except Exception:
+        stats["failed"] += 1
+        connected.set()
+        return
+    stats["connected"] += 1
+    if write:
+        await ws.send(json.dumps({"type": "message", "text": "soak", "client_id": "1"}))
+    connected.set()
+
+    async def answer_pings():
+        async for frame in ws:
+            if json.loads(frame).get("type") == "ping" and not abandon:
+                await ws.send(json.dumps({"type": "pong"}))
+
+    reader = asyncio.create_task(answer_pings())
+    await release.wait()
+    if abandon:
+        # Never answered a ping; by now the server should have closed it
+        stats["evicted" if ws.closed else "survived"] += 1
+    reader.cancel()
+    await ws.close()
+
+
+async def sample(pid, token, base, label, round_no):
+    import httpx
+
+    async with httpx.AsyncClient() as client:
+        r = await client.get(f"{base}/admin/api/connections", headers={"Authorization": f"Bearer {token}"})
+    m = r.json()
+    v = m["visitors"]
+    per_socket = f"{v['bytes_per_socket'] / 1024:8.1f}" if v["bytes_per_socket"] else f"{'-':>8}"
+    print(f"{round_no:5}  {label:16} {v['sockets']:7} {m['conversations']:7} {m['unbound']:7} "
+          f"{rss_mb(pid):8.1f} {per_socket} {v['bookkeeping_bytes'] / 1024:9.1f} {v['dead']:7} {v['pings']:8}")
+    return m
+
+
+async def soak(args, pid, token, port):
+    base = f"http://127.0.0.1:{port}"
+    url = f"ws://127.0.0.1:{port}"
+    print(f"{'round':>5}  {'phase':16} {'sockets':>7} {'convos':>7} {'unbound':>7} {'rss MB':>8} "
+          f"{'KB/sock':>8} {'bookk KB':>9} {'dead':>7} {'pings':>8}")
+    await sample(pid, token, base, "idle", 0)
+    for round_no in range(1, args.rounds + 1):
+        stats = {"connected": 0, "failed": 0, "evicted": 0, "survived": 0}
+        gate = asyncio.Semaphore(args.concurrency)
+        release = asyncio.Event()
+        n_abandon = int(args.sockets * args.abandon)
+        n_write = int(args.sockets * args.writers)
+
+        async def one(i):
+            connected = asyncio.Event()
+            async with gate:
+                task = asyncio.create_task(visitor(url, f"soak-{i}", i < n_write, i >= args.sockets - n_abandon,
+                                                   connected, release, stats))
+                await connected.wait()
+            await task
+
+        started = time.perf_counter()
+        tasks = [asyncio.create_task(one(i)) for i in range(args.sockets)]
+        while stats["connected"] + stats["failed"] < args.sockets:
+            await asyncio.sleep(0.2)
+        open_s = time.perf_counter() - started
+        await sample(pid, token, base, f"open ({open_s:.0f} s)", round_no)
+
+        # Two ping intervals past the pong timeout: every silent socket is due
+        await asyncio.sleep(args.pong_timeout + 2 * args.ping_interval)
+        await sample(pid, token, base, "after eviction", round_no)
+
+        release.set()
+        await asyncio.gather(*tasks)
+        await asyncio.sleep(2)
+        m = await sample(pid, token, base, "all closed", round_no)
+        print(f"       connected {stats['connected']}, failed {stats['failed']}, abandoned evicted "
+              f"{stats['evicted']}/{n_abandon}, survived {stats['survived']}; "
+              f"tables empty: {m['visitors']['sockets'] == 0 and m['conversations'] == 0 and m['unbound'] == 0}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sockets", type=int, default=10000)
+    parser.add_argument("--rounds", type=int, default=3)
+    parser.add_argument("--abandon", type=float, default=0.3, help="share of sockets that stop answering pings")
+    parser.add_argument("--writers", type=float, default=0.1, help="share of visitors that send a message")
+    parser.add_argument("--concurrency", type=int, default=200, help="handshakes in flight")
+    # Generous enough for one Python client to answer 10k sockets' pings while still opening more
+    parser.add_argument("--ping-interval", type=float, default=20)
+    parser.add_argument("--pong-timeout", type=float, default=60)
+    parser.add_argument("--deflate", action="store_true", help="negotiate permessage-deflate")
+    args = parser.parse_args()
+
+    root = os.path.dirname(os.path.abspath(__file__))
+    workdir = tempfile.mkdtemp()
+    port = free_port()
+    env = dict(os.environ,
+               JWT_SECRET="soak-secret",
+               WS_PING_INTERVAL_SECONDS=str(args.ping_interval),
+               WS_PONG_TIMEOUT_SECONDS=str(args.pong_timeout),
+               WS_MAX_PER_IP=str(args.sockets * 2))
+    code = SERVER.format(root=root, db=os.path.join(workdir, "handoff.sqlite"), port=port, deflate=args.deflate)
+    proc = subprocess.Popen([sys.executable, "-c", code], cwd=workdir, env=env, stdout=subprocess.DEVNULL)
+    try:
+        for _ in range(100):
+            try:
+                socket.create_connection(("127.0.0.1", port), timeout=0.2).close()
+                break
+            except OSError:
+                time.sleep(0.2)
+        from jose import jwt
+        token = jwt.encode({"id": 1, "tenant_id": 1, "email": "soak@example.com", "name": "soak", "role": "admin",
+                            "exp": int(time.time()) + 3600}, "soak-secret", algorithm="HS256")
+        print("=" * 100)
+        print(f"VISITOR SOCKET SOAK ({args.sockets:,} sockets x {args.rounds} rounds, {args.abandon:.0%} abandoned, "
+              f"ping {args.ping_interval:g} s, pong timeout {args.pong_timeout:g} s, deflate {'on' if args.deflate else 'off'})")
+        print("=" * 100)
+        asyncio.run(soak(args, proc.pid, token, port))
+    finally:
+        proc.terminate()
+        proc.wait(10)
+
+
+if __name__ == "__main__":
+    main()
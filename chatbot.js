@@ -34,16 +34,39 @@ document.addEventListener("DOMContentLoaded", function () {
   // For local development on WordPress: window.DWC_CHAT_BACKEND = "http://localhost:8000"
   // For production: window.DWC_CHAT_BACKEND = "https://dwc-omnichat.onrender.com"
   const BASE_URL = window.DWC_CHAT_BACKEND || "https://dwc-omnichat.onrender.com";
+  // Public key of the site's tenant (window.DWC_CHAT_TENANT_KEY); without it messages go to the default tenant
+  const TENANT_KEY = window.DWC_CHAT_TENANT_KEY || "";
 
-  // Persistent visitor ID
+  function withTenant(url) {
+    if (!TENANT_KEY) return url;
+    return url + (url.includes("?") ? "&" : "?") + "tenant_key=" + encodeURIComponent(TENANT_KEY);
+  }
+
+  // Persistent visitor ID (128 random bits). Legacy "visitor-1234" ids had only
+  // 10,000 values and collided between visitors, so they are replaced.
   let userId = localStorage.getItem("dwc_user_id");
-  if (!userId) {
-    userId = "visitor-" + Math.floor(Math.random() * 10000);
+  if (!userId || /^visitor-\d{1,4}$/.test(userId)) {
+    userId = "visitor-" + randomId();
     localStorage.setItem("dwc_user_id", userId);
+    localStorage.removeItem("dwc_last_msg_id");
   }
 
+  // Highest message id rendered so far; sent as ?since= on reconnect so the
+  // server replays only what this visitor missed
+  let lastMessageId = parseInt(localStorage.getItem("dwc_last_msg_id") || "0", 10) || 0;
+
+  // Messages sent over the socket but not yet acknowledged, keyed by client id.
+  // Resent on reconnect; the server dedupes on client_id.
+  const pendingMessages = new Map();
+
   let ws;
+  // Reconnect backoff; reset once a socket opens
+  let retryDelay = 3000;
+  // Closed by the server for idleness or by a newer tab: reconnect on the next interaction
+  let parked = false;
   let typingTimeout;
+  // The server drops typing frames beyond a couple per second; don't send them
+  let typingSentAt = 0;
   let typingTimer = null;
   let typingAutoHideTimer = null;
 
@@ -79,17 +102,55 @@ document.addEventListener("DOMContentLoaded", function () {
     }
   }
 
+  function randomId() {
+    const c = window.crypto;
+    if (c && c.randomUUID) return c.randomUUID();
+    if (c && c.getRandomValues) {
+      return Array.from(c.getRandomValues(new Uint8Array(16)), (b) => b.toString(16).padStart(2, "0")).join("");
+    }
+    return Date.now().toString(36) + Math.random().toString(36).slice(2) + Math.random().toString(36).slice(2);
+  }
+
+  function newClientId() {
+    return randomId();
+  }
+
+  function wake() {
+    if (!parked) return;
+    parked = false;
+    connectWS();
+  }
+
+  function markDelivered(id) {
+    lastMessageId = id;
+    localStorage.setItem("dwc_last_msg_id", String(id));
+    if (ws && ws.readyState === WebSocket.OPEN) {
+      ws.send(JSON.stringify({ type: "ack", id }));
+    }
+  }
+
   function connectWS() {
-    const wsUrl = BASE_URL.replace("https", "wss") + `/ws/${userId}`;
-    ws = new WebSocket(wsUrl);
+    const since = lastMessageId ? `?since=${lastMessageId}` : "";
+    const wsUrl = BASE_URL.replace("https", "wss") + `/ws/${userId}${since}`;
+    ws = new WebSocket(withTenant(wsUrl));
 
-    ws.onopen = () => appendMessage("System", "Connected to chat.", "system");
+    ws.onopen = () => {
+      retryDelay = 3000;
+      appendMessage("System", "Connected to chat.", "system");
+      pendingMessages.forEach((text, clientId) => {
+        ws.send(JSON.stringify({ type: "message", text, client_id: clientId }));
+      });
+    };
 
     ws.onmessage = (event) => {
       try {
         const data = JSON.parse(event.data);
         console.log("[chatbot] WS message received:", data);
 
+        if (data.type === "ping") {
+          ws.send(JSON.stringify({ type: "pong" }));
+          return;
+        }
         if (data.type === "typing") {
           showTyping(true);
           return;
@@ -98,6 +159,31 @@ document.addEventListener("DOMContentLoaded", function () {
           showTyping(false);
           return;
         }
+        if (data.type === "ack") {
+          pendingMessages.delete(data.client_id);
+          return;
+        }
+        if (data.type === "rate_limited") {
+          // Still pending: resend once the server has a token for us
+          setTimeout(() => {
+            const text = pendingMessages.get(data.client_id);
+            if (text !== undefined && ws && ws.readyState === WebSocket.OPEN) {
+              ws.send(JSON.stringify({ type: "message", text, client_id: data.client_id }));
+            }
+          }, (data.retry_after || 1) * 1000);
+          return;
+        }
+        if (data.type === "error") {
+          console.warn("[chatbot] Server rejected message:", data.detail);
+          pendingMessages.delete(data.client_id);
+          return;
+        }
+
+        // Skip anything already shown (replay and live push can overlap)
+        if (data.id) {
+          if (data.id <= lastMessageId) return;
+          markDelivered(data.id);
+        }
 
         appendMessage(data.sender || "system", data.text || "", data.sender || "system");
       } catch {
@@ -105,17 +191,24 @@ document.addEventListener("DOMContentLoaded", function () {
       }
     };
 
-    ws.onclose = () => {
+    ws.onclose = (event) => {
+      if (event.code === 4000 || event.code === 4001) {
+        parked = true;
+        return;
+      }
       appendMessage("System", "Connection closed. Retrying...", "system");
-      setTimeout(connectWS, 3000);
+      setTimeout(connectWS, retryDelay + Math.random() * 1000);
+      retryDelay = Math.min(retryDelay * 2, 60000);
     };
   }
 
   // ========================
   // Typing events
   // ========================
+  msgInput.addEventListener("focus", wake);
   msgInput.addEventListener("input", () => {
-    if (ws && ws.readyState === WebSocket.OPEN) {
+    if (ws && ws.readyState === WebSocket.OPEN && Date.now() - typingSentAt > 1000) {
+      typingSentAt = Date.now();
       ws.send(JSON.stringify({ type: "typing" }));
     }
     clearTimeout(typingTimeout);
@@ -132,14 +225,22 @@ document.addEventListener("DOMContentLoaded", function () {
   sendBtn.addEventListener("click", () => {
     const text = msgInput.value.trim();
     if (!text) return;
+    wake();
 
     appendMessage("You", text, "user");
 
-    fetch(`${BASE_URL}/webchat`, {
-      method: "POST",
-      headers: { "Content-Type": "application/json" },
-      body: JSON.stringify({ user_id: userId, channel: "webchat", text }),
-    }).then((res) => console.log("[chatbot] POST /webchat response:", res.status));
+    const clientId = newClientId();
+    if (ws && ws.readyState === WebSocket.OPEN) {
+      // Preferred path: reuse the open socket instead of a new HTTP request
+      pendingMessages.set(clientId, text);
+      ws.send(JSON.stringify({ type: "message", text, client_id: clientId }));
+    } else {
+      fetch(withTenant(`${BASE_URL}/webchat`), {
+        method: "POST",
+        headers: { "Content-Type": "application/json" },
+        body: JSON.stringify({ user_id: userId, channel: "webchat", text, client_id: clientId }),
+      }).then((res) => console.log("[chatbot] POST /webchat response:", res.status));
+    }
 
     msgInput.value = "";
   });
@@ -152,6 +253,7 @@ document.addEventListener("DOMContentLoaded", function () {
   // Toggle
   // ========================
   toggleBtn.addEventListener("click", () => {
+    wake();
     chatBox.style.display = chatBox.style.display === "none" ? "flex" : "none";
   });
 
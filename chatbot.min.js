@@ -1 +1,36 @@
-document.addEventListener("DOMContentLoaded",function(){const e=document.createElement("div");e.innerHTML='\n    <div id="chat-toggle">💬</div>\n    <div id="chat-box" style="display:none; flex-direction:column;">\n      <div id="messages" style="flex:1; overflow-y:auto; padding:8px;"></div>\n\n      \x3c!-- ✅ Typing indicator --\x3e\n      <div id="typingIndicator" style="display:none; padding:4px; font-style:italic; color:gray;">\n        Staff is typing<span id="typingDots">.</span>\n      </div>\n\n      <div id="input-box" style="display:flex; gap:4px; padding:8px;">\n        <input id="msgInput" type="text" placeholder="Type a message..." style="flex:1;" />\n        <button id="sendBtn">Send</button>\n      </div>\n    </div>\n  ',document.body.appendChild(e);const t=document.getElementById("chat-toggle"),n=document.getElementById("chat-box"),s=document.getElementById("msgInput"),o=document.getElementById("sendBtn"),d=document.getElementById("messages"),i=document.getElementById("typingIndicator"),a=document.getElementById("typingDots"),l=window.DWC_CHAT_BACKEND||"https://dwc-omnichat.onrender.com";let c,r,y=localStorage.getItem("dwc_user_id");y||(y="visitor-"+Math.floor(1e4*Math.random()),localStorage.setItem("dwc_user_id",y));let p=null,m=null;function g(e,t,n="system"){const s=document.createElement("div");s.className=n,s.innerHTML=`<strong>${e}:</strong> ${t}`,d.appendChild(s),d.scrollTop=d.scrollHeight}function u(e){if(i&&a)if(e){i.style.display="block";let e=1;p&&clearInterval(p),p=setInterval(()=>{e=e%3+1,a.textContent=".".repeat(e)},500),m&&clearTimeout(m),m=setTimeout(()=>u(!1),3e3)}else i.style.display="none",p&&clearInterval(p),m&&clearTimeout(m),a.textContent="."}s.addEventListener("input",()=>{c&&c.readyState===WebSocket.OPEN&&c.send(JSON.stringify({type:"typing"})),clearTimeout(r),r=setTimeout(()=>{c&&c.readyState===WebSocket.OPEN&&c.send(JSON.stringify({type:"stop_typing"}))},1500)}),o.addEventListener("click",()=>{const e=s.value.trim();e&&(g("You",e,"user"),fetch(`${l}/webchat`,{method:"POST",headers:{"Content-Type":"application/json"},body:JSON.stringify({user_id:y,channel:"webchat",text:e})}).then(e=>console.log("[chatbot] POST /webchat response:",e.status)),s.value="")}),s.addEventListener("keypress",e=>{"Enter"===e.key&&o.click()}),t.addEventListener("click",()=>{n.style.display="none"===n.style.display?"flex":"none"}),function e(){const t=l.replace("https","wss")+`/ws/${y}`;c=new WebSocket(t),c.onopen=()=>g("System","Connected to chat.","system"),c.onmessage=e=>{try{const t=JSON.parse(e.data);if(console.log("[chatbot] WS message received:",t),"typing"===t.type)return void u(!0);if("stop_typing"===t.type)return void u(!1);g(t.sender||"system",t.text||"",t.sender||"system")}catch{g("System","⚠️ Invalid server message","system")}},c.onclose=()=>{g("System","Connection closed. Retrying...","system"),setTimeout(e,3e3)}}()});
\ No newline at end of file
+document.addEventListener("DOMContentLoaded",function(){const container=document.createElement("div");container.innerHTML=`
+    <div id="chat-toggle">💬</div>
+    <div id="chat-box" style="display:none; flex-direction:column;">
+      <div id="messages" style="flex:1; overflow-y:auto; padding:8px;"></div>
+
+      <!-- ✅ Typing indicator -->
+      <div id="typingIndicator" style="display:none; padding:4px; font-style:italic; color:gray;">
+        Staff is typing<span id="typingDots">.</span>
+      </div>
+
+      <div id="input-box" style="display:flex; gap:4px; padding:8px;">
+        <input id="msgInput" type="text" placeholder="Type a message..." style="flex:1;" />
+        <button id="sendBtn">Send</button>
+      </div>
+    </div>
+  `;document.body.appendChild(container);const toggleBtn=document.getElementById("chat-toggle");const chatBox=document.getElementById("chat-box");const msgInput=document.getElementById("msgInput");const sendBtn=document.getElementById("sendBtn");const messagesDiv=document.getElementById("messages");const typingIndicator=document.getElementById("typingIndicator");const typingDots=document.getElementById("typingDots");const BASE_URL=window.DWC_CHAT_BACKEND||"https://dwc-omnichat.onrender.com";const TENANT_KEY=window.DWC_CHAT_TENANT_KEY||"";function withTenant(url){if(!TENANT_KEY)return url;return url+(url.includes("?")?"&":"?")+"tenant_key="+encodeURIComponent(TENANT_KEY);}
+let userId=localStorage.getItem("dwc_user_id");if(!userId||/^visitor-\d{1,4}$/.test(userId)){userId="visitor-"+randomId();localStorage.setItem("dwc_user_id",userId);localStorage.removeItem("dwc_last_msg_id");}
+let lastMessageId=parseInt(localStorage.getItem("dwc_last_msg_id")||"0",10)||0;const pendingMessages=new Map();let ws;let retryDelay=3000;let parked=false;let typingTimeout;let typingSentAt=0;let typingTimer=null;let typingAutoHideTimer=null;function appendMessage(sender,text,type="system"){const div=document.createElement("div");div.className=type;div.innerHTML=`<strong>${sender}:</strong> ${text}`;messagesDiv.appendChild(div);messagesDiv.scrollTop=messagesDiv.scrollHeight;}
+function showTyping(show){if(!typingIndicator||!typingDots)return;if(show){typingIndicator.style.display="block";let n=1;if(typingTimer)clearInterval(typingTimer);typingTimer=setInterval(()=>{n=(n%3)+1;typingDots.textContent=".".repeat(n);},500);if(typingAutoHideTimer)clearTimeout(typingAutoHideTimer);typingAutoHideTimer=setTimeout(()=>showTyping(false),3000);}else{typingIndicator.style.display="none";if(typingTimer)clearInterval(typingTimer);if(typingAutoHideTimer)clearTimeout(typingAutoHideTimer);typingDots.textContent=".";}}
+function randomId(){const c=window.crypto;if(c&&c.randomUUID)return c.randomUUID();if(c&&c.getRandomValues){return Array.from(c.getRandomValues(new Uint8Array(16)),(b)=>b.toString(16).padStart(2,"0")).join("");}
+return Date.now().toString(36)+Math.random().toString(36).slice(2)+Math.random().toString(36).slice(2);}
+function newClientId(){return randomId();}
+function wake(){if(!parked)return;parked=false;connectWS();}
+function markDelivered(id){lastMessageId=id;localStorage.setItem("dwc_last_msg_id",String(id));if(ws&&ws.readyState===WebSocket.OPEN){ws.send(JSON.stringify({type:"ack",id}));}}
+function connectWS(){const since=lastMessageId?`?since=${lastMessageId}`:"";const wsUrl=BASE_URL.replace("https","wss")+`/ws/${userId}${since}`;ws=new WebSocket(withTenant(wsUrl));ws.onopen=()=>{retryDelay=3000;appendMessage("System","Connected to chat.","system");pendingMessages.forEach((text,clientId)=>{ws.send(JSON.stringify({type:"message",text,client_id:clientId}));});};ws.onmessage=(event)=>{try{const data=JSON.parse(event.data);console.log("[chatbot] WS message received:",data);if(data.type==="ping"){ws.send(JSON.stringify({type:"pong"}));return;}
+if(data.type==="typing"){showTyping(true);return;}
+if(data.type==="stop_typing"){showTyping(false);return;}
+if(data.type==="ack"){pendingMessages.delete(data.client_id);return;}
+if(data.type==="rate_limited"){setTimeout(()=>{const text=pendingMessages.get(data.client_id);if(text!==undefined&&ws&&ws.readyState===WebSocket.OPEN){ws.send(JSON.stringify({type:"message",text,client_id:data.client_id}));}},(data.retry_after||1)*1000);return;}
+if(data.type==="error"){console.warn("[chatbot] Server rejected message:",data.detail);pendingMessages.delete(data.client_id);return;}
+if(data.id){if(data.id<=lastMessageId)return;markDelivered(data.id);}
+appendMessage(data.sender||"system",data.text||"",data.sender||"system");}catch{appendMessage("System","⚠️ Invalid server message","system");}};ws.onclose=(event)=>{if(event.code===4000||event.code===4001){parked=true;return;}
+appendMessage("System","Connection closed. Retrying...","system");setTimeout(connectWS,retryDelay+Math.random()*1000);retryDelay=Math.min(retryDelay*2,60000);};}
+msgInput.addEventListener("focus",wake);msgInput.addEventListener("input",()=>{if(ws&&ws.readyState===WebSocket.OPEN&&Date.now()-typingSentAt>1000){typingSentAt=Date.now();ws.send(JSON.stringify({type:"typing"}));}
+clearTimeout(typingTimeout);typingTimeout=setTimeout(()=>{if(ws&&ws.readyState===WebSocket.OPEN){ws.send(JSON.stringify({type:"stop_typing"}));}},1500);});sendBtn.addEventListener("click",()=>{const text=msgInput.value.trim();if(!text)return;wake();appendMessage("You",text,"user");const clientId=newClientId();if(ws&&ws.readyState===WebSocket.OPEN){pendingMessages.set(clientId,text);ws.send(JSON.stringify({type:"message",text,client_id:clientId}));}else{fetch(withTenant(`${BASE_URL}/webchat`),{method:"POST",headers:{"Content-Type":"application/json"},body:JSON.stringify({user_id:userId,channel:"webchat",text,client_id:clientId}),}).then((res)=>console.log("[chatbot] POST /webchat response:",res.status));}
+msgInput.value="";});msgInput.addEventListener("keypress",(e)=>{if(e.key==="Enter")sendBtn.click();});toggleBtn.addEventListener("click",()=>{wake();chatBox.style.display=chatBox.style.display==="none"?"flex":"none";});connectWS();});
\ No newline at end of file
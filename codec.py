@@ -0,0 +1,92 @@
+"""
+Response / WebSocket frame encoding.
+
+``FastJSONResponse`` renders with orjson when it is installed (falling back
+to the stdlib ``json``).  Endpoints that build plain dict/list payloads
+return it directly, which also skips FastAPI's ``jsonable_encoder`` walk
+over every row.
+
+WebSocket broadcasts encode a payload once and send the same frame to
+every socket.  Admin sockets may negotiate the ``msgpack`` subprotocol
+(used by the mobile app) when the msgpack package is installed; everyone
+else gets JSON text frames.
+"""
+import json
+from typing import Any, Optional, Union
+
+from fastapi.responses import JSONResponse
+from starlette.websockets import WebSocket, WebSocketDisconnect
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - optional speedup
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:  # pragma: no cover - optional subprotocol
+    msgpack = None
+
+MSGPACK_SUBPROTOCOL = "msgpack"
+
+
+def _default(obj):
+    if hasattr(obj, "model_dump"):
+        return obj.model_dump()
+    if isinstance(obj, (set, frozenset, tuple)):
+        return list(obj)
+    if isinstance(obj, bytes):
+        return obj.decode("utf-8", "replace")
+    return str(obj)
+
+
+def dumps(obj: Any) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(obj, default=_default, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(obj, default=_default, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def dumps_text(obj: Any) -> str:
+    return dumps(obj).decode("utf-8")
+
+
+class FastJSONResponse(JSONResponse):
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
+
+
+# ---------- WebSocket frames ----------
+def negotiate_subprotocol(websocket: WebSocket) -> Optional[str]:
+    """Pick msgpack if the client offered it and we can speak it"""
+    if msgpack is not None and MSGPACK_SUBPROTOCOL in websocket.scope.get("subprotocols", []):
+        return MSGPACK_SUBPROTOCOL
+    return None
+
+
+def encode_frame(payload: Any, fmt: str = "json") -> Union[str, bytes]:
+    if fmt == MSGPACK_SUBPROTOCOL:
+        return msgpack.packb(payload, default=_default, use_bin_type=True)
+    return dumps_text(payload)
+
+
+async def send_frame(websocket: WebSocket, frame: Union[str, bytes]):
+    if isinstance(frame, bytes):
+        await websocket.send_bytes(frame)
+    else:
+        await websocket.send_text(frame)
+
+
+async def send(websocket: WebSocket, payload: Any, fmt: str = "json"):
+    await send_frame(websocket, encode_frame(payload, fmt))
+
+
+async def receive(websocket: WebSocket, fmt: str = "json") -> Any:
+    """Receive and decode one frame in the socket's negotiated format"""
+    message = await websocket.receive()
+    if message["type"] == "websocket.disconnect":
+        raise WebSocketDisconnect(message.get("code", 1000), message.get("reason"))
+    if message.get("text") is not None:
+        return json.loads(message["text"])
+    if fmt == MSGPACK_SUBPROTOCOL:
+        return msgpack.unpackb(message["bytes"], raw=False)
+    return json.loads(message.get("bytes") or b"")
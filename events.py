@@ -0,0 +1,186 @@
+"""
+Buffered audit/event ingestion.
+
+``log_event`` only appends to an in-memory buffer, so request handlers
+never pay for a connection or a commit.  A background task started by
+server.py flushes the buffer with one ``executemany`` per batch, either on
+a timer or as soon as the buffer passes its high-water mark.  If the buffer
+is completely full, new events are dropped and counted rather than blocking
+the caller.  Everything left in the buffer is flushed on shutdown.
+
+The server hands the writer its primary shard's writer connection
+(``start(connect=...)``), so flushes queue behind the same lock as every
+other write instead of competing with it for the SQLite write lock.
+Scripts that run without the server fall back to their own connection.
+
+All events go into the single canonical table:
+
+    events(id, tenant_id, conversation_id, user_id, type, payload, ts, ts_ms)
+"""
+import asyncio
+import atexit
+import contextlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+from collections import deque
+from pathlib import Path
+from typing import Callable, ContextManager, Optional
+
+import timestamps
+
+EVENT_FLUSH_INTERVAL = float(os.getenv("EVENT_FLUSH_INTERVAL", "1.0"))
+EVENT_BATCH_SIZE = int(os.getenv("EVENT_BATCH_SIZE", "500"))
+EVENT_BUFFER_MAX = int(os.getenv("EVENT_BUFFER_MAX", "20000"))
+
+
+def _default_db_path():
+    if os.path.exists("/data"):
+        return "/data/handoff.sqlite"
+    return str(Path(__file__).parent / "handoff.sqlite")
+
+
+def init_schema(conn):
+    """Create / upgrade the canonical events table (idempotent)"""
+    conn.execute("""CREATE TABLE IF NOT EXISTS events (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER,
+        tenant_id INTEGER,
+        type TEXT NOT NULL,
+        payload TEXT,
+        ts TEXT NOT NULL DEFAULT (datetime('now')),
+        FOREIGN KEY (user_id) REFERENCES users(id),
+        FOREIGN KEY (tenant_id) REFERENCES tenants(id)
+    )""")
+    try:
+        conn.execute("ALTER TABLE events ADD COLUMN conversation_id INTEGER")
+    except sqlite3.OperationalError:
+        pass
+    try:
+        conn.execute("ALTER TABLE events ADD COLUMN ts_ms INTEGER")
+        timestamps.backfill_column(conn, "events", "ts", "ts_ms")
+    except sqlite3.OperationalError:
+        pass
+    conn.execute("DROP INDEX IF EXISTS idx_events_tenant_ts")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_events_tenant_ts_ms ON events(tenant_id, ts_ms)")
+
+
+class EventWriter:
+    def __init__(self, db_path: Optional[str] = None, flush_interval: float = EVENT_FLUSH_INTERVAL,
+                 batch_size: int = EVENT_BATCH_SIZE, max_buffer: int = EVENT_BUFFER_MAX,
+                 connect: Optional[Callable[[], ContextManager[sqlite3.Connection]]] = None):
+        self.db_path = db_path or _default_db_path()
+        self.connect = connect
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.max_buffer = max_buffer
+        self._buffer = deque()
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup: Optional[asyncio.Event] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._task: Optional[asyncio.Task] = None
+        self.stats = {"logged": 0, "written": 0, "dropped": 0, "flushes": 0, "failures": 0}
+
+    def log(self, type: str, user_id=None, tenant_id=None, conversation_id=None, payload=None) -> bool:
+        """Queue one event. Never blocks on the database; returns False if dropped."""
+        now = timestamps.now_ms()
+        row = (tenant_id, conversation_id, user_id, type, json.dumps(payload or {}), timestamps.to_iso(now), now)
+        with self._lock:
+            if len(self._buffer) >= self.max_buffer:
+                self.stats["dropped"] += 1
+                return False
+            self._buffer.append(row)
+            self.stats["logged"] += 1
+            high_water = len(self._buffer) >= self.batch_size
+        if high_water and self._loop is not None and self._wakeup is not None:
+            self._loop.call_soon_threadsafe(self._wakeup.set)
+        return True
+
+    def pending(self) -> int:
+        return len(self._buffer)
+
+    @contextlib.contextmanager
+    def _own_connection(self):
+        conn = sqlite3.connect(self.db_path, timeout=10)
+        try:
+            yield conn
+            conn.commit()
+        finally:
+            conn.close()
+
+    def flush(self) -> int:
+        """Write everything buffered so far in batches. Safe to call from any thread."""
+        written = 0
+        with self._flush_lock:
+            while True:
+                with self._lock:
+                    batch = [self._buffer.popleft() for _ in range(min(self.batch_size, len(self._buffer)))]
+                if not batch:
+                    break
+                try:
+                    with (self.connect or self._own_connection)() as conn:
+                        conn.executemany(
+                            "INSERT INTO events (tenant_id, conversation_id, user_id, type, payload, ts, ts_ms) VALUES (?,?,?,?,?,?,?)",
+                            batch,
+                        )
+                except Exception as e:
+                    self.stats["failures"] += 1
+                    logging.error(f"[events] Flush of {len(batch)} events failed: {e}")
+                    # Put the batch back (oldest first) so the next flush retries it
+                    with self._lock:
+                        room = self.max_buffer - len(self._buffer)
+                        self._buffer.extendleft(reversed(batch[:max(room, 0)]))
+                        self.stats["dropped"] += max(len(batch) - room, 0)
+                    break
+                written += len(batch)
+                self.stats["written"] += len(batch)
+                self.stats["flushes"] += 1
+        return written
+
+    async def run(self):
+        self._loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            if self._buffer:
+                await asyncio.to_thread(self.flush)
+
+    def start(self, db_path: Optional[str] = None,
+              connect: Optional[Callable[[], ContextManager[sqlite3.Connection]]] = None):
+        """``connect()`` returns a writer connection context (commits on exit); default: a connection of our own"""
+        if db_path:
+            self.db_path = db_path
+        if connect:
+            self.connect = connect
+        if self._task is None:
+            self._task = asyncio.create_task(self.run())
+        return self._task
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        self._loop = self._wakeup = None
+        written = await asyncio.to_thread(self.flush)
+        logging.info(f"[events] Flushed {written} events on shutdown")
+
+
+event_writer = EventWriter()
+# Scripts that log events without running the server still persist them
+atexit.register(event_writer.flush)
+
+
+def log_event(type: str, user_id=None, tenant_id=None, conversation_id=None, payload=None) -> bool:
+    return event_writer.log(type, user_id=user_id, tenant_id=tenant_id,
+                            conversation_id=conversation_id, payload=payload)
@@ -4,14 +4,30 @@
  */
 
 function dwc_enqueue_chatbot() {
-    // Load chatbot JavaScript (minified version)
+    // Load chatbot JavaScript (minified version). Define DWC_OMNICHAT_URL in wp-config.php
+    // to load it from the chat server instead (brotli/gzip, ETag revalidation).
+    if (defined('DWC_OMNICHAT_URL')) {
+        $chatbot_src = rtrim(DWC_OMNICHAT_URL, '/') . '/chatbot.min.js';
+        $chatbot_ver = null; // no ?ver= - the server's ETag handles updates
+    } else {
+        $chatbot_src = get_stylesheet_directory_uri() . '/chatbot.min.js';
+        $chatbot_ver = filemtime(get_stylesheet_directory() . '/chatbot.min.js');
+    }
     wp_enqueue_script(
         'dwc-chatbot',
-        get_stylesheet_directory_uri() . '/chatbot.min.js',
+        $chatbot_src,
         array(), // No dependencies
-        filemtime(get_stylesheet_directory() . '/chatbot.min.js'),
+        $chatbot_ver,
         true // Load in footer
     );
+    // Multi-tenant servers: define DWC_OMNICHAT_TENANT_KEY (the tenant's widget_key) in wp-config.php
+    if (defined('DWC_OMNICHAT_TENANT_KEY')) {
+        wp_add_inline_script(
+            'dwc-chatbot',
+            'window.DWC_CHAT_TENANT_KEY = ' . wp_json_encode(DWC_OMNICHAT_TENANT_KEY) . ';',
+            'before'
+        );
+    }
 
     // Load chatbot CSS (minified if available)
     if (file_exists(get_stylesheet_directory() . '/style.min.css')) {
@@ -0,0 +1,109 @@
+"""
+Leader election over the shared SQLite database.
+
+Every worker process runs a ``Lease`` heartbeat.  Whoever holds the lease
+row runs the periodic background jobs (escalation, archiving, ...); the
+others stay idle and take over once the holder's lease expires, i.e. at
+most ``ttl`` seconds after the leader dies.  Acquire and renew are a single
+atomic UPSERT, so two workers can never both believe they hold the lease.
+"""
+import asyncio
+import logging
+import os
+import socket
+import sqlite3
+import time
+import uuid
+
+LEADER_LEASE_TTL = float(os.getenv("LEADER_LEASE_TTL", "10"))
+
+
+def init_schema(conn):
+    conn.execute("""CREATE TABLE IF NOT EXISTS leases (
+        name TEXT PRIMARY KEY,
+        holder TEXT NOT NULL,
+        expires_at REAL NOT NULL,
+        acquired_at REAL NOT NULL
+    )""")
+
+
+class Lease:
+    def __init__(self, name: str, db_path: str, ttl: float = LEADER_LEASE_TTL):
+        self.name = name
+        self.db_path = db_path
+        self.ttl = ttl
+        self.holder = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._valid_until = 0.0
+        self._task = None
+
+    @property
+    def is_leader(self) -> bool:
+        # Only trust the lease until it would expire for the other workers
+        return time.time() < self._valid_until
+
+    def try_acquire(self) -> bool:
+        """Acquire or renew the lease. Returns True if this process holds it."""
+        now = time.time()
+        expires_at = now + self.ttl
+        was_leader = self.is_leader
+        conn = sqlite3.connect(self.db_path, timeout=self.ttl / 2)
+        try:
+            row = conn.execute("""
+                INSERT INTO leases (name, holder, expires_at, acquired_at) VALUES (?, ?, ?, ?)
+                ON CONFLICT(name) DO UPDATE SET
+                    holder = excluded.holder,
+                    expires_at = excluded.expires_at,
+                    acquired_at = CASE WHEN leases.holder = excluded.holder
+                                       THEN leases.acquired_at ELSE excluded.acquired_at END
+                WHERE leases.holder = excluded.holder OR leases.expires_at < ?
+                RETURNING holder
+            """, (self.name, self.holder, expires_at, now, now)).fetchone()
+            conn.commit()
+        finally:
+            conn.close()
+
+        if row and row[0] == self.holder:
+            self._valid_until = expires_at
+        else:
+            self._valid_until = 0.0
+        if self.is_leader != was_leader:
+            logging.info(f"[lease] {self.holder} {'acquired' if self.is_leader else 'lost'} lease '{self.name}'")
+        return self.is_leader
+
+    def release(self):
+        if not self.is_leader:
+            return
+        self._valid_until = 0.0
+        conn = sqlite3.connect(self.db_path, timeout=self.ttl / 2)
+        try:
+            conn.execute("DELETE FROM leases WHERE name=? AND holder=?", (self.name, self.holder))
+            conn.commit()
+        finally:
+            conn.close()
+        logging.info(f"[lease] {self.holder} released lease '{self.name}'")
+
+    async def run(self):
+        """Heartbeat: renew (or try to take over) several times per TTL"""
+        while True:
+            try:
+                await asyncio.to_thread(self.try_acquire)
+            except Exception as e:
+                self._valid_until = 0.0
+                logging.warning(f"[lease] Heartbeat for '{self.name}' failed: {e}")
+            await asyncio.sleep(self.ttl / 3)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self.run())
+        return self._task
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        # Hand over immediately instead of waiting for the TTL to lapse
+        await asyncio.to_thread(self.release)
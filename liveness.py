@@ -0,0 +1,225 @@
+"""
+Lifecycle of the visitor sockets on ``/ws/{user_id}``.
+
+Without it a socket stays registered until a push to it fails.  That covers
+abandoned widget tabs and half-open TCP connections whose peer vanished
+without a FIN.  Nothing limited how many sockets one visitor or one
+address could hold, either.  ``SocketRegistry`` tracks every open visitor
+socket in a small slotted record:
+
+- Liveness: the handler waits for frames with a timeout.  When a socket
+  has been silent for ``WS_PING_INTERVAL_SECONDS`` it gets a
+  ``{"type": "ping"}`` frame, which the widget answers with ``pong``.  A
+  socket with no inbound frame for ``WS_PONG_TIMEOUT_SECONDS`` is closed
+  as dead.
+- Idle eviction: a socket with no chat traffic in either direction
+  (visitor messages or typing, or staff/system pushes) for
+  ``WS_IDLE_SECONDS`` is closed with ``CLOSE_IDLE``.  The widget
+  reconnects on the next interaction rather than right away.
+- Caps: at most ``WS_MAX_PER_IP`` sockets per client address (further
+  ones are refused before the handshake completes) and
+  ``WS_MAX_PER_VISITOR`` per visitor.  A visitor over the cap keeps their
+  newest tabs; the oldest is closed with ``CLOSE_REPLACED``.
+
+Client addresses come from ``client_address``.  It reads X-Forwarded-For
+only when the peer is one of ``TRUSTED_PROXY_NETWORKS``, and then takes
+the rightmost entry outside them, which is the one the proxy appended.
+Entries to the left of it are whatever the client sent.
+
+``metrics()`` reports the counts, evictions by reason and the process
+memory per open socket.  The per-socket figure is the RSS growth since
+startup divided by the number of open sockets.  The allocator keeps the
+peak after sockets close, so the figure is only meaningful near peak.
+Serve with ``--ws-per-message-deflate false`` (see render.yaml).  The
+negotiated zlib contexts cost about 90 KB per socket, roughly twice what
+the rest of a visitor socket holds, and buy nothing for small chat frames.
+"""
+import functools
+import ipaddress
+import os
+import sys
+import time
+from typing import Dict, Hashable, List, Optional, Tuple
+
+WS_PING_INTERVAL_SECONDS = float(os.getenv("WS_PING_INTERVAL_SECONDS", "25"))
+WS_PONG_TIMEOUT_SECONDS = float(os.getenv("WS_PONG_TIMEOUT_SECONDS", "60"))
+WS_IDLE_SECONDS = float(os.getenv("WS_IDLE_SECONDS", "1800"))
+WS_MAX_PER_IP = int(os.getenv("WS_MAX_PER_IP", "50"))
+WS_MAX_PER_VISITOR = int(os.getenv("WS_MAX_PER_VISITOR", "5"))
+WS_MAX_USER_ID_LENGTH = 128
+# Comma-separated CIDRs of the reverse proxies in front of the app (render.yaml sets Render's)
+TRUSTED_PROXY_NETWORKS = [ipaddress.ip_network(cidr.strip(), strict=False)
+                          for cidr in os.getenv("TRUSTED_PROXY_NETWORKS", "127.0.0.1/32").split(",") if cidr.strip()]
+
+CLOSE_DEAD = 1001  # going away: no pong (the peer rarely sees it)
+CLOSE_POLICY = 1008  # malformed visitor id
+CLOSE_TRY_LATER = 1013  # address over its cap
+CLOSE_IDLE = 4000
+CLOSE_REPLACED = 4001
+CLOSE_CODES = {"dead": CLOSE_DEAD, "idle": CLOSE_IDLE}
+
+
+@functools.lru_cache(maxsize=1024)
+def is_trusted_proxy(host: str) -> bool:
+    try:
+        address = ipaddress.ip_address(host)
+    except ValueError:
+        return False
+    return any(address in network for network in TRUSTED_PROXY_NETWORKS)
+
+
+def client_address(peer: Optional[str], forwarded_for: Optional[str]) -> str:
+    """The client behind ``peer``: X-Forwarded-For is honoured only from a trusted proxy"""
+    if not peer:
+        return "unknown"
+    if not forwarded_for or not is_trusted_proxy(peer):
+        return peer
+    for host in reversed([h.strip() for h in forwarded_for.split(",")]):
+        if host and not is_trusted_proxy(host):
+            return host
+    return peer
+
+
+def rss_bytes() -> Optional[int]:
+    """Resident set size of this process (Linux), or None where /proc is unavailable"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+class Conn:
+    """Per-socket state; slotted because there is one per open visitor tab"""
+    __slots__ = ("ws", "visitor", "ip", "opened", "seen", "active", "pinged")
+
+    def __init__(self, ws, visitor: Hashable, ip: str, now: float):
+        self.ws = ws
+        self.visitor = visitor
+        self.ip = ip
+        self.opened = now
+        self.seen = now  # last inbound frame of any kind
+        self.active = now  # last chat traffic either way
+        self.pinged = 0.0
+
+
+class SocketRegistry:
+    def __init__(self, ping_interval: float = WS_PING_INTERVAL_SECONDS, pong_timeout: float = WS_PONG_TIMEOUT_SECONDS,
+                 idle_seconds: float = WS_IDLE_SECONDS, max_per_ip: int = WS_MAX_PER_IP,
+                 max_per_visitor: int = WS_MAX_PER_VISITOR, clock=time.monotonic):
+        self.ping_interval = ping_interval
+        self.pong_timeout = pong_timeout
+        self.idle_seconds = idle_seconds
+        self.max_per_ip = max_per_ip
+        self.max_per_visitor = max_per_visitor
+        self.clock = clock
+        self.conns: Dict[object, Conn] = {}
+        self.by_ip: Dict[str, int] = {}
+        # Oldest first, so the cap displaces the longest-open tab
+        self.by_visitor: Dict[Hashable, List[Conn]] = {}
+        self.baseline_rss = rss_bytes()
+        self.stats = {"opened": 0, "closed": 0, "rejected_ip": 0, "replaced": 0, "dead": 0, "idle": 0, "pings": 0}
+
+    def admit(self, ws, visitor: Hashable, ip: str) -> Optional[list]:
+        """
+        Register a new socket.  Returns None when ``ip`` is at its cap (refuse
+        the socket); otherwise the visitor's older sockets the caller must
+        close with ``CLOSE_REPLACED``.
+        """
+        if self.by_ip.get(ip, 0) >= self.max_per_ip:
+            self.stats["rejected_ip"] += 1
+            return None
+        conn = Conn(ws, visitor, ip, self.clock())
+        self.conns[ws] = conn
+        self.by_ip[ip] = self.by_ip.get(ip, 0) + 1
+        tabs = self.by_visitor.setdefault(visitor, [])
+        tabs.append(conn)
+        self.stats["opened"] += 1
+        displaced = [c.ws for c in tabs[:max(len(tabs) - self.max_per_visitor, 0)]]
+        for old in displaced:
+            self.release(old)
+            self.stats["replaced"] += 1
+        return displaced
+
+    def release(self, ws):
+        """Forget a socket (idempotent)"""
+        conn = self.conns.pop(ws, None)
+        if conn is None:
+            return
+        self.stats["closed"] += 1
+        left = self.by_ip[conn.ip] - 1
+        if left:
+            self.by_ip[conn.ip] = left
+        else:
+            del self.by_ip[conn.ip]
+        tabs = self.by_visitor[conn.visitor]
+        tabs.remove(conn)
+        if not tabs:
+            del self.by_visitor[conn.visitor]
+        if not self.conns:
+            # Dicts never shrink in place: drop the tables sized for the last peak
+            self.conns, self.by_ip, self.by_visitor = {}, {}, {}
+
+    def seen(self, ws, active: bool = False):
+        """An inbound frame arrived; ``active`` for chat traffic (not pong/ack)"""
+        conn = self.conns.get(ws)
+        if conn is not None:
+            conn.seen = self.clock()
+            if active:
+                conn.active = conn.seen
+
+    def pushed(self, ws):
+        """Chat traffic was sent to the socket; keeps a tab that is only reading alive"""
+        conn = self.conns.get(ws)
+        if conn is not None:
+            conn.active = self.clock()
+
+    def poll(self, ws) -> Tuple[Optional[str], float]:
+        """
+        What the socket's handler should do next: ("ping", 0), ("dead", 0),
+        ("idle", 0) or (None, seconds to wait for a frame before polling again).
+        """
+        conn = self.conns.get(ws)
+        if conn is None:
+            return "replaced", 0.0
+        now = self.clock()
+        if now - conn.active >= self.idle_seconds:
+            self.stats["idle"] += 1
+            return "idle", 0.0
+        if now - conn.seen >= self.pong_timeout:
+            self.stats["dead"] += 1
+            return "dead", 0.0
+        ping_due = max(conn.seen, conn.pinged) + self.ping_interval
+        if now >= ping_due:
+            conn.pinged = now
+            self.stats["pings"] += 1
+            return "ping", 0.0
+        deadline = min(ping_due, conn.seen + self.pong_timeout, conn.active + self.idle_seconds)
+        return None, max(deadline - now, 0.01)
+
+    def bookkeeping_bytes(self) -> int:
+        """Approximate size of the registry's own structures"""
+        size = sys.getsizeof(self.conns) + sys.getsizeof(self.by_ip) + sys.getsizeof(self.by_visitor)
+        size += sum(sys.getsizeof(tabs) for tabs in self.by_visitor.values())
+        if self.conns:
+            size += len(self.conns) * sys.getsizeof(next(iter(self.conns.values())))
+        return size
+
+    def metrics(self) -> dict:
+        rss = rss_bytes()
+        n = len(self.conns)
+        grown = rss - self.baseline_rss if rss is not None and self.baseline_rss is not None else None
+        return {
+            "sockets": n,
+            "visitors": len(self.by_visitor),
+            "addresses": len(self.by_ip),
+            "oldest_seconds": round(self.clock() - min(c.opened for c in self.conns.values()), 1) if n else 0,
+            "rss_bytes": rss,
+            "baseline_rss_bytes": self.baseline_rss,
+            "bytes_per_socket": round(max(grown, 0) / n) if n and grown is not None else None,
+            "bookkeeping_bytes": self.bookkeeping_bytes(),
+            "limits": {"ping_interval_seconds": self.ping_interval, "pong_timeout_seconds": self.pong_timeout,
+                       "idle_seconds": self.idle_seconds, "max_per_ip": self.max_per_ip,
+                       "max_per_visitor": self.max_per_visitor},
+            **self.stats,
+        }
@@ -0,0 +1,280 @@
+"""
+Space reclamation and planner upkeep for the SQLite files.
+
+Purges (history export, message purge, archiving) put the freed pages on
+the file's freelist.  SQLite reuses them, but the file never shrinks and
+the WAL keeps the old frames until a checkpoint.  Planner statistics go
+stale as well.  ``Maintainer.run`` makes one pass over a shard and its
+archive tier on the shard's writer connection:
+
+- ``PRAGMA incremental_vacuum``: files are created with
+  ``auto_vacuum=INCREMENTAL`` so free pages can be returned a few at a
+  time.  Older files are converted with one ``VACUUM``, but only while they
+  are smaller than ``MAINTENANCE_CONVERT_MAX_MB``.
+- ``PRAGMA wal_checkpoint``: PASSIVE on every pass; TRUNCATE when a -wal
+  file has grown past ``MAINTENANCE_WAL_TRUNCATE_MB``.
+- ``ANALYZE``, bounded by ``analysis_limit``, after a purge or a vacuum.
+  Otherwise ``PRAGMA optimize`` runs.
+
+Passes only start on a quiet shard, i.e. one that saw fewer than
+``MAINTENANCE_QUIET_OPS_PER_MIN`` queries per minute since the previous
+check.  Each slice holds the writer for about ``MAINTENANCE_SLICE_MS`` and
+the pass sleeps ``MAINTENANCE_PAUSE_MS`` between slices, so queued writes
+go first.  A pass stops when it has held the writer for
+``MAINTENANCE_BUDGET_MS`` in total, or as soon as traffic picks up again.
+"""
+import logging
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+
+MAINTENANCE_SLICE_MS = float(os.getenv("MAINTENANCE_SLICE_MS", "10"))
+MAINTENANCE_PAUSE_MS = float(os.getenv("MAINTENANCE_PAUSE_MS", "50"))
+MAINTENANCE_BUDGET_MS = float(os.getenv("MAINTENANCE_BUDGET_MS", "1000"))
+MAINTENANCE_QUIET_OPS_PER_MIN = float(os.getenv("MAINTENANCE_QUIET_OPS_PER_MIN", "120"))
+# Other queries on the shard during a pass before it gives the writer back for good
+MAINTENANCE_YIELD_AFTER_OPS = int(os.getenv("MAINTENANCE_YIELD_AFTER_OPS", "20"))
+MAINTENANCE_WAL_TRUNCATE_MB = float(os.getenv("MAINTENANCE_WAL_TRUNCATE_MB", "64"))
+MAINTENANCE_CONVERT_MAX_MB = float(os.getenv("MAINTENANCE_CONVERT_MAX_MB", "128"))
+MAINTENANCE_ANALYSIS_LIMIT = int(os.getenv("MAINTENANCE_ANALYSIS_LIMIT", "1000"))
+VACUUM_CHUNK_PAGES = 32
+CHECKPOINT_BUSY_MS = 50
+
+AUTO_VACUUM_MODES = {0: "none", 1: "full", 2: "incremental"}
+
+
+def schemas(conn) -> List[Tuple[str, str]]:
+    """(schema, file) of every on-disk database attached to ``conn``"""
+    return [(row[1], row[2]) for row in conn.execute("PRAGMA database_list").fetchall()
+            if row[1] != "temp" and row[2]]
+
+
+def _pragma(conn, schema: str, name: str) -> int:
+    return conn.execute(f"PRAGMA {schema}.{name}").fetchone()[0]
+
+
+def _size(path: str) -> int:
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return 0
+
+
+def file_stats(conn) -> Dict[str, dict]:
+    """
+    Size and free-space figures per database file.  ``fragmentation`` is the
+    share of pages on the freelist, i.e. space a vacuum would give back.
+    """
+    stats = {}
+    for schema, path in schemas(conn):
+        page_size = _pragma(conn, schema, "page_size")
+        pages = _pragma(conn, schema, "page_count")
+        free = _pragma(conn, schema, "freelist_count")
+        stats[Path(path).name] = {
+            "bytes": _size(path),
+            "wal_bytes": _size(path + "-wal"),
+            "page_size": page_size,
+            "pages": pages,
+            "free_pages": free,
+            "free_bytes": free * page_size,
+            "fragmentation": round(free / pages, 4) if pages else 0.0,
+            "auto_vacuum": AUTO_VACUUM_MODES.get(_pragma(conn, schema, "auto_vacuum"), "unknown"),
+        }
+    return stats
+
+
+def checkpoint(path: str, truncate: bool = False) -> dict:
+    """
+    Checkpoint ``path``'s WAL on a connection of its own.  Writers keep
+    going during a PASSIVE checkpoint.  TRUNCATE (forced, or when the -wal
+    file is over MAINTENANCE_WAL_TRUNCATE_MB) waits at most
+    CHECKPOINT_BUSY_MS for them.
+    """
+    mode = "TRUNCATE" if truncate or _size(path + "-wal") > MAINTENANCE_WAL_TRUNCATE_MB * 1e6 else "PASSIVE"
+    conn = sqlite3.connect(path, timeout=CHECKPOINT_BUSY_MS / 1000)
+    try:
+        busy, wal_frames, checkpointed = conn.execute(f"PRAGMA wal_checkpoint({mode})").fetchone()
+    finally:
+        conn.close()
+    return {"mode": mode, "busy": bool(busy), "wal_frames": wal_frames, "checkpointed": checkpointed}
+
+
+class Maintainer:
+    """
+    Runs maintenance passes, one at a time, and keeps statistics.  Shards are
+    identified by a ``key`` (their file path).  ``connect()`` must return the
+    shard's writer as a context manager, with any tiers that should be
+    maintained as well already attached.
+    """
+    def __init__(self, slice_ms: float = MAINTENANCE_SLICE_MS, pause_ms: float = MAINTENANCE_PAUSE_MS,
+                 budget_ms: float = MAINTENANCE_BUDGET_MS, quiet_ops_per_min: float = MAINTENANCE_QUIET_OPS_PER_MIN,
+                 yield_after_ops: int = MAINTENANCE_YIELD_AFTER_OPS):
+        self.slice_ms = slice_ms
+        self.pause_ms = pause_ms
+        self.budget_ms = budget_ms
+        self.quiet_ops_per_min = quiet_ops_per_min
+        self.yield_after_ops = yield_after_ops
+        self._running = threading.Lock()
+        self._seen: Dict[str, Tuple[int, float]] = {}  # key -> (other ops, monotonic time) at the last check
+        self._own_ops: Dict[str, int] = {}  # writer checkouts made by maintenance itself
+        self._purged = set()
+        self.stats = {"passes": 0, "skipped_busy": 0, "interrupted": 0, "slices": 0, "max_slice_ms": 0.0,
+                      "pages_reclaimed": 0, "bytes_reclaimed": 0, "converted": 0, "checkpoints": 0,
+                      "analyzed": 0, "optimized": 0, "last_run": None, "last": {}, "running": False}
+
+    @property
+    def running(self) -> bool:
+        return self.stats["running"]
+
+    def mark_purged(self, key: str):
+        """Rows were bulk-deleted from ``key``: re-ANALYZE it on its next pass"""
+        self._purged.add(key)
+
+    def quiet(self, key: str, ops: int) -> bool:
+        """True if the shard saw fewer than ``quiet_ops_per_min`` other queries per minute since the last check"""
+        now = time.monotonic()
+        others = ops - self._own_ops.get(key, 0)
+        last = self._seen.get(key)
+        self._seen[key] = (others, now)
+        if last is None:
+            return False  # no rate yet; the next check has one
+        per_min = (others - last[0]) / max(now - last[1], 1e-3) * 60
+        return per_min < self.quiet_ops_per_min
+
+    def run(self, key: str, connect: Callable, ops: Optional[Callable[[], int]] = None,
+            force: bool = False) -> Optional[dict]:
+        """
+        One pass over the shard.  ``ops()`` returns the shard's query count
+        so far (reads + writes).  It is used for the quiet check, which
+        ``force`` skips.  Returns the pass report, or None if the shard was
+        busy.  Raises RuntimeError if a pass is already running.
+        """
+        if not self._running.acquire(blocking=False):
+            raise RuntimeError("maintenance is already running")
+        self.stats["running"] = True
+        try:
+            if not force and ops is not None and not self.quiet(key, ops()):
+                self.stats["skipped_busy"] += 1
+                return None
+            return self._run(key, connect, ops, force)
+        finally:
+            self.stats["running"] = False
+            self._running.release()
+
+    def _run(self, key: str, connect: Callable, ops: Optional[Callable[[], int]], force: bool) -> dict:
+        started = time.perf_counter()
+        baseline = ops() if ops is not None else 0
+        own = 0
+        held_ms = 0.0
+        report = {"pages_reclaimed": 0, "bytes_reclaimed": 0, "slices": 0, "max_slice_ms": 0.0,
+                  "converted": [], "checkpoint": {}, "analyze": None, "interrupted": False}
+
+        def in_slice(fn):
+            nonlocal own, held_ms
+            with connect() as conn:
+                slice_started = time.perf_counter()
+                result = fn(conn, slice_started)
+                slice_ms = (time.perf_counter() - slice_started) * 1000
+            own += 1
+            held_ms += slice_ms
+            report["slices"] += 1
+            report["max_slice_ms"] = round(max(report["max_slice_ms"], slice_ms), 2)
+            return result
+
+        def should_stop() -> bool:
+            if held_ms >= self.budget_ms:
+                return True
+            if not force and ops is not None and ops() - baseline - own > self.yield_after_ops:
+                report["interrupted"] = True
+                return True
+            return False
+
+        try:
+            files = in_slice(lambda conn, _: [(schema, path, _pragma(conn, schema, "auto_vacuum"),
+                                               _pragma(conn, schema, "freelist_count"))
+                                              for schema, path in schemas(conn)])
+
+            for schema, path, auto_vacuum, free in files:
+                if auto_vacuum != 0 or not free or _size(path) > MAINTENANCE_CONVERT_MAX_MB * 1e6:
+                    continue
+                if should_stop():
+                    break
+                # Switching auto_vacuum on an existing file takes a full rebuild, once
+                in_slice(lambda conn, _: conn.executescript(
+                    f"PRAGMA {schema}.auto_vacuum=INCREMENTAL; VACUUM {schema};"))
+                report["converted"].append(Path(path).name)
+
+            for schema, path, _, _ in files:
+                while not should_stop():
+                    freed, page_size, remaining = in_slice(lambda conn, t0: self._vacuum_slice(conn, schema, t0))
+                    report["pages_reclaimed"] += freed
+                    report["bytes_reclaimed"] += freed * page_size
+                    if not remaining or not freed:
+                        break
+                    # Slices skip the writer's autocheckpoint; keep the WAL short from here instead
+                    checkpoint(path)
+                    time.sleep(self.pause_ms / 1000)
+
+            if not report["interrupted"]:
+                truncate = bool(report["converted"])
+                report["checkpoint"] = {Path(path).name: checkpoint(path, truncate) for _, path, _, _ in files}
+                analyze = bool(report["pages_reclaimed"] or report["converted"] or key in self._purged)
+                in_slice(lambda conn, _: self._analyze(conn, analyze))
+                report["analyze"] = "analyze" if analyze else "optimize"
+                self._purged.discard(key)
+        finally:
+            self._own_ops[key] = self._own_ops.get(key, 0) + own
+
+        report["held_ms"] = round(held_ms, 2)
+        report["duration_ms"] = round((time.perf_counter() - started) * 1000, 2)
+        self._record(key, report)
+        return report
+
+    def _vacuum_slice(self, conn, schema: str, slice_started: float) -> Tuple[int, int, int]:
+        """Free pages of ``schema`` for up to slice_ms; returns (freed, page_size, still free)"""
+        if _pragma(conn, schema, "auto_vacuum") != 2:
+            return 0, 0, 0
+        page_size = _pragma(conn, schema, "page_size")
+        before = free = _pragma(conn, schema, "freelist_count")
+        chunk_ms = 0.0
+        autocheckpoint = conn.execute("PRAGMA wal_autocheckpoint").fetchone()[0]
+        conn.execute("PRAGMA wal_autocheckpoint=0")  # a commit crossing it would checkpoint while holding the writer
+        try:
+            # Stop before a chunk that would overrun the slice
+            while free and (time.perf_counter() - slice_started) * 1000 + chunk_ms < self.slice_ms:
+                chunk_started = time.perf_counter()
+                # executescript steps the pragma to completion; execute() would free one page
+                conn.executescript(f"PRAGMA {schema}.incremental_vacuum({VACUUM_CHUNK_PAGES});")
+                free = _pragma(conn, schema, "freelist_count")
+                chunk_ms = max(chunk_ms, (time.perf_counter() - chunk_started) * 1000)
+        finally:
+            conn.execute(f"PRAGMA wal_autocheckpoint={autocheckpoint}")
+        return before - free, page_size, free
+
+    def _analyze(self, conn, full: bool):
+        if full:
+            conn.execute(f"PRAGMA analysis_limit={MAINTENANCE_ANALYSIS_LIMIT}")
+            conn.execute("ANALYZE")
+        else:
+            conn.execute("PRAGMA optimize")
+
+    def _record(self, key: str, report: dict):
+        self.stats["passes"] += 1
+        self.stats["interrupted"] += int(report["interrupted"])
+        self.stats["slices"] += report["slices"]
+        self.stats["max_slice_ms"] = max(self.stats["max_slice_ms"], report["max_slice_ms"])
+        self.stats["pages_reclaimed"] += report["pages_reclaimed"]
+        self.stats["bytes_reclaimed"] += report["bytes_reclaimed"]
+        self.stats["converted"] += len(report["converted"])
+        self.stats["checkpoints"] += int(bool(report["checkpoint"]))
+        self.stats["analyzed"] += int(report["analyze"] == "analyze")
+        self.stats["optimized"] += int(report["analyze"] == "optimize")
+        self.stats["last_run"] = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
+        self.stats["last"][Path(key).name] = report
+        if report["pages_reclaimed"] or report["converted"]:
+            logging.info(f"[maintenance] {Path(key).name}: reclaimed {report['bytes_reclaimed'] / 1e6:.1f} MB "
+                         f"in {report['slices']} slices (longest {report['max_slice_ms']:.1f} ms)"
+                         + (f", converted {', '.join(report['converted'])}" if report["converted"] else ""))
@@ -0,0 +1,319 @@
+"""
+Incremental conversation / agent metrics.
+
+The write paths in server.py call into this module inside their own
+transaction, so ``conversation_metrics``, ``agent_metrics`` and the
+timestamp columns on ``conversations`` are always up to date and the
+dashboard never has to scan ``messages``.
+
+Existing data can be rolled up in one streaming pass with:
+
+    python metrics.py --backfill
+"""
+import argparse
+import datetime
+import json
+import logging
+import os
+import sqlite3
+from pathlib import Path
+
+import timestamps
+
+# System text sent by the escalation loop when a conversation escalates;
+# used to recover escalation counts during backfill.
+ESCALATION_MARKER = "All staff are currently assisting others"
+
+CONVERSATION_COLUMNS = [
+    "ALTER TABLE conversations ADD COLUMN tenant_id INTEGER",
+    "ALTER TABLE conversations ADD COLUMN assigned_staff_id INTEGER",
+    "ALTER TABLE conversations ADD COLUMN created_at TEXT",
+    "ALTER TABLE conversations ADD COLUMN first_user_message_at TEXT",
+    "ALTER TABLE conversations ADD COLUMN first_staff_reply_at TEXT",
+    "ALTER TABLE conversations ADD COLUMN closed_at TEXT",
+    "ALTER TABLE conversations ADD COLUMN resolved INTEGER DEFAULT 0",
+    "ALTER TABLE conversations ADD COLUMN last_staff_activity_at TEXT",
+    "ALTER TABLE messages ADD COLUMN tenant_id INTEGER",
+    "ALTER TABLE messages ADD COLUMN staff_id INTEGER",
+]
+
+
+def init_schema(conn):
+    """Create rollup tables and the conversation columns they depend on (idempotent)"""
+    c = conn.cursor()
+    for sql in CONVERSATION_COLUMNS:
+        try:
+            c.execute(sql)
+        except sqlite3.OperationalError:
+            pass
+
+    c.execute("""CREATE TABLE IF NOT EXISTS conversation_metrics (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        tenant_id INTEGER NOT NULL,
+        conversation_id INTEGER NOT NULL,
+        total_messages INTEGER NOT NULL DEFAULT 0,
+        user_messages INTEGER NOT NULL DEFAULT 0,
+        staff_messages INTEGER NOT NULL DEFAULT 0,
+        first_response_seconds INTEGER,
+        duration_seconds INTEGER,
+        assigned_staff_id INTEGER,
+        quality_score INTEGER,
+        rating_comment TEXT,
+        updated_at TEXT NOT NULL,
+        FOREIGN KEY (tenant_id) REFERENCES tenants(id)
+    )""")
+    c.execute("""CREATE TABLE IF NOT EXISTS agent_metrics (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        staff_id INTEGER NOT NULL,
+        date TEXT NOT NULL,
+        total_chats INTEGER DEFAULT 0,
+        avg_response_seconds INTEGER,
+        avg_duration_seconds INTEGER,
+        avg_quality_score INTEGER,
+        FOREIGN KEY (staff_id) REFERENCES users(id)
+    )""")
+    for sql in (
+        "ALTER TABLE conversation_metrics ADD COLUMN system_messages INTEGER NOT NULL DEFAULT 0",
+        "ALTER TABLE conversation_metrics ADD COLUMN escalation_count INTEGER NOT NULL DEFAULT 0",
+        "ALTER TABLE agent_metrics ADD COLUMN closed_chats INTEGER DEFAULT 0",
+    ):
+        try:
+            c.execute(sql)
+        except sqlite3.OperationalError:
+            pass
+    try:
+        c.execute("ALTER TABLE conversation_metrics ADD COLUMN updated_at_ms INTEGER")
+        timestamps.backfill_column(conn, "conversation_metrics", "updated_at", "updated_at_ms")
+    except sqlite3.OperationalError:
+        pass
+
+    c.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_conversation_metrics_convo ON conversation_metrics(conversation_id)")
+    c.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_agent_metrics_staff_date ON agent_metrics(staff_id, date)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_conversation_metrics_updated_ms ON conversation_metrics(updated_at_ms)")
+
+
+def _parse(ts):
+    if not ts:
+        return None
+    try:
+        return datetime.datetime.fromisoformat(ts.replace("Z", ""))
+    except ValueError:
+        return None
+
+
+def _seconds_between(start, end):
+    start, end = _parse(start), _parse(end)
+    if not start or not end:
+        return None
+    return max(0, int((end - start).total_seconds()))
+
+
+def record_message(conn, conversation_id: int, tenant_id: int, sender: str, now: int, staff_id=None):
+    """
+    Update rollups for one new message sent at ``now`` (epoch ms); call inside
+    the insert transaction.  Returns the conversation's message count
+    including this one.
+    """
+    if conversation_id is None:
+        return None
+    ts = timestamps.to_iso(now)
+    is_user, is_staff = int(sender == "user"), int(sender == "staff")
+    total = conn.execute("""
+        INSERT INTO conversation_metrics (tenant_id, conversation_id, total_messages, user_messages,
+                                          staff_messages, system_messages, updated_at, updated_at_ms)
+        VALUES (?, ?, 1, ?, ?, ?, ?, ?)
+        ON CONFLICT(conversation_id) DO UPDATE SET
+            total_messages = total_messages + 1,
+            user_messages = user_messages + excluded.user_messages,
+            staff_messages = staff_messages + excluded.staff_messages,
+            system_messages = system_messages + excluded.system_messages,
+            updated_at = excluded.updated_at,
+            updated_at_ms = excluded.updated_at_ms
+        RETURNING total_messages
+    """, (tenant_id, conversation_id, is_user, is_staff, int(not (is_user or is_staff)), ts, now)).fetchone()[0]
+
+    if is_user:
+        conn.execute("UPDATE conversations SET first_user_message_at=? WHERE id=? AND first_user_message_at IS NULL",
+                     (ts, conversation_id))
+    elif is_staff:
+        first = conn.execute("""
+            UPDATE conversations SET first_staff_reply_at=?, assigned_staff_id=COALESCE(assigned_staff_id, ?)
+            WHERE id=? AND first_staff_reply_at IS NULL
+            RETURNING first_user_message_at, created_at
+        """, (ts, staff_id, conversation_id)).fetchone()
+        conn.execute("UPDATE conversations SET last_staff_activity_at=? WHERE id=?", (ts, conversation_id))
+        if first:
+            response_seconds = _seconds_between(first[0] or first[1], ts)
+            conn.execute("""UPDATE conversation_metrics
+                            SET first_response_seconds=?, assigned_staff_id=COALESCE(assigned_staff_id, ?)
+                            WHERE conversation_id=?""",
+                         (response_seconds, staff_id, conversation_id))
+            if staff_id is not None and response_seconds is not None:
+                conn.execute("""
+                    INSERT INTO agent_metrics (staff_id, date, total_chats, avg_response_seconds)
+                    VALUES (?, ?, 1, ?)
+                    ON CONFLICT(staff_id, date) DO UPDATE SET
+                        avg_response_seconds = (COALESCE(avg_response_seconds, 0) * total_chats + excluded.avg_response_seconds)
+                                               / (total_chats + 1),
+                        total_chats = total_chats + 1
+                """, (staff_id, ts[:10], response_seconds))
+    return total
+
+
+def record_escalation(conn, conversation_id: int, tenant_id: int, now: int):
+    conn.execute("""
+        INSERT INTO conversation_metrics (tenant_id, conversation_id, escalation_count, updated_at, updated_at_ms)
+        VALUES (?, ?, 1, ?, ?)
+        ON CONFLICT(conversation_id) DO UPDATE SET
+            escalation_count = escalation_count + 1,
+            updated_at = excluded.updated_at,
+            updated_at_ms = excluded.updated_at_ms
+    """, (tenant_id, conversation_id, timestamps.to_iso(now), now))
+
+
+def record_close(conn, conversation_ids, now: int):
+    """Stamp closed_at and roll up durations for conversations that were just closed at ``now`` (epoch ms)"""
+    ids = list(conversation_ids)
+    if not ids:
+        return
+    ts = timestamps.to_iso(now)
+    rows = conn.execute("""
+        UPDATE conversations SET closed_at=? WHERE id IN (SELECT value FROM json_each(?))
+        RETURNING id, COALESCE(created_at, first_user_message_at), assigned_staff_id
+    """, (ts, json.dumps(ids))).fetchall()
+
+    durations, per_agent = [], {}
+    for conversation_id, started, staff_id in rows:
+        duration = _seconds_between(started, ts)
+        durations.append((duration, ts, now, conversation_id))
+        if staff_id is not None and duration is not None:
+            count, total = per_agent.get(staff_id, (0, 0))
+            per_agent[staff_id] = (count + 1, total + duration)
+
+    conn.executemany("UPDATE conversation_metrics SET duration_seconds=?, updated_at=?, updated_at_ms=? WHERE conversation_id=?",
+                     durations)
+    # Fold each agent's batch into the running average in one upsert
+    conn.executemany("""
+        INSERT INTO agent_metrics (staff_id, date, closed_chats, avg_duration_seconds)
+        VALUES (?, ?, ?, ?)
+        ON CONFLICT(staff_id, date) DO UPDATE SET
+            avg_duration_seconds = (COALESCE(avg_duration_seconds, 0) * COALESCE(closed_chats, 0)
+                                    + excluded.avg_duration_seconds * excluded.closed_chats)
+                                   / (COALESCE(closed_chats, 0) + excluded.closed_chats),
+            closed_chats = COALESCE(closed_chats, 0) + excluded.closed_chats
+    """, [(staff_id, ts[:10], count, total / count) for staff_id, (count, total) in per_agent.items()])
+
+
+def needs_backfill(conn) -> bool:
+    has_metrics = conn.execute("SELECT 1 FROM conversation_metrics LIMIT 1").fetchone()
+    has_messages = conn.execute("SELECT 1 FROM messages LIMIT 1").fetchone()
+    return bool(has_messages and not has_metrics)
+
+
+def backfill(conn, default_tenant_id: int = 1, message_source: str = "messages") -> int:
+    """
+    Recompute all conversation rollups from ``message_source`` in one
+    streaming pass ordered by (conversation_id, id), which
+    idx_messages_conversation serves without a sort.
+    Returns the number of conversations written.
+    """
+    now = timestamps.now_ms()
+    ts_now = timestamps.to_iso(now)
+    convos = {
+        r[0]: r for r in conn.execute(
+            "SELECT id, user_id, channel, tenant_id, created_at, open, closed_at, updated_at FROM conversations")
+    }
+
+    rows_out, conversation_updates = [], []
+    # (staff_id, date) -> [chats, response seconds, closed chats, duration seconds]
+    agents = {}
+    state = None
+
+    def flush(st):
+        if not st or st["key"] not in convos:
+            return
+        cv = convos[st["key"]]
+        created = cv[4] or st["first_ts"]
+        closed = cv[6] or (cv[7] if cv[5] == 0 else None)
+        response = _seconds_between(st["first_user"] or created, st["first_staff"]) if st["first_staff"] else None
+        duration = _seconds_between(created, closed) if closed else None
+        rows_out.append((
+            cv[3] or default_tenant_id, cv[0], st["total"], st["user"], st["staff"], st["system"],
+            response, duration, st["staff_id"], st["escalations"], ts_now, now,
+        ))
+        if st["staff_id"] is not None:
+            if response is not None:
+                agent = agents.setdefault((st["staff_id"], st["first_staff"][:10]), [0, 0, 0, 0])
+                agent[0] += 1
+                agent[1] += response
+            if duration is not None:
+                agent = agents.setdefault((st["staff_id"], closed[:10]), [0, 0, 0, 0])
+                agent[2] += 1
+                agent[3] += duration
+        conversation_updates.append((created, st["first_user"], st["first_staff"], closed, st["staff_id"], cv[0]))
+
+    cur = conn.cursor()
+    cur.execute(f"""SELECT conversation_id, sender, text, ts, staff_id FROM {message_source}
+                     WHERE conversation_id IS NOT NULL ORDER BY conversation_id, id""")
+    for key, sender, text, ts, staff_id in cur:
+        if state is None or state["key"] != key:
+            flush(state)
+            state = {"key": key, "total": 0, "user": 0, "staff": 0, "system": 0, "escalations": 0,
+                     "first_ts": ts, "first_user": None, "first_staff": None, "staff_id": None}
+        state["total"] += 1
+        if sender == "user":
+            state["user"] += 1
+            state["first_user"] = state["first_user"] or ts
+        elif sender == "staff":
+            state["staff"] += 1
+            state["first_staff"] = state["first_staff"] or ts
+            state["staff_id"] = state["staff_id"] or staff_id
+        else:
+            state["system"] += 1
+            if text and text.startswith(ESCALATION_MARKER):
+                state["escalations"] += 1
+    flush(state)
+
+    conn.execute("DELETE FROM conversation_metrics")
+    conn.executemany("""
+        INSERT INTO conversation_metrics (tenant_id, conversation_id, total_messages, user_messages, staff_messages,
+                                          system_messages, first_response_seconds, duration_seconds,
+                                          assigned_staff_id, escalation_count, updated_at, updated_at_ms)
+        VALUES (?,?,?,?,?,?,?,?,?,?,?,?)
+    """, rows_out)
+    conn.executemany("""
+        UPDATE conversations SET created_at=COALESCE(created_at, ?), first_user_message_at=?,
+                                 first_staff_reply_at=?, closed_at=?, assigned_staff_id=COALESCE(assigned_staff_id, ?)
+        WHERE id=?
+    """, conversation_updates)
+    conn.execute("DELETE FROM agent_metrics")
+    conn.executemany("""
+        INSERT INTO agent_metrics (staff_id, date, total_chats, avg_response_seconds, closed_chats, avg_duration_seconds)
+        VALUES (?,?,?,?,?,?)
+    """, [(staff_id, date, chats, response / chats if chats else None, closed, duration / closed if closed else None)
+          for (staff_id, date), (chats, response, closed, duration) in agents.items()])
+    conn.commit()
+    logging.info(f"[metrics] Backfilled rollups for {len(rows_out)} conversations and {len(agents)} agent-days")
+    return len(rows_out)
+
+
+def _default_db_path():
+    if os.path.exists("/data"):
+        return "/data/handoff.sqlite"
+    return str(Path(__file__).parent / "handoff.sqlite")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Conversation / agent metrics rollups")
+    parser.add_argument("--db", default=_default_db_path())
+    parser.add_argument("--backfill", action="store_true", help="recompute rollups from existing messages")
+    args = parser.parse_args()
+
+    conn = sqlite3.connect(args.db)
+    init_schema(conn)
+    conn.commit()
+    if args.backfill:
+        import archive
+        archive.attach(conn, args.db)
+        print(f"✅ Backfilled metrics for {backfill(conn, message_source='all_messages')} conversations")
+    conn.close()
@@ -0,0 +1,139 @@
+"""
+Token-bucket rate limits for the public ingestion endpoints.
+
+``POST /webchat``, ``POST /followup``, ``/sms`` and ``/ws/{user_id}`` take
+no credentials.  Without a limit one noisy client can fill the database
+with writes and every admin dashboard with broadcasts.  A ``RateLimiter``
+holds one bucket per key, such as a visitor, a client address or a phone
+number.  Each bucket refills at ``rate`` tokens per second up to ``burst``.
+A check costs one dict lookup plus the refill arithmetic.
+
+Buckets are kept in least-recently-used order.  Every check drops up to two
+buckets from the cold end once they have refilled completely.  A full
+bucket behaves exactly like a missing one, so this loses nothing.
+``max_buckets`` caps memory when a flood of distinct keys arrives faster
+than buckets refill; the coldest bucket is dropped, which only forgives
+that key.
+
+What happens to a request over its limit is set by ``RATE_LIMIT_OVERLOAD``:
+
+- ``reject`` (default): HTTP 429 with ``Retry-After``.  On the visitor
+  socket the message gets a ``rate_limited`` frame with ``retry_after``,
+  and the widget resends it then.
+- ``queue``: wait for a token, for at most ``RATE_LIMIT_QUEUE_SECONDS``.
+  A longer wait is rejected as above.  Waiting requests hold their token
+  already, so they go through in arrival order.
+
+Typing frames are dropped over their limit in either mode.  The next one
+supersedes them anyway.
+"""
+import asyncio
+import os
+import time
+from collections import OrderedDict
+from typing import Hashable, Iterable, Optional, Tuple
+
+RATE_LIMIT_OVERLOAD = os.getenv("RATE_LIMIT_OVERLOAD", "reject").lower()
+RATE_LIMIT_QUEUE_SECONDS = float(os.getenv("RATE_LIMIT_QUEUE_SECONDS", "5"))
+RATE_LIMIT_MAX_BUCKETS = int(os.getenv("RATE_LIMIT_MAX_BUCKETS", "100000"))
+
+# (tokens per second, burst) per key
+VISITOR_LIMIT = (float(os.getenv("RATE_LIMIT_VISITOR_PER_SECOND", "1")), float(os.getenv("RATE_LIMIT_VISITOR_BURST", "10")))
+IP_LIMIT = (float(os.getenv("RATE_LIMIT_IP_PER_SECOND", "10")), float(os.getenv("RATE_LIMIT_IP_BURST", "100")))
+PHONE_LIMIT = (float(os.getenv("RATE_LIMIT_PHONE_PER_SECOND", "0.5")), float(os.getenv("RATE_LIMIT_PHONE_BURST", "10")))
+TYPING_LIMIT = (float(os.getenv("RATE_LIMIT_TYPING_PER_SECOND", "2")), float(os.getenv("RATE_LIMIT_TYPING_BURST", "5")))
+
+if RATE_LIMIT_OVERLOAD not in ("reject", "queue"):
+    raise ValueError(f"RATE_LIMIT_OVERLOAD must be 'reject' or 'queue', not {RATE_LIMIT_OVERLOAD!r}")
+
+
+class Bucket:
+    """Tokens left as of ``stamp``; slotted because there is one per active key"""
+    __slots__ = ("tokens", "stamp")
+
+    def __init__(self, tokens: float, stamp: float):
+        self.tokens = tokens
+        self.stamp = stamp
+
+
+class RateLimiter:
+    def __init__(self, rate: float, burst: float, max_buckets: int = RATE_LIMIT_MAX_BUCKETS, clock=time.monotonic):
+        self.rate = rate
+        self.burst = burst
+        self.max_buckets = max_buckets
+        self.clock = clock
+        self.buckets: "OrderedDict[Hashable, Bucket]" = OrderedDict()
+        self.stats = {"allowed": 0, "limited": 0, "evicted_idle": 0, "evicted_cap": 0}
+
+    def bucket(self, key: Hashable) -> Bucket:
+        """The key's bucket, refilled up to now"""
+        now = self.clock()
+        buckets = self.buckets
+        # Evict up to two fully refilled buckets from the cold end, one more than this call can add
+        for _ in range(2):
+            cold = next(iter(buckets), None)
+            if cold is None:
+                break
+            bucket = buckets[cold]
+            if bucket.tokens + (now - bucket.stamp) * self.rate < self.burst:
+                break
+            del buckets[cold]
+            self.stats["evicted_idle"] += 1
+        bucket = buckets.get(key)
+        if bucket is None:
+            bucket = buckets[key] = Bucket(self.burst, now)
+            if len(buckets) > self.max_buckets:
+                buckets.popitem(last=False)
+                self.stats["evicted_cap"] += 1
+        else:
+            buckets.move_to_end(key)
+            bucket.tokens = min(self.burst, bucket.tokens + (now - bucket.stamp) * self.rate)
+            bucket.stamp = now
+        return bucket
+
+    def metrics(self) -> dict:
+        return {"rate_per_second": self.rate, "burst": self.burst, "buckets": len(self.buckets),
+                "max_buckets": self.max_buckets, **self.stats}
+
+
+def check(limits: Iterable[Tuple[RateLimiter, Optional[Hashable]]], max_wait: float = 0.0) -> Tuple[bool, float]:
+    """
+    Check every (limiter, key) pair; keys of None are skipped.  Tokens are
+    taken from all of them only if the longest wait is within ``max_wait``,
+    so a request refused by one limit costs nothing from the others.
+    Returns (allowed, wait): the seconds to wait before proceeding, or the
+    retry-after hint when refused.
+    """
+    taken = []
+    wait = 0.0
+    for limiter, key in limits:
+        if key is not None:
+            bucket = limiter.bucket(key)
+            delay = max(1 - bucket.tokens, 0) / limiter.rate
+            taken.append((limiter, bucket, delay))
+            wait = max(wait, delay)
+    if wait > max_wait:
+        for limiter, _, delay in taken:
+            if delay > max_wait:
+                limiter.stats["limited"] += 1
+        return False, wait
+    for limiter, bucket, _ in taken:
+        # May leave the bucket in debt, which reserves a future token for a queued request
+        bucket.tokens -= 1
+        limiter.stats["allowed"] += 1
+    return True, wait
+
+
+async def admit(limits: Iterable[Tuple[RateLimiter, Optional[Hashable]]], overload: Optional[str] = None) -> float:
+    """
+    Apply the overload policy to one request.  Returns 0 when it may
+    proceed (after queueing, if that policy is on), otherwise the
+    retry-after in seconds.
+    """
+    queue = (overload or RATE_LIMIT_OVERLOAD) == "queue"
+    allowed, wait = check(limits, RATE_LIMIT_QUEUE_SECONDS if queue else 0.0)
+    if not allowed:
+        return wait
+    if wait > 0:
+        await asyncio.sleep(wait)
+    return 0.0
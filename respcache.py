@@ -0,0 +1,115 @@
+"""
+Conditional GET and rendered-body cache for the admin list endpoints.
+
+Each resource in ``RESOURCES`` has a write-generation row.  Every write
+that changes what an endpoint shows bumps the rows of the resources it
+touched, in the same transaction (``bump(conn, "followups")``).  Writes
+that no endpoint shows, such as the visitor's delivery cursor, bump
+nothing.  The rows live in SQLite rather than in memory so that all worker
+processes - and the background jobs, which only run on the lease holder -
+share them.
+
+A GET reads the generations of the resources it depends on first (one
+indexed lookup) and:
+
+  * answers ``304 Not Modified`` if the client's ``If-None-Match`` already
+    names them, without building anything;
+  * otherwise serves the rendered body cached for this URL if it was built
+    at the same generations, or builds, renders and caches it.
+
+The ETag is ``"<epoch>-<generation>[.<generation>...]"``; the epoch is
+fixed when the rows are created so a recreated database can never
+revalidate an old ETag.
+"""
+import json
+import threading
+from collections import OrderedDict
+from typing import Any, Callable
+
+from fastapi import Request
+from fastapi.responses import Response
+
+import codec
+import timestamps
+
+CACHE_CONTROL = "private, no-cache"  # browsers keep the body but always revalidate
+
+
+# conversations: conversation rows, their messages and rollups; followups: the
+# followups table; history: followups migrated to the history table
+RESOURCES = ("conversations", "followups", "history")
+
+
+def init_schema(conn):
+    conn.execute("""CREATE TABLE IF NOT EXISTS write_generations (
+        resource TEXT PRIMARY KEY,
+        epoch INTEGER NOT NULL,
+        value INTEGER NOT NULL
+    ) WITHOUT ROWID""")
+    epoch = timestamps.now_ms()
+    conn.executemany("INSERT OR IGNORE INTO write_generations (resource, epoch, value) VALUES (?, ?, 0)",
+                     [(resource, epoch) for resource in RESOURCES])
+    # Superseded by the per-resource rows
+    conn.execute("DROP TABLE IF EXISTS write_generation")
+
+
+def bump(conn, *resources: str):
+    """Invalidate cached responses built from ``resources`` (all of them if none
+    are named); call inside the writing transaction"""
+    conn.execute("UPDATE write_generations SET value = value + 1 WHERE resource IN (SELECT value FROM json_each(?))",
+                 (json.dumps(resources or RESOURCES),))
+
+
+def current(conn, *resources: str) -> str:
+    rows = conn.execute("""SELECT epoch, value FROM write_generations
+                           WHERE resource IN (SELECT value FROM json_each(?)) ORDER BY resource""",
+                        (json.dumps(resources or RESOURCES),)).fetchall()
+    return f"{rows[0][0]:x}-" + ".".join(str(value) for _, value in rows)
+
+
+def _matches(if_none_match: str, etag: str) -> bool:
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate == "*" or candidate.removeprefix("W/") == etag:
+            return True
+    return False
+
+
+class ResponseCache:
+    def __init__(self, max_entries: int = 128):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "not_modified": 0}
+
+    def respond(self, request: Request, generation: str, build: Callable[[], Any], scope: str = "") -> Response:
+        """``scope`` separates bodies that share a URL but not a database (tenant shards)"""
+        etag = f'"{generation}"'
+        headers = {"ETag": etag, "Cache-Control": CACHE_CONTROL}
+
+        if_none_match = request.headers.get("if-none-match")
+        if if_none_match and _matches(if_none_match, etag):
+            self.stats["not_modified"] += 1
+            return Response(status_code=304, headers=headers)
+
+        key = f"{scope}:{request.url.path}?{request.url.query}"
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == generation:
+                self._entries.move_to_end(key)
+                self.stats["hits"] += 1
+                return Response(entry[1], media_type="application/json", headers=headers)
+
+        # Build outside the lock; concurrent misses for one URL just render twice
+        body = codec.dumps(build())
+        with self._lock:
+            self.stats["misses"] += 1
+            self._entries[key] = (generation, body)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return Response(body, media_type="application/json", headers=headers)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
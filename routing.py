@@ -0,0 +1,207 @@
+"""
+Shift-rota-aware staff routing.
+
+``shift_config.json`` is compiled into a time-interval index: the day is cut
+at every shift start/end into elementary intervals, each holding the staff
+numbers on duty.  Finding who is on duty is a bisect over the boundaries,
+and picking a staff member is O(log n):
+
+  * least_loaded - per-interval min-heap keyed on open conversation count
+                   (lazy invalidation: stale heap entries are skipped)
+  * round_robin  - per-interval rotating cursor
+
+The config file is re-read automatically when its mtime changes; load
+counters survive a reload.
+"""
+import bisect
+import datetime
+import heapq
+import itertools
+import json
+import logging
+import os
+import threading
+import time
+from typing import Dict, List, Optional
+
+try:
+    from zoneinfo import ZoneInfo
+except ImportError:  # pragma: no cover - Python < 3.9
+    ZoneInfo = None
+
+MINUTES_PER_DAY = 24 * 60
+POLICIES = ("least_loaded", "round_robin", "off")
+
+
+def _minutes(hhmm: str) -> int:
+    h, m = hhmm.strip().split(":")
+    minutes = int(h) * 60 + int(m)
+    # "23:59" is how the rota spells "until midnight"
+    return MINUTES_PER_DAY if minutes >= MINUTES_PER_DAY - 1 else minutes
+
+
+class _Interval:
+    __slots__ = ("numbers", "shifts", "heap", "cursor")
+
+    def __init__(self, numbers: List[str], shifts: List[str]):
+        self.numbers = numbers
+        self.shifts = shifts
+        self.heap = []
+        self.cursor = 0
+
+
+class ShiftRouter:
+    def __init__(self, config_path: str, policy: str = "least_loaded", timezone: str = "UTC",
+                 reload_check_seconds: float = 5.0):
+        if policy not in POLICIES:
+            raise ValueError(f"Unknown routing policy: {policy}")
+        self.config_path = config_path
+        self.policy = policy
+        self.tz = ZoneInfo(timezone) if ZoneInfo and timezone else None
+        self.reload_check_seconds = reload_check_seconds
+        self.loads: Dict[str, int] = {}
+        self.shifts: List[dict] = []
+        self._boundaries: List[int] = [0]
+        self._intervals: List[_Interval] = [_Interval([], [])]
+        self._member_of: Dict[str, List[_Interval]] = {}
+        self._seq = itertools.count()
+        self._mtime = None
+        self._last_check = 0.0
+        self._lock = threading.Lock()
+        self.load()
+
+    # ---------- config / index ----------
+    def load(self):
+        """(Re)build the interval index from the config file"""
+        try:
+            mtime = os.path.getmtime(self.config_path)
+            with open(self.config_path) as f:
+                shifts = json.load(f)
+        except FileNotFoundError:
+            logging.warning(f"[routing] {self.config_path} not found - routing disabled")
+            mtime, shifts = None, []
+        except (OSError, ValueError) as e:
+            logging.error(f"[routing] Failed to load {self.config_path}: {e} - keeping previous rota")
+            return
+
+        segments = []
+        for shift in shifts:
+            start, end = _minutes(shift["start"]), _minutes(shift["end"])
+            numbers = list(shift.get("numbers") or [])
+            if start < end:
+                segments.append((start, end, shift["name"], numbers))
+            else:  # overnight shift wraps past midnight
+                segments.append((start, MINUTES_PER_DAY, shift["name"], numbers))
+                segments.append((0, end, shift["name"], numbers))
+
+        boundaries = sorted({0, MINUTES_PER_DAY} | {s[0] for s in segments} | {s[1] for s in segments})
+        intervals = []
+        for lo in boundaries[:-1]:
+            numbers, names = {}, []
+            for start, end, name, nums in segments:
+                if start <= lo < end:
+                    names.append(name)
+                    numbers.update(dict.fromkeys(nums))
+            intervals.append(_Interval(list(numbers), names))
+
+        member_of: Dict[str, List[_Interval]] = {}
+        for interval in intervals:
+            for number in interval.numbers:
+                member_of.setdefault(number, []).append(interval)
+
+        with self._lock:
+            self.shifts = shifts
+            self._boundaries = boundaries[:-1]
+            self._intervals = intervals
+            self._member_of = member_of
+            self._mtime = mtime
+            for number in member_of:
+                self.loads.setdefault(number, 0)
+            for interval in intervals:
+                interval.heap = [(self.loads[n], next(self._seq), n) for n in interval.numbers]
+                heapq.heapify(interval.heap)
+        logging.info(f"[routing] Loaded {len(shifts)} shifts into {len(intervals)} intervals ({self.policy})")
+
+    def maybe_reload(self):
+        now = time.monotonic()
+        if now - self._last_check < self.reload_check_seconds:
+            return
+        self._last_check = now
+        try:
+            mtime = os.path.getmtime(self.config_path)
+        except OSError:
+            mtime = None
+        if mtime != self._mtime:
+            self.load()
+
+    def shift_names(self) -> List[str]:
+        return [s["name"] for s in self.shifts]
+
+    def _minute_of_day(self, now: Optional[datetime.datetime]) -> int:
+        if now is None:
+            now = datetime.datetime.now(self.tz) if self.tz else datetime.datetime.utcnow()
+        return now.hour * 60 + now.minute
+
+    def _interval_at(self, minute: int) -> _Interval:
+        return self._intervals[bisect.bisect_right(self._boundaries, minute) - 1]
+
+    def on_duty(self, now: Optional[datetime.datetime] = None) -> List[str]:
+        return list(self._interval_at(self._minute_of_day(now)).numbers)
+
+    # ---------- load accounting ----------
+    def _push_load(self, number: str):
+        load = self.loads[number]
+        for interval in self._member_of.get(number, ()):
+            heapq.heappush(interval.heap, (load, next(self._seq), number))
+            # Drop stale entries once they dominate the heap
+            if len(interval.heap) > 4 * len(interval.numbers) + 16:
+                interval.heap = [(self.loads[n], next(self._seq), n) for n in interval.numbers]
+                heapq.heapify(interval.heap)
+
+    def assign(self, now: Optional[datetime.datetime] = None) -> Optional[str]:
+        """Pick a staff number for a new conversation, or None if nobody is on duty"""
+        if self.policy == "off":
+            return None
+        self.maybe_reload()
+        minute = self._minute_of_day(now)
+        with self._lock:
+            interval = self._interval_at(minute)
+            if not interval.numbers:
+                return None
+            if self.policy == "round_robin":
+                number = interval.numbers[interval.cursor % len(interval.numbers)]
+                interval.cursor += 1
+            else:
+                while True:
+                    load, _, number = heapq.heappop(interval.heap)
+                    if load == self.loads.get(number):
+                        break
+            self.loads[number] = self.loads.get(number, 0) + 1
+            self._push_load(number)
+            return number
+
+    def claim(self, number: Optional[str]):
+        """A conversation kept ``number`` as its assignee when it reopened"""
+        if not number:
+            return
+        with self._lock:
+            self.loads[number] = self.loads.get(number, 0) + 1
+            self._push_load(number)
+
+    def release(self, number: Optional[str]):
+        """A conversation assigned to ``number`` was closed"""
+        if not number:
+            return
+        with self._lock:
+            if self.loads.get(number, 0) > 0:
+                self.loads[number] -= 1
+                self._push_load(number)
+
+    def set_loads(self, loads: Dict[str, int]):
+        """Replace the counters with authoritative counts (e.g. from the database)"""
+        with self._lock:
+            self.loads = {n: 0 for n in self._member_of}
+            self.loads.update(loads)
+            for interval in self._intervals:
+                interval.heap = [(self.loads[n], next(self._seq), n) for n in interval.numbers]
+                heapq.heapify(interval.heap)
@@ -0,0 +1,184 @@
+"""
+Full-text search over messages, followups and history.
+
+A single FTS5 table holds one row per searchable record.  The FTS rowid
+encodes where the record came from (``source_id * 4 + source code``), so
+updates and deletes are rowid lookups rather than scans over UNINDEXED
+columns.  The index is maintained incrementally by the write paths in
+server.py and can be rebuilt from scratch with ``python search.py --rebuild``.
+"""
+import argparse
+import logging
+import os
+import sqlite3
+from pathlib import Path
+
+SEARCH_TABLE = "search_index"
+
+SOURCE_CODES = {"message": 0, "followup": 1, "history": 2}
+SOURCE_NAMES = {v: k for k, v in SOURCE_CODES.items()}
+
+
+def rowid_for(source: str, source_id: int) -> int:
+    return int(source_id) * 4 + SOURCE_CODES[source]
+
+
+def init_schema(conn) -> bool:
+    """Create the FTS5 index. Returns True if it did not exist before."""
+    exists = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type='table' AND name=?", (SEARCH_TABLE,)
+    ).fetchone()
+    if exists:
+        return False
+    conn.execute(f"""CREATE VIRTUAL TABLE {SEARCH_TABLE} USING fts5(
+        body,
+        tenant_id UNINDEXED,
+        user_id UNINDEXED,
+        channel UNINDEXED,
+        ts UNINDEXED,
+        tokenize = 'unicode61 remove_diacritics 2'
+    )""")
+    return True
+
+
+def _upsert(conn, source: str, source_id: int, tenant_id: int, user_id, channel, body: str, ts):
+    conn.execute(
+        f"INSERT OR REPLACE INTO {SEARCH_TABLE} (rowid, body, tenant_id, user_id, channel, ts) VALUES (?,?,?,?,?,?)",
+        (rowid_for(source, source_id), body or "", tenant_id, user_id, channel, ts),
+    )
+
+
+def index_message(conn, message_id: int, tenant_id: int, user_id: str, channel: str, text: str, ts: str):
+    _upsert(conn, "message", message_id, tenant_id, user_id, channel, text, ts)
+
+
+def followup_body(name, email, phone, message) -> str:
+    return " ".join(part for part in (name, email, phone, message) if part)
+
+
+def index_followup(conn, followup_id: int, tenant_id: int, user_id: str, channel: str,
+                   name, email, phone, message, ts: str):
+    _upsert(conn, "followup", followup_id, tenant_id, user_id, channel,
+            followup_body(name, email, phone, message), ts)
+
+
+def index_history(conn, history_id: int, tenant_id: int, user_id: str, channel: str,
+                  name, contact, message, ts: str):
+    _upsert(conn, "history", history_id, tenant_id, user_id, channel,
+            " ".join(part for part in (name, contact, message) if part), ts)
+
+
+def remove(conn, source: str, source_ids):
+    conn.executemany(f"DELETE FROM {SEARCH_TABLE} WHERE rowid = ?",
+                     [(rowid_for(source, sid),) for sid in source_ids])
+
+
+def build_match_query(q: str) -> str:
+    """
+    Turn free text from the admin UI into a safe FTS5 MATCH expression.
+    Every term is quoted (so operators and punctuation are literal) and the
+    last term is a prefix match to support search-as-you-type.
+    """
+    terms = [t.replace('"', '""') for t in q.split() if t.strip()]
+    if not terms:
+        return ""
+    quoted = [f'"{t}"' for t in terms]
+    quoted[-1] += "*"
+    return " ".join(quoted)
+
+
+def search(conn, q: str, tenant_id: int, sources=None, limit: int = 20, offset: int = 0):
+    """
+    Ranked (bm25) search scoped to one tenant.
+    Returns (results, has_more).
+    """
+    match = build_match_query(q)
+    if not match:
+        return [], False
+
+    sql = f"""
+        SELECT rowid, user_id, channel, ts,
+               snippet({SEARCH_TABLE}, 0, '[', ']', '…', 12) AS snippet,
+               bm25({SEARCH_TABLE}) AS rank
+        FROM {SEARCH_TABLE}
+        WHERE {SEARCH_TABLE} MATCH ? AND tenant_id = ?
+    """
+    params = [match, tenant_id]
+    if sources:
+        codes = [SOURCE_CODES[s] for s in sources]
+        sql += f" AND (rowid % 4) IN ({','.join('?' * len(codes))})"
+        params.extend(codes)
+    sql += " ORDER BY rank LIMIT ? OFFSET ?"
+    params.extend([limit + 1, offset])
+
+    rows = conn.execute(sql, params).fetchall()
+    results = []
+    for row in rows[:limit]:
+        rowid = row[0]
+        results.append({
+            "source": SOURCE_NAMES[rowid % 4],
+            "id": rowid // 4,
+            "user_id": row[1],
+            "channel": row[2],
+            "ts": row[3],
+            "snippet": row[4],
+            "rank": row[5],
+        })
+    return results, len(rows) > limit
+
+
+def rebuild(conn, tenant_id: int = 1, batch_size: int = 5000) -> int:
+    """
+    Rebuild the whole index from messages (hot and archived, if attached),
+    followups and history.  Streams each table in batches.
+    """
+    conn.execute(f"DELETE FROM {SEARCH_TABLE}")
+    tables = {row[1] for row in conn.execute("PRAGMA database_list").fetchall()}
+    message_source = "all_messages" if "archive" in tables else "messages"
+    sources = [
+        (f"SELECT id, user_id, channel, text, ts FROM {message_source}",
+         lambda r: (rowid_for("message", r[0]), r[3] or "", tenant_id, r[1], r[2], r[4])),
+        ("SELECT id, user_id, channel, name, email, phone, message, ts FROM followups",
+         lambda r: (rowid_for("followup", r[0]), followup_body(r[3], r[4], r[5], r[6]), tenant_id, r[1], r[2], r[7])),
+        ("SELECT id, user_id, channel, name, contact, message, ts FROM history",
+         lambda r: (rowid_for("history", r[0]), " ".join(p for p in (r[3], r[4], r[5]) if p), tenant_id, r[1], r[2], r[6])),
+    ]
+    total = 0
+    for sql, to_row in sources:
+        cur = conn.cursor()
+        cur.execute(sql)
+        while True:
+            batch = cur.fetchmany(batch_size)
+            if not batch:
+                break
+            conn.executemany(
+                f"INSERT OR REPLACE INTO {SEARCH_TABLE} (rowid, body, tenant_id, user_id, channel, ts) VALUES (?,?,?,?,?,?)",
+                [to_row(r) for r in batch],
+            )
+            total += len(batch)
+    conn.execute(f"INSERT INTO {SEARCH_TABLE}({SEARCH_TABLE}) VALUES ('optimize')")
+    conn.commit()
+    logging.info(f"[search] Rebuilt index with {total} records")
+    return total
+
+
+def _default_db_path():
+    if os.path.exists("/data"):
+        return "/data/handoff.sqlite"
+    return str(Path(__file__).parent / "handoff.sqlite")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Maintain the full-text search index")
+    parser.add_argument("--db", default=_default_db_path())
+    parser.add_argument("--rebuild", action="store_true", help="rebuild the index from scratch")
+    parser.add_argument("--tenant", type=int, default=1)
+    args = parser.parse_args()
+
+    conn = sqlite3.connect(args.db)
+    init_schema(conn)
+    if args.rebuild:
+        import archive
+        archive.attach(conn, args.db)
+        print(f"✅ Indexed {rebuild(conn, args.tenant)} records in {args.db}")
+    conn.close()
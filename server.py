@@ -1,19 +1,31 @@
+import startup  # first, so the startup timeline covers every other import
 from fastapi import FastAPI, Request, WebSocket, WebSocketDisconnect, WebSocketException, HTTPException, UploadFile, File, Form, Depends, Query, status
 from fastapi.responses import Response, JSONResponse, PlainTextResponse, HTMLResponse
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.staticfiles import StaticFiles
 from fastapi import File
 from pydantic import BaseModel
-from twilio.twiml.messaging_response import MessagingResponse
-from twilio.rest import Client as TwilioClient
-from twilio.request_validator import RequestValidator
 from dotenv import load_dotenv
-import os, logging, datetime, sqlite3, asyncio
-from auth import router as auth_router, require_role, TokenData, SECRET_KEY, ALGORITHM
+import os, logging, sqlite3, asyncio, time, heapq, threading, contextlib, math, secrets
+from auth import router as auth_router, require_role, TokenData, SECRET_KEY, ALGORITHM, get_pwd_context
+import archive
+import search
+import metrics
+import events
+import lease
+import routing
+import timestamps
+import codec
+import respcache
+import assets
+import shards
+import backup
+import maintenance
+import liveness
+import ratelimit
 from logging.handlers import RotatingFileHandler
 from pathlib import Path
-from typing import Optional, Dict, Set
-from jose import jwt
+from typing import Optional, Dict, List, Set, Tuple
+from collections import OrderedDict
 DEBUG_ADMIN_PUSH = False
 import json
 
@@ -28,7 +40,6 @@ if os.path.exists("/data"):
 else:
     DB_PATH = str(Path(__file__).parent / "handoff.sqlite")
 
-from fastapi.openapi.utils import get_openapi
 from fastapi.security import OAuth2PasswordBearer
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/api/v1/auth/login")
@@ -36,6 +47,7 @@ oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/api/v1/auth/login")
 def custom_openapi():
     if app.openapi_schema:
         return app.openapi_schema
+    from fastapi.openapi.utils import get_openapi
     openapi_schema = get_openapi(
         title="DWC Omnichat",
         version="1.0.0",
@@ -59,8 +71,17 @@ def custom_openapi():
     app.openapi_schema = openapi_schema
     return app.openapi_schema
 
-app = FastAPI(title="DWC Omnichat")
+app = FastAPI(title="DWC Omnichat", default_response_class=codec.FastJSONResponse)
 app.openapi = custom_openapi
+app.add_middleware(startup.FirstRequestMiddleware)
+
+def decode_token(token: str) -> dict:
+    from jose import jwt
+    return jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+
+# Route each request to the database shard of its JWT's or widget key's tenant (see shards.py)
+app.add_middleware(shards.TenantMiddleware, decode=decode_token,
+                   resolve_key=lambda key: shard_router.resolve_tenant("widget_key", key))
 
 app.include_router(auth_router)
 
@@ -89,17 +110,26 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Static files
+# Static files: precompressed (gzip/brotli), ETag'd and held in memory; built in startup_tasks
+static_mounts: list[assets.PrecompressedStaticFiles] = []
 if Path("static").exists():
-    app.mount("/static", StaticFiles(directory="static"), name="static")
+    static_mounts.append(assets.PrecompressedStaticFiles(directory="static"))
+    app.mount("/static", static_mounts[-1], name="static")
 
-# Mount React Admin Dashboard
+# Mount React Admin Dashboard (fingerprinted assets/ files are cached as immutable)
 if Path("admin-frontend/dist").exists():
-    app.mount("/admin-app", StaticFiles(directory="admin-frontend/dist", html=True), name="admin-app")
+    static_mounts.append(assets.PrecompressedStaticFiles(directory="admin-frontend/dist", html=True))
+    app.mount("/admin-app", static_mounts[-1], name="admin-app")
     logging.info("✅ Admin dashboard mounted at /admin-app")
 else:
     logging.warning("⚠️  Admin frontend dist directory not found - run 'npm run build' in admin-frontend/")
 
+# Visitor widget for sites that load it from this server; not fingerprinted, so short-lived
+# caching and ETag revalidation instead of immutable
+WIDGET_CACHE_CONTROL = os.getenv("WIDGET_CACHE_CONTROL", "public, max-age=300, stale-while-revalidate=86400")
+widget_files = assets.PrecompressedStaticFiles(directory=str(Path(__file__).parent),
+                                               cache_control=lambda path: WIDGET_CACHE_CONTROL)
+
 # Logging
 log_handler = RotatingFileHandler("chat.log", maxBytes=1_000_000, backupCount=5)
 console_handler = logging.StreamHandler()  # ensure logs also go to stdout for Render
@@ -118,58 +148,154 @@ TWILIO_NUMBER = os.getenv("TWILIO_NUMBER")
 VERIFY_TWILIO_SIGNATURE = os.getenv("VERIFY_TWILIO_SIGNATURE", "0") == "1"
 PUBLIC_BASE_URL = os.getenv("PUBLIC_BASE_URL", "")
 
+def _twilio_client():
+    from twilio.rest import Client as TwilioClient
+    return TwilioClient(ACCOUNT_SID, AUTH_TOKEN)
+
+def _twilio_validator():
+    from twilio.request_validator import RequestValidator
+    return RequestValidator(AUTH_TOKEN)
+
+# Built on first use: twilio.rest drags in requests + certifi, too slow for every cold start
 twilio_client = None
 twilio_validator = None
 if ACCOUNT_SID and AUTH_TOKEN:
-    twilio_client = TwilioClient(ACCOUNT_SID, AUTH_TOKEN)
-    twilio_validator = RequestValidator(AUTH_TOKEN)
-
-SHIFT_ROTA = [{"name": "Default"}]  # stub for config
+    twilio_client = startup.Lazy(_twilio_client)
+    twilio_validator = startup.Lazy(_twilio_validator)
+
+# Staff routing: new conversations are assigned from the shift rota
+SHIFT_CONFIG_PATH = os.getenv("SHIFT_CONFIG_PATH", str(Path(__file__).parent / "shift_config.json"))
+ROUTING_POLICY = os.getenv("ROUTING_POLICY", "least_loaded")  # least_loaded | round_robin | off
+SHIFT_TIMEZONE = os.getenv("SHIFT_TIMEZONE", "UTC")
+shift_router = routing.ShiftRouter(SHIFT_CONFIG_PATH, ROUTING_POLICY, SHIFT_TIMEZONE)
 BACKUP_NUMBER = os.getenv("BACKUP_NUMBER")
+DEFAULT_TENANT_ID = int(os.getenv("DEFAULT_TENANT_ID", "1"))
+# One SQLite file per tenant (the default tenant stays in DB_PATH); 0 keeps every tenant in DB_PATH
+TENANT_SHARDS = os.getenv("TENANT_SHARDS", "1") == "1"
+# Idle read-only connections kept per shard (each shard has one writer connection)
+SHARD_POOL_SIZE = int(os.getenv("SHARD_POOL_SIZE", "4"))
+
+# Inbound SMS ingestion: webhook acks immediately, a worker persists + broadcasts
+SMS_INGEST_QUEUE_MAX = int(os.getenv("SMS_INGEST_QUEUE_MAX", "1000"))
+SMS_RECENT_SID_CACHE = int(os.getenv("SMS_RECENT_SID_CACHE", "10000"))
+# Already acked to Twilio, so the worker retries transient failures (e.g. a busy writer) itself
+SMS_INGEST_ATTEMPTS = int(os.getenv("SMS_INGEST_ATTEMPTS", "3"))
+PATIENCE_AFTER_SECONDS = 30
 ESCALATE_AFTER_SECONDS = 120
 
+# Idle open conversations are closed by the auto-close sweeper (0 disables it)
+AUTO_CLOSE_MINUTES = int(os.getenv("AUTO_CLOSE_MINUTES", "30"))
+AUTO_CLOSE_BATCH_SIZE = int(os.getenv("AUTO_CLOSE_BATCH_SIZE", "500"))
+AUTO_CLOSE_INTERVAL_SECONDS = int(os.getenv("AUTO_CLOSE_INTERVAL_SECONDS", "60"))
+
+# The followup badge count is pushed on change; a periodic recount catches other workers' writes
+FOLLOWUP_COUNT_RESYNC_SECONDS = int(os.getenv("FOLLOWUP_COUNT_RESYNC_SECONDS", "60"))
+
+# Tiered storage: messages of conversations closed longer than this move to the archive DB
+ARCHIVE_AFTER_DAYS = int(os.getenv("ARCHIVE_AFTER_DAYS", "14"))
+ARCHIVE_BATCH_SIZE = int(os.getenv("ARCHIVE_BATCH_SIZE", "500"))
+ARCHIVE_INTERVAL_SECONDS = int(os.getenv("ARCHIVE_INTERVAL_SECONDS", "3600"))
+
+# Online snapshots of every database file (see backup.py); 0 disables the schedule
+BACKUP_INTERVAL_HOURS = float(os.getenv("BACKUP_INTERVAL_HOURS", "24"))
+
+# Incremental vacuum / checkpoint / ANALYZE passes on quiet shards (see maintenance.py); 0 disables them
+MAINTENANCE_INTERVAL_SECONDS = int(os.getenv("MAINTENANCE_INTERVAL_SECONDS", "300"))
+
+# Cold starts: skip db_init's CREATE/ALTER pass when the stored PRAGMA user_version is
+# current, and build static assets / heavy imports after the server is accepting requests.
+# FAST_STARTUP=0 runs everything up front on every boot.
+FAST_STARTUP = os.getenv("FAST_STARTUP", "1") == "1"
+# Bump whenever db_init (or a module schema it calls) changes
+SCHEMA_VERSION = 5
+
 # ========================
 # DB Helpers
 # ========================
+# New tenant shards get their (conversation data only) schema on first use
+shard_router = shards.ShardRouter(lambda: DB_PATH, DEFAULT_TENANT_ID, enabled=TENANT_SHARDS,
+                                  pool_size=SHARD_POOL_SIZE, initializer=lambda tenant_id: db_init(shard=True))
+
 def db():
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
-    return conn
+    """The current tenant shard's writer connection: ``with db() as conn`` (writes are serialized)"""
+    return shard_router.connect()
+
+def db_read():
+    """Read-only snapshot of the current tenant's shard; never waits for or blocks writers"""
+    return shard_router.read()
 
-def db_init():
+def attach_archive(conn):
+    return archive.attach(conn, shard_router.path_for(shard_router.current()))
+
+@contextlib.contextmanager
+def db_tiered():
+    """Connection with the archive tier attached; read messages via the all_messages view"""
     with db() as conn:
-        c = conn.cursor()
+        yield attach_archive(conn)
 
-        # Create tenants table first (foreign key dependency for users)
-        c.execute("""CREATE TABLE IF NOT EXISTS tenants (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            name TEXT NOT NULL,
-            created_at TEXT NOT NULL DEFAULT (datetime('now'))
-        )""")
+def db_read_tiered():
+    """db_read() with the archive tier attached"""
+    return shard_router.read(setup=attach_archive)
 
-        # Create users table for authentication
-        c.execute("""CREATE TABLE IF NOT EXISTS users (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            tenant_id INTEGER NOT NULL DEFAULT 1,
-            email TEXT UNIQUE NOT NULL,
-            name TEXT NOT NULL,
-            password_hash TEXT NOT NULL,
-            role TEXT NOT NULL DEFAULT 'staff',
-            created_at TEXT NOT NULL DEFAULT (datetime('now')),
-            FOREIGN KEY (tenant_id) REFERENCES tenants(id)
-        )""")
+# Rendered admin list responses, valid until the next write bumps the generation
+response_cache = respcache.ResponseCache()
 
-        # Create events table for audit logging
-        c.execute("""CREATE TABLE IF NOT EXISTS events (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER,
-            tenant_id INTEGER,
-            type TEXT NOT NULL,
-            payload TEXT,
-            ts TEXT NOT NULL DEFAULT (datetime('now')),
-            FOREIGN KEY (user_id) REFERENCES users(id),
-            FOREIGN KEY (tenant_id) REFERENCES tenants(id)
-        )""")
+def cached_response(request: Request, build, *resources: str):
+    """Serve a GET built from ``resources`` through the write-generation cache (ETag / 304 / cached body)"""
+    with db_read() as conn:
+        generation = respcache.current(conn, *resources)
+    return response_cache.respond(request, generation, build, scope=str(shard_router.current()))
+
+def db_init(force: bool = False, shard: bool = False) -> bool:
+    """
+    Create / migrate the schema; returns False if skipped because it is already current.
+    ``shard`` is for tenant shards, which hold conversation data only (no users,
+    tenants, leases or events).
+    """
+    with db() as conn:
+        if FAST_STARTUP and not force and conn.execute("PRAGMA user_version").fetchone()[0] == SCHEMA_VERSION:
+            return False
+        c = conn.cursor()
+
+        if shard:
+            # Shards created before the split got the primary's tables too; drop them while empty
+            for table in ("users", "tenants", "leases", "events"):
+                if c.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name=?", (table,)).fetchone() \
+                        and not c.execute(f"SELECT 1 FROM {table} LIMIT 1").fetchone():
+                    c.execute(f"DROP TABLE {table}")
+        else:
+            # Create tenants table first (foreign key dependency for users)
+            c.execute("""CREATE TABLE IF NOT EXISTS tenants (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                name TEXT NOT NULL,
+                created_at TEXT NOT NULL DEFAULT (datetime('now'))
+            )""")
+            # Public identifiers that route visitor and Twilio traffic to the tenant (see shards.py)
+            for column in ("widget_key", "sms_number"):
+                try:
+                    c.execute(f"ALTER TABLE tenants ADD COLUMN {column} TEXT")
+                except sqlite3.OperationalError:
+                    pass
+                c.execute(f"CREATE UNIQUE INDEX IF NOT EXISTS idx_tenants_{column} ON tenants({column}) "
+                          f"WHERE {column} IS NOT NULL")
+
+            # Create users table for authentication
+            c.execute("""CREATE TABLE IF NOT EXISTS users (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                tenant_id INTEGER NOT NULL DEFAULT 1,
+                email TEXT UNIQUE NOT NULL,
+                name TEXT NOT NULL,
+                password_hash TEXT NOT NULL,
+                role TEXT NOT NULL DEFAULT 'staff',
+                created_at TEXT NOT NULL DEFAULT (datetime('now')),
+                FOREIGN KEY (tenant_id) REFERENCES tenants(id)
+            )""")
+
+            # Create events table for audit logging (canonical schema lives in events.py)
+            events.init_schema(conn)
+
+            # Lease row used to elect the single worker that runs background jobs
+            lease.init_schema(conn)
 
         c.execute("""CREATE TABLE IF NOT EXISTS conversations (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -182,6 +308,7 @@ def db_init():
         )""")
         c.execute("""CREATE TABLE IF NOT EXISTS messages (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
+            conversation_id INTEGER REFERENCES conversations(id),
             user_id TEXT, channel TEXT,
             sender TEXT, text TEXT, ts TEXT
         )""")
@@ -189,6 +316,7 @@ def db_init():
         c.execute("""
         CREATE TABLE IF NOT EXISTS followups (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
+            conversation_id INTEGER REFERENCES conversations(id),
             user_id TEXT, channel TEXT,
             name TEXT, email TEXT, phone TEXT,
             message TEXT, ts TEXT
@@ -199,6 +327,7 @@ def db_init():
         c.execute("""
         CREATE TABLE IF NOT EXISTS history (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
+            conversation_id INTEGER REFERENCES conversations(id),
             user_id TEXT,
             channel TEXT,
             name TEXT,
@@ -210,6 +339,9 @@ def db_init():
         """)
 
 
+        # Rollup tables plus created_at/closed_at/... columns on conversations
+        metrics.init_schema(conn)
+
         # Backward compatibility: add new columns if missing
         try:
             c.execute("ALTER TABLE conversations ADD COLUMN patience_sent INTEGER DEFAULT 0")
@@ -223,9 +355,249 @@ def db_init():
             c.execute("ALTER TABLE conversations ADD COLUMN escalation_active INTEGER DEFAULT 1")
         except sqlite3.OperationalError:
             pass
+        # Provider message id (e.g. Twilio MessageSid) for idempotent inbound processing
+        try:
+            c.execute("ALTER TABLE messages ADD COLUMN external_id TEXT")
+        except sqlite3.OperationalError:
+            pass
+        c.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_messages_external_id ON messages(external_id) WHERE external_id IS NOT NULL")
+        # Unread badge for followups (same column migrate_followups_viewed.py adds)
+        try:
+            c.execute("ALTER TABLE followups ADD COLUMN viewed INTEGER DEFAULT 0")
+        except sqlite3.OperationalError:
+            pass
+        # 1 when assigned_staff was picked by the shift router rather than set by staff
+        try:
+            c.execute("ALTER TABLE conversations ADD COLUMN assignment_routed INTEGER DEFAULT 0")
+            # Until now only the router set assignees
+            c.execute("UPDATE conversations SET assignment_routed=1 WHERE assigned_staff IS NOT NULL")
+        except sqlite3.OperationalError:
+            pass
+        # Highest message id the visitor's widget has acknowledged (missed-message replay)
+        try:
+            c.execute("ALTER TABLE conversations ADD COLUMN visitor_delivered_id INTEGER DEFAULT 0")
+        except sqlite3.OperationalError:
+            pass
+        # Random token of the upsert that last created or reopened the conversation (see upsert_conversation)
+        try:
+            c.execute("ALTER TABLE conversations ADD COLUMN open_token INTEGER")
+        except sqlite3.OperationalError:
+            pass
+        # Indexed epoch-ms columns for escalation, auto-close, cutoffs and ordering
+        timestamps.init_schema(conn)
+        # Write-generation counter behind the admin list ETags
+        respcache.init_schema(conn)
+        # Integer conversation key on child rows (added before the dedupe so it gets repointed too)
+        added = []
+        for table in ("messages", "followups", "history"):
+            try:
+                c.execute(f"ALTER TABLE {table} ADD COLUMN conversation_id INTEGER REFERENCES conversations(id)")
+                added.append(table)
+            except sqlite3.OperationalError:
+                pass
+        # One row per (user_id, channel): the key ensure_conversation upserts on
+        dedupe_conversations(conn)
+        c.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_conversations_user_channel ON conversations(user_id, channel)")
+        for table in added:
+            backfill_conversation_ids(conn, table)
+        c.execute("DROP INDEX IF EXISTS idx_messages_convo")
+        c.execute("CREATE INDEX IF NOT EXISTS idx_messages_conversation ON messages(conversation_id, id)")
+        c.execute("CREATE INDEX IF NOT EXISTS idx_followups_conversation ON followups(conversation_id)")
+        c.execute("CREATE INDEX IF NOT EXISTS idx_history_conversation ON history(conversation_id)")
 
         conn.commit()
 
+    # Archive tier lives in its own file; attaching creates its schema
+    with db_tiered() as conn:
+        # Full-text index: backfill once when it is first created
+        if search.init_schema(conn):
+            search.rebuild(conn, shard_router.current())
+        # Metrics: roll up pre-existing messages once
+        if metrics.needs_backfill(conn):
+            metrics.backfill(conn, shard_router.current(), message_source="all_messages")
+    if not shard and shard_router.enabled:
+        # Conversations of other tenants stored here before sharding (or before their traffic was routed)
+        with db_read() as conn:
+            tenant_ids = [r[0] for r in conn.execute(
+                "SELECT DISTINCT tenant_id FROM conversations WHERE tenant_id != ? AND tenant_id IN (SELECT id FROM tenants)",
+                (DEFAULT_TENANT_ID,))]
+        for tenant_id in tenant_ids:
+            logging.info(f"Moved {migrate_tenant_rows(tenant_id)} conversations of tenant {tenant_id} into its shard")
+    with db() as conn:
+        # Only once everything above has succeeded
+        conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+    return True
+
+def backfill_conversation_ids(conn, table: str) -> int:
+    """Fill ``table.conversation_id`` from (user_id, channel); rows without a conversation stay NULL"""
+    cur = conn.execute(f"""UPDATE {table} SET conversation_id = (
+                               SELECT cv.id FROM conversations cv
+                               WHERE cv.user_id = {table}.user_id AND cv.channel = {table}.channel)
+                           WHERE conversation_id IS NULL""")
+    return cur.rowcount
+
+def dedupe_conversations(conn) -> int:
+    """
+    Merge conversations that share (user_id, channel), left behind by concurrent
+    first messages before the unique index existed, into the oldest row.  It
+    takes the state of the most recently updated duplicate and the earliest
+    milestones; rollups are summed and other references repointed.  Returns
+    the number of rows removed.
+    """
+    c = conn.cursor()
+    c.execute("DROP TABLE IF EXISTS temp.conversation_dupes")
+    c.execute("""
+        CREATE TEMP TABLE conversation_dupes AS
+        SELECT id, keeper, latest FROM (
+            SELECT id,
+                   MIN(id) OVER convo AS keeper,
+                   FIRST_VALUE(id) OVER (PARTITION BY user_id, channel ORDER BY updated_at_ms DESC, id DESC) AS latest,
+                   COUNT(*) OVER convo AS n
+            FROM conversations
+            WHERE user_id IS NOT NULL AND channel IS NOT NULL
+            WINDOW convo AS (PARTITION BY user_id, channel)
+        ) WHERE n > 1
+    """)
+    removed = c.execute("SELECT COUNT(*) FROM temp.conversation_dupes WHERE id != keeper").fetchone()[0]
+    if removed:
+        c.execute("""
+            UPDATE conversations AS k SET
+                open = l.open, assigned_staff = l.assigned_staff, updated_at = l.updated_at,
+                updated_at_ms = l.updated_at_ms, patience_sent = l.patience_sent, final_sent = l.final_sent,
+                escalation_active = l.escalation_active, closed_at = l.closed_at, resolved = l.resolved
+            FROM (SELECT d.keeper, cv.* FROM temp.conversation_dupes d JOIN conversations cv ON cv.id = d.latest
+                  WHERE d.id = d.keeper) AS l
+            WHERE k.id = l.keeper
+        """)
+        c.execute("""
+            UPDATE conversations AS k SET
+                created_at = a.created_at, first_user_message_at = a.first_user_message_at,
+                first_staff_reply_at = a.first_staff_reply_at, last_staff_activity_at = a.last_staff_activity_at,
+                assigned_staff_id = COALESCE(k.assigned_staff_id, a.assigned_staff_id),
+                visitor_delivered_id = a.visitor_delivered_id
+            FROM (SELECT d.keeper, MIN(cv.created_at) AS created_at, MIN(cv.first_user_message_at) AS first_user_message_at,
+                         MIN(cv.first_staff_reply_at) AS first_staff_reply_at,
+                         MAX(cv.last_staff_activity_at) AS last_staff_activity_at,
+                         MIN(cv.assigned_staff_id) AS assigned_staff_id, MAX(cv.visitor_delivered_id) AS visitor_delivered_id
+                  FROM temp.conversation_dupes d JOIN conversations cv ON cv.id = d.id
+                  GROUP BY d.keeper) AS a
+            WHERE k.id = a.keeper
+        """)
+        c.execute("""
+            INSERT INTO conversation_metrics (tenant_id, conversation_id, total_messages, user_messages, staff_messages,
+                                              system_messages, escalation_count, first_response_seconds,
+                                              duration_seconds, assigned_staff_id, updated_at)
+            SELECT MAX(m.tenant_id), d.keeper, SUM(m.total_messages), SUM(m.user_messages), SUM(m.staff_messages),
+                   SUM(m.system_messages), SUM(m.escalation_count), MIN(m.first_response_seconds),
+                   MAX(m.duration_seconds), MIN(m.assigned_staff_id), MAX(m.updated_at)
+            FROM conversation_metrics m JOIN temp.conversation_dupes d ON d.id = m.conversation_id
+            WHERE d.id != d.keeper
+            GROUP BY d.keeper
+            ON CONFLICT(conversation_id) DO UPDATE SET
+                total_messages = total_messages + excluded.total_messages,
+                user_messages = user_messages + excluded.user_messages,
+                staff_messages = staff_messages + excluded.staff_messages,
+                system_messages = system_messages + excluded.system_messages,
+                escalation_count = escalation_count + excluded.escalation_count,
+                first_response_seconds = COALESCE(MIN(first_response_seconds, excluded.first_response_seconds),
+                                                  first_response_seconds, excluded.first_response_seconds),
+                duration_seconds = COALESCE(MAX(duration_seconds, excluded.duration_seconds),
+                                            duration_seconds, excluded.duration_seconds),
+                assigned_staff_id = COALESCE(assigned_staff_id, excluded.assigned_staff_id),
+                updated_at = MAX(updated_at, excluded.updated_at)
+        """)
+        c.execute("DELETE FROM conversation_metrics WHERE conversation_id IN "
+                  "(SELECT id FROM temp.conversation_dupes WHERE id != keeper)")
+        # Anything else keyed on the conversation row (e.g. events in the primary file)
+        tables = [r[0] for r in c.execute("SELECT name FROM sqlite_master WHERE type='table' AND name != 'conversation_metrics'")]
+        for table in tables:
+            if any(col[1] == "conversation_id" for col in c.execute(f'PRAGMA table_info("{table}")')):
+                c.execute(f"""
+                    UPDATE "{table}" SET conversation_id =
+                        (SELECT keeper FROM temp.conversation_dupes d WHERE d.id = "{table}".conversation_id)
+                    WHERE conversation_id IN (SELECT id FROM temp.conversation_dupes WHERE id != keeper)
+                """)
+        c.execute("DELETE FROM conversations WHERE id IN (SELECT id FROM temp.conversation_dupes WHERE id != keeper)")
+        logging.info(f"Merged {removed} duplicate conversation rows")
+    c.execute("DROP TABLE temp.conversation_dupes")
+    return removed
+
+def table_columns(conn, table: str, schema: str = "main") -> List[str]:
+    return [r[1] for r in conn.execute(f'PRAGMA {schema}.table_info("{table}")')]
+
+def migrate_tenant_rows(tenant_id: int) -> int:
+    """
+    Move ``tenant_id``'s conversations out of the primary file into the
+    tenant's shard, with their messages (hot and archived), followups and
+    history; rollups and the search index are rebuilt on the shard.  Rows get
+    new ids there, and a conversation the shard already has for the same
+    (user_id, channel) absorbs the moved rows.  The shard records each copy in
+    ``migrated_conversations`` in the same transaction, so a run cut short
+    before the primary's rows were deleted finishes without copying twice.
+    Returns the number of conversations moved.
+    """
+    primary = shard_router.path_for(DEFAULT_TENANT_ID)
+    with shard_router.connect(tenant_id) as conn:
+        conn.execute("CREATE TABLE IF NOT EXISTS migrated_conversations (source_id INTEGER PRIMARY KEY, id INTEGER NOT NULL)")
+        conn.commit()
+        conn.execute("ATTACH DATABASE ? AS src", (primary,))
+        conn.execute("ATTACH DATABASE ? AS src_archive", (archive.archive_path(primary),))
+        try:
+            columns = [col for col in table_columns(conn, "conversations", "src")
+                       if col != "id" and col in table_columns(conn, "conversations")]
+            fresh = []
+            for row in conn.execute(f"""SELECT id, {", ".join(columns)} FROM src.conversations
+                                        WHERE tenant_id = ? AND id NOT IN (SELECT source_id FROM migrated_conversations)""",
+                                    (tenant_id,)).fetchall():
+                new = conn.execute(f"""INSERT INTO conversations ({", ".join(columns)}) VALUES ({", ".join("?" * len(columns))})
+                                       ON CONFLICT(user_id, channel) DO NOTHING RETURNING id""", tuple(row)[1:]).fetchone()
+                if new is None:
+                    new = conn.execute("SELECT id FROM conversations WHERE user_id=? AND channel=?",
+                                       (row["user_id"], row["channel"])).fetchone()
+                conn.execute("INSERT INTO migrated_conversations (source_id, id) VALUES (?, ?)", (row["id"], new[0]))
+                fresh.append((row["id"], new[0]))
+            conn.execute("CREATE TEMP TABLE IF NOT EXISTS moved_conversations (source_id INTEGER PRIMARY KEY, id INTEGER)")
+            conn.execute("DELETE FROM temp.moved_conversations")
+            conn.executemany("INSERT INTO temp.moved_conversations VALUES (?, ?)", fresh)
+            for schema, table in (("src", "messages"), ("src_archive", "messages"), ("src", "followups"), ("src", "history")):
+                target = table_columns(conn, table)
+                columns = [col for col in table_columns(conn, table, schema) if col not in ("id", "conversation_id") and col in target]
+                # Ordered by id so replies keep their order under the new ids
+                conn.execute(f"""INSERT OR IGNORE INTO {table} (conversation_id, {", ".join(columns)})
+                                 SELECT mv.id, {", ".join(f"t.{col}" for col in columns)}
+                                 FROM {schema}.{table} t JOIN temp.moved_conversations mv ON mv.source_id = t.conversation_id
+                                 ORDER BY t.id""")
+            moved = [r[0] for r in conn.execute("""SELECT source_id FROM migrated_conversations
+                                                   WHERE source_id IN (SELECT id FROM src.conversations)""")]
+            conn.execute("DROP TABLE temp.moved_conversations")
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+        finally:
+            conn.execute("DETACH DATABASE src")
+            conn.execute("DETACH DATABASE src_archive")
+    if not moved:
+        return 0
+
+    with shards.use_tenant(DEFAULT_TENANT_ID), db_tiered() as conn:
+        ids = json.dumps(moved)
+        for source, table in (("message", "main.messages"), ("message", "archive.messages"),
+                              ("followup", "followups"), ("history", "history")):
+            search.remove(conn, source, [r[0] for r in conn.execute(
+                f"SELECT id FROM {table} WHERE conversation_id IN (SELECT value FROM json_each(?))", (ids,))])
+            conn.execute(f"DELETE FROM {table} WHERE conversation_id IN (SELECT value FROM json_each(?))", (ids,))
+        conn.execute("DELETE FROM conversation_metrics WHERE conversation_id IN (SELECT value FROM json_each(?))", (ids,))
+        conn.execute("DELETE FROM agent_metrics WHERE staff_id IN (SELECT id FROM users WHERE tenant_id=?)", (tenant_id,))
+        conn.execute("DELETE FROM conversations WHERE id IN (SELECT value FROM json_each(?))", (ids,))
+        respcache.bump(conn)
+    with shards.use_tenant(tenant_id), db_tiered() as conn:
+        respcache.bump(conn)
+        conn.commit()
+        search.rebuild(conn, tenant_id)
+        metrics.backfill(conn, tenant_id, message_source="all_messages")
+    return len(moved)
+
 
 def seed_admin_user():
     """
@@ -247,9 +619,8 @@ def seed_admin_user():
         # Check if admin user exists
         c.execute("SELECT id FROM users WHERE email = ?", ("admin@dwc.com",))
         if not c.fetchone():
-            # Import password hashing from auth module
-            from passlib.context import CryptContext
-            pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+            # Password hashing from the auth module (passlib/bcrypt load only here)
+            pwd_context = get_pwd_context()
 
             # Default admin password - CHANGE THIS IMMEDIATELY AFTER FIRST LOGIN
             default_password = "admin123"
@@ -281,6 +652,7 @@ class PostMessageSchema(BaseModel):
     user_id: str
     channel: str = "webchat"
     text: str
+    client_id: Optional[str] = None  # widget-generated id for dedupe of resends
 
 class AdminSendSchema(BaseModel):
     user_id: str
@@ -297,109 +669,438 @@ class FollowupSchema(BaseModel):
     message: Optional[str] = None
 class BulkCloseSchema(BaseModel):
     conversations: list[dict]  # List of {user_id, channel} dicts
+class BulkFollowupSchema(BaseModel):
+    ids: list[int]
 
 
 # ========================
 # Conversation Helpers
 # ========================
-def ensure_conversation(user_id: str, channel: str) -> bool:
+def upsert_conversation(conn, user_id: str, channel: str, now: int) -> Tuple[int, bool]:
+    """
+    Create the conversation, or touch it and reopen it if it was closed, in
+    one atomic statement keyed on the unique (user_id, channel) index.
+    Reopening re-arms escalation and keeps the previous assignee.  Returns
+    (conversation id, opened): opened is True when this call created or
+    reopened it, and the caller then routes it with route_conversation once
+    the transaction has committed.
+    """
+    ts = timestamps.to_iso(now)
+    # RETURNING sees the row after the update, so the call stamps a token of its own on create / reopen
+    token = secrets.randbits(62)
+    row = conn.execute("""
+        INSERT INTO conversations (user_id, channel, open, updated_at, updated_at_ms, escalation_active,
+                                   created_at, tenant_id, open_token)
+        VALUES (?, ?, 1, ?, ?, 1, ?, ?, ?)
+        ON CONFLICT(user_id, channel) DO UPDATE SET
+            updated_at = excluded.updated_at,
+            updated_at_ms = excluded.updated_at_ms,
+            escalation_active = CASE WHEN open = 0 THEN 1 ELSE escalation_active END,
+            patience_sent = CASE WHEN open = 0 THEN 0 ELSE patience_sent END,
+            final_sent = CASE WHEN open = 0 THEN 0 ELSE final_sent END,
+            closed_at = CASE WHEN open = 0 THEN NULL ELSE closed_at END,
+            open_token = CASE WHEN open = 0 THEN excluded.open_token ELSE open_token END,
+            open = 1
+        RETURNING id, open_token IS ? AS opened
+    """, (user_id, channel, ts, now, ts, shard_router.current(), token, token)).fetchone()
+    return row["id"], bool(row["opened"])
+
+def route_conversation(conversation_id: int) -> Optional[dict]:
     """
-    Ensures conversation exists and is open.
-    Returns True if this is a brand new conversation (first message ever).
+    Account for the assignee of a conversation that was just created or
+    reopened; call after that transaction has committed, so the router's
+    load counters never count a rolled-back assignment.  A reopened
+    conversation keeps its previous assignee; otherwise the shift router
+    picks one.  Returns the conversation (user_id, channel, assigned_staff)
+    for notify_assignee, or None if nobody was assigned.
     """
-    ts = datetime.datetime.utcnow().isoformat() + "Z"
-    is_new = False
+    staff = None
+    try:
+        with db() as conn:
+            row = conn.execute("SELECT id, user_id, channel, assigned_staff FROM conversations WHERE id=? AND open=1",
+                               (conversation_id,)).fetchone()
+            if row is None:
+                return None
+            kept = row["assigned_staff"]
+            if kept is None:
+                staff = shift_router.assign()
+                if staff is None:
+                    return None
+                conn.execute("UPDATE conversations SET assigned_staff=?, assignment_routed=1 WHERE id=?",
+                             (staff, conversation_id))
+                respcache.bump(conn, "conversations")
+    except BaseException:
+        shift_router.release(staff)
+        raise
+    shift_router.claim(kept)
+    return {"conversation_id": conversation_id, "user_id": row["user_id"], "channel": row["channel"],
+            "assigned_staff": kept or staff}
+
+def tenant_sms_number(tenant_id: Optional[int] = None) -> Optional[str]:
+    """The Twilio number the tenant texts from (tenants.sms_number, else TWILIO_NUMBER)"""
+    tenant_id = shard_router.current() if tenant_id is None else tenant_id
+    with shard_router.read(DEFAULT_TENANT_ID) as conn:
+        row = conn.execute("SELECT sms_number FROM tenants WHERE id=?", (tenant_id,)).fetchone()
+    return (row["sms_number"] if row else None) or TWILIO_NUMBER
+
+async def notify_assignee(assignment: Optional[dict]):
+    """Tell the current tenant's dashboards, and the assignee by SMS, who picks up a conversation"""
+    if not assignment:
+        return
+    await broadcast_admin({"type": "conversation_assigned", "user_id": assignment["user_id"],
+                           "channel": assignment["channel"], "assigned_staff": assignment["assigned_staff"]})
+    if twilio_client:
+        try:
+            sender = await asyncio.to_thread(tenant_sms_number)
+            if not sender:
+                return
+            await asyncio.to_thread(
+                twilio_client.messages.create, from_=sender, to=assignment["assigned_staff"],
+                body=f"[Assigned] Conversation with {assignment['user_id']} ({assignment['channel']}) is waiting for you.")
+        except Exception as e:
+            logging.exception(f"Failed to send assignment SMS: {repr(e)}")
 
+def ensure_conversation(user_id: str, channel: str) -> int:
+    """Ensures the conversation exists and is open; returns its id"""
     with db() as conn:
-        c = conn.cursor()
-        c.execute("SELECT id, open FROM conversations WHERE user_id=? AND channel=?",
-                  (user_id, channel))
-        row = c.fetchone()
-        if not row:
-            # First message ever - create conversation with escalation enabled
-            c.execute("INSERT INTO conversations (user_id, channel, assigned_staff, open, updated_at, escalation_active) VALUES (?,?,?,?,?,?)",
-                      (user_id, channel, None, 1, ts, 1))
-            is_new = True
-        else:
-            # Conversation exists - check if it was closed
-            was_closed = row["open"] == 0
-            if was_closed:
-                # Reopening after being closed - re-enable escalation for new user message
-                c.execute("UPDATE conversations SET open=1, updated_at=?, escalation_active=1, patience_sent=0, final_sent=0 WHERE user_id=? AND channel=?",
-                          (ts, user_id, channel))
-            else:
-                # Conversation still open - just update timestamp, don't touch escalation
-                c.execute("UPDATE conversations SET updated_at=? WHERE user_id=? AND channel=?",
-                          (ts, user_id, channel))
-        conn.commit()
-
-    return is_new
+        conversation_id, opened = upsert_conversation(conn, user_id, channel, timestamps.now_ms())
+        respcache.bump(conn, "conversations")
+    if opened:
+        route_conversation(conversation_id)
+    return conversation_id
+
+def insert_message(conn, conversation_id: Optional[int], user_id: str, channel: str, sender: str, text: str,
+                   now: int, staff_id: Optional[int] = None, external_id: Optional[str] = None) -> Optional[int]:
+    """Insert one message row plus its search entry; returns None for a duplicate external_id"""
+    ts = timestamps.to_iso(now)
+    tenant_id = shard_router.current()
+    c = conn.execute("""INSERT OR IGNORE INTO messages (conversation_id, user_id, channel, sender, text, ts, ts_ms,
+                                                        tenant_id, staff_id, external_id)
+                        VALUES (?,?,?,?,?,?,?,?,?,?)""",
+                     (conversation_id, user_id, channel, sender, text, ts, now, tenant_id, staff_id, external_id))
+    if c.rowcount == 0:
+        return None
+    search.index_message(conn, c.lastrowid, tenant_id, user_id, channel, text, ts)
+    return c.lastrowid
 
-def add_message(user_id: str, channel: str, sender: str, text: str):
-    ts = datetime.datetime.utcnow().isoformat() + "Z"
+def add_message(user_id: str, channel: str, sender: str, text: str, staff_id: Optional[int] = None,
+                external_id: Optional[str] = None, conversation_id: Optional[int] = None,
+                now: Optional[int] = None) -> Optional[int]:
+    """
+    Store a message and return its id.
+    Pass conversation_id when the caller already has it, to skip the (user_id, channel) lookup.
+    Pass now (epoch ms) when the caller pushes the message too, so both carry the same ts.
+    Returns None if a message with the same external_id was already stored.
+    """
+    now = now or timestamps.now_ms()
+    ts = timestamps.to_iso(now)
     with db() as conn:
-        c = conn.cursor()
-        c.execute("INSERT INTO messages (user_id, channel, sender, text, ts) VALUES (?,?,?,?,?)",
-                  (user_id, channel, sender, text, ts))
-        c.execute("UPDATE conversations SET updated_at=? WHERE user_id=? AND channel=?",
-                  (ts, user_id, channel))
+        if conversation_id is None:
+            convo = conn.execute("UPDATE conversations SET updated_at=?, updated_at_ms=? WHERE user_id=? AND channel=? RETURNING id",
+                                 (ts, now, user_id, channel)).fetchone()
+            conversation_id = convo["id"] if convo else None
+        else:
+            conn.execute("UPDATE conversations SET updated_at=?, updated_at_ms=? WHERE id=?", (ts, now, conversation_id))
+        message_id = insert_message(conn, conversation_id, user_id, channel, sender, text, now, staff_id, external_id)
+        if message_id is None:
+            conn.rollback()
+            return None  # duplicate delivery
+        if conversation_id is not None:
+            metrics.record_message(conn, conversation_id, shard_router.current(), sender, now, staff_id)
+        respcache.bump(conn, "conversations")
         conn.commit()
+    return message_id
 
-def get_messages(user_id: str, channel: str):
-    with db() as conn:
+def find_conversation(user_id: str, channel: str) -> Optional[int]:
+    """Conversation id for (user_id, channel), or None if the visitor has never written"""
+    with db_read() as conn:
+        row = conn.execute("SELECT id FROM conversations WHERE user_id=? AND channel=?", (user_id, channel)).fetchone()
+    return row["id"] if row else None
+
+def get_messages(user_id: str, channel: str, conversation_id: Optional[int] = None):
+    with db_read_tiered() as conn:
         c = conn.cursor()
-        c.execute("SELECT sender, text, ts FROM messages WHERE user_id=? AND channel=? ORDER BY id ASC",
-                  (user_id, channel))
-        rows = c.fetchall()
-        c.execute("SELECT assigned_staff, open, updated_at FROM conversations WHERE user_id=? AND channel=?",
-                  (user_id, channel))
+        if conversation_id is None:
+            c.execute("SELECT id, assigned_staff, open, updated_at FROM conversations WHERE user_id=? AND channel=?",
+                      (user_id, channel))
+        else:
+            c.execute("SELECT id, assigned_staff, open, updated_at FROM conversations WHERE id=?", (conversation_id,))
         convo = c.fetchone()
+        if convo:
+            c.execute("SELECT sender, text, ts FROM all_messages WHERE conversation_id=? ORDER BY id ASC", (convo["id"],))
+        else:
+            # Messages logged before (or without) a conversation row
+            c.execute("""SELECT sender, text, ts FROM all_messages
+                         WHERE conversation_id IS NULL AND user_id=? AND channel=? ORDER BY id ASC""",
+                      (user_id, channel))
+        rows = c.fetchall()
     return {
+        "conversation_id": convo["id"] if convo else None,
         "assigned_staff": convo["assigned_staff"] if convo else None,
         "open": bool(convo["open"]) if convo else False,
         "last_updated": convo["updated_at"] if convo else None,
         "messages": [dict(r) for r in rows]
     }
 
+def get_undelivered_messages(conversation_id: int, since_id: Optional[int], limit: int = 500):
+    """
+    Staff/system messages after since_id for a reconnecting visitor.
+    When since_id is None the stored delivery high-water mark is used.
+    Returns (messages, high_water_mark).
+    """
+    with db_read() as conn:
+        c = conn.cursor()
+        if since_id is None:
+            c.execute("SELECT visitor_delivered_id FROM conversations WHERE id=?", (conversation_id,))
+            row = c.fetchone()
+            since_id = (row["visitor_delivered_id"] or 0) if row else 0
+            if not since_id:
+                return [], 0  # nothing acknowledged yet: widget starts fresh
+        # Served by idx_messages_conversation (conversation_id, id)
+        c.execute("""
+            SELECT id, sender, text, ts FROM messages
+            WHERE conversation_id=? AND id > ? AND sender != 'user'
+            ORDER BY id ASC LIMIT ?
+        """, (conversation_id, since_id, limit))
+        return [dict(r) for r in c.fetchall()], since_id
+
+def save_visitor_delivered(conversation_id: int, message_id: int):
+    # Visitor-side bookkeeping the admin lists leave out (admin_conversation), so no cache bump
+    with db() as conn:
+        conn.execute("""UPDATE conversations SET visitor_delivered_id=?
+                        WHERE id=? AND COALESCE(visitor_delivered_id, 0) < ?""",
+                     (message_id, conversation_id, message_id))
+        conn.commit()
+
 def set_assignment(user_id: str, channel: str, staff_number: Optional[str], open_state: bool):
-    ts = datetime.datetime.utcnow().isoformat() + "Z"
+    now = timestamps.now_ms()
+    ts = timestamps.to_iso(now)
+    with db() as conn:
+        c = conn.cursor()
+        c.execute("SELECT assigned_staff FROM conversations WHERE user_id=? AND channel=? AND open=1",
+                  (user_id, channel))
+        previous = [r["assigned_staff"] for r in c.fetchall()]
+        c.execute("UPDATE conversations SET assigned_staff=?, assignment_routed=0, open=?, updated_at=?, updated_at_ms=? WHERE user_id=? AND channel=? RETURNING id",
+                  (staff_number, 1 if open_state else 0, ts, now, user_id, channel))
+        closed_ids = [r["id"] for r in c.fetchall()]
+        if not open_state:
+            metrics.record_close(conn, closed_ids, now)
+        respcache.bump(conn, "conversations")
+        conn.commit()
+    # Free the routing slot held by the previous assignee
+    for staff in previous:
+        if staff != staff_number or not open_state:
+            shift_router.release(staff)
+
+def close_conversations(convos: List[tuple]) -> List[dict]:
+    """Close many (user_id, channel) conversations in a single transaction"""
+    now = timestamps.now_ms()
+    ts = timestamps.to_iso(now)
     with db() as conn:
         c = conn.cursor()
-        c.execute("UPDATE conversations SET assigned_staff=?, open=?, updated_at=? WHERE user_id=? AND channel=?",
-                  (staff_number, 1 if open_state else 0, ts, user_id, channel))
+        c.execute("CREATE TEMP TABLE IF NOT EXISTS bulk_targets (user_id TEXT, channel TEXT)")
+        c.executemany("INSERT INTO temp.bulk_targets (user_id, channel) VALUES (?, ?)", convos)
+        c.execute("""
+            SELECT id, user_id, channel, assigned_staff FROM conversations
+            WHERE open=1 AND (user_id, channel) IN (SELECT user_id, channel FROM temp.bulk_targets)
+        """)
+        closed = [dict(r) for r in c.fetchall()]
+        c.executemany("UPDATE conversations SET assigned_staff=NULL, open=0, updated_at=?, updated_at_ms=? WHERE id=?",
+                      [(ts, now, r["id"]) for r in closed])
+        metrics.record_close(conn, [r["id"] for r in closed], now)
+        c.execute("DELETE FROM temp.bulk_targets")
+        respcache.bump(conn, "conversations")
         conn.commit()
+    for r in closed:
+        shift_router.release(r["assigned_staff"])
+    return closed
+
+class UnviewedFollowups:
+    """In-memory unviewed followup counts (per tenant shard) behind the dashboard badge; writers apply deltas"""
+    def __init__(self):
+        self.counts: Dict[int, int] = {}
+        self._lock = threading.Lock()
+
+    @property
+    def count(self) -> int:
+        return self.counts.get(shard_router.current(), 0)
+
+    def add(self, delta: int):
+        if delta:
+            tenant_id = shard_router.current()
+            with self._lock:
+                self.counts[tenant_id] = max(self.counts.get(tenant_id, 0) + delta, 0)
+
+    def resync(self) -> List[int]:
+        """Recount every shard (picks up other workers' writes); returns the tenants whose count changed"""
+        counts = shard_router.each(
+            lambda conn: conn.execute("SELECT COUNT(*) FROM followups WHERE viewed = 0").fetchone()[0])
+        with self._lock:
+            changed = [t for t, n in counts.items() if self.counts.get(t, 0) != n]
+            self.counts = counts
+        return changed
+
+unviewed_followups = UnviewedFollowups()
+
+def archive_followups(followup_ids: List[int]) -> List[int]:
+    """Move followups to history in one transaction; returns the ids that existed"""
+    now = timestamps.now_ms()
+    ts = timestamps.to_iso(now)
+    ids_json = json.dumps(list(followup_ids))
+    with db() as conn:
+        c = conn.cursor()
+        c.execute("""
+            INSERT INTO history (conversation_id, user_id, channel, name, contact, message, ts, migrated_at, migrated_at_ms)
+            SELECT conversation_id, user_id, channel, name,
+                   'Email: ' || COALESCE(NULLIF(email, ''), 'N/A') || ', Phone: ' || COALESCE(NULLIF(phone, ''), 'N/A'),
+                   message, ts, ?, ?
+            FROM followups WHERE id IN (SELECT value FROM json_each(?)) ORDER BY id
+            RETURNING id, user_id, channel, name, contact, message, ts
+        """, (ts, now, ids_json))
+        for h in c.fetchall():
+            search.index_history(conn, h["id"], shard_router.current(), h["user_id"], h["channel"],
+                                 h["name"], h["contact"], h["message"], h["ts"])
+        c.execute("DELETE FROM followups WHERE id IN (SELECT value FROM json_each(?)) RETURNING id, viewed", (ids_json,))
+        deleted = c.fetchall()
+        archived = [r["id"] for r in deleted]
+        search.remove(conn, "followup", archived)
+        respcache.bump(conn, "followups", "history")
+        conn.commit()
+    unviewed_followups.add(-sum(1 for r in deleted if not r["viewed"]))
+    return archived
+
+def mark_followups_viewed(followup_ids: List[int]) -> List[int]:
+    with db() as conn:
+        c = conn.cursor()
+        c.execute("UPDATE followups SET viewed=1 WHERE viewed=0 AND id IN (SELECT value FROM json_each(?)) RETURNING id",
+                  (json.dumps(list(followup_ids)),))
+        marked = [r["id"] for r in c.fetchall()]
+        respcache.bump(conn, "followups")
+        conn.commit()
+    unviewed_followups.add(-len(marked))
+    return marked
 
 # ========================
 # WebSocket Manager
 # ========================
 class WSManager:
+    """
+    Visitor sockets keyed by integer conversation id, per tenant shard (ids are
+    only unique within a shard).  A visitor who has not written yet has no
+    conversation: their sockets wait in ``unbound`` until bind() moves them
+    once the first message creates it.
+    """
     def __init__(self):
-        self.connections: Dict[str, Set[WebSocket]] = {}
-
-    def key(self, user_id: str, channel: str) -> str:
-        return f"{user_id}|{channel}"
-
-    async def connect(self, user_id: str, channel: str, ws: WebSocket):
+        self.connections: Dict[int, Dict[int, Set[WebSocket]]] = {}
+        # Per-conversation delivery high-water mark (highest acked message id)
+        self.delivered: Dict[int, Dict[int, int]] = {}
+        self.unbound: Dict[Tuple[int, str, str], Set[WebSocket]] = {}
+        # Connected visitors' conversation ids, for frames that only name (user_id, channel)
+        self.ids: Dict[Tuple[int, str, str], int] = {}
+        # Socket -> (tenant, user_id, channel), conversation id
+        self.sockets: Dict[WebSocket, Tuple[Tuple[int, str, str], Optional[int]]] = {}
+
+    async def connect(self, ws: WebSocket, user_id: str, channel: str, conversation_id: Optional[int]):
         await ws.accept()
-        k = self.key(user_id, channel)
-        self.connections.setdefault(k, set()).add(ws)
-
-    def disconnect(self, user_id: str, channel: str, ws: WebSocket):
-        k = self.key(user_id, channel)
-        if k in self.connections and ws in self.connections[k]:
-            self.connections[k].remove(ws)
-            if not self.connections[k]:
-                del self.connections[k]
-
-    async def push(self, user_id: str, channel: str, payload: dict):
-        k = self.key(user_id, channel)
-        for ws in list(self.connections.get(k, [])):
+        self._attach(ws, (shard_router.current(), user_id, channel), conversation_id)
+
+    def _attach(self, ws: WebSocket, visitor: Tuple[int, str, str], conversation_id: Optional[int]):
+        self.sockets[ws] = (visitor, conversation_id)
+        if conversation_id is None:
+            self.unbound.setdefault(visitor, set()).add(ws)
+        else:
+            self.connections.setdefault(visitor[0], {}).setdefault(conversation_id, set()).add(ws)
+            self.ids[visitor] = conversation_id
+
+    def bind(self, user_id: str, channel: str, conversation_id: int):
+        """Move the visitor's waiting sockets onto their (new) conversation"""
+        if not self.unbound:
+            return
+        visitor = (shard_router.current(), user_id, channel)
+        for ws in self.unbound.pop(visitor, ()):
+            self._attach(ws, visitor, conversation_id)
+
+    def find(self, user_id: str, channel: str) -> Optional[int]:
+        return self.ids.get((shard_router.current(), user_id, channel))
+
+    def disconnect(self, ws: WebSocket) -> Optional[int]:
+        """Forget the socket; returns the conversation id it was bound to"""
+        visitor, conversation_id = self.sockets.pop(ws, (None, None))
+        if visitor is None:
+            return None
+        if conversation_id is None:
+            group = self.unbound.get(visitor)
+            if group is not None:
+                group.discard(ws)
+                if not group:
+                    del self.unbound[visitor]
+            return None
+        convos = self.connections.get(visitor[0], {})
+        group = convos.get(conversation_id)
+        if group is not None:
+            group.discard(ws)
+            if not group:
+                del convos[conversation_id]
+                self.ids.pop(visitor, None)
+        return conversation_id
+
+    def ack(self, ws: WebSocket, message_id: int):
+        visitor, conversation_id = self.sockets.get(ws, (None, None))
+        if conversation_id is None:
+            return
+        marks = self.delivered.setdefault(visitor[0], {})
+        if message_id > marks.get(conversation_id, 0):
+            marks[conversation_id] = message_id
+
+    def release_delivered(self, conversation_id: int) -> Optional[int]:
+        """Pop the high-water mark once the conversation has no sockets left"""
+        tenant_id = shard_router.current()
+        if conversation_id in self.connections.get(tenant_id, {}):
+            return None
+        return self.delivered.get(tenant_id, {}).pop(conversation_id, None)
+
+    async def push(self, conversation_id: Optional[int], payload: dict):
+        if conversation_id is None:
+            return
+        sockets = list(self.connections.get(shard_router.current(), {}).get(conversation_id, ()))
+        if not sockets:
+            return
+        frame = codec.encode_frame(payload)  # encode once for all of the visitor's tabs
+        for ws in sockets:
             try:
-                await ws.send_json(payload)
+                await codec.send_frame(ws, frame)
+                visitor_sockets.pushed(ws)
             except Exception:
-                self.disconnect(user_id, channel, ws)
+                self.disconnect(ws)
 
 ws_manager = WSManager()
+# Heartbeats, idle eviction and per-address / per-visitor caps for visitor sockets (see liveness.py)
+visitor_sockets = liveness.SocketRegistry()
+# Token buckets for the unauthenticated ingestion endpoints (see ratelimit.py)
+visitor_limits = ratelimit.RateLimiter(*ratelimit.VISITOR_LIMIT)
+ip_limits = ratelimit.RateLimiter(*ratelimit.IP_LIMIT)
+phone_limits = ratelimit.RateLimiter(*ratelimit.PHONE_LIMIT)
+typing_limits = ratelimit.RateLimiter(*ratelimit.TYPING_LIMIT)
+
+def phone_key(phone: Optional[str]):
+    """Per-tenant bucket key for a phone number in any format (whatsapp: prefix, spaces, dashes)"""
+    digits = "".join(ch for ch in phone or "" if ch.isdigit())
+    return (shard_router.current(), digits) if digits else None
+
+async def limit_request(request: Request, user_id: Optional[str] = None, phone: Optional[str] = None,
+                        by_address: bool = True):
+    """Apply the ingestion rate limits to one request; raises 429 when over them"""
+    retry_after = await ratelimit.admit([
+        (visitor_limits, (shard_router.current(), user_id) if user_id else None),
+        (ip_limits, client_address(request) if by_address else None),
+        (phone_limits, phone_key(phone)),
+    ])
+    if retry_after:
+        raise HTTPException(status_code=429, detail="Too many requests",
+                            headers={"Retry-After": str(math.ceil(retry_after))})
+
+# Only the worker holding this lease runs escalation / archive / other periodic jobs
+job_leader = lease.Lease("background-jobs", DB_PATH)
 
 # ========================
 # WebSocket Authentication
@@ -415,8 +1116,10 @@ async def get_websocket_token(
     IMPORTANT: This function accepts the websocket connection before validation
     to allow proper error handling and connection closure.
     """
+    from jose import jwt
+
     # Accept the connection first (required before we can close it)
-    await websocket.accept()
+    await websocket.accept(subprotocol=codec.negotiate_subprotocol(websocket))
 
     if token is None:
         logging.warning("[WebSocket] Connection attempt without token")
@@ -453,16 +1156,54 @@ async def get_websocket_token(
 # ========================
 # Routes
 # ========================
+def warm_static_and_imports():
+    """Build static asset variants and import what the first login needs (jose, bcrypt)"""
+    for files in static_mounts:
+        logging.info(f"Static assets ready: {files.warm()} files from {files.directory}")
+    from jose import jwt  # noqa: F401
+    get_pwd_context()
+    startup.timeline.mark("warmed")
+
 @app.on_event("startup")
 async def startup_tasks():
-    db_init()
+    if not db_init():
+        logging.info(f"Schema version {SCHEMA_VERSION} is current, skipped schema init")
+    startup.timeline.mark("db_init")
     seed_admin_user()
+    unviewed_followups.resync()
+    startup.timeline.mark("seed_admin_user")
+    if FAST_STARTUP:
+        asyncio.create_task(asyncio.to_thread(warm_static_and_imports))
+    else:
+        warm_static_and_imports()
     logging.info("DB initialized, admin user seeded, and escalation loop starting.")
     logging.info(f"Env check: SID={'set' if ACCOUNT_SID else 'missing'}, "
                  f"Token={'set' if AUTH_TOKEN else 'missing'}, "
                  f"Number={TWILIO_NUMBER}, "
                  f"Client={'ready' if twilio_client else 'NONE'}")
+    job_leader.db_path = DB_PATH
+    job_leader.start()
+    asyncio.create_task(routing_loop())
+    asyncio.create_task(followup_count_loop())
     asyncio.create_task(escalation_loop())
+    if AUTO_CLOSE_MINUTES > 0:
+        asyncio.create_task(auto_close_loop())
+    asyncio.create_task(archive_loop())
+    if BACKUP_INTERVAL_HOURS > 0:
+        asyncio.create_task(backup_loop())
+    if MAINTENANCE_INTERVAL_SECONDS > 0:
+        asyncio.create_task(maintenance_loop())
+    events.event_writer.start(DB_PATH, connect=lambda: shard_router.connect(DEFAULT_TENANT_ID))
+    asyncio.create_task(sms_ingest_worker())
+    startup.timeline.mark("startup_complete")
+
+@app.on_event("shutdown")
+async def shutdown_tasks():
+    # Hand background jobs to another worker right away
+    await job_leader.stop()
+    # Persist buffered audit events before the worker exits
+    await events.event_writer.stop()
+    shard_router.close()
 
 @app.get("/")
 def root():
@@ -476,9 +1217,15 @@ def root():
         "admin_login": "/api/v1/auth/login"
     }
 
+@app.api_route("/chatbot.js", methods=["GET", "HEAD"], include_in_schema=False)
+@app.api_route("/chatbot.min.js", methods=["GET", "HEAD"], include_in_schema=False)
+async def chatbot_script(request: Request):
+    return await widget_files.get_response(request.url.path.lstrip("/"), request.scope)
+
 @app.get("/health")
 def health():
-    return {"status": "running", "db": str(DB_PATH), "shifts": [s["name"] for s in SHIFT_ROTA]}
+    return {"status": "running", "db": str(DB_PATH), "shifts": shift_router.shift_names(),
+            "background_jobs": "leader" if job_leader.is_leader else "standby"}
 
 # Admin dashboard - redirect legacy route to new React dashboard
 @app.get("/admin")
@@ -488,29 +1235,42 @@ def admin_dashboard_redirect():
 
 # Admin API
 @app.get("/admin/api/convos", dependencies=[Depends(require_role(["admin", "staff"]))])
-def admin_convos():
-    with db() as conn:
+def admin_convos(request: Request):
+    return cached_response(request, open_convos_payload, "conversations")
+
+def admin_conversation(row) -> dict:
+    """Conversation row as the admin lists show it, without the visitor's delivery cursor or the upsert's token"""
+    convo = dict(row)
+    convo.pop("visitor_delivered_id", None)
+    convo.pop("open_token", None)
+    return convo
+
+def open_convos_payload():
+    with db_read() as conn:
         c = conn.cursor()
-        c.execute("SELECT * FROM conversations WHERE open=1 ORDER BY updated_at DESC")
+        c.execute("""
+            SELECT cv.*, COALESCE(cm.total_messages, 0) AS message_count
+            FROM conversations cv
+            LEFT JOIN conversation_metrics cm ON cm.conversation_id = cv.id
+            WHERE cv.open=1 ORDER BY cv.updated_at_ms DESC
+        """)
         rows = c.fetchall()
 
         conversations = []
         for row in rows:
-            convo = dict(row)
+            convo = admin_conversation(row)
 
-            # Get message count and preview for this conversation
+            # Get message preview for this conversation (count comes from the metrics rollup)
             c.execute("""
-                SELECT COUNT(*) as count,
-                       GROUP_CONCAT(sender || ': ' || text, ' | ') as preview
+                SELECT GROUP_CONCAT(sender || ': ' || text, ' | ') as preview
                 FROM (
                     SELECT sender, text FROM messages
-                    WHERE user_id=? AND channel=?
-                    ORDER BY ts DESC LIMIT 3
+                    WHERE conversation_id=?
+                    ORDER BY id DESC LIMIT 3
                 )
-            """, (convo['user_id'], convo['channel']))
+            """, (convo['id'],))
             msg_data = c.fetchone()
 
-            convo['message_count'] = msg_data['count'] if msg_data else 0
             convo['preview'] = msg_data['preview'] if msg_data and msg_data['preview'] else "No messages yet"
             conversations.append(convo)
 
@@ -519,58 +1279,60 @@ def admin_convos():
 @app.get("/admin/api/messages/{user_id}/{channel}", dependencies=[Depends(require_role(["admin", "staff"]))])
 def get_conversation_messages(user_id: str, channel: str):
     """Fetch all messages for a specific conversation"""
-    with db() as conn:
+    with db_read_tiered() as conn:
         c = conn.cursor()
-        c.execute("""
-            SELECT sender, text, ts
-            FROM messages
-            WHERE user_id=? AND channel=?
-            ORDER BY ts ASC
-        """, (user_id, channel))
-        messages = [dict(row) for row in c.fetchall()]
-
-        # Also get conversation metadata
+        # Conversation metadata first: its id keys the message lookup
         c.execute("""
             SELECT * FROM conversations
             WHERE user_id=? AND channel=?
         """, (user_id, channel))
         convo = c.fetchone()
 
-    return {
+        c.execute("""
+            SELECT sender, text, ts
+            FROM all_messages
+            WHERE conversation_id=?
+            ORDER BY id ASC
+        """, (convo["id"] if convo else None,))
+        messages = [dict(row) for row in c.fetchall()]
+
+    return codec.FastJSONResponse({
         "messages": messages,
-        "conversation": dict(convo) if convo else None
-    }
+        "conversation": admin_conversation(convo) if convo else None
+    })
 
 # ✅ Corrected: merged closed convos + migrated followups
 @app.get("/admin/api/history", dependencies=[Depends(require_role(["admin"]))])
-def admin_history():
-    with db() as conn:
+def admin_history(request: Request):
+    return cached_response(request, history_payload, "conversations", "history")
+
+def history_payload():
+    with db_read() as conn:
         c = conn.cursor()
 
-        # Closed conversations from conversations table (show all fields)
+        # Closed conversations from conversations table (show all fields),
+        # message counts come precomputed from conversation_metrics
         c.execute("""
-            SELECT user_id, channel, assigned_staff, updated_at,
-                   created_at, closed_at, 'conversation' as source,
-                   NULL as name, NULL as email, NULL as phone, NULL as message
-            FROM conversations
-            WHERE open=0
-            ORDER BY updated_at DESC
+            SELECT cv.user_id, cv.channel, cv.assigned_staff, cv.updated_at,
+                   cv.created_at, cv.closed_at, 'conversation' as source,
+                   NULL as name, NULL as email, NULL as phone, NULL as message,
+                   COALESCE(cm.total_messages, 0) as message_count,
+                   COALESCE(cv.updated_at_ms, 0) as sort_ms
+            FROM conversations cv
+            LEFT JOIN conversation_metrics cm ON cm.conversation_id = cv.id
+            WHERE cv.open=0
+            ORDER BY sort_ms DESC
         """)
         convos = [dict(r) for r in c.fetchall()]
 
-        # Count messages for each conversation
-        for convo in convos:
-            c.execute("SELECT COUNT(*) FROM messages WHERE user_id=? AND channel=?",
-                     (convo["user_id"], convo["channel"]))
-            convo["message_count"] = c.fetchone()[0]
-
         # Migrated followups from history table (show all fields)
         c.execute("""
             SELECT id, user_id, channel, name, contact, message,
                    ts as created_at, migrated_at as updated_at, 'followup' as source,
-                   NULL as assigned_staff, NULL as closed_at, 0 as message_count
+                   NULL as assigned_staff, NULL as closed_at, 0 as message_count,
+                   COALESCE(migrated_at_ms, 0) as sort_ms
             FROM history
-            ORDER BY migrated_at DESC
+            ORDER BY sort_ms DESC
         """)
         followup_histories = [dict(r) for r in c.fetchall()]
 
@@ -588,186 +1350,350 @@ def admin_history():
                     elif part.startswith("Phone: "):
                         fh["phone"] = part.replace("Phone: ", "").strip()
 
-    # Combine both lists (no deduplication - show all history)
-    combined = convos + followup_histories
-    combined.sort(key=lambda x: x.get("updated_at", ""), reverse=True)
+    # Combine both lists (no deduplication - show all history); both are already
+    # sorted newest-first on the integer key, so a linear merge is enough
+    combined = list(heapq.merge(convos, followup_histories, key=lambda x: x["sort_ms"], reverse=True))
+    for item in combined:
+        del item["sort_ms"]
 
     return {"history": combined}
 
 @app.get("/admin/api/history/export", dependencies=[Depends(require_role(["admin"]))])
 def export_and_purge_history():
-    cutoff = (datetime.datetime.utcnow() - datetime.timedelta(days=30)).isoformat() + "Z"
-    with db() as conn:
+    cutoff_ms = timestamps.ago_ms(days=30)
+    with db_tiered() as conn:
         c = conn.cursor()
-        c.execute("SELECT * FROM conversations WHERE updated_at < ?", (cutoff,))
+        c.execute("SELECT * FROM conversations WHERE updated_at_ms < ?", (cutoff_ms,))
         convos = [dict(r) for r in c.fetchall()]
-        c.execute("SELECT * FROM messages WHERE ts < ?", (cutoff,))
-        msgs = [dict(r) for r in c.fetchall()]
-        c.execute("DELETE FROM conversations WHERE updated_at < ?", (cutoff,))
-        c.execute("DELETE FROM messages WHERE ts < ?", (cutoff,))
+        ids_json = json.dumps([cv["id"] for cv in convos])
+        msgs = archive.export_and_purge(conn, cutoff_ms, [cv["id"] for cv in convos])
+        search.remove(conn, "message", [m["id"] for m in msgs])
+        # Rows keyed to the purged conversations go in the same transaction, search entries included
+        c.execute("DELETE FROM followups WHERE conversation_id IN (SELECT value FROM json_each(?)) RETURNING *",
+                  (ids_json,))
+        followups = [dict(r) for r in c.fetchall()]
+        search.remove(conn, "followup", [f["id"] for f in followups])
+        c.execute("DELETE FROM history WHERE conversation_id IN (SELECT value FROM json_each(?)) RETURNING *",
+                  (ids_json,))
+        history = [dict(r) for r in c.fetchall()]
+        search.remove(conn, "history", [h["id"] for h in history])
+        c.execute("DELETE FROM conversation_metrics WHERE conversation_id IN (SELECT value FROM json_each(?))",
+                  (ids_json,))
+        c.execute("DELETE FROM conversations WHERE id IN (SELECT value FROM json_each(?))", (ids_json,))
+        respcache.bump(conn)
         conn.commit()
-    return {"conversations": convos, "messages": msgs}
+    unviewed_followups.add(-sum(1 for f in followups if not f["viewed"]))
+    mark_purged()
+    return codec.FastJSONResponse({"conversations": convos, "messages": msgs, "followups": followups,
+                                   "history": history})
 
 @app.post("/admin/api/followups/clear/{fid}")
-def clear_followup(fid: int, user: TokenData = Depends(require_role(["admin"]))):
+async def clear_followup(fid: int, user: TokenData = Depends(require_role(["admin"]))):
+    if not await asyncio.to_thread(migrate_followup, fid):
+        raise HTTPException(status_code=404, detail="Followup not found")
+    await publish_followup_count()
+    return {"status": "migrated", "id": fid}
+
+def migrate_followup(fid: int) -> bool:
+    """Move one followup to history and log it in its thread; False if it doesn't exist"""
     with db() as conn:
         c = conn.cursor()
         # Step 1: fetch followup row
-        c.execute("SELECT id, user_id, channel, name, contact, message, ts FROM followups WHERE id=?", (fid,))
+        c.execute("SELECT id, conversation_id, user_id, channel, name, email, phone, message, ts, ts_ms, viewed FROM followups WHERE id=?", (fid,))
         row = c.fetchone()
         if not row:
-            raise HTTPException(status_code=404, detail="Followup not found")
+            return False
+        contact = f"Email: {row['email'] or 'N/A'}, Phone: {row['phone'] or 'N/A'}"
+        now = timestamps.now_ms()
 
         # Step 2: insert into history (keeping fields consistent)
         c.execute("""
-            INSERT INTO history (user_id, channel, name, contact, message, ts, migrated_at)
-            VALUES (?, ?, ?, ?, ?, ?, ?)
+            INSERT INTO history (conversation_id, user_id, channel, name, contact, message, ts, migrated_at, migrated_at_ms)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
         """, (
+            row["conversation_id"],
             row["user_id"],
             row["channel"],
             row["name"],
-            row["contact"],
+            contact,
             row["message"],
             row["ts"],
-            datetime.datetime.utcnow().isoformat()+"Z"
+            timestamps.to_iso(now),
+            now
         ))
+        search.index_history(conn, c.lastrowid, shard_router.current(), row["user_id"], row["channel"],
+                             row["name"], contact, row["message"], row["ts"])
 
         # Step 2b: also log followup in messages so it appears in history threads
+        followup_text = f"Follow-up submitted:\nName: {row['name']}\nContact: {contact}\nMessage: {row['message']}"
         c.execute("""
-            INSERT INTO messages (user_id, channel, sender, text, ts)
-            VALUES (?, ?, ?, ?, ?)
+            INSERT INTO messages (conversation_id, user_id, channel, sender, text, ts, ts_ms)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
         """, (
+            row["conversation_id"],
             row["user_id"],
             row["channel"],
             "system",
-            f"Follow-up submitted:\nName: {row['name']}\nContact: {row['contact']}\nMessage: {row['message']}",
-            row["ts"]
+            followup_text,
+            row["ts"],
+            row["ts_ms"]
         ))
+        search.index_message(conn, c.lastrowid, shard_router.current(), row["user_id"], row["channel"],
+                             followup_text, row["ts"])
 
         # Step 3: delete from followups
         c.execute("DELETE FROM followups WHERE id=?", (fid,))
+        search.remove(conn, "followup", [fid])
+        respcache.bump(conn, "conversations", "followups", "history")
         conn.commit()
 
-    return {"status": "migrated", "id": fid}
+    if not row["viewed"]:
+        unviewed_followups.add(-1)
+    return True
+
+@app.get("/admin/api/search")
+def admin_search(
+    q: str,
+    source: Optional[str] = None,
+    page: int = Query(default=1, ge=1),
+    page_size: int = Query(default=20, ge=1, le=100),
+    user: TokenData = Depends(require_role(["admin", "staff"])),
+):
+    """Ranked full-text search over messages, followups and history for the caller's tenant"""
+    sources = [s.strip() for s in source.split(",")] if source else list(search.SOURCE_CODES)
+    unknown = [s for s in sources if s not in search.SOURCE_CODES]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown source: {', '.join(unknown)}")
+    # Followups and history are admin-only elsewhere in the API
+    if user.role != "admin":
+        sources = [s for s in sources if s == "message"]
+        if not sources:
+            raise HTTPException(status_code=403, detail="Forbidden")
+
+    with db_read() as conn:
+        # Rows are indexed under their shard's tenant (the default one for every tenant with TENANT_SHARDS=0)
+        results, has_more = search.search(conn, q, shard_router.current(), sources,
+                                          limit=page_size, offset=(page - 1) * page_size)
+    return codec.FastJSONResponse({"results": results, "page": page, "page_size": page_size, "has_more": has_more})
 
 @app.get("/admin/api/escalated", dependencies=[Depends(require_role(["admin", "staff"]))])
-def admin_escalated():
-    with db() as conn:
+def admin_escalated(request: Request):
+    return cached_response(request, escalated_payload, "conversations")
+
+def escalated_payload():
+    with db_read() as conn:
         c = conn.cursor()
-        c.execute("SELECT * FROM conversations WHERE open=1 AND final_sent=1 ORDER BY updated_at DESC")
+        c.execute("SELECT * FROM conversations WHERE open=1 AND final_sent=1 ORDER BY updated_at_ms DESC")
         rows = c.fetchall()
-    return {"conversations": [dict(r) for r in rows]}
+    return {"conversations": [admin_conversation(r) for r in rows]}
 
 @app.get("/admin/api/followups", dependencies=[Depends(require_role(["admin"]))])
-def admin_followups():
-    with db() as conn:
+def admin_followups(request: Request):
+    return cached_response(request, followups_payload, "followups")
+
+def followups_payload():
+    with db_read() as conn:
         c = conn.cursor()
-        c.execute("SELECT * FROM followups ORDER BY ts DESC LIMIT 200")
+        c.execute("SELECT * FROM followups ORDER BY ts_ms DESC LIMIT 200")
         rows = c.fetchall()
     return {"followups": [dict(r) for r in rows]}
 
 @app.get("/admin/api/conversations", dependencies=[Depends(require_role(["admin", "staff"]))])
-def admin_conversations(status: str = "open"):
+def admin_conversations(request: Request, status: str = "open"):
     """Get conversations filtered by status (open, escalated, closed)"""
-    with db() as conn:
-        c = conn.cursor()
-
-        if status == "open":
-            # Get open conversations that are NOT escalated
-            c.execute("""
-                SELECT * FROM conversations
-                WHERE open=1 AND final_sent=0
-                ORDER BY updated_at DESC
-            """)
-        elif status == "escalated":
-            # Get escalated conversations (open AND final_sent=1)
-            c.execute("""
-                SELECT * FROM conversations
-                WHERE open=1 AND final_sent=1
-                ORDER BY updated_at DESC
-            """)
-        elif status == "closed":
-            # Get closed conversations
-            c.execute("""
-                SELECT * FROM conversations
-                WHERE open=0
-                ORDER BY updated_at DESC LIMIT 100
-            """)
-        else:
-            # Default: all open conversations
-            c.execute("""
-                SELECT * FROM conversations
-                WHERE open=1
-                ORDER BY updated_at DESC
-            """)
+    return cached_response(request, lambda: conversations_payload(status), "conversations")
 
-        rows = c.fetchall()
-        conversations = [dict(r) for r in rows]
+def conversations_payload(status: str):
+    where = {
+        "open": "cv.open=1 AND cv.final_sent=0",          # open conversations that are NOT escalated
+        "escalated": "cv.open=1 AND cv.final_sent=1",     # escalated (open AND final_sent=1)
+        "closed": "cv.open=0",                            # closed conversations
+    }.get(status, "cv.open=1")                            # default: all open conversations
+    limit = " LIMIT 100" if status == "closed" else ""
 
-        # Add message count for each conversation
-        for convo in conversations:
-            c.execute("""
-                SELECT COUNT(*) FROM messages
-                WHERE user_id=? AND channel=?
-            """, (convo["user_id"], convo["channel"]))
-            convo["message_count"] = c.fetchone()[0]
+    with db_read() as conn:
+        c = conn.cursor()
+        # Message count comes precomputed from conversation_metrics
+        c.execute(f"""
+            SELECT cv.*, COALESCE(cm.total_messages, 0) AS message_count
+            FROM conversations cv
+            LEFT JOIN conversation_metrics cm ON cm.conversation_id = cv.id
+            WHERE {where}
+            ORDER BY cv.updated_at_ms DESC{limit}
+        """)
+        conversations = [admin_conversation(r) for r in c.fetchall()]
 
     return {"conversations": conversations}
 
+def stats_totals(conn, since_ms: int) -> dict:
+    c = conn.cursor()
+    c.execute("""
+        SELECT COUNT(*) AS conversations,
+               COALESCE(SUM(total_messages), 0) AS total_messages,
+               COALESCE(SUM(user_messages), 0) AS user_messages,
+               COALESCE(SUM(staff_messages), 0) AS staff_messages,
+               COALESCE(SUM(system_messages), 0) AS system_messages,
+               COALESCE(SUM(escalation_count), 0) AS escalations,
+               AVG(first_response_seconds) AS avg_first_response_seconds,
+               AVG(duration_seconds) AS avg_duration_seconds
+        FROM conversation_metrics
+        WHERE updated_at_ms >= ?
+    """, (since_ms,))
+    totals = dict(c.fetchone())
+    c.execute("SELECT COUNT(*) FROM conversations WHERE open=1")
+    totals["open"] = c.fetchone()[0]
+    c.execute("SELECT COUNT(*) FROM conversations WHERE open=1 AND final_sent=1")
+    totals["escalated_open"] = c.fetchone()[0]
+    return totals
+
+@app.get("/admin/api/stats", dependencies=[Depends(require_role(["admin", "staff"]))])
+def admin_stats(days: int = Query(default=7, ge=1, le=365)):
+    """Dashboard totals read from the precomputed conversation_metrics rollup"""
+    since_ms = timestamps.ago_ms(days=days)
+    with db_read() as conn:
+        totals = stats_totals(conn, since_ms)
+    return {"days": days, "stats": totals, "auto_close": auto_close_stats, "response_cache": response_cache.stats,
+            "startup": startup.timeline.summary()}
+
+def require_global_admin(user: TokenData = Depends(require_role(["admin"]))) -> TokenData:
+    """Store-wide operations are limited to admins of the default tenant"""
+    if user.tenant_id != DEFAULT_TENANT_ID:
+        raise HTTPException(status_code=403, detail="Forbidden")
+    return user
+
+@app.get("/admin/api/stats/global", dependencies=[Depends(require_global_admin)])
+def admin_global_stats(days: int = Query(default=7, ge=1, le=365)):
+    """Totals per tenant shard and summed over all of them"""
+    since_ms = timestamps.ago_ms(days=days)
+    per_tenant = shard_router.each(lambda conn: stats_totals(conn, since_ms))
+
+    totals = {}
+    for stats in per_tenant.values():
+        for key, value in stats.items():
+            if key.startswith("avg_"):
+                continue
+            totals[key] = totals.get(key, 0) + value
+    # Averages weighted by each shard's conversation count
+    for key in ("avg_first_response_seconds", "avg_duration_seconds"):
+        weighted = [(s[key], s["conversations"]) for s in per_tenant.values() if s[key] is not None]
+        weight = sum(n for _, n in weighted)
+        totals[key] = sum(v * n for v, n in weighted) / weight if weight else None
+    return {"days": days, "stats": totals, "tenants": per_tenant, "pools": shard_router.stats()}
+
+@app.get("/admin/api/backups", dependencies=[Depends(require_global_admin)])
+def admin_backups():
+    return {"snapshots": backup.list_snapshots(backup_service.directory), "stats": backup_service.stats}
+
+@app.post("/admin/api/backups", dependencies=[Depends(require_global_admin)])
+async def admin_create_backup():
+    """Take a snapshot now (restores are done offline with `python backup.py restore`)"""
+    try:
+        manifest = await asyncio.to_thread(backup_service.create, backup.store_files(DB_PATH))
+    except RuntimeError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return manifest
+
+@app.get("/admin/api/maintenance", dependencies=[Depends(require_global_admin)])
+def admin_maintenance():
+    return {"files": maintenance_files(), "stats": maintainer.stats}
+
+@app.get("/admin/api/connections", dependencies=[Depends(require_global_admin)])
+def admin_connections_stats():
+    """This worker's sockets: visitor lifecycle metrics (see liveness.py) and routing table sizes"""
+    return {
+        "visitors": visitor_sockets.metrics(),
+        "conversations": sum(len(convos) for convos in ws_manager.connections.values()),
+        "unbound": sum(len(group) for group in ws_manager.unbound.values()),
+        "admin_sockets": len(admin_connections),
+        "rate_limits": {"overload": ratelimit.RATE_LIMIT_OVERLOAD, "visitor": visitor_limits.metrics(),
+                        "ip": ip_limits.metrics(), "phone": phone_limits.metrics(),
+                        "typing": typing_limits.metrics()},
+    }
+
+@app.post("/admin/api/maintenance", dependencies=[Depends(require_global_admin)])
+async def admin_run_maintenance():
+    """Run a pass on every shard now, regardless of traffic (still time-boxed)"""
+    reports = {}
+    try:
+        for tenant_id in await asyncio.to_thread(shard_router.tenants):
+            reports[tenant_id] = await asyncio.to_thread(maintenance_pass, tenant_id, True)
+    except RuntimeError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return {"passes": reports, "files": await asyncio.to_thread(maintenance_files)}
+
+@app.get("/admin/api/stats/agents", dependencies=[Depends(require_role(["admin"]))])
+def admin_agent_stats(days: int = Query(default=7, ge=1, le=365)):
+    """Per-staff daily rollups from agent_metrics"""
+    since = timestamps.to_iso(timestamps.ago_ms(days=days))[:10]
+    with db_read() as conn:
+        c = conn.cursor()
+        c.execute("""
+            SELECT staff_id, date, total_chats, closed_chats, avg_response_seconds, avg_duration_seconds
+            FROM agent_metrics
+            WHERE date >= ?
+            ORDER BY date DESC, staff_id
+        """, (since,))
+        rows = [dict(r) for r in c.fetchall()]
+    # Users live in the primary database, not in the tenant shard
+    with shard_router.read(DEFAULT_TENANT_ID) as conn:
+        users = {r["id"]: r for r in conn.execute(
+            "SELECT id, name, email FROM users WHERE id IN (SELECT value FROM json_each(?))",
+            (json.dumps(sorted({r["staff_id"] for r in rows if r["staff_id"] is not None})),))}
+    for r in rows:
+        u = users.get(r["staff_id"])
+        r["name"], r["email"] = (u["name"], u["email"]) if u else (None, None)
+    return {"days": days, "agents": rows}
+
 @app.get("/admin/api/followups/unviewed-count", dependencies=[Depends(require_role(["admin"]))])
 def admin_followups_unviewed_count():
-    """Get count of unviewed followups for notification badge"""
-    with db() as conn:
-        c = conn.cursor()
-        c.execute("SELECT COUNT(*) FROM followups WHERE viewed = 0")
-        count = c.fetchone()[0]
-    return {"count": count}
+    """Get count of unviewed followups for notification badge (dashboards get followup_count pushes)"""
+    return {"count": unviewed_followups.count}
 
 @app.post("/admin/api/followups/{followup_id}/mark-viewed", dependencies=[Depends(require_role(["admin"]))])
-def mark_followup_viewed(followup_id: int):
+async def mark_followup_viewed(followup_id: int):
     """Mark a followup as viewed when admin opens it"""
-    with db() as conn:
-        c = conn.cursor()
-        c.execute("UPDATE followups SET viewed = 1 WHERE id = ?", (followup_id,))
-        conn.commit()
+    if await asyncio.to_thread(mark_followups_viewed, [followup_id]):
+        await publish_followup_count()
     return {"success": True, "id": followup_id}
 
+@app.post("/admin/api/followups/mark-viewed-bulk", dependencies=[Depends(require_role(["admin"]))])
+async def mark_followups_viewed_bulk(data: BulkFollowupSchema):
+    """Mark many followups as viewed in one statement"""
+    marked = await asyncio.to_thread(mark_followups_viewed, data.ids)
+    if marked:
+        await broadcast_admin({"type": "followups_viewed", "ids": marked})
+        await publish_followup_count()
+    return {"success": True, "marked": len(marked), "ids": marked}
+
 @app.delete("/admin/api/followups/{followup_id}", dependencies=[Depends(require_role(["admin"]))])
-def delete_followup(followup_id: int):
+async def delete_followup(followup_id: int):
     """Archive a followup to history instead of deleting"""
-    with db() as conn:
-        c = conn.cursor()
-        # Get the followup data
-        c.execute("SELECT user_id, channel, name, email, phone, message, ts FROM followups WHERE id = ?", (followup_id,))
-        row = c.fetchone()
-
-        if row:
-            # Archive to history table
-            contact = f"Email: {row[3] or 'N/A'}, Phone: {row[4] or 'N/A'}"
-            c.execute(
-                "INSERT INTO history (user_id, channel, name, contact, message, ts, migrated_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
-                (row[0], row[1], row[2], contact, row[5], row[6], datetime.datetime.utcnow().isoformat() + "Z")
-            )
-
-            # Remove from followups
-            c.execute("DELETE FROM followups WHERE id = ?", (followup_id,))
-            conn.commit()
-            return {"success": True, "id": followup_id, "archived": True}
-        else:
-            raise HTTPException(status_code=404, detail="Followup not found")
+    if not await asyncio.to_thread(archive_followups, [followup_id]):
+        raise HTTPException(status_code=404, detail="Followup not found")
+    await publish_followup_count()
+    return {"success": True, "id": followup_id, "archived": True}
+
+@app.post("/admin/api/followups/archive-bulk", dependencies=[Depends(require_role(["admin"]))])
+async def archive_followups_bulk(data: BulkFollowupSchema):
+    """Archive many followups to history in one transaction"""
+    archived = await asyncio.to_thread(archive_followups, data.ids)
+    if archived:
+        await broadcast_admin({"type": "followups_archived", "ids": archived})
+        await publish_followup_count()
+    return {"success": True, "archived": len(archived), "total": len(data.ids), "ids": archived}
 
 @app.get("/admin/api/history/export", dependencies=[Depends(require_role(["admin"]))])
 def export_history(days: int = None):
     """Export history records. If days specified, only exports records from last N days."""
-    with db() as conn:
+    with db_read() as conn:
         c = conn.cursor()
         if days:
-            cutoff_date = (datetime.datetime.utcnow() - datetime.timedelta(days=days)).isoformat() + "Z"
-            c.execute("SELECT * FROM history WHERE migrated_at >= ? ORDER BY migrated_at DESC", (cutoff_date,))
+            c.execute("SELECT * FROM history WHERE migrated_at_ms >= ? ORDER BY migrated_at_ms DESC",
+                      (timestamps.ago_ms(days=days),))
         else:
-            c.execute("SELECT * FROM history ORDER BY migrated_at DESC")
+            c.execute("SELECT * FROM history ORDER BY migrated_at_ms DESC")
         rows = c.fetchall()
-    return {"history": [dict(r) for r in rows], "count": len(rows)}
+    return codec.FastJSONResponse({"history": [dict(r) for r in rows], "count": len(rows)})
 
 @app.post("/admin/api/history/export-and-delete", dependencies=[Depends(require_role(["admin"]))])
 def export_and_delete_history():
@@ -776,39 +1702,52 @@ def export_and_delete_history():
         c = conn.cursor()
 
         # Get all history for export
-        c.execute("SELECT * FROM history ORDER BY migrated_at DESC")
+        c.execute("SELECT * FROM history ORDER BY migrated_at_ms DESC")
         all_history = [dict(r) for r in c.fetchall()]
 
         # Delete records older than 30 days
-        cutoff_date = (datetime.datetime.utcnow() - datetime.timedelta(days=30)).isoformat() + "Z"
-        c.execute("DELETE FROM history WHERE migrated_at < ?", (cutoff_date,))
+        cutoff_ms = timestamps.ago_ms(days=30)
+        c.execute("SELECT id FROM history WHERE migrated_at_ms < ?", (cutoff_ms,))
+        search.remove(conn, "history", [r["id"] for r in c.fetchall()])
+        c.execute("DELETE FROM history WHERE migrated_at_ms < ?", (cutoff_ms,))
         deleted_count = c.rowcount
+        respcache.bump(conn, "history")
         conn.commit()
+    if deleted_count:
+        mark_purged()
 
-    return {
+    return codec.FastJSONResponse({
         "success": True,
         "history": all_history,
         "total_exported": len(all_history),
         "deleted_count": deleted_count
-    }
+    })
 
 @app.get("/admin/api/messages/{channel}/{user_id}", dependencies=[Depends(require_role(["admin", "staff"]))])
 def admin_messages(channel: str, user_id: str):
-    return get_messages(user_id, channel)
+    return codec.FastJSONResponse(get_messages(user_id, channel))
 
 
-@app.post("/admin/api/send")
-async def admin_send(msg: AdminSendSchema, user: TokenData = Depends(require_role(["admin", "staff"]))):
-    add_message(msg.user_id, msg.channel, "staff", msg.text)
+def store_staff_reply(user_id: str, channel: str, text: str, staff_id: int) -> Tuple[Optional[int], Optional[int], str]:
+    """Stop escalation and store a staff reply; returns (conversation_id, message_id, ts)"""
+    now = timestamps.now_ms()
     # Terminate escalation completely when staff replies
     with db() as conn:
-        conn.execute("UPDATE conversations SET escalation_active=0, final_sent=0, patience_sent=0 WHERE user_id=? AND channel=?",
-                     (msg.user_id, msg.channel))
+        convo = conn.execute("UPDATE conversations SET escalation_active=0, final_sent=0, patience_sent=0 WHERE user_id=? AND channel=? RETURNING id",
+                             (user_id, channel)).fetchone()
         conn.commit()
+    conversation_id = convo["id"] if convo else None
+    message_id = add_message(user_id, channel, "staff", text, staff_id=staff_id, conversation_id=conversation_id,
+                             now=now)
+    return conversation_id, message_id, timestamps.to_iso(now)
+
+@app.post("/admin/api/send")
+async def admin_send(msg: AdminSendSchema, user: TokenData = Depends(require_role(["admin", "staff"]))):
+    conversation_id, message_id, ts = await asyncio.to_thread(store_staff_reply, msg.user_id, msg.channel,
+                                                              msg.text, user.id)
 
-    await push_with_admin(msg.user_id, msg.channel,
-                          {"sender": "staff", "text": msg.text,
-                           "ts": datetime.datetime.utcnow().isoformat() + "Z"})
+    await push_with_admin(conversation_id, msg.user_id, msg.channel,
+                          {"id": message_id, "sender": "staff", "text": msg.text, "ts": ts})
 
     # Forward to Twilio if SMS/WhatsApp, with normalization + debug logging
     if twilio_client:
@@ -820,42 +1759,60 @@ async def admin_send(msg: AdminSendSchema, user: TokenData = Depends(require_rol
                         to_number = f"whatsapp:{msg.user_id}"
                     else:
                         to_number = msg.user_id
-                    from_number = f"whatsapp:{TWILIO_NUMBER}"
+                    from_number = f"whatsapp:{await asyncio.to_thread(tenant_sms_number)}"
                 else:
                     to_number = msg.user_id
-                    from_number = TWILIO_NUMBER
+                    from_number = await asyncio.to_thread(tenant_sms_number)
 
                 logging.info(f"Sending via Twilio: from={from_number}, to={to_number}, body={msg.text}")
-                twilio_client.messages.create(
-                    body=msg.text,
-                    from_=from_number,
-                    to=to_number
-                )
+                await asyncio.to_thread(twilio_client.messages.create, body=msg.text, from_=from_number, to=to_number)
             except Exception as e:
                 logging.exception(f"Twilio send failed with exception: {repr(e)}")
 
     return {"status": "ok"}
 
 
-@app.post("/followup")
-async def followup_submit(data: FollowupSchema):
-    ts = datetime.datetime.utcnow().isoformat() + "Z"
+def store_followup(data: FollowupSchema) -> Tuple[Optional[int], Optional[int], str]:
+    """
+    Store a followup, close its conversation and add the thank-you message.
+    Returns (conversation_id, thanks_message_id, ts).
+    """
+    now = timestamps.now_ms()
+    ts = timestamps.to_iso(now)
     # write to followups
     with db() as conn:
-        conn.execute(
-            "INSERT INTO followups (user_id, channel, name, email, phone, message, ts) VALUES (?,?,?,?,?,?,?)",
-            (data.user_id, data.channel, data.name, data.email, data.phone, data.message, ts),
+        convo = conn.execute("SELECT id FROM conversations WHERE user_id=? AND channel=?",
+                             (data.user_id, data.channel)).fetchone()
+        conversation_id = convo["id"] if convo else None
+        cur = conn.execute(
+            "INSERT INTO followups (conversation_id, user_id, channel, name, email, phone, message, ts, ts_ms) VALUES (?,?,?,?,?,?,?,?,?)",
+            (conversation_id, data.user_id, data.channel, data.name, data.email, data.phone, data.message, ts, now),
         )
+        search.index_followup(conn, cur.lastrowid, shard_router.current(), data.user_id, data.channel,
+                              data.name, data.email, data.phone, data.message, ts)
         # close the conversation so escalation loop won't re-fire
-        conn.execute("UPDATE conversations SET open=0, updated_at=? WHERE user_id=? AND channel=?",
-                     (ts, data.user_id, data.channel))
+        closed = conn.execute("UPDATE conversations SET open=0, updated_at=?, updated_at_ms=? WHERE id=? AND open=1 RETURNING id, assigned_staff",
+                              (ts, now, conversation_id)).fetchall()
+        metrics.record_close(conn, [r["id"] for r in closed], now)
+        respcache.bump(conn, "conversations", "followups")
         conn.commit()
-
+    for r in closed:
+        shift_router.release(r["assigned_staff"])
     # thank-you system message goes to history
-    add_message(data.user_id, data.channel, "system", "✅ Thank you for your message. Our team will respond promptly.")
+    thanks_id = add_message(data.user_id, data.channel, "system", "✅ Thank you for your message. Our team will respond promptly.",
+                            conversation_id=conversation_id)
+    return conversation_id, thanks_id, ts
+
+@app.post("/followup")
+async def followup_submit(data: FollowupSchema, request: Request):
+    await limit_request(request, data.user_id, data.phone)
+    conversation_id, thanks_id, ts = await asyncio.to_thread(store_followup, data)
+    unviewed_followups.add(1)
+    await publish_followup_count()
 
     # push to visitor
-    await ws_manager.push(data.user_id, data.channel, {
+    await ws_manager.push(conversation_id, {
+        "id": thanks_id,
         "sender": "system",
         "text": "✅ Thank you for your message. Our team will respond promptly.",
         "ts": ts
@@ -863,7 +1820,7 @@ async def followup_submit(data: FollowupSchema):
 
     # notify admin dashboards
     await push_with_admin(
-        data.user_id, data.channel,
+        conversation_id, data.user_id, data.channel,
         {"sender": "system", "text": f"[Follow-up submitted by visitor]", "ts": ts}
     )
     return {"status": "ok"}
@@ -874,37 +1831,31 @@ def handoff_close(data: StartHandoffSchema, user: TokenData = Depends(require_ro
     return {"status": "closed"}
 
 @app.post("/handoff/close-bulk")
-def handoff_close_bulk(data: BulkCloseSchema, user: TokenData = Depends(require_role(["admin", "staff"]))):
+async def handoff_close_bulk(data: BulkCloseSchema, user: TokenData = Depends(require_role(["admin", "staff"]))):
     """Close multiple conversations at once"""
-    logging.info(f"[BULK CLOSE] Received request to close {len(data.conversations)} conversations")
-    closed_count = 0
-    errors = []
-    
+    targets, errors = [], []
     for convo in data.conversations:
-        try:
-            user_id = convo.get("user_id")
-            channel = convo.get("channel", "webchat")
-            
-            logging.info(f"[BULK CLOSE] Processing: user_id={user_id}, channel={channel}")
-            
-            if user_id:
-                set_assignment(user_id, channel, None, False)
-                closed_count += 1
-                logging.info(f"[BULK CLOSE] Successfully closed: {user_id} on {channel}")
-            else:
-                logging.warning(f"[BULK CLOSE] Skipping conversation with no user_id: {convo}")
-        except Exception as e:
-            error_msg = f"Failed to close {convo.get('user_id')}: {str(e)}"
-            logging.error(f"[BULK CLOSE] {error_msg}")
-            errors.append(error_msg)
-    
+        if convo.get("user_id"):
+            targets.append((convo["user_id"], convo.get("channel", "webchat")))
+        else:
+            errors.append(f"Skipping conversation with no user_id: {convo}")
+
+    closed = await asyncio.to_thread(close_conversations, targets) if targets else []
+    if closed:
+        await broadcast_admin({
+            "type": "conversations_closed",
+            "reason": "staff",
+            "conversations": [{"user_id": r["user_id"], "channel": r["channel"]} for r in closed],
+            "ts": timestamps.now_iso(),
+        })
+
     result = {
         "status": "ok",
-        "closed": closed_count,
+        "closed": len(closed),
         "total": len(data.conversations),
         "errors": errors if errors else None
     }
-    logging.info(f"[BULK CLOSE] Result: {result}")
+    logging.info(f"[BULK CLOSE] {user.email}: closed {len(closed)}/{len(data.conversations)} conversations")
     return result
 
 # Webchat
@@ -912,88 +1863,292 @@ def handoff_close_bulk(data: BulkCloseSchema, user: TokenData = Depends(require_
 def webchat_check():
     return {"status": "ok"}
 
-@app.post("/webchat")
-async def webchat_post(msg: PostMessageSchema):
-    channel = msg.channel or "webchat"
-
-    is_new_conversation = ensure_conversation(msg.user_id, channel)
-    add_message(msg.user_id, channel, "user", msg.text)
+def store_inbound_message(user_id: str, channel: str, text: str, external_id: Optional[str] = None,
+                          now: Optional[int] = None):
+    """
+    Persist one inbound visitor message received at ``now`` (epoch ms): the
+    message, the conversation upsert and the rollups commit together in one
+    writer transaction.
+    A created or reopened conversation is routed once that has committed.
+    Returns (message_id, conversation_id, is_new_conversation, assignment);
+    message_id is None for a duplicate external_id, and assignment is
+    route_conversation's result for notify_assignee.
+    """
+    now = now or timestamps.now_ms()
+    with db() as conn:
+        # Insert first so a duplicate delivery never touches (or reopens) the conversation
+        message_id = insert_message(conn, None, user_id, channel, "user", text, now, external_id=external_id)
+        if message_id is None:
+            return None, None, False, None
+        conversation_id, opened = upsert_conversation(conn, user_id, channel, now)
+        conn.execute("UPDATE messages SET conversation_id=? WHERE id=?", (conversation_id, message_id))
+        # First message ever: exact even when two first messages race, unlike a prior SELECT
+        is_new_conversation = metrics.record_message(conn, conversation_id, shard_router.current(), "user", now) == 1
+        respcache.bump(conn, "conversations")
+    assignment = route_conversation(conversation_id) if opened else None
+    return message_id, conversation_id, is_new_conversation, assignment
+
+async def ingest_webchat_message(user_id: str, channel: str, text: str, client_id: Optional[str] = None) -> Optional[int]:
+    """
+    Shared ingestion path for webchat messages arriving over HTTP POST or the visitor socket.
+    Returns the stored message id, or None if client_id was already ingested.
+    """
+    external_id = f"webchat:{user_id}:{client_id}" if client_id else None
+    now = timestamps.now_ms()
+    message_id, conversation_id, is_new_conversation, assignment = await asyncio.to_thread(
+        store_inbound_message, user_id, channel, text, external_id, now)
+    if message_id is None:
+        logging.info(f"[webchat] Duplicate client message {client_id} from {user_id} ignored")
+        return None
+    ws_manager.bind(user_id, channel, conversation_id)
 
     # Broadcast the actual user message to admin dashboards
-    await push_with_admin(msg.user_id, channel, {
+    await push_with_admin(conversation_id, user_id, channel, {
+        "id": message_id,
         "sender": "user",
-        "text": msg.text,
-        "ts": datetime.datetime.utcnow().isoformat() + "Z"
+        "text": text,
+        "ts": timestamps.to_iso(now)
     })
-    # Send push notifications to admin mobile apps
-    await notify_admins_new_message(msg.user_id, channel, msg.text)
-
 
     # Send push notifications to admin mobile apps
-    await notify_admins_new_message(msg.user_id, channel, msg.text)
+    await notify_admins_new_message(user_id, channel, text)
+    await notify_assignee(assignment)
 
     # Send greeting ONLY on first message ever
     if is_new_conversation:
         auto_msg = "Connecting you with a staff member, please wait..."
-        await ws_manager.push(msg.user_id, channel, {
+        await ws_manager.push(conversation_id, {
             "sender": "system",
             "text": auto_msg,
-            "ts": datetime.datetime.utcnow().isoformat() + "Z"
+            "ts": timestamps.now_iso()
         })
+    return message_id
 
+@app.post("/webchat")
+async def webchat_post(msg: PostMessageSchema, request: Request):
+    await limit_request(request, msg.user_id)
+    channel = msg.channel or "webchat"
+    await ingest_webchat_message(msg.user_id, channel, msg.text, msg.client_id)
     return {"status": "ok"}
 
 
 # Twilio SMS webhook
+class RecentIds:
+    """Bounded LRU set of provider message ids recently stored"""
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self._ids: "OrderedDict[str, None]" = OrderedDict()
+
+    def __contains__(self, key: str) -> bool:
+        if key in self._ids:
+            self._ids.move_to_end(key)
+            return True
+        return False
+
+    def add(self, key: str):
+        """Remember key; only once its message is stored, so a failed attempt is retried in full"""
+        self._ids[key] = None
+        self._ids.move_to_end(key)
+        if len(self._ids) > self.maxsize:
+            self._ids.popitem(last=False)
+
+recent_sms_sids = RecentIds(SMS_RECENT_SID_CACHE)
+sms_ingest_queue: asyncio.Queue = asyncio.Queue(maxsize=SMS_INGEST_QUEUE_MAX)
+
+async def ingest_inbound_sms(user_id: str, channel: str, text: str, message_sid: Optional[str]):
+    external_id = f"twilio:{message_sid}" if message_sid else None
+    now = timestamps.now_ms()
+    message_id, conversation_id, _, assignment = await asyncio.to_thread(store_inbound_message, user_id, channel,
+                                                                         text, external_id, now)
+    if message_sid:
+        recent_sms_sids.add(message_sid)
+    if message_id is None:
+        logging.info(f"[sms] Duplicate MessageSid {message_sid} ignored")
+        return
+    await push_with_admin(conversation_id, user_id, channel,
+                          {"id": message_id, "sender": "user", "text": text, "ts": timestamps.to_iso(now)})
+    await notify_assignee(assignment)
+
+async def sms_ingest_worker():
+    while True:
+        item = await sms_ingest_queue.get()
+        try:
+            tenant_id, *message = item
+            for attempt in range(1, SMS_INGEST_ATTEMPTS + 1):
+                try:
+                    with shards.use_tenant(tenant_id):
+                        await ingest_inbound_sms(*message)
+                    break
+                except Exception as e:
+                    if attempt == SMS_INGEST_ATTEMPTS:
+                        # Twilio already has its 200: log the whole message so it can be recovered by hand
+                        logging.exception(f"Error ingesting inbound SMS, giving up: {item!r}", exc_info=e)
+                    else:
+                        logging.warning(f"[sms] Ingest attempt {attempt} failed ({e!r}), retrying")
+                        await asyncio.sleep(0.5 * 2 ** attempt)
+        finally:
+            sms_ingest_queue.task_done()
+
 @app.post("/sms")
 async def sms_webhook(
     request: Request,
     From: str = Form(...),
-    Body: str = Form(...)
+    Body: str = Form(...),
+    MessageSid: Optional[str] = Form(None),
+    To: Optional[str] = Form(None),
 ):
+    # The tenant is the one whose number was texted; other numbers (e.g. TWILIO_NUMBER) are the default tenant's
+    tenant_id = await shard_router.resolve_tenant("sms_number", (To or "").removeprefix("whatsapp:"))
+    with shards.use_tenant(tenant_id or DEFAULT_TENANT_ID):
+        return await receive_sms(request, From, Body, MessageSid)
+
+async def receive_sms(request: Request, From: str, Body: str, MessageSid: Optional[str]):
     user_id = From
     channel = "whatsapp" if From.startswith("whatsapp:") else "sms"
     text = Body.strip()
 
-    ensure_conversation(user_id, channel)
-    add_message(user_id, channel, "user", text)
+    from twilio.twiml.messaging_response import MessagingResponse
+
+    # Twilio retries on timeout: acknowledge messages already stored without replying again.
+    # Checked before the rate limit, so retries don't spend the sender's tokens.
+    if MessageSid and MessageSid in recent_sms_sids:
+        logging.info(f"[sms] Retry for {MessageSid} acknowledged")
+        return PlainTextResponse(str(MessagingResponse()), media_type="application/xml")
+
+    # Keyed on the sender only: every number reaches us from Twilio's shared addresses
+    await limit_request(request, phone=From, by_address=False)
 
-    await push_with_admin(user_id, channel,
-                          {"sender": "user", "text": text,
-                           "ts": datetime.datetime.utcnow().isoformat() + "Z"})
+    # Fast-ack: persistence and broadcast happen in sms_ingest_worker.
+    # If the queue is saturated, fall back to processing inline rather than dropping;
+    # an error there fails the webhook, and Twilio's retry is ingested again (the
+    # unique external_id index keeps a message from being stored twice).
+    try:
+        sms_ingest_queue.put_nowait((shard_router.current(), user_id, channel, text, MessageSid))
+    except asyncio.QueueFull:
+        logging.warning("[sms] Ingest queue full, processing inline")
+        await ingest_inbound_sms(user_id, channel, text, MessageSid)
 
     resp = MessagingResponse()
     resp.message("Thanks, we got your message!")
     return PlainTextResponse(str(resp), media_type="application/xml")
 
 # WebSocket for webchat visitors
+def client_address(connection) -> str:
+    """Client address of a Request or WebSocket (see liveness.client_address)"""
+    return liveness.client_address(connection.client.host if connection.client else None,
+                                   connection.headers.get("x-forwarded-for"))
+
+async def close_quietly(websocket: WebSocket, code: int):
+    try:
+        await websocket.close(code=code)
+    except Exception:
+        pass  # already closed by the peer
+
 @app.websocket("/ws/{user_id}")
-async def ws_endpoint(websocket: WebSocket, user_id: str):
-    await ws_manager.connect(user_id, "webchat", websocket)
+async def ws_endpoint(websocket: WebSocket, user_id: str, since: Optional[int] = Query(default=None)):
+    if len(user_id) > liveness.WS_MAX_USER_ID_LENGTH:
+        await websocket.close(code=liveness.CLOSE_POLICY)
+        return
+    # A reconnect storm costs the address a token per handshake
+    if await ratelimit.admit([(ip_limits, client_address(websocket))]):
+        await websocket.close(code=liveness.CLOSE_TRY_LATER)
+        return
+    displaced = visitor_sockets.admit(websocket, (shard_router.current(), user_id), client_address(websocket))
+    if displaced is None:
+        logging.warning(f"[ws] Refused socket for {user_id}: {client_address(websocket)} is at its cap")
+        await websocket.close(code=liveness.CLOSE_TRY_LATER)
+        return
     try:
+        conversation_id = await asyncio.to_thread(find_conversation, user_id, "webchat")
+        await ws_manager.connect(websocket, user_id, "webchat", conversation_id)
+        for old in displaced:
+            await close_quietly(old, liveness.CLOSE_REPLACED)
+        # Replay staff/system messages the visitor missed while disconnected.
+        # Registered before replaying, so the widget dedupes anything pushed live in between by id.
+        if conversation_id is not None:
+            missed, high_water = await asyncio.to_thread(get_undelivered_messages, conversation_id, since)
+            if high_water:
+                ws_manager.ack(websocket, high_water)
+            for m in missed:
+                await codec.send(websocket, {**m, "replay": True})
+
         while True:
-            msg = await websocket.receive_text()
+            action, timeout = visitor_sockets.poll(websocket)
+            if action == "ping":
+                await codec.send(websocket, {"type": "ping"})
+                continue
+            if action in liveness.CLOSE_CODES:
+                logging.info(f"[ws] Closing {action} socket of {user_id}")
+                await close_quietly(websocket, liveness.CLOSE_CODES[action])
+                break
+            if action:
+                break  # replaced by a newer tab, already closed
+            try:
+                msg = await asyncio.wait_for(websocket.receive_text(), timeout)
+            except asyncio.TimeoutError:
+                continue
             try:
                 data = json.loads(msg)
             except Exception:
+                visitor_sockets.seen(websocket)
                 continue  # ignore invalid messages
 
-            ev_type = (data.get("type") or "").lower()
-            if ev_type in ("typing", "stop_typing"):
+            ev_type = (data.get("type") or "").lower() if isinstance(data, dict) else ""
+            visitor_sockets.seen(websocket, active=ev_type in ("message", "typing", "stop_typing"))
+            if ev_type == "message":
+                # Chat message over the open socket; same ingestion path as POST /webchat
+                text = data.get("text")
+                client_id = data.get("client_id")
+                if not isinstance(text, str) or not text.strip():
+                    await codec.send(websocket, {"type": "error", "client_id": client_id, "detail": "text is required"})
+                    continue
+                # Shares the visitor's bucket with POST /webchat; queueing here also stops reading the socket
+                retry_after = await ratelimit.admit([(visitor_limits, (shard_router.current(), user_id)),
+                                                     (ip_limits, client_address(websocket))])
+                if retry_after:
+                    await codec.send(websocket, {"type": "rate_limited", "client_id": client_id,
+                                                 "retry_after": round(retry_after, 1)})
+                    continue
+                message_id = await ingest_webchat_message(
+                    user_id, "webchat", text, str(client_id) if client_id is not None else None
+                )
+                await codec.send(websocket, {
+                    "type": "ack",
+                    "client_id": client_id,
+                    "id": message_id,
+                    "duplicate": message_id is None,
+                })
+            elif ev_type == "ack":
+                try:
+                    ws_manager.ack(websocket, int(data.get("id")))
+                except (TypeError, ValueError):
+                    pass
+            elif ev_type in ("typing", "stop_typing"):
+                if ev_type == "typing" and not ratelimit.check([(typing_limits, (shard_router.current(), user_id))])[0]:
+                    continue  # dropped: the next typing frame supersedes it
                 await push_with_admin(
+                    ws_manager.find(user_id, "webchat"),
                     user_id,
                     "webchat",
                     {
                         "sender": "user",
                         "type": ev_type,
                         "text": "",
-                        "ts": datetime.datetime.utcnow().isoformat() + "Z",
+                        "ts": timestamps.now_iso(),
                     },
                 )
     except WebSocketDisconnect:
         pass
     finally:
-        ws_manager.disconnect(user_id, "webchat", websocket)
+        visitor_sockets.release(websocket)
+        conversation_id = ws_manager.disconnect(websocket)
+        # Persist the high-water mark once per session rather than per ack
+        delivered = ws_manager.release_delivered(conversation_id) if conversation_id is not None else None
+        if delivered:
+            try:
+                await asyncio.to_thread(save_visitor_delivered, conversation_id, delivered)
+            except Exception as e:
+                logging.exception("Failed to persist visitor delivery mark", exc_info=e)
 
 # WebSocket for admin dashboard (broadcast)
 # Store connections with user metadata for authentication tracking
@@ -1001,6 +2156,15 @@ async def ws_endpoint(websocket: WebSocket, user_id: str):
 admin_connections: list[dict] = []
 admin_connections_lock = asyncio.Lock()
 
+def open_conversation_snapshots() -> List[dict]:
+    """Every open conversation with its messages, as replayed to a dashboard on connect"""
+    with db_read() as conn:
+        c = conn.cursor()
+        c.execute("SELECT id, user_id, channel FROM conversations WHERE open=1 ORDER BY updated_at_ms DESC")
+        convos = c.fetchall()
+    return [{"user_id": row["user_id"], "channel": row["channel"],
+             **get_messages(row["user_id"], row["channel"], row["id"])} for row in convos]
+
 @app.websocket("/admin-ws")
 async def ws_admin(websocket: WebSocket, user: TokenData = Depends(get_websocket_token)):
     # WebSocket already accepted in get_websocket_token dependency
@@ -1011,44 +2175,38 @@ async def ws_admin(websocket: WebSocket, user: TokenData = Depends(get_websocket
         "email": user.email,
         "role": user.role,
         "tenant_id": user.tenant_id,
-        "connected_at": datetime.datetime.utcnow().isoformat() + "Z"
+        "connected_at": timestamps.now_iso(),
+        "format": codec.negotiate_subprotocol(websocket) or "json",
     }
+    fmt = connection_info["format"]
     async with admin_connections_lock:
         admin_connections.append(connection_info)
 
     logging.info(f"[admin] Authenticated dashboard connected: {user.email} ({user.role}), total={len(admin_connections)}")
 
     try:
-        with db() as conn:
-            c = conn.cursor()
-            c.execute("SELECT user_id, channel FROM conversations WHERE open=1 ORDER BY updated_at DESC")
-            convos = c.fetchall()
-        for row in convos:
-            convo_data = get_messages(row["user_id"], row["channel"])
-            enriched = {
-                "user_id": row["user_id"],
-                "channel": row["channel"],
-                **convo_data
-            }
+        for enriched in await asyncio.to_thread(open_conversation_snapshots):
             try:
-                await websocket.send_json({"type": "snapshot", "data": enriched})
+                await codec.send(websocket, {"type": "snapshot", "data": enriched}, fmt)
             except Exception as e:
                 logging.exception("Failed to send snapshot to admin", exc_info=e)
+        # Initial badge value; later changes arrive as followup_count pushes
+        await codec.send(websocket, {"type": "followup_count", "count": unviewed_followups.count}, fmt)
     except Exception as e:
         logging.exception("Replay on connect failed", exc_info=e)
 
     try:
         while True:
             try:
-                msg = await asyncio.wait_for(websocket.receive_text(), timeout=20)
-                logging.debug("[admin] received frame: %s", msg[:120])
-
                 # Handle typing messages sent by admin dashboard
                 try:
-                    data = json.loads(msg)
-                except Exception as e:
-                    logging.warning("Failed to parse admin WS message: %s", msg)
+                    data = await asyncio.wait_for(codec.receive(websocket, fmt), timeout=20)
+                except (ValueError, TypeError) as e:
+                    logging.warning("Failed to parse admin WS message: %s", e)
+                    continue
+                if not isinstance(data, dict):
                     continue
+                logging.debug("[admin] received frame: %s", str(data)[:120])
 
                 ev_type = (data.get("type") or "").lower()
                 user_id = data.get("user_id")
@@ -1058,14 +2216,15 @@ async def ws_admin(websocket: WebSocket, user: TokenData = Depends(get_websocket
                 if ev_type in ("typing", "stop_typing", "staff_typing", "staff_stop_typing") and user_id:
                     # Normalize type to typing/stop_typing for visitor
                     normalized_type = "typing" if "typing" in ev_type and "stop" not in ev_type else "stop_typing"
-                    await ws_manager.push(user_id, channel, {
+                    conversation_id = data.get("conversation_id") or ws_manager.find(user_id, channel)
+                    await ws_manager.push(conversation_id, {
                         "type": normalized_type,
                         "sender": "staff",
-                        "ts": datetime.datetime.utcnow().isoformat() + "Z"
+                        "ts": timestamps.now_iso()
                     })
 
             except asyncio.TimeoutError:
-                await websocket.send_json({"type": "ping"})
+                await codec.send(websocket, {"type": "ping"}, fmt)
     except WebSocketDisconnect:
         pass
     finally:
@@ -1087,35 +2246,47 @@ def test_connection():
 # Helper: push to both user channel + admin dashboard
 DEBUG_ADMIN_PUSH = True  # set False in production if logs too noisy
 
-async def push_with_admin(user_id: str, channel: str, payload: dict):
+async def push_with_admin(conversation_id: Optional[int], user_id: str, channel: str, payload: dict):
     if DEBUG_ADMIN_PUSH:
-        logging.info("[DEBUG] push_with_admin -> user=%s, channel=%s, payload=%s", user_id, channel, payload)
+        logging.info("[DEBUG] push_with_admin -> conversation=%s, user=%s, channel=%s, payload=%s",
+                     conversation_id, user_id, channel, payload)
         logging.info("[DEBUG] active admin connections = %d", len(admin_connections))
 
     if payload.get("sender") != "user":
-        await ws_manager.push(user_id, channel, payload)
+        await ws_manager.push(conversation_id, payload)
 
     enriched = {
+        "conversation_id": conversation_id,
         "user_id": user_id,
         "channel": channel,
+        "id": payload.get("id"),
         "sender": payload.get("sender", ""),
         "text": payload.get("text", ""),
         "type": payload.get("type", ""),
-        "ts": payload.get("ts") or datetime.datetime.utcnow().isoformat() + "Z",
+        "ts": payload.get("ts") or timestamps.now_iso(),
     }
 
-    # Broadcast to all authenticated admin connections
+    await broadcast_admin(enriched)
+
+async def broadcast_admin(payload: dict):
+    """Send one frame to every authenticated admin dashboard connection of the current tenant's shard"""
+    tenant_id = shard_router.current()
     # Create snapshot of connections to avoid lock during send
     async with admin_connections_lock:
-        connections_snapshot = list(admin_connections)
+        connections_snapshot = [c for c in admin_connections if shard_router.same_shard(c["tenant_id"], tenant_id)]
     
+    # Encode once per wire format rather than once per socket
+    frames = {}
     failed_connections = []
     for connection in connections_snapshot:
         try:
             ws = connection["ws"]
-            await ws.send_json(enriched)
+            fmt = connection.get("format", "json")
+            if fmt not in frames:
+                frames[fmt] = codec.encode_frame(payload, fmt)
+            await codec.send_frame(ws, frames[fmt])
         except Exception as e:
-            logging.warning(f"[push_with_admin] Failed to send to {connection.get('email', 'unknown')}: {e}")
+            logging.warning(f"[broadcast_admin] Failed to send to {connection.get('email', 'unknown')}: {e}")
             failed_connections.append(connection)
     
     # Remove failed connections
@@ -1127,106 +2298,331 @@ async def push_with_admin(user_id: str, channel: str, payload: dict):
                 except ValueError:
                     pass  # Already removed
 
+async def publish_followup_count():
+    """Push the unviewed followup badge count to the current tenant's dashboards"""
+    await broadcast_admin({"type": "followup_count", "count": unviewed_followups.count})
+
 # ========================
 # Escalation Loop
 # ========================
+def mark_escalation_step(conversation_id: int, final: bool):
+    """Record that the patience (or final) auto-reply went out"""
+    with db() as conn:
+        if final:
+            conn.execute("UPDATE conversations SET final_sent=1 WHERE id=?", (conversation_id,))
+            metrics.record_escalation(conn, conversation_id, shard_router.current(), timestamps.now_ms())
+        else:
+            conn.execute("UPDATE conversations SET patience_sent=1 WHERE id=?", (conversation_id,))
+        respcache.bump(conn, "conversations")
+        conn.commit()
+
+async def escalation_pass():
+    """One escalation step for the current tenant's shard"""
+    now_ms = timestamps.now_ms()
+    patience_cutoff = now_ms - PATIENCE_AFTER_SECONDS * 1000
+    final_cutoff = now_ms - ESCALATE_AFTER_SECONDS * 1000
+    def due_conversations():
+        with db_read() as conn:
+            # Only fetch conversations that are due for a step and nobody has picked up:
+            # a staff reply (escalation_active=0) or a manual assignment stops escalation.
+            # The router's own pick doesn't, since the assignee may not have seen it yet
+            return conn.execute("""
+                SELECT id, user_id, channel, patience_sent, final_sent, ? - updated_at_ms AS age_ms
+                FROM conversations
+                WHERE open=1 AND updated_at_ms <= ?
+                  AND COALESCE(escalation_active, 1) = 1
+                  AND (assigned_staff IS NULL OR assignment_routed = 1)
+                  AND ((COALESCE(patience_sent, 0) = 0 AND updated_at_ms <= ?)
+                    OR (COALESCE(final_sent, 0) = 0 AND updated_at_ms <= ?))
+            """, (now_ms, max(patience_cutoff, final_cutoff), patience_cutoff, final_cutoff)).fetchall()
+
+    rows = await asyncio.to_thread(due_conversations)
+
+    for row in rows:
+        # Stop mid-pass if the lease lapsed so a new leader can't double-send
+        if not job_leader.is_leader:
+            break
+        patience_sent = row["patience_sent"] or 0
+        final_sent = row["final_sent"] or 0
+        delta = row["age_ms"] / 1000
+
+        # Step 1: 30s patience reply
+        if delta >= PATIENCE_AFTER_SECONDS and patience_sent == 0:
+            patience_text = "We are still trying to locate an available staff member, thank you for your patience."
+            now = timestamps.now_ms()
+            patience_id = await asyncio.to_thread(add_message, row["user_id"], row["channel"], "system", patience_text,
+                                                  conversation_id=row["id"], now=now)
+            await push_with_admin(
+                row["id"], row["user_id"], row["channel"],
+                {"id": patience_id, "sender": "system", "text": patience_text, "ts": timestamps.to_iso(now)}
+            )
+            if twilio_client and row["channel"] in ("sms", "whatsapp"):
+                try:
+                    to_number = row["user_id"]
+                    sender = await asyncio.to_thread(tenant_sms_number)
+                    from_number = sender if row["channel"] == "sms" else f"whatsapp:{sender}"
+                    if row["channel"] == "whatsapp" and not to_number.startswith("whatsapp:"):
+                        to_number = f"whatsapp:{to_number}"
+                    await asyncio.to_thread(twilio_client.messages.create, body=patience_text, from_=from_number,
+                                            to=to_number)
+                except Exception as e:
+                    logging.exception(f"Twilio patience send failed: {repr(e)}")
+
+            await asyncio.to_thread(mark_escalation_step, row["id"], False)
+            logging.info(f"Escalation: patience auto-reply sent to {row['user_id']} ({row['channel']})")
+
+        # Step 2: Final callback prompt
+        if delta >= ESCALATE_AFTER_SECONDS and final_sent == 0:
+            final_text = "All staff are currently assisting others. Please leave your message and contact info, and a team member will respond as soon as possible."
+            now = timestamps.now_ms()
+            final_id = await asyncio.to_thread(add_message, row["user_id"], row["channel"], "system", final_text,
+                                               conversation_id=row["id"], now=now)
+            await push_with_admin(
+                row["id"], row["user_id"], row["channel"],
+                {"id": final_id, "sender": "system", "text": final_text, "ts": timestamps.to_iso(now)}
+            )
+            if twilio_client and row["channel"] in ("sms", "whatsapp"):
+                try:
+                    to_number = row["user_id"]
+                    sender = await asyncio.to_thread(tenant_sms_number)
+                    from_number = sender if row["channel"] == "sms" else f"whatsapp:{sender}"
+                    if row["channel"] == "whatsapp" and not to_number.startswith("whatsapp:"):
+                        to_number = f"whatsapp:{to_number}"
+                    await asyncio.to_thread(twilio_client.messages.create, body=final_text, from_=from_number,
+                                            to=to_number)
+                except Exception as e:
+                    logging.exception(f"Twilio final send failed: {repr(e)}")
+
+            await asyncio.to_thread(mark_escalation_step, row["id"], True)
+            logging.info(f"Escalation: final callback prompt sent to {row['user_id']} ({row['channel']})")
+
+            # SMS manager alert if BACKUP_NUMBER is set
+            if twilio_client and BACKUP_NUMBER:
+                try:
+                    alert_text = (
+                        f"[Escalation Alert] Conversation with {row['user_id']} "
+                        f"({row['channel']}) has escalated. Visitor was asked to leave contact info."
+                    )
+                    await asyncio.to_thread(twilio_client.messages.create, body=alert_text,
+                                            from_=await asyncio.to_thread(tenant_sms_number),
+                                            to=BACKUP_NUMBER)
+                    logging.info(f"Escalation alert SMS sent to manager at {BACKUP_NUMBER}")
+                except Exception as e:
+                    logging.exception(f"Failed to send escalation alert SMS: {repr(e)}")
+
 async def escalation_loop():
     await asyncio.sleep(5)  # startup delay
     while True:
+        if not job_leader.is_leader:
+            await asyncio.sleep(5)  # another worker runs escalation
+            continue
         try:
-            now = datetime.datetime.utcnow()
-            with db() as conn:
-                c = conn.cursor()
-                c.execute("SELECT user_id, channel, assigned_staff, updated_at, patience_sent, final_sent, escalation_active FROM conversations WHERE open=1")
-                rows = c.fetchall()
-
-            for row in rows:
-                assigned = row["assigned_staff"]
-                updated_at = row["updated_at"]
-                patience_sent = row["patience_sent"] or 0
-                final_sent = row["final_sent"] or 0
-                escalation_active = row.get("escalation_active", 1)  # Default to 1 for backward compatibility
-
-                # Skip escalation if it's been terminated by staff reply
-                if not escalation_active:
+            for tenant_id in await asyncio.to_thread(shard_router.tenants):
+                with shards.use_tenant(tenant_id):
+                    await escalation_pass()
+        except Exception as e:
+            logging.exception("Error in escalation_loop", exc_info=e)
+        await asyncio.sleep(30)
+
+# ========================
+# Routing Loop
+# ========================
+def open_assignment_counts() -> Dict[str, int]:
+    """Open conversations per staff member, summed over every shard (the rota is shared)"""
+    per_shard = shard_router.each(lambda conn: conn.execute(
+        """SELECT assigned_staff, COUNT(*) AS n FROM conversations
+           WHERE open=1 AND assigned_staff IS NOT NULL GROUP BY assigned_staff""").fetchall())
+    counts: Dict[str, int] = {}
+    for rows in per_shard.values():
+        for r in rows:
+            counts[r["assigned_staff"]] = counts.get(r["assigned_staff"], 0) + r["n"]
+    return counts
+
+async def routing_loop():
+    """Resync in-memory load counters with the DB (other workers assign too) and pick up rota edits"""
+    while True:
+        try:
+            shift_router.set_loads(await asyncio.to_thread(open_assignment_counts))
+            shift_router.maybe_reload()
+        except Exception as e:
+            logging.exception("Error in routing_loop", exc_info=e)
+        await asyncio.sleep(60)
+
+# ========================
+# Followup Badge Resync
+# ========================
+async def followup_count_loop():
+    """Recount unviewed followups so writes made by other workers reach this worker's dashboards"""
+    while True:
+        await asyncio.sleep(FOLLOWUP_COUNT_RESYNC_SECONDS)
+        try:
+            for tenant_id in await asyncio.to_thread(unviewed_followups.resync):
+                with shards.use_tenant(tenant_id):
+                    await publish_followup_count()
+        except Exception as e:
+            logging.exception("Error in followup_count_loop", exc_info=e)
+
+# ========================
+# Auto-close Sweeper
+# ========================
+auto_close_stats = {"passes": 0, "closed_total": 0, "last_closed": 0, "last_pass_ms": None,
+                    "max_pass_ms": 0.0, "last_run": None}
+
+def close_idle_batch(idle_before_ms: int, batch_size: int) -> List[dict]:
+    """Close up to batch_size open conversations idle since before idle_before_ms, in one transaction"""
+    now = timestamps.now_ms()
+    with db() as conn:
+        c = conn.cursor()
+        # Re-checking open/updated_at_ms in the outer WHERE skips rows a new message touched meanwhile
+        c.execute("""
+            UPDATE conversations SET open=0
+            WHERE id IN (SELECT id FROM conversations WHERE open=1 AND updated_at_ms < ?
+                         ORDER BY updated_at_ms LIMIT ?)
+              AND open=1 AND updated_at_ms < ?
+            RETURNING id, user_id, channel, assigned_staff
+        """, (idle_before_ms, batch_size, idle_before_ms))
+        closed = [dict(r) for r in c.fetchall()]
+        if closed:
+            metrics.record_close(conn, [r["id"] for r in closed], now)
+            respcache.bump(conn, "conversations")
+        conn.commit()
+    for r in closed:
+        shift_router.release(r["assigned_staff"])
+    return closed
+
+async def auto_close_loop():
+    """Close conversations idle for AUTO_CLOSE_MINUTES so open=1 stays small"""
+    await asyncio.sleep(15)  # startup delay
+    while True:
+        if not job_leader.is_leader:
+            await asyncio.sleep(30)
+            continue
+        try:
+            started = time.perf_counter()
+            idle_before_ms = timestamps.ago_ms(minutes=AUTO_CLOSE_MINUTES)
+            closed_by_tenant = {}
+            for tenant_id in await asyncio.to_thread(shard_router.tenants):
+                with shards.use_tenant(tenant_id):
+                    closed = closed_by_tenant[tenant_id] = []
+                    while job_leader.is_leader:
+                        batch = await asyncio.to_thread(close_idle_batch, idle_before_ms, AUTO_CLOSE_BATCH_SIZE)
+                        closed.extend(batch)
+                        if len(batch) < AUTO_CLOSE_BATCH_SIZE:
+                            break
+                        await asyncio.sleep(0.05)  # yield to request handlers between batches
+            pass_ms = (time.perf_counter() - started) * 1000
+            total = sum(len(closed) for closed in closed_by_tenant.values())
+
+            auto_close_stats["passes"] += 1
+            auto_close_stats["closed_total"] += total
+            auto_close_stats["last_closed"] = total
+            auto_close_stats["last_pass_ms"] = round(pass_ms, 2)
+            auto_close_stats["max_pass_ms"] = round(max(auto_close_stats["max_pass_ms"], pass_ms), 2)
+            auto_close_stats["last_run"] = timestamps.now_iso()
+
+            if total:
+                logging.info(f"Auto-close: closed {total} conversations idle > {AUTO_CLOSE_MINUTES}m in {pass_ms:.1f} ms")
+            for tenant_id, closed in closed_by_tenant.items():
+                if not closed:
                     continue
+                # One frame per sweep and tenant, not one per conversation
+                with shards.use_tenant(tenant_id):
+                    await broadcast_admin({
+                        "type": "conversations_closed",
+                        "reason": "idle",
+                        "conversations": [{"user_id": r["user_id"], "channel": r["channel"]} for r in closed],
+                        "ts": auto_close_stats["last_run"],
+                    })
+        except Exception as e:
+            logging.exception("Error in auto_close_loop", exc_info=e)
+        await asyncio.sleep(AUTO_CLOSE_INTERVAL_SECONDS)
 
-                if not assigned and updated_at:
-                    try:
-                        last_update = datetime.datetime.fromisoformat(updated_at.replace("Z", ""))
-                    except Exception:
-                        continue
-                    delta = (now - last_update).total_seconds()
-
-                    # Step 1: 30s patience reply
-                    if delta >= 30 and patience_sent == 0:
-                        patience_text = "We are still trying to locate an available staff member, thank you for your patience."
-                        add_message(row["user_id"], row["channel"], "system", patience_text)
-                        await push_with_admin(
-                            row["user_id"], row["channel"],
-                            {"sender": "system", "text": patience_text,
-                             "ts": datetime.datetime.utcnow().isoformat() + "Z"}
-                        )
-                        if twilio_client and row["channel"] in ("sms", "whatsapp"):
-                            try:
-                                to_number = row["user_id"]
-                                from_number = TWILIO_NUMBER if row["channel"] == "sms" else f"whatsapp:{TWILIO_NUMBER}"
-                                if row["channel"] == "whatsapp" and not to_number.startswith("whatsapp:"):
-                                    to_number = f"whatsapp:{to_number}"
-                                twilio_client.messages.create(body=patience_text, from_=from_number, to=to_number)
-                            except Exception as e:
-                                logging.exception(f"Twilio patience send failed: {repr(e)}")
-
-                        with db() as conn:
-                            conn.execute("UPDATE conversations SET patience_sent=1 WHERE user_id=? AND channel=?",
-                                         (row["user_id"], row["channel"]))
-                            conn.commit()
-                        logging.info(f"Escalation: patience auto-reply sent to {row['user_id']} ({row['channel']})")
-
-                    # Step 2: Final callback prompt
-                    if delta >= ESCALATE_AFTER_SECONDS and final_sent == 0:
-                        final_text = "All staff are currently assisting others. Please leave your message and contact info, and a team member will respond as soon as possible."
-                        add_message(row["user_id"], row["channel"], "system", final_text)
-                        await push_with_admin(
-                            row["user_id"], row["channel"],
-                            {"sender": "system", "text": final_text,
-                             "ts": datetime.datetime.utcnow().isoformat() + "Z"}
-                        )
-                        if twilio_client and row["channel"] in ("sms", "whatsapp"):
-                            try:
-                                to_number = row["user_id"]
-                                from_number = TWILIO_NUMBER if row["channel"] == "sms" else f"whatsapp:{TWILIO_NUMBER}"
-                                if row["channel"] == "whatsapp" and not to_number.startswith("whatsapp:"):
-                                    to_number = f"whatsapp:{to_number}"
-                                twilio_client.messages.create(body=final_text, from_=from_number, to=to_number)
-                            except Exception as e:
-                                logging.exception(f"Twilio final send failed: {repr(e)}")
-
-                        with db() as conn:
-                            conn.execute("UPDATE conversations SET final_sent=1 WHERE user_id=? AND channel=?",
-                                         (row["user_id"], row["channel"]))
-                            conn.commit()
-                        logging.info(f"Escalation: final callback prompt sent to {row['user_id']} ({row['channel']})")
-
-                        # SMS manager alert if BACKUP_NUMBER is set
-                        if twilio_client and BACKUP_NUMBER:
-                            try:
-                                alert_text = (
-                                    f"[Escalation Alert] Conversation with {row['user_id']} "
-                                    f"({row['channel']}) has escalated. Visitor was asked to leave contact info."
-                                )
-                                twilio_client.messages.create(
-                                    body=alert_text,
-                                    from_=TWILIO_NUMBER,
-                                    to=BACKUP_NUMBER
-                                )
-                                logging.info(f"Escalation alert SMS sent to manager at {BACKUP_NUMBER}")
-                            except Exception as e:
-                                logging.exception(f"Failed to send escalation alert SMS: {repr(e)}")
+# ========================
+# Archive Loop
+# ========================
+def archive_closed_batch(closed_before_ms: int) -> int:
+    with db_tiered() as conn:
+        return archive.archive_batch(conn, closed_before_ms, ARCHIVE_BATCH_SIZE, timestamps.now_ms())
 
+async def archive_loop():
+    """Move messages of long-closed conversations to the archive tier in small batches"""
+    await asyncio.sleep(60)  # let startup traffic settle
+    while True:
+        if not job_leader.is_leader:
+            await asyncio.sleep(30)
+            continue
+        try:
+            closed_before_ms = timestamps.ago_ms(days=ARCHIVE_AFTER_DAYS)
+            total = 0
+            for tenant_id in await asyncio.to_thread(shard_router.tenants):
+                with shards.use_tenant(tenant_id):
+                    while job_leader.is_leader:
+                        moved = await asyncio.to_thread(archive_closed_batch, closed_before_ms)
+                        total += moved
+                        if moved:
+                            mark_purged()
+                        if moved < ARCHIVE_BATCH_SIZE:
+                            break
+                        await asyncio.sleep(0.1)  # yield to request handlers between batches
+            if total:
+                logging.info(f"Archive: moved {total} messages closed before {timestamps.to_iso(closed_before_ms)}")
         except Exception as e:
-            logging.exception("Error in escalation_loop", exc_info=e)
-        await asyncio.sleep(30)
+            logging.exception("Error in archive_loop", exc_info=e)
+        await asyncio.sleep(ARCHIVE_INTERVAL_SECONDS)
+
+# ========================
+# Backup Loop
+# ========================
+backup_service = backup.BackupService(lambda: backup.default_dir(DB_PATH))
+
+async def backup_loop():
+    """Snapshot the store every BACKUP_INTERVAL_HOURS without blocking writers"""
+    while True:
+        await asyncio.sleep(BACKUP_INTERVAL_HOURS * 3600)
+        if not job_leader.is_leader:
+            continue
+        try:
+            await asyncio.to_thread(backup_service.create, backup.store_files(DB_PATH))
+        except Exception as e:
+            logging.exception("Error in backup_loop", exc_info=e)
+
+# ========================
+# Maintenance Loop
+# ========================
+maintainer = maintenance.Maintainer()
+
+def mark_purged():
+    """Bulk deletes on the current shard: refresh its planner statistics on the next pass"""
+    maintainer.mark_purged(shard_router.path_for(shard_router.current()))
+
+def maintenance_pass(tenant_id: int, force: bool = False) -> Optional[dict]:
+    """One time-boxed pass over a tenant's shard and its archive tier (blocking; None if it was busy)"""
+    pool = shard_router.pool(tenant_id)
+    with shards.use_tenant(tenant_id):
+        return maintainer.run(pool.path, db_tiered, ops=lambda: pool.stats["writes"] + pool.stats["reads"],
+                              force=force)
+
+def maintenance_files() -> dict:
+    """Size and free-space figures of every database file"""
+    files = {}
+    for tenant_id in shard_router.tenants():
+        with shards.use_tenant(tenant_id), db_read_tiered() as conn:
+            files.update(maintenance.file_stats(conn))
+    return files
+
+async def maintenance_loop():
+    """Reclaim space freed by purges and keep WAL size and planner stats in check, on quiet shards only"""
+    await asyncio.sleep(120)  # let startup traffic settle
+    while True:
+        if job_leader.is_leader and not maintainer.running:
+            try:
+                for tenant_id in await asyncio.to_thread(shard_router.tenants):
+                    if not job_leader.is_leader:
+                        break
+                    await asyncio.to_thread(maintenance_pass, tenant_id)
+            except Exception as e:
+                logging.exception("Error in maintenance_loop", exc_info=e)
+        await asyncio.sleep(MAINTENANCE_INTERVAL_SECONDS)
 # ============================================================================
 # PUSH NOTIFICATION ENDPOINTS
 # ============================================================================
@@ -1320,3 +2716,5 @@ async def notify_admins_new_message(user_id: str, channel: str, message_text: st
         print(f"📤 Sending push notification to {admin_id}")
         await send_push_notification(token, title, body, data)
 
+
+startup.timeline.mark("imports")
@@ -0,0 +1,342 @@
+"""
+Per-tenant database shards.
+
+Each tenant's conversation data lives in its own SQLite file next to the
+primary database, so tenants no longer share one write lock:
+
+    handoff.sqlite                 primary: users, tenants, leases, events,
+                                   and the default tenant's conversations
+    handoff_tenant_<id>.sqlite     every other tenant
+
+The tenant of the current request is held in a context variable.
+``TenantMiddleware`` sets it from the ``tenant_id`` claim of a verified JWT
+(``Authorization: Bearer`` or the ``token`` query parameter used by
+websockets).  Visitors carry no token; their widget sends its tenant's
+public key instead (``tenant_key`` query parameter or ``X-Tenant-Key``
+header, matched against ``tenants.widget_key``).  The Twilio webhook picks
+the tenant from the number a text was sent to (``tenants.sms_number``).
+Requests with neither stay on the default tenant.  Background jobs pick a
+shard explicitly with ``use_tenant``.
+
+Shards hold conversation data only; users, tenants, leases and events stay
+in the primary file.
+
+Each shard file runs in WAL mode.  All writes in a process go through
+one writer connection per shard, which serializes them behind a lock.
+Reads use a pool of ``query_only`` connections.  Each read block is one
+snapshot transaction, so a long report sees a consistent state and never
+holds a lock that ``add_message`` has to wait for.
+
+``ShardRouter.each`` runs a function against every shard, which is the
+cross-shard path for global views.  With ``TENANT_SHARDS=0`` every tenant
+maps to the primary file.
+"""
+import asyncio
+import contextlib
+import contextvars
+import os
+import queue
+import sqlite3
+import threading
+import time
+from functools import lru_cache
+from pathlib import Path
+from typing import Awaitable, Callable, Dict, Iterator, List, Optional, Tuple
+from urllib.parse import parse_qs
+
+SQLITE_SYNCHRONOUS = os.getenv("SQLITE_SYNCHRONOUS", "NORMAL")  # NORMAL is durable enough under WAL
+SQLITE_BUSY_TIMEOUT = float(os.getenv("SQLITE_BUSY_TIMEOUT", "5"))
+
+current_tenant: contextvars.ContextVar[Optional[int]] = contextvars.ContextVar("current_tenant", default=None)
+
+
+@contextlib.contextmanager
+def use_tenant(tenant_id: int):
+    """Route db() calls in this block (and threads started from it) to ``tenant_id``"""
+    token = current_tenant.set(tenant_id)
+    try:
+        yield
+    finally:
+        current_tenant.reset(token)
+
+
+def shard_path(primary_path: str, tenant_id: int) -> str:
+    p = Path(primary_path)
+    return str(p.with_name(f"{p.stem}_tenant_{tenant_id}{p.suffix or '.sqlite'}"))
+
+
+class ConnectionPool:
+    """
+    Connections to one SQLite file: a single writer behind a lock, and
+    reusable read-only readers.  Reader checkout never blocks; readers
+    beyond ``size`` are closed on release.
+    """
+    def __init__(self, path: str, size: int):
+        self.path = path
+        self.size = size
+        self._writer: Optional[sqlite3.Connection] = None
+        self._writer_lock = threading.Lock()
+        self._idle: "queue.SimpleQueue[sqlite3.Connection]" = queue.SimpleQueue()
+        self.stats = {"writes": 0, "max_write_wait_ms": 0.0, "reads": 0, "readers_opened": 0, "readers_closed": 0}
+
+    def _open(self, **kwargs) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, timeout=SQLITE_BUSY_TIMEOUT, check_same_thread=False, **kwargs)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    @contextlib.contextmanager
+    def connection(self) -> Iterator[sqlite3.Connection]:
+        """The writer; commits on success, rolls back on error"""
+        started = time.perf_counter()
+        with self._writer_lock:
+            wait_ms = (time.perf_counter() - started) * 1000
+            self.stats["writes"] += 1
+            if wait_ms > self.stats["max_write_wait_ms"]:
+                self.stats["max_write_wait_ms"] = round(wait_ms, 2)
+            if self._writer is None:
+                self._writer = self._open()
+                # Only takes effect on a new file (it must precede WAL); see maintenance.py
+                self._writer.execute("PRAGMA auto_vacuum=INCREMENTAL")
+                self._writer.execute("PRAGMA journal_mode=WAL")
+                self._writer.execute(f"PRAGMA synchronous={SQLITE_SYNCHRONOUS}")
+            conn = self._writer
+            try:
+                yield conn
+                conn.commit()
+            except BaseException:
+                conn.rollback()
+                raise
+
+    @contextlib.contextmanager
+    def read_connection(self, setup: Optional[Callable[[sqlite3.Connection], object]] = None
+                        ) -> Iterator[sqlite3.Connection]:
+        """
+        A reader inside one snapshot transaction (rolled back on release).
+        ``setup(conn)`` runs first, outside the transaction and with writes
+        allowed (ATTACH, temp views); it must be idempotent.
+        """
+        try:
+            conn = self._idle.get_nowait()
+        except queue.Empty:
+            # Autocommit mode so BEGIN / ROLLBACK below are the only transaction control
+            conn = self._open(isolation_level=None)
+            conn.execute("PRAGMA query_only=1")
+            self.stats["readers_opened"] += 1
+        self.stats["reads"] += 1
+        healthy = False
+        try:
+            if setup is not None:
+                conn.execute("PRAGMA query_only=0")
+                try:
+                    setup(conn)
+                finally:
+                    conn.execute("PRAGMA query_only=1")
+            conn.execute("BEGIN")
+            yield conn
+            healthy = True
+        finally:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            if not healthy or self._idle.qsize() >= self.size:
+                conn.close()
+                self.stats["readers_closed"] += 1
+            else:
+                self._idle.put(conn)
+
+    def close(self):
+        with self._writer_lock:
+            if self._writer is not None:
+                self._writer.close()
+                self._writer = None
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                return
+
+
+class ShardRouter:
+    """
+    Maps tenants to database files and hands out pooled connections.
+
+    ``primary_path`` is a callable so the database location can still be
+    changed after import (tests and benchmarks point it at a temp file).
+    ``initializer(tenant_id)`` runs once per process for each non-primary
+    shard before its first connection is handed out (schema creation).
+    """
+    def __init__(self, primary_path: Callable[[], str], default_tenant_id: int, enabled: bool = True,
+                 pool_size: int = 4, initializer: Optional[Callable[[int], None]] = None):
+        self.primary_path = primary_path
+        self.default_tenant_id = default_tenant_id
+        self.enabled = enabled
+        self.pool_size = pool_size
+        self.initializer = initializer
+        self._pools: Dict[str, ConnectionPool] = {}
+        # (column, value) -> tenant id; only hits, so a key added later is found on its first use
+        self._found: Dict[Tuple[str, str], int] = {}
+        self._initializing: Dict[str, ConnectionPool] = {}
+        self._lock = threading.RLock()
+
+    def current(self) -> int:
+        """Tenant whose shard db() uses right now"""
+        tenant_id = current_tenant.get()
+        if tenant_id is None or not self.enabled:
+            return self.default_tenant_id
+        return tenant_id
+
+    def path_for(self, tenant_id: int) -> str:
+        primary = self.primary_path()
+        if not self.enabled or tenant_id == self.default_tenant_id:
+            return primary
+        return shard_path(primary, tenant_id)
+
+    def same_shard(self, a: Optional[int], b: Optional[int]) -> bool:
+        return self.path_for(a or self.default_tenant_id) == self.path_for(b or self.default_tenant_id)
+
+    def pool(self, tenant_id: Optional[int] = None) -> ConnectionPool:
+        tenant_id = self.current() if tenant_id is None else tenant_id
+        path = self.path_for(tenant_id)
+        pool = self._pools.get(path)
+        if pool is not None:
+            return pool
+        with self._lock:
+            # The initializer's own db() calls land here on this thread and get the pool being set up
+            pool = self._pools.get(path) or self._initializing.get(path)
+            if pool is not None:
+                return pool
+            pool = ConnectionPool(path, self.pool_size)
+            if self.initializer and path != self.primary_path():
+                self._initializing[path] = pool
+                try:
+                    with use_tenant(tenant_id):
+                        self.initializer(tenant_id)
+                finally:
+                    del self._initializing[path]
+            self._pools[path] = pool
+        return pool
+
+    def connect(self, tenant_id: Optional[int] = None):
+        """``with router.connect() as conn`` - the shard's writer; commits on success, rolls back on error"""
+        return self.pool(tenant_id).connection()
+
+    def read(self, tenant_id: Optional[int] = None, setup: Optional[Callable[[sqlite3.Connection], object]] = None):
+        """``with router.read() as conn`` - a read-only snapshot of the shard"""
+        return self.pool(tenant_id).read_connection(setup)
+
+    def tenants(self) -> List[int]:
+        """Tenants with their own shard (always includes the default tenant)"""
+        if not self.enabled:
+            return [self.default_tenant_id]
+        with self.read(self.default_tenant_id) as conn:
+            try:
+                ids = [r[0] for r in conn.execute("SELECT id FROM tenants ORDER BY id")]
+            except sqlite3.OperationalError:
+                ids = []  # schema not created yet
+        return [self.default_tenant_id] + [t for t in ids if t != self.default_tenant_id]
+
+    def find_tenant(self, column: str, value: Optional[str]) -> Optional[int]:
+        """Tenant whose ``tenants.<column>`` (widget_key, sms_number) is ``value``; None if there is none"""
+        if not value:
+            return None
+        tenant_id = self._found.get((column, value))
+        if tenant_id is None:
+            with self.read(self.default_tenant_id) as conn:
+                row = conn.execute(f"SELECT id FROM tenants WHERE {column} = ?", (value,)).fetchone()
+            if row is None:
+                return None
+            tenant_id = self._found[(column, value)] = row[0]
+        return tenant_id
+
+    async def resolve_tenant(self, column: str, value: Optional[str]) -> Optional[int]:
+        """find_tenant for async callers: cached hits skip the thread hop"""
+        tenant_id = self._found.get((column, value))
+        if tenant_id is None and value:
+            tenant_id = await asyncio.to_thread(self.find_tenant, column, value)
+        return tenant_id
+
+    def each(self, fn: Callable[[sqlite3.Connection], object]) -> Dict[int, object]:
+        """Run ``fn(conn)`` on every shard (cross-shard reads for global views)"""
+        results = {}
+        for tenant_id in self.tenants():
+            with use_tenant(tenant_id), self.read(tenant_id) as conn:
+                results[tenant_id] = fn(conn)
+        return results
+
+    def stats(self) -> Dict[str, dict]:
+        return {Path(path).name: dict(pool.stats) for path, pool in self._pools.items()}
+
+    def close(self):
+        with self._lock:
+            for pool in self._pools.values():
+                pool.close()
+            self._pools.clear()
+            self._found.clear()
+
+
+class TenantMiddleware:
+    """
+    Sets ``current_tenant`` for the duration of the request: from a verified
+    JWT, else from the widget's tenant key via ``resolve_key``.  An unknown
+    key is refused (403, or close 1008 on a websocket) rather than filed
+    under the default tenant.
+    """
+    def __init__(self, app, decode: Callable[[str], dict],
+                 resolve_key: Optional[Callable[[str], Awaitable[Optional[int]]]] = None):
+        self.app = app
+        self.decode = decode
+        self.resolve_key = resolve_key
+        self._tenant_of = lru_cache(maxsize=4096)(self._tenant_for_token)
+
+    def _tenant_for_token(self, token: str) -> Optional[int]:
+        try:
+            tenant_id = self.decode(token).get("tenant_id")
+        except Exception:
+            return None  # the endpoint's own auth rejects it
+        return int(tenant_id) if tenant_id is not None else None
+
+    def _token(self, scope) -> Optional[str]:
+        for name, value in scope.get("headers", ()):
+            if name == b"authorization":
+                scheme, _, credentials = value.decode("latin-1").partition(" ")
+                if scheme.lower() == "bearer" and credentials:
+                    return credentials.strip()
+        if scope["type"] == "websocket" and scope.get("query_string"):
+            tokens = parse_qs(scope["query_string"].decode("latin-1")).get("token")
+            if tokens:
+                return tokens[0]
+        return None
+
+    def _tenant_key(self, scope) -> Optional[str]:
+        for name, value in scope.get("headers", ()):
+            if name == b"x-tenant-key":
+                return value.decode("latin-1").strip() or None
+        if scope.get("query_string"):
+            keys = parse_qs(scope["query_string"].decode("latin-1")).get("tenant_key")
+            if keys:
+                return keys[0]
+        return None
+
+    async def _refuse(self, scope, receive, send):
+        if scope["type"] == "websocket":
+            await receive()  # websocket.connect; closing before accept answers the handshake with 403
+            await send({"type": "websocket.close", "code": 1008})
+            return
+        await send({"type": "http.response.start", "status": 403,
+                    "headers": [(b"content-type", b"application/json")]})
+        await send({"type": "http.response.body", "body": b'{"detail":"Unknown tenant key"}'})
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] not in ("http", "websocket"):
+            return await self.app(scope, receive, send)
+        token = self._token(scope)
+        tenant_id = self._tenant_of(token) if token else None
+        if tenant_id is None and self.resolve_key is not None:
+            key = self._tenant_key(scope)
+            if key:
+                tenant_id = await self.resolve_key(key)
+                if tenant_id is None:
+                    return await self._refuse(scope, receive, send)
+        if tenant_id is None:
+            return await self.app(scope, receive, send)
+        with use_tenant(tenant_id):
+            await self.app(scope, receive, send)
@@ -0,0 +1,81 @@
+"""
+Cold-start support: a startup timeline and lazily built heavy clients.
+
+``timeline`` records named marks in milliseconds since the process was
+started (read from /proc on Linux, so interpreter and uvicorn start-up are
+included; otherwise since this module was imported).  ``FirstRequestMiddleware``
+adds the ``first_request`` mark, i.e. time to first request, and logs the
+whole timeline once.
+
+``Lazy(factory)`` defers building an object - and importing whatever its
+factory imports - until an attribute is first used, so rarely needed
+clients (Twilio pulls in requests + certifi) stay off the startup path.
+"""
+import logging
+import os
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+
+def _process_start() -> float:
+    """Wall-clock time this process started (Linux); falls back to now"""
+    try:
+        with open("/proc/self/stat") as f:
+            start_ticks = int(f.read().rsplit(")", 1)[1].split()[19])
+        with open("/proc/uptime") as f:
+            uptime = float(f.read().split()[0])
+        return time.time() - uptime + start_ticks / os.sysconf("SC_CLK_TCK")
+    except (OSError, ValueError, IndexError):
+        return time.time()
+
+
+class Timeline:
+    def __init__(self):
+        self.started_at = _process_start()
+        self.marks: List[Tuple[str, float]] = []
+        self.first_request_ms: Optional[float] = None
+        self.mark("server_import")
+
+    def elapsed_ms(self) -> float:
+        return (time.time() - self.started_at) * 1000
+
+    def mark(self, name: str) -> float:
+        ms = round(self.elapsed_ms(), 1)
+        self.marks.append((name, ms))
+        return ms
+
+    def summary(self) -> Dict[str, object]:
+        return {"marks": dict(self.marks), "time_to_first_request_ms": self.first_request_ms}
+
+
+timeline = Timeline()
+
+
+class FirstRequestMiddleware:
+    """Marks the first HTTP/WebSocket request and logs the startup timeline once"""
+    def __init__(self, app, timeline: Timeline = timeline):
+        self.app = app
+        self.timeline = timeline
+
+    async def __call__(self, scope, receive, send):
+        if self.timeline.first_request_ms is None and scope["type"] in ("http", "websocket"):
+            self.timeline.first_request_ms = self.timeline.mark("first_request")
+            steps = ", ".join(f"{name} {ms:.0f}ms" for name, ms in self.timeline.marks)
+            logging.info(f"[startup] {steps} ({scope.get('path')})")
+        await self.app(scope, receive, send)
+
+
+class Lazy:
+    """Proxy that builds its target with ``factory()`` on first attribute access"""
+    def __init__(self, factory: Callable[[], object]):
+        self._factory = factory
+        self._target = None
+        self._lock = threading.Lock()
+
+    def __getattr__(self, name):
+        if self._target is None:
+            with self._lock:
+                if self._target is None:
+                    self._target = self._factory()
+        return getattr(self._target, name)
@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+"""
+Test the archive tier (archive.py):
+
+1. A row left in both tiers by a crash mid-batch is read once, and the
+   next batch finishes the move
+2. The 30-day export purges a conversation's followups, history, rollups
+   and search entries together with its messages
+
+Runs against a throwaway database:  python3 test_archive.py
+"""
+import contextlib
+import io
+import json
+import logging
+import os
+import tempfile
+
+with contextlib.redirect_stdout(io.StringIO()):
+    import server
+
+
+def setup_module(module=None):
+    logging.disable(logging.CRITICAL)
+    server.shard_router.close()
+    server.DB_PATH = os.path.join(tempfile.mkdtemp(), "archive.sqlite")
+    server.db_init()
+
+
+def teardown_module(module=None):
+    server.shard_router.close()
+    logging.disable(logging.NOTSET)
+
+
+def age_conversation(conversation_id: int, days: int):
+    old = server.timestamps.ago_ms(days=days)
+    with server.db() as conn:
+        conn.execute("UPDATE conversations SET open=0, updated_at_ms=? WHERE id=?", (old, conversation_id))
+        conn.execute("UPDATE messages SET ts_ms=? WHERE conversation_id=?", (old, conversation_id))
+
+
+def test_half_archived_batch_is_read_once():
+    _, conversation_id, _, _ = server.store_inbound_message("crashed", "webchat", "one")
+    server.add_message("crashed", "webchat", "staff", "two", conversation_id=conversation_id)
+    age_conversation(conversation_id, days=10)
+    with server.db_tiered() as conn:
+        # What a crash between the archive commit and the hot-tier commit leaves behind
+        conn.execute(f"""INSERT INTO {server.archive.ARCHIVE_SCHEMA}.messages
+                         (id, conversation_id, user_id, channel, sender, text, ts, ts_ms)
+                         SELECT id, conversation_id, user_id, channel, sender, text, ts, ts_ms
+                         FROM main.messages WHERE conversation_id=?""", (conversation_id,))
+    assert [m["text"] for m in server.get_messages("crashed", "webchat")["messages"]] == ["one", "two"]
+
+    while server.archive_closed_batch(server.timestamps.ago_ms(days=1)):
+        pass
+    with server.db_read_tiered() as conn:
+        hot = conn.execute("SELECT COUNT(*) FROM main.messages WHERE conversation_id=?", (conversation_id,)).fetchone()[0]
+    assert hot == 0
+    assert [m["text"] for m in server.get_messages("crashed", "webchat")["messages"]] == ["one", "two"]
+
+
+def test_purge_removes_dependent_rows():
+    _, conversation_id, _, _ = server.store_inbound_message("purged", "webchat", "old question")
+    server.store_followup(server.FollowupSchema(user_id="purged", channel="webchat", name="P",
+                                                email="p@example.com", message="call me"))
+    with server.db_read() as conn:
+        followup_id = conn.execute("SELECT id FROM followups WHERE conversation_id=?", (conversation_id,)).fetchone()[0]
+    server.migrate_followup(followup_id)
+    server.store_followup(server.FollowupSchema(user_id="purged", channel="webchat", name="P",
+                                                email="p@example.com", message="again"))
+    age_conversation(conversation_id, days=40)
+
+    body = json.loads(server.export_and_purge_history().body)
+    assert {cv["id"] for cv in body["conversations"]} >= {conversation_id}
+    assert len([f for f in body["followups"] if f["conversation_id"] == conversation_id]) == 1
+    assert len([h for h in body["history"] if h["conversation_id"] == conversation_id]) == 1
+
+    with server.db_read_tiered() as conn:
+        for table in ("all_messages", "followups", "history", "conversation_metrics"):
+            left = conn.execute(f"SELECT COUNT(*) FROM {table} WHERE conversation_id=?", (conversation_id,)).fetchone()[0]
+            assert left == 0, table
+        results = [r for q in ("question", "call", "again")
+                   for r in server.search.search(conn, q, server.DEFAULT_TENANT_ID)[0]]
+    assert not [r for r in results if r["user_id"] == "purged"]
+
+
+if __name__ == "__main__":
+    print("=" * 60)
+    print("ARCHIVE TEST")
+    print("=" * 60)
+    setup_module()
+    try:
+        for test in (test_half_archived_batch_is_read_once, test_purge_removes_dependent_rows):
+            test()
+            print(f"✅ {test.__name__}")
+    finally:
+        teardown_module()
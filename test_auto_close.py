@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+"""
+Test the batched auto-close of idle conversations:
+
+1. One batch closes every aged conversation in a single write, leaves
+   active ones open and releases the assignees' routing load
+2. A sweep of auto_close_loop sends dashboards one aggregated
+   conversations_closed frame, not one per conversation
+
+Runs against a throwaway database:  python3 test_auto_close.py
+"""
+import asyncio
+import contextlib
+import io
+import json
+import logging
+import os
+import tempfile
+import time
+
+import lease
+import routing
+
+with contextlib.redirect_stdout(io.StringIO()):
+    import server
+
+STAFF = "+15550007777"
+
+
+def setup_module(module=None):
+    logging.disable(logging.CRITICAL)
+    server.shard_router.close()
+    server.DB_PATH = os.path.join(tempfile.mkdtemp(), "autoclose.sqlite")
+    server.db_init()
+
+
+def teardown_module(module=None):
+    server.shard_router.close()
+    logging.disable(logging.NOTSET)
+
+
+@contextlib.contextmanager
+def on_shift():
+    config = os.path.join(tempfile.mkdtemp(), "shifts.json")
+    with open(config, "w") as f:
+        json.dump([{"name": "all day", "start": "00:00", "end": "23:59", "numbers": [STAFF]}], f)
+    previous, server.shift_router = server.shift_router, routing.ShiftRouter(config)
+    try:
+        yield server.shift_router
+    finally:
+        server.shift_router = previous
+
+
+def open_aged(prefix: str, n: int) -> list:
+    """n routed conversations last touched two hours ago"""
+    for i in range(n):
+        server.store_inbound_message(f"{prefix}-{i}", "webchat", "anyone there?")
+    with server.db() as conn:
+        conn.execute("UPDATE conversations SET updated_at_ms=? WHERE user_id LIKE ?",
+                     (server.timestamps.ago_ms(minutes=120), f"{prefix}-%"))
+    return [f"{prefix}-{i}" for i in range(n)]
+
+
+def open_users(prefix: str) -> list:
+    with server.db_read() as conn:
+        return [r[0] for r in conn.execute("SELECT user_id FROM conversations WHERE open=1 AND user_id LIKE ? "
+                                           "ORDER BY user_id", (f"{prefix}-%",))]
+
+
+def test_batch_closes_in_one_write():
+    with on_shift() as router:
+        aged = open_aged("idle", 5)
+        server.store_inbound_message("idle-active", "webchat", "still here")
+        assert router.loads[STAFF] == 6
+
+        pool = server.shard_router.pool()
+        writes = pool.stats["writes"]
+        closed = server.close_idle_batch(server.timestamps.ago_ms(minutes=server.AUTO_CLOSE_MINUTES), 100)
+        assert pool.stats["writes"] - writes == 1
+        assert sorted(r["user_id"] for r in closed) == aged
+        assert open_users("idle") == ["idle-active"]
+        assert router.loads[STAFF] == 1
+        with server.db_read() as conn:
+            assert conn.execute("SELECT COUNT(*) FROM conversations WHERE user_id LIKE 'idle-%' "
+                                "AND closed_at IS NOT NULL").fetchone()[0] == 5
+
+
+def test_sweep_broadcasts_once():
+    frames = []
+
+    async def broadcast_admin(payload):
+        frames.append(payload)
+
+    real_sleep = asyncio.sleep
+
+    async def fast_sleep(delay, *args, **kwargs):
+        await real_sleep(0)
+
+    async def sweep():
+        task = asyncio.create_task(server.auto_close_loop())
+        await real_sleep(0.3)  # several passes: only the first finds anything
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+
+    leader = lease.Lease("background-jobs", server.DB_PATH)
+    leader._valid_until = time.time() + 3600
+    saved = server.job_leader, server.broadcast_admin
+    server.job_leader, server.broadcast_admin = leader, broadcast_admin
+    with on_shift():
+        aged = open_aged("swept", 4)
+        asyncio.sleep = fast_sleep
+        try:
+            asyncio.run(sweep())
+        finally:
+            asyncio.sleep = real_sleep
+            server.job_leader, server.broadcast_admin = saved
+    assert len(frames) == 1
+    assert frames[0]["type"] == "conversations_closed" and frames[0]["reason"] == "idle"
+    assert sorted(c["user_id"] for c in frames[0]["conversations"]) == aged
+    assert open_users("swept") == []
+
+
+if __name__ == "__main__":
+    print("=" * 60)
+    print("AUTO-CLOSE TEST")
+    print("=" * 60)
+    setup_module()
+    try:
+        for test in (test_batch_closes_in_one_write, test_sweep_broadcasts_once):
+            test()
+            print(f"✅ {test.__name__}")
+    finally:
+        teardown_module()
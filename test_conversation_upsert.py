@@ -0,0 +1,221 @@
+#!/usr/bin/env python3
+"""
+Test the atomic conversation upsert under concurrent first messages:
+
+1. Worker processes (each with its own connections, like uvicorn workers)
+   racing on the same visitors never create duplicate conversation rows,
+   and exactly one message per visitor counts as the first
+2. A message to a closed conversation reopens it and re-arms escalation;
+   the upsert reports opened exactly once on create and once on reopen
+3. The migration merges existing duplicates into one row
+4. The metrics backfill attributes conversations and agent rollups to the
+   replying staff member
+5. Routing happens after commit: a rolled-back message takes no routing
+   load, and a reopened conversation keeps its assignee
+
+Runs against a throwaway database:  python3 test_conversation_upsert.py
+"""
+import contextlib
+import io
+import json
+import logging
+import multiprocessing
+import os
+import tempfile
+
+import routing
+
+with contextlib.redirect_stdout(io.StringIO()):
+    import server
+
+WORKERS = 4
+VISITORS = 50
+MESSAGES_PER_VISITOR = 3  # per worker
+
+
+def setup_module(module=None):
+    logging.disable(logging.CRITICAL)
+    server.shard_router.close()
+    server.DB_PATH = os.path.join(tempfile.mkdtemp(), "upsert.sqlite")
+    server.db_init()
+
+
+def teardown_module(module=None):
+    server.shard_router.close()
+    logging.disable(logging.NOTSET)
+
+
+def worker(barrier, results):
+    server.shard_router.close()  # never share the parent's connections across fork
+    logging.disable(logging.CRITICAL)
+    barrier.wait()
+    first = 0
+    for round_ in range(MESSAGES_PER_VISITOR):
+        for v in range(VISITORS):
+            _, _, is_new, _ = server.store_inbound_message(f"race-{v}", "webchat", f"hello {round_}")
+            first += is_new
+    results.put(first)
+
+
+def test_concurrent_first_messages_create_one_conversation():
+    ctx = multiprocessing.get_context("fork")
+    barrier = ctx.Barrier(WORKERS)
+    results = ctx.Queue()
+    procs = [ctx.Process(target=worker, args=(barrier, results)) for _ in range(WORKERS)]
+    for p in procs:
+        p.start()
+    for p in procs:
+        p.join(60)
+        assert p.exitcode == 0
+    firsts = sum(results.get(timeout=5) for _ in procs)
+
+    with server.db_read() as conn:
+        dupes = conn.execute("""SELECT COUNT(*) FROM (SELECT 1 FROM conversations WHERE user_id LIKE 'race-%'
+                                GROUP BY user_id, channel HAVING COUNT(*) > 1)""").fetchone()[0]
+        convos = conn.execute("SELECT COUNT(*) FROM conversations WHERE user_id LIKE 'race-%'").fetchone()[0]
+        totals = conn.execute("""SELECT MIN(cm.total_messages), MAX(cm.total_messages) FROM conversations cv
+                                 JOIN conversation_metrics cm ON cm.conversation_id = cv.id
+                                 WHERE cv.user_id LIKE 'race-%'""").fetchone()
+    assert dupes == 0, f"{dupes} visitors got duplicate conversation rows"
+    assert convos == VISITORS
+    assert firsts == VISITORS, f"{firsts} messages were treated as a visitor's first (expected {VISITORS})"
+    assert tuple(totals) == (WORKERS * MESSAGES_PER_VISITOR,) * 2
+
+
+def test_message_reopens_closed_conversation():
+    server.store_inbound_message("reopen", "webchat", "first")
+    with server.db() as conn:
+        conn.execute("UPDATE conversations SET open=0, escalation_active=0, patience_sent=1, final_sent=1, "
+                     "closed_at='2024-01-01T00:00:00Z' WHERE user_id='reopen'")
+    _, _, is_new, _ = server.store_inbound_message("reopen", "webchat", "back again")
+    assert not is_new
+    with server.db_read() as conn:
+        row = conn.execute("SELECT open, escalation_active, patience_sent, final_sent, closed_at "
+                           "FROM conversations WHERE user_id='reopen'").fetchone()
+    assert tuple(row) == (1, 1, 0, 0, None)
+
+
+def test_upsert_reports_create_and_reopen_once():
+    def upsert():
+        with server.db() as conn:
+            return server.upsert_conversation(conn, "opened", "webchat", server.timestamps.now_ms())
+
+    conversation_id, opened = upsert()
+    assert opened
+    assert upsert() == (conversation_id, False)
+    with server.db() as conn:
+        conn.execute("UPDATE conversations SET open=0 WHERE id=?", (conversation_id,))
+    assert upsert() == (conversation_id, True)
+    assert upsert() == (conversation_id, False)
+
+
+def test_duplicate_external_id_leaves_conversation_untouched():
+    message_id, _, _, _ = server.store_inbound_message("retry", "sms", "hi", external_id="SM-retry")
+    assert message_id is not None
+    with server.db_read() as conn:
+        before = conn.execute("SELECT updated_at_ms FROM conversations WHERE user_id='retry'").fetchone()[0]
+    assert server.store_inbound_message("retry", "sms", "hi", external_id="SM-retry") == (None, None, False, None)
+    with server.db_read() as conn:
+        assert conn.execute("SELECT updated_at_ms FROM conversations WHERE user_id='retry'").fetchone()[0] == before
+
+
+def test_migration_merges_existing_duplicates():
+    with server.db() as conn:
+        conn.execute("DROP INDEX idx_conversations_user_channel")
+        ids = [conn.execute("INSERT INTO conversations (user_id, channel, open, updated_at_ms, created_at) "
+                            "VALUES ('dup', 'webchat', ?, ?, ?) RETURNING id", (open_, updated, created)).fetchone()[0]
+               for open_, updated, created in ((0, 100, "2024-01-01"), (1, 300, "2024-01-02"), (0, 200, "2024-01-03"))]
+        for conversation_id in ids:
+            conn.execute("INSERT INTO conversation_metrics (tenant_id, conversation_id, total_messages, updated_at) "
+                         "VALUES (1, ?, 2, 'x')", (conversation_id,))
+        assert server.dedupe_conversations(conn) == 2
+        conn.execute("CREATE UNIQUE INDEX idx_conversations_user_channel ON conversations(user_id, channel)")
+    with server.db_read() as conn:
+        rows = conn.execute("SELECT id, open, updated_at_ms, created_at FROM conversations WHERE user_id='dup'").fetchall()
+        total = conn.execute("SELECT total_messages FROM conversation_metrics WHERE conversation_id=?",
+                             (ids[0],)).fetchone()[0]
+        orphans = conn.execute("SELECT COUNT(*) FROM conversation_metrics WHERE conversation_id IN (?, ?)",
+                               ids[1:]).fetchone()[0]
+    # Oldest id survives with the latest state and the earliest creation time
+    assert [tuple(r) for r in rows] == [(ids[0], 1, 300, "2024-01-01")]
+    assert total == 6 and orphans == 0
+
+
+def test_backfill_keys_rows_by_conversation_id():
+    _, conversation_id, _, _ = server.store_inbound_message("keyed", "webchat", "live")
+    with server.db() as conn:
+        conn.executemany("INSERT INTO messages (user_id, channel, sender, text) VALUES (?, 'webchat', 'user', ?)",
+                         (("keyed", "legacy"), ("nobody", "orphan")))
+        assert server.backfill_conversation_ids(conn, "messages") == 2
+    with server.db_read() as conn:
+        keyed = conn.execute("SELECT DISTINCT conversation_id FROM messages WHERE user_id='keyed'").fetchall()
+    assert [r[0] for r in keyed] == [conversation_id]
+    assert [m["text"] for m in server.get_messages("keyed", "webchat")["messages"]] == ["live", "legacy"]
+    assert [m["text"] for m in server.get_messages("nobody", "webchat")["messages"]] == ["orphan"]
+
+
+def test_metrics_backfill_attributes_staff():
+    _, conversation_id, _, _ = server.store_inbound_message("helped", "webchat", "help")
+    server.add_message("helped", "webchat", "staff", "on it", staff_id=7, conversation_id=conversation_id)
+    server.close_conversations([("helped", "webchat")])
+    with server.db_tiered() as conn:
+        server.metrics.backfill(conn, message_source="all_messages")
+        assigned = conn.execute("SELECT assigned_staff_id FROM conversation_metrics WHERE conversation_id=?",
+                                (conversation_id,)).fetchone()[0]
+        agent = conn.execute("SELECT SUM(total_chats), SUM(closed_chats) FROM agent_metrics WHERE staff_id=7").fetchone()
+        totals = server.stats_totals(conn, server.timestamps.ago_ms(days=1))
+    assert assigned == 7
+    assert tuple(agent) == (1, 1)
+    assert totals["staff_messages"] >= 1
+
+
+def test_routing_after_commit_keeps_assignee_on_reopen():
+    config = os.path.join(tempfile.mkdtemp(), "shifts.json")
+    with open(config, "w") as f:
+        json.dump([{"name": "all day", "start": "00:00", "end": "23:59", "numbers": ["+15550009999"]}], f)
+    previous, server.shift_router = server.shift_router, routing.ShiftRouter(config)
+    record_message = server.metrics.record_message
+    try:
+        def failing(*args, **kwargs):
+            raise server.sqlite3.OperationalError("disk I/O error")
+        server.metrics.record_message = failing
+        try:
+            server.store_inbound_message("rolled-back", "webchat", "lost")
+        except server.sqlite3.OperationalError:
+            pass
+        server.metrics.record_message = record_message
+        assert server.shift_router.loads["+15550009999"] == 0
+
+        _, conversation_id, _, assignment = server.store_inbound_message("routed", "webchat", "hi")
+        assert assignment["assigned_staff"] == "+15550009999"
+        assert server.shift_router.loads["+15550009999"] == 1
+        assert server.store_inbound_message("routed", "webchat", "still there")[3] is None  # already open
+
+        server.close_idle_batch(server.timestamps.now_ms() + 1, 100)
+        assert server.shift_router.loads["+15550009999"] == 0
+        assert server.store_inbound_message("routed", "webchat", "back")[3]["assigned_staff"] == "+15550009999"
+        assert server.shift_router.loads["+15550009999"] == 1
+        with server.db_read() as conn:
+            row = conn.execute("SELECT assigned_staff, assignment_routed FROM conversations WHERE id=?",
+                               (conversation_id,)).fetchone()
+        assert tuple(row) == ("+15550009999", 1)
+    finally:
+        server.metrics.record_message = record_message
+        server.shift_router = previous
+
+
+if __name__ == "__main__":
+    print("=" * 60)
+    print("CONVERSATION UPSERT TEST")
+    print("=" * 60)
+    setup_module()
+    try:
+        for test in (test_concurrent_first_messages_create_one_conversation, test_message_reopens_closed_conversation,
+                     test_upsert_reports_create_and_reopen_once,
+                     test_duplicate_external_id_leaves_conversation_untouched,
+                     test_migration_merges_existing_duplicates, test_backfill_keys_rows_by_conversation_id,
+                     test_metrics_backfill_attributes_staff, test_routing_after_commit_keeps_assignee_on_reopen):
+            test()
+            print(f"✅ {test.__name__}")
+    finally:
+        teardown_module()
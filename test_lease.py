@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+"""
+Test leader election for the background jobs (lease.py):
+
+1. Of two workers on one database the first acquires the lease and the
+   second is refused while its TTL is live
+2. Renewal extends the lease and keeps its acquisition time
+3. The second worker takes over once the holder stops renewing
+4. The escalation, auto-close, archive and backup loops do no work on a
+   worker that is not the leader (and do once it is)
+
+Runs against a throwaway database:  python3 test_lease.py
+"""
+import asyncio
+import contextlib
+import io
+import logging
+import os
+import sqlite3
+import tempfile
+import time
+
+import lease
+
+with contextlib.redirect_stdout(io.StringIO()):
+    import server
+
+TTL = 0.5
+
+
+def setup_module(module=None):
+    logging.disable(logging.CRITICAL)
+    server.shard_router.close()
+    server.DB_PATH = os.path.join(tempfile.mkdtemp(), "lease.sqlite")
+    server.db_init()
+
+
+def teardown_module(module=None):
+    server.shard_router.close()
+    logging.disable(logging.NOTSET)
+
+
+def lease_row(db_path: str):
+    conn = sqlite3.connect(db_path)
+    try:
+        return conn.execute("SELECT holder, expires_at, acquired_at FROM leases WHERE name='jobs'").fetchone()
+    finally:
+        conn.close()
+
+
+def test_acquire_renew_and_take_over():
+    db_path = os.path.join(tempfile.mkdtemp(), "leases.sqlite")
+    conn = sqlite3.connect(db_path)
+    lease.init_schema(conn)
+    conn.close()
+    first, second = lease.Lease("jobs", db_path, ttl=TTL), lease.Lease("jobs", db_path, ttl=TTL)
+
+    assert first.try_acquire() and first.is_leader
+    assert not second.try_acquire() and not second.is_leader
+    holder, expires_at, acquired_at = lease_row(db_path)
+    assert holder == first.holder
+
+    time.sleep(TTL / 3)
+    assert first.try_acquire()
+    _, renewed_until, renewed_acquired_at = lease_row(db_path)
+    assert renewed_until > expires_at and renewed_acquired_at == acquired_at
+    assert not second.try_acquire()
+
+    time.sleep(TTL * 1.2)  # the holder stops renewing
+    assert not first.is_leader
+    assert second.try_acquire() and second.is_leader
+    assert lease_row(db_path)[0] == second.holder
+    assert not first.try_acquire()
+
+
+def run_loops(is_leader: bool) -> dict:
+    """Run the job loops briefly with sleeps cut to a yield; returns how often each did its work"""
+    calls = {"escalation": 0, "auto_close": 0, "archive": 0, "backup": 0}
+
+    async def escalation_pass():
+        calls["escalation"] += 1
+
+    def close_idle_batch(idle_before_ms, batch_size):
+        calls["auto_close"] += 1
+        return []
+
+    def archive_closed_batch(closed_before_ms):
+        calls["archive"] += 1
+        return 0
+
+    class Backups:
+        def create(self, files):
+            calls["backup"] += 1
+
+    real_sleep = asyncio.sleep
+
+    async def fast_sleep(delay, *args, **kwargs):
+        await real_sleep(0)
+
+    async def run():
+        tasks = [asyncio.create_task(loop()) for loop in (server.escalation_loop, server.auto_close_loop,
+                                                          server.archive_loop, server.backup_loop)]
+        await real_sleep(0.3)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    worker = lease.Lease("background-jobs", server.DB_PATH)
+    worker._valid_until = time.time() + 3600 if is_leader else 0.0
+    saved = (server.job_leader, server.escalation_pass, server.close_idle_batch, server.archive_closed_batch,
+             server.backup_service)
+    server.job_leader, server.escalation_pass, server.close_idle_batch = worker, escalation_pass, close_idle_batch
+    server.archive_closed_batch, server.backup_service = archive_closed_batch, Backups()
+    asyncio.sleep = fast_sleep
+    try:
+        asyncio.run(run())
+    finally:
+        asyncio.sleep = real_sleep
+        (server.job_leader, server.escalation_pass, server.close_idle_batch, server.archive_closed_batch,
+         server.backup_service) = saved
+    return calls
+
+
+def test_loops_idle_on_standby():
+    assert run_loops(is_leader=False) == {"escalation": 0, "auto_close": 0, "archive": 0, "backup": 0}
+    assert all(run_loops(is_leader=True).values())
+
+
+if __name__ == "__main__":
+    print("=" * 60)
+    print("LEASE TEST")
+    print("=" * 60)
+    setup_module()
+    try:
+        for test in (test_acquire_renew_and_take_over, test_loops_idle_on_standby):
+            test()
+            print(f"✅ {test.__name__}")
+    finally:
+        teardown_module()
@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+"""
+Test the ingestion rate limits (ratelimit.py):
+
+1. A bucket allows its burst, then refills at its rate
+2. A request refused by one limit takes nothing from the others
+3. Idle buckets are evicted once full; the cap bounds the rest
+4. Queue mode waits for a token instead of refusing
+5. End to end: POST /webchat answers 429 with Retry-After, the visitor
+   socket gets rate_limited frames, and surplus typing frames are dropped
+
+Runs against a throwaway database:  python3 test_rate_limit.py
+"""
+import asyncio
+import contextlib
+import io
+import json
+import logging
+import os
+import tempfile
+
+import ratelimit
+
+with contextlib.redirect_stdout(io.StringIO()):
+    import server
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def setup_module(module=None):
+    logging.disable(logging.CRITICAL)
+    server.shard_router.close()
+    server.DB_PATH = os.path.join(tempfile.mkdtemp(), "ratelimit.sqlite")
+    server.db_init()
+
+
+def teardown_module(module=None):
+    server.shard_router.close()
+    logging.disable(logging.NOTSET)
+
+
+def test_burst_then_refill():
+    clock = Clock()
+    limiter = ratelimit.RateLimiter(rate=2, burst=3, clock=clock)
+    assert [ratelimit.check([(limiter, "v")])[0] for _ in range(4)] == [True, True, True, False]
+    assert ratelimit.check([(limiter, "v")]) == (False, 0.5)
+    clock.now += 0.5
+    assert ratelimit.check([(limiter, "v")])[0]
+    assert ratelimit.check([(limiter, "other")])[0]  # keys are independent
+    assert limiter.stats["allowed"] == 5 and limiter.stats["limited"] == 2
+
+
+def test_refusal_costs_nothing():
+    clock = Clock()
+    loose = ratelimit.RateLimiter(rate=1, burst=5, clock=clock)
+    tight = ratelimit.RateLimiter(rate=1, burst=1, clock=clock)
+    assert ratelimit.check([(loose, "k"), (tight, "k")])[0]
+    for _ in range(3):
+        assert not ratelimit.check([(loose, "k"), (tight, "k")])[0]
+    assert loose.buckets["k"].tokens == 4
+    assert loose.stats["limited"] == 0 and tight.stats["limited"] == 3
+    assert ratelimit.check([(loose, "k"), (tight, None)])[0]  # None keys are skipped
+
+
+def test_eviction():
+    clock = Clock()
+    limiter = ratelimit.RateLimiter(rate=1, burst=2, max_buckets=100, clock=clock)
+    for i in range(50):
+        ratelimit.check([(limiter, i)])
+    clock.now += 1  # each bucket is back at 2 tokens
+    for i in range(50, 75):
+        ratelimit.check([(limiter, i)])
+    assert len(limiter.buckets) == 25 and limiter.stats["evicted_idle"] == 50
+    for i in range(75, 300):
+        ratelimit.check([(limiter, i)])  # no time passes: nothing is idle yet
+    assert len(limiter.buckets) == 100 and limiter.stats["evicted_cap"] == 150
+
+
+def test_queue_waits_in_order():
+    clock = Clock()
+    limiter = ratelimit.RateLimiter(rate=10, burst=1, clock=clock)
+    waits = [ratelimit.check([(limiter, "v")], max_wait=1)[1] for _ in range(3)]
+    assert waits == [0, 0.1, 0.2]  # each waiter already holds its token
+
+    limiter = ratelimit.RateLimiter(rate=10, burst=1)
+
+    async def three_requests():
+        return await asyncio.gather(*(ratelimit.admit([(limiter, "v")], overload="queue") for _ in range(3)))
+
+    assert asyncio.run(asyncio.wait_for(three_requests(), 2)) == [0, 0, 0]
+    assert asyncio.run(ratelimit.admit([(limiter, "v")], overload="reject")) > 0
+
+
+def test_endpoints():
+    from fastapi.testclient import TestClient
+
+    previous = server.visitor_limits, server.ip_limits, server.typing_limits
+    server.visitor_limits = ratelimit.RateLimiter(rate=0.01, burst=2)
+    server.ip_limits = ratelimit.RateLimiter(rate=0.01, burst=100)
+    server.typing_limits = ratelimit.RateLimiter(rate=0.01, burst=1)
+    try:
+        run_endpoint_checks(TestClient(server.app))
+    finally:
+        server.visitor_limits, server.ip_limits, server.typing_limits = previous
+
+
+def run_endpoint_checks(client):
+    body = {"user_id": "visitor-flood", "text": "hi"}
+    statuses = [client.post("/webchat", json=body).status_code for _ in range(3)]
+    assert statuses == [200, 200, 429]
+    r = client.post("/webchat", json=body)
+    assert int(r.headers["Retry-After"]) > 0
+    assert client.post("/webchat", json={**body, "user_id": "visitor-calm"}).status_code == 200
+
+    with client.websocket_connect("/ws/visitor-flood") as ws:
+        ws.send_text(json.dumps({"type": "message", "text": "again", "client_id": "c1"}))
+        frame = ws.receive_json()
+        assert frame["type"] == "rate_limited" and frame["client_id"] == "c1" and frame["retry_after"] > 0
+    before = server.typing_limits.stats["limited"]
+    with client.websocket_connect("/ws/visitor-typist") as ws:
+        for _ in range(3):
+            ws.send_text(json.dumps({"type": "typing"}))
+        ws.send_text(json.dumps({"type": "message", "text": "done", "client_id": "c2"}))
+        frame = ws.receive_json()
+        while frame.get("type") != "ack":
+            frame = ws.receive_json()
+    assert server.typing_limits.stats["limited"] - before == 2
+    assert server.ip_limits.stats["limited"] == 0
+
+
+if __name__ == "__main__":
+    print("=" * 60)
+    print("RATE LIMIT TEST")
+    print("=" * 60)
+    setup_module()
+    try:
+        for test in (test_burst_then_refill, test_refusal_costs_nothing, test_eviction, test_queue_waits_in_order,
+                     test_endpoints):
+            test()
+            print(f"✅ {test.__name__}")
+    finally:
+        teardown_module()
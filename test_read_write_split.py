@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+"""
+Test the read/write connection split under concurrent report + ingest load:
+
+1. Readers are query_only
+2. A read block is one snapshot (writes committed meanwhile are not seen)
+3. Long reports running continuously never stall add_message
+
+Runs against a throwaway database:  python3 test_read_write_split.py
+"""
+import contextlib
+import io
+import logging
+import os
+import sqlite3
+import statistics
+import tempfile
+import threading
+import time
+
+with contextlib.redirect_stdout(io.StringIO()):
+    import server
+
+SEED_CONVERSATIONS = 2000
+INGEST_MESSAGES = 300
+MAX_WRITE_MS = 250  # generous for slow CI disks; a blocked writer waits seconds
+
+
+def setup_module(module=None):
+    logging.disable(logging.CRITICAL)
+    workdir = tempfile.mkdtemp()
+    server.shard_router.close()
+    server.DB_PATH = os.path.join(workdir, "rw.sqlite")
+    server.db_init()
+    now = server.timestamps.now_ms()
+    with server.db() as conn:
+        conn.executemany(
+            "INSERT INTO conversations (user_id, channel, open, updated_at, updated_at_ms) VALUES (?, 'webchat', 0, ?, ?)",
+            ((f"v{i}", server.timestamps.to_iso(now - i), now - i) for i in range(SEED_CONVERSATIONS)))
+        conn.executemany(
+            "INSERT INTO messages (user_id, channel, sender, text, ts, ts_ms) VALUES (?, 'webchat', 'user', 'hello', ?, ?)",
+            ((f"v{i % SEED_CONVERSATIONS}", server.timestamps.to_iso(now), now) for i in range(SEED_CONVERSATIONS * 5)))
+    server.ensure_conversation("live", "webchat")
+
+
+def teardown_module(module=None):
+    server.shard_router.close()
+    logging.disable(logging.NOTSET)
+
+
+def test_readers_are_query_only():
+    with server.db_read() as conn:
+        try:
+            conn.execute("INSERT INTO messages (user_id, channel, sender, text) VALUES ('x', 'webchat', 'user', 'x')")
+        except sqlite3.OperationalError as e:
+            assert "readonly" in str(e)
+        else:
+            raise AssertionError("write through a read connection succeeded")
+
+
+def count_messages(conn):
+    return conn.execute("SELECT COUNT(*) FROM messages").fetchone()[0]
+
+
+def test_read_block_is_a_snapshot():
+    with server.db_read() as conn:
+        before = count_messages(conn)
+        started = time.perf_counter()
+        server.add_message("live", "webchat", "user", "written while a reader is open")
+        write_ms = (time.perf_counter() - started) * 1000
+        assert count_messages(conn) == before, "reader saw a write committed after its snapshot"
+    assert write_ms < MAX_WRITE_MS
+    with server.db_read() as conn:
+        assert count_messages(conn) == before + 1
+
+
+def test_reports_do_not_block_ingest():
+    stop = threading.Event()
+    reports = []
+
+    def report_load():
+        while not stop.is_set():
+            started = time.perf_counter()
+            server.history_payload()
+            server.conversations_payload("closed")
+            with server.db_read_tiered() as conn:
+                conn.execute("SELECT user_id, COUNT(*) FROM all_messages GROUP BY user_id").fetchall()
+            reports.append((time.perf_counter() - started) * 1000)
+
+    readers = [threading.Thread(target=report_load) for _ in range(2)]
+    for t in readers:
+        t.start()
+    write_ms = []
+    try:
+        for i in range(INGEST_MESSAGES):
+            started = time.perf_counter()
+            server.add_message("live", "webchat", "user", f"ingest {i}")
+            write_ms.append((time.perf_counter() - started) * 1000)
+    finally:
+        stop.set()
+        for t in readers:
+            t.join()
+
+    print(f"   {len(reports)} reports (median {statistics.median(reports):.1f} ms) alongside "
+          f"{len(write_ms)} writes (median {statistics.median(write_ms):.2f} ms, max {max(write_ms):.1f} ms)")
+    assert reports, "no report completed during ingest"
+    assert max(write_ms) < MAX_WRITE_MS, f"add_message stalled for {max(write_ms):.0f} ms behind reports"
+
+
+if __name__ == "__main__":
+    print("=" * 60)
+    print("READ/WRITE SPLIT TEST")
+    print("=" * 60)
+    setup_module()
+    try:
+        for test in (test_readers_are_query_only, test_read_block_is_a_snapshot, test_reports_do_not_block_ingest):
+            test()
+            print(f"✅ {test.__name__}")
+    finally:
+        teardown_module()
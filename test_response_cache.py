@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+"""
+Test the per-resource write generations behind the admin list ETags:
+
+1. A visitor's delivery cursor changes no ETag
+2. Marking a followup viewed changes the followups ETag only
+3. A new message changes the conversation and history ETags
+
+Runs against a throwaway database:  python3 test_response_cache.py
+"""
+import contextlib
+import io
+import logging
+import os
+import tempfile
+
+with contextlib.redirect_stdout(io.StringIO()):
+    import server
+
+ENDPOINTS = {"convos": ("conversations",), "history": ("conversations", "history"), "followups": ("followups",)}
+
+
+def setup_module(module=None):
+    logging.disable(logging.CRITICAL)
+    server.shard_router.close()
+    server.DB_PATH = os.path.join(tempfile.mkdtemp(), "respcache.sqlite")
+    server.db_init()
+
+
+def teardown_module(module=None):
+    server.shard_router.close()
+    logging.disable(logging.NOTSET)
+
+
+def etags() -> dict:
+    with server.db_read() as conn:
+        return {name: server.respcache.current(conn, *resources) for name, resources in ENDPOINTS.items()}
+
+
+def changed(before: dict) -> set:
+    after = etags()
+    return {name for name in before if before[name] != after[name]}
+
+
+def test_writes_bump_only_what_they_change():
+    message_id, conversation_id, _, _ = server.store_inbound_message("cached", "webchat", "hello")
+    server.store_followup(server.FollowupSchema(user_id="cached", channel="webchat", name="V", email="v@example.com",
+                                                phone="", message="call me"))
+    with server.db_read() as conn:
+        followup_id = conn.execute("SELECT id FROM followups WHERE user_id='cached'").fetchone()[0]
+
+    before = etags()
+    server.save_visitor_delivered(conversation_id, message_id)
+    assert changed(before) == set()
+
+    before = etags()
+    server.mark_followups_viewed([followup_id])
+    assert changed(before) == {"followups"}
+
+    before = etags()
+    server.add_message("cached", "webchat", "staff", "hi", staff_id=1, conversation_id=conversation_id)
+    assert changed(before) == {"convos", "history"}
+
+
+def test_admin_lists_leave_out_delivery_cursor():
+    server.store_inbound_message("cursor", "webchat", "hello")
+    convos = server.open_convos_payload()["conversations"]
+    assert convos and all("visitor_delivered_id" not in c for c in convos)
+    convo = server.get_conversation_messages("cursor", "webchat").body
+    assert b'"conversation"' in convo and b"visitor_delivered_id" not in convo and b"open_token" not in convo
+
+
+if __name__ == "__main__":
+    print("=" * 60)
+    print("RESPONSE CACHE TEST")
+    print("=" * 60)
+    setup_module()
+    try:
+        for test in (test_writes_bump_only_what_they_change, test_admin_lists_leave_out_delivery_cursor):
+            test()
+            print(f"✅ {test.__name__}")
+    finally:
+        teardown_module()
@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+"""
+Test the admin full-text search (search.py, GET /admin/api/search):
+
+1. A message, a followup and a history row are each found under their
+   own source, and only there
+2. Staff see messages only; asking for admin-only sources is refused
+3. With TENANT_SHARDS=0, staff of a non-default tenant find their rows,
+   which are indexed under the default tenant
+
+Runs against a throwaway database:  python3 test_search.py
+"""
+import contextlib
+import io
+import logging
+import os
+import tempfile
+
+with contextlib.redirect_stdout(io.StringIO()):
+    import server
+from auth import create_access_token
+
+
+def setup_module(module=None):
+    logging.disable(logging.CRITICAL)
+    server.shard_router.close()
+    server.DB_PATH = os.path.join(tempfile.mkdtemp(), "search.sqlite")
+    server.db_init()
+    server.store_inbound_message("searcher", "webchat", "my zebra is lost")
+    for message in ("giraffe sighting", "walrus question"):
+        server.store_followup(server.FollowupSchema(user_id="searcher", name="Sam", email="sam@example.com",
+                                                    phone="", message=message))
+    with server.db_read() as conn:
+        walrus = conn.execute("SELECT id FROM followups WHERE message LIKE 'walrus%'").fetchone()[0]
+    assert server.migrate_followup(walrus)
+
+
+def teardown_module(module=None):
+    server.shard_router.close()
+    logging.disable(logging.NOTSET)
+
+
+def auth(role: str, tenant_id: int = 1) -> dict:
+    token = create_access_token({"id": 1, "tenant_id": tenant_id, "email": "s@example.com", "name": "S", "role": role})
+    return {"Authorization": f"Bearer {token}"}
+
+
+def found(client, q: str, role: str = "admin", tenant_id: int = 1, **params):
+    r = client.get("/admin/api/search", params={"q": q, **params}, headers=auth(role, tenant_id))
+    assert r.status_code == 200, r.text
+    return sorted({hit["source"] for hit in r.json()["results"]})
+
+
+def test_each_source_is_searchable():
+    from fastapi.testclient import TestClient
+
+    client = TestClient(server.app)
+    assert found(client, "zebra") == ["message"]
+    assert found(client, "giraffe") == ["followup"]
+    # Migration logs the followup in the thread too
+    assert found(client, "walrus") == ["history", "message"]
+    assert found(client, "walrus", source="history") == ["history"]
+    assert found(client, "giraffe", source="message") == []
+
+
+def test_staff_see_messages_only():
+    from fastapi.testclient import TestClient
+
+    client = TestClient(server.app)
+    assert found(client, "zebra", role="staff") == ["message"]
+    assert found(client, "giraffe", role="staff") == []
+    assert found(client, "walrus", role="staff") == ["message"]
+    r = client.get("/admin/api/search", params={"q": "giraffe", "source": "followup"}, headers=auth("staff"))
+    assert r.status_code == 403
+
+
+def test_unsharded_tenant_finds_its_rows():
+    from fastapi.testclient import TestClient
+
+    server.shard_router.enabled = False
+    try:
+        assert found(TestClient(server.app), "zebra", tenant_id=2) == ["message"]
+    finally:
+        server.shard_router.enabled = True
+
+
+if __name__ == "__main__":
+    print("=" * 60)
+    print("SEARCH TEST")
+    print("=" * 60)
+    setup_module()
+    try:
+        for test in (test_each_source_is_searchable, test_staff_see_messages_only, test_unsharded_tenant_finds_its_rows):
+            test()
+            print(f"✅ {test.__name__}")
+    finally:
+        teardown_module()
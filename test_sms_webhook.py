@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+"""
+Test the Twilio /sms webhook's retry handling:
+
+1. A message whose inline ingestion fails is not remembered as seen, so
+   Twilio's retry stores it
+2. A retry of a stored message is acked without a reply and without
+   spending the sender's rate-limit tokens
+3. The ingest worker retries a failed message instead of dropping it
+
+Runs against a throwaway database:  python3 test_sms_webhook.py
+"""
+import asyncio
+import contextlib
+import io
+import logging
+import os
+import tempfile
+
+with contextlib.redirect_stdout(io.StringIO()):
+    import server
+
+
+def setup_module(module=None):
+    logging.disable(logging.CRITICAL)
+    server.shard_router.close()
+    server.DB_PATH = os.path.join(tempfile.mkdtemp(), "sms.sqlite")
+    server.db_init()
+
+
+def teardown_module(module=None):
+    server.shard_router.close()
+    logging.disable(logging.NOTSET)
+
+
+def stored(sid):
+    with server.db_read() as conn:
+        return conn.execute("SELECT COUNT(*) FROM messages WHERE external_id=?", (f"twilio:{sid}",)).fetchone()[0]
+
+
+def flaky_store(failures):
+    real = server.store_inbound_message
+    calls = []
+
+    def store(*args):
+        calls.append(args)
+        if len(calls) <= failures:
+            raise server.sqlite3.OperationalError("database is locked")
+        return real(*args)
+    return store, real
+
+
+def test_failed_inline_ingest_is_retried():
+    from fastapi.testclient import TestClient
+
+    client = TestClient(server.app, raise_server_exceptions=False)
+    full = asyncio.Queue(maxsize=1)
+    full.put_nowait(None)  # saturated: the webhook ingests inline
+    previous_queue = server.sms_ingest_queue
+    server.sms_ingest_queue = full
+    server.store_inbound_message, real = flaky_store(1)
+    form = {"From": "+15550001111", "Body": "hello", "MessageSid": "SM-inline"}
+    try:
+        assert client.post("/sms", data=form).status_code == 500
+        assert stored("SM-inline") == 0
+        r = client.post("/sms", data=form)  # Twilio's retry
+        assert r.status_code == 200 and "Thanks" in r.text
+        assert stored("SM-inline") == 1
+
+        tokens = server.phone_limits.buckets[server.phone_key(form["From"])].tokens
+        r = client.post("/sms", data=form)
+        assert r.status_code == 200 and "Thanks" not in r.text
+        assert server.phone_limits.buckets[server.phone_key(form["From"])].tokens == tokens  # bucket untouched
+        assert stored("SM-inline") == 1
+    finally:
+        server.store_inbound_message = real
+        server.sms_ingest_queue = previous_queue
+
+
+def test_worker_retries_failed_ingest():
+    async def run():
+        server.sms_ingest_queue = asyncio.Queue()
+        worker = asyncio.create_task(server.sms_ingest_worker())
+        await server.sms_ingest_queue.put((server.DEFAULT_TENANT_ID, "+15550002222", "sms", "queued", "SM-worker"))
+        await asyncio.wait_for(server.sms_ingest_queue.join(), 10)
+        worker.cancel()
+
+    previous_queue = server.sms_ingest_queue
+    server.store_inbound_message, real = flaky_store(1)
+    try:
+        asyncio.run(run())
+    finally:
+        server.store_inbound_message = real
+        server.sms_ingest_queue = previous_queue
+    assert stored("SM-worker") == 1
+    assert "SM-worker" in server.recent_sms_sids
+
+
+if __name__ == "__main__":
+    print("=" * 60)
+    print("SMS WEBHOOK TEST")
+    print("=" * 60)
+    setup_module()
+    try:
+        for test in (test_failed_inline_ingest_is_retried, test_worker_retries_failed_ingest):
+            test()
+            print(f"✅ {test.__name__}")
+    finally:
+        teardown_module()
@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+"""
+Test the visitor socket lifecycle (liveness.SocketRegistry):
+
+1. A quiet socket is pinged, then closed as dead if nothing comes back
+2. A socket without chat traffic is evicted as idle; pongs don't count
+3. Per-address cap refuses sockets; per-visitor cap displaces the oldest tab
+4. Bookkeeping is empty again after every socket is released
+5. End to end over /ws: ping frame, pong, and the oldest tab closed with 4001
+6. X-Forwarded-For counts only from a trusted proxy, and only its own entry
+
+Runs against a throwaway database:  python3 test_socket_lifecycle.py
+"""
+import contextlib
+import io
+import json
+import logging
+import os
+import tempfile
+
+import liveness
+
+with contextlib.redirect_stdout(io.StringIO()):
+    import server
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def registry(**limits):
+    clock = Clock()
+    options = {"ping_interval": 10, "pong_timeout": 25, "idle_seconds": 100, "max_per_ip": 3, "max_per_visitor": 2}
+    options.update(limits)
+    return liveness.SocketRegistry(clock=clock, **options), clock
+
+
+def setup_module(module=None):
+    logging.disable(logging.CRITICAL)
+    server.shard_router.close()
+    server.DB_PATH = os.path.join(tempfile.mkdtemp(), "lifecycle.sqlite")
+    server.db_init()
+
+
+def teardown_module(module=None):
+    server.shard_router.close()
+    logging.disable(logging.NOTSET)
+
+
+def test_ping_then_dead():
+    sockets, clock = registry()
+    assert sockets.admit("ws", "v1", "1.1.1.1") == []
+    action, wait = sockets.poll("ws")
+    assert action is None and wait == 10
+    clock.now += 10
+    assert sockets.poll("ws") == ("ping", 0.0)
+    clock.now += 5
+    sockets.seen("ws")  # pong
+    assert sockets.poll("ws")[0] is None
+    clock.now += 10
+    assert sockets.poll("ws")[0] == "ping"
+    assert sockets.poll("ws")[0] is None  # one ping per interval
+    clock.now += 15  # no pong: silent for the whole timeout
+    assert sockets.poll("ws") == ("dead", 0.0)
+    assert sockets.stats["dead"] == 1
+
+
+def test_idle_eviction_ignores_pongs():
+    sockets, clock = registry()
+    sockets.admit("ws", "v1", "1.1.1.1")
+    for _ in range(9):
+        clock.now += 10
+        sockets.poll("ws")
+        sockets.seen("ws")  # pong only
+    sockets.pushed("ws")  # a staff reply keeps a reading tab open
+    clock.now += 99
+    sockets.seen("ws")
+    assert sockets.poll("ws")[0] in (None, "ping")
+    clock.now += 1
+    sockets.seen("ws")
+    assert sockets.poll("ws") == ("idle", 0.0)
+
+
+def test_caps():
+    sockets, _ = registry()
+    assert sockets.admit("a1", "alice", "1.1.1.1") == []
+    assert sockets.admit("a2", "alice", "1.1.1.1") == []
+    assert sockets.admit("a3", "alice", "1.1.1.1") == ["a1"]
+    assert sockets.poll("a1")[0] == "replaced"
+    assert sockets.admit("b1", "bob", "1.1.1.1") == []
+    assert sockets.admit("b2", "bob", "1.1.1.1") is None  # address full
+    assert sockets.admit("b2", "bob", "2.2.2.2") == []
+    assert sockets.stats["rejected_ip"] == 1 and sockets.stats["replaced"] == 1
+    for ws in ("a1", "a2", "a3", "b1", "b2", "a2"):
+        sockets.release(ws)  # idempotent
+    assert not sockets.conns and not sockets.by_ip and not sockets.by_visitor
+    assert sockets.metrics()["sockets"] == 0
+
+
+def test_client_address_ignores_spoofed_forwarded_for():
+    previous = liveness.TRUSTED_PROXY_NETWORKS
+    liveness.TRUSTED_PROXY_NETWORKS = [liveness.ipaddress.ip_network("10.0.0.0/8")]
+    liveness.is_trusted_proxy.cache_clear()
+    try:
+        assert liveness.client_address("10.1.2.3", "198.51.100.7") == "198.51.100.7"
+        # Spoofed entries sit left of the one the proxy appended
+        assert liveness.client_address("10.1.2.3", "1.1.1.1, 198.51.100.7") == "198.51.100.7"
+        assert liveness.client_address("10.1.2.3", "198.51.100.7, 10.9.9.9") == "198.51.100.7"
+        # Straight from the internet: the header is the client's own claim
+        assert liveness.client_address("203.0.113.5", "1.1.1.1") == "203.0.113.5"
+        assert liveness.client_address("10.1.2.3", None) == "10.1.2.3"
+        assert liveness.client_address(None, "1.1.1.1") == "unknown"
+    finally:
+        liveness.TRUSTED_PROXY_NETWORKS = previous
+        liveness.is_trusted_proxy.cache_clear()
+
+
+def test_endpoint_pings_and_replaces_oldest_tab():
+    from fastapi.testclient import TestClient
+    from starlette.websockets import WebSocketDisconnect
+
+    previous = server.visitor_sockets
+    server.visitor_sockets = liveness.SocketRegistry(ping_interval=0.2, pong_timeout=5, idle_seconds=60,
+                                                     max_per_ip=10, max_per_visitor=1)
+    try:
+        run_endpoint_checks(TestClient(server.app), WebSocketDisconnect)
+    finally:
+        server.visitor_sockets = previous
+
+
+def run_endpoint_checks(client, WebSocketDisconnect):
+    with client.websocket_connect("/ws/visitor-lifecycle") as first:
+        assert first.receive_json() == {"type": "ping"}
+        first.send_text(json.dumps({"type": "pong"}))
+        with client.websocket_connect("/ws/visitor-lifecycle") as second:
+            try:
+                first.receive_json()
+            except WebSocketDisconnect as e:
+                assert e.code == liveness.CLOSE_REPLACED
+            else:
+                raise AssertionError("oldest tab was not closed")
+            assert second.receive_json() == {"type": "ping"}
+            assert server.visitor_sockets.metrics()["sockets"] == 1
+    try:
+        with client.websocket_connect("/ws/" + "x" * 200):
+            pass
+    except WebSocketDisconnect as e:
+        assert e.code == liveness.CLOSE_POLICY
+    else:
+        raise AssertionError("oversized visitor id accepted")
+
+
+if __name__ == "__main__":
+    print("=" * 60)
+    print("SOCKET LIFECYCLE TEST")
+    print("=" * 60)
+    setup_module()
+    try:
+        for test in (test_ping_then_dead, test_idle_eviction_ignores_pongs, test_caps,
+                     test_client_address_ignores_spoofed_forwarded_for, test_endpoint_pings_and_replaces_oldest_tab):
+            test()
+            print(f"✅ {test.__name__}")
+    finally:
+        teardown_module()
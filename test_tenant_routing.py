@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+"""
+Test that traffic without a staff token reaches the right tenant shard:
+
+1. A visitor message sent with tenant 2's widget key shows up for tenant 2's
+   admin (and not tenant 1's), and their reply lands in that conversation
+2. An unknown widget key is refused instead of filed under the default tenant
+3. A text to tenant 2's Twilio number is stored in tenant 2's shard
+4. Tenant 2's conversations left in the primary file move into its shard,
+   once, and shards carry conversation tables only
+
+Runs against a throwaway database:  python3 test_tenant_routing.py
+"""
+import asyncio
+import contextlib
+import io
+import logging
+import os
+import sqlite3
+import tempfile
+
+with contextlib.redirect_stdout(io.StringIO()):
+    import server
+import shards
+from auth import create_access_token
+
+TENANT = 2
+WIDGET_KEY = "widget-key-2"
+SMS_NUMBER = "+15550002000"
+
+
+def setup_module(module=None):
+    logging.disable(logging.CRITICAL)
+    server.shard_router.close()
+    server.DB_PATH = os.path.join(tempfile.mkdtemp(), "tenants.sqlite")
+    server.db_init()
+    with server.shard_router.connect(server.DEFAULT_TENANT_ID) as conn:
+        conn.execute("INSERT INTO tenants (id, name, widget_key, sms_number) VALUES (?, 'Tenant 2', ?, ?)",
+                     (TENANT, WIDGET_KEY, SMS_NUMBER))
+
+
+def teardown_module(module=None):
+    server.shard_router.close()
+    logging.disable(logging.NOTSET)
+
+
+def auth(tenant_id: int) -> dict:
+    token = create_access_token({"id": 100 + tenant_id, "tenant_id": tenant_id, "email": f"t{tenant_id}@example.com",
+                                 "name": f"Admin {tenant_id}", "role": "admin"})
+    return {"Authorization": f"Bearer {token}"}
+
+
+def shard_rows(sql: str, args=()) -> list:
+    with server.shard_router.read(TENANT) as conn:
+        return [dict(r) for r in conn.execute(sql, args)]
+
+
+def test_visitor_message_reaches_tenant_admin():
+    from fastapi.testclient import TestClient
+
+    client = TestClient(server.app)
+    r = client.post("/webchat", params={"tenant_key": WIDGET_KEY}, json={"user_id": "visitor-t2", "text": "hello"})
+    assert r.status_code == 200
+
+    convos = client.get("/admin/api/convos", headers=auth(TENANT)).json()["conversations"]
+    assert [c["user_id"] for c in convos] == ["visitor-t2"]
+    convos = client.get("/admin/api/convos", headers=auth(server.DEFAULT_TENANT_ID)).json()["conversations"]
+    assert "visitor-t2" not in [c["user_id"] for c in convos]
+
+    r = client.post("/admin/api/send", headers=auth(TENANT),
+                    json={"user_id": "visitor-t2", "channel": "webchat", "text": "hi there"})
+    assert r.status_code == 200
+    reply = shard_rows("SELECT conversation_id FROM messages WHERE sender='staff' AND text='hi there'")
+    assert reply and reply[0]["conversation_id"] == convos_id("visitor-t2")
+
+    with client.websocket_connect(f"/ws/visitor-t2?tenant_key={WIDGET_KEY}") as ws:
+        ws.send_json({"type": "message", "text": "over the socket", "client_id": "c1"})
+        frame = ws.receive_json()
+        while frame.get("type") != "ack":
+            frame = ws.receive_json()
+    assert shard_rows("SELECT 1 FROM messages WHERE text='over the socket'")
+
+
+def convos_id(user_id: str) -> int:
+    return shard_rows("SELECT id FROM conversations WHERE user_id=?", (user_id,))[0]["id"]
+
+
+def test_unknown_widget_key_is_refused():
+    from fastapi.testclient import TestClient
+    from starlette.websockets import WebSocketDisconnect
+
+    client = TestClient(server.app)
+    r = client.post("/webchat", headers={"X-Tenant-Key": "nope"}, json={"user_id": "visitor-lost", "text": "hello"})
+    assert r.status_code == 403
+    try:
+        with client.websocket_connect("/ws/visitor-lost?tenant_key=nope"):
+            raise AssertionError("socket accepted")
+    except WebSocketDisconnect as e:
+        assert e.code == 1008
+    with server.db_read() as conn:
+        assert conn.execute("SELECT COUNT(*) FROM messages WHERE user_id='visitor-lost'").fetchone()[0] == 0
+
+
+def test_sms_to_tenant_number():
+    from fastapi.testclient import TestClient
+
+    async def drain():
+        worker = asyncio.create_task(server.sms_ingest_worker())
+        await asyncio.wait_for(server.sms_ingest_queue.join(), 10)
+        worker.cancel()
+
+    previous_queue = server.sms_ingest_queue
+    server.sms_ingest_queue = asyncio.Queue()
+    try:
+        form = {"From": "+15550003333", "To": SMS_NUMBER, "Body": "texting tenant 2", "MessageSid": "SM-tenant-2"}
+        assert TestClient(server.app).post("/sms", data=form).status_code == 200
+        assert server.sms_ingest_queue.qsize() == 1
+        asyncio.run(drain())
+    finally:
+        server.sms_ingest_queue = previous_queue
+    assert shard_rows("SELECT channel FROM messages WHERE external_id='twilio:SM-tenant-2'") == [{"channel": "sms"}]
+
+
+def test_primary_rows_move_into_shard():
+    # Rows of tenant 2 written to the primary file before its traffic was routed
+    with shards.use_tenant(server.DEFAULT_TENANT_ID), server.db() as conn:
+        conversation_id = conn.execute(
+            "INSERT INTO conversations (user_id, channel, open, tenant_id, updated_at_ms) "
+            "VALUES ('visitor-old', 'webchat', 1, ?, 0) RETURNING id", (TENANT,)).fetchone()[0]
+        for text in ("first", "second"):
+            message_id = conn.execute("INSERT INTO messages (conversation_id, user_id, channel, sender, text, ts, tenant_id) "
+                                      "VALUES (?, 'visitor-old', 'webchat', 'user', ?, '2026-01-01T00:00:00', ?)",
+                                      (conversation_id, text, TENANT)).lastrowid
+            server.search.index_message(conn, message_id, TENANT, "visitor-old", "webchat", text, "2026-01-01T00:00:00")
+        conn.execute("INSERT INTO followups (conversation_id, user_id, channel, name, message) "
+                     "VALUES (?, 'visitor-old', 'webchat', 'Old', 'call me')", (conversation_id,))
+
+    assert server.migrate_tenant_rows(TENANT) == 1
+    assert server.migrate_tenant_rows(TENANT) == 0
+    with server.db_read() as conn:
+        assert conn.execute("SELECT COUNT(*) FROM conversations WHERE tenant_id=?", (TENANT,)).fetchone()[0] == 0
+        assert conn.execute("SELECT COUNT(*) FROM messages WHERE user_id='visitor-old'").fetchone()[0] == 0
+        assert server.search.search(conn, "second", TENANT) == ([], False)
+    moved = convos_id("visitor-old")
+    assert [r["text"] for r in shard_rows("SELECT text FROM messages WHERE conversation_id=? ORDER BY id", (moved,))] \
+        == ["first", "second"]
+    assert shard_rows("SELECT name FROM followups WHERE conversation_id=?", (moved,)) == [{"name": "Old"}]
+    with shards.use_tenant(TENANT), server.db_read() as conn:
+        assert [hit["user_id"] for hit in server.search.search(conn, "second", TENANT)[0]] == ["visitor-old"]
+        assert conn.execute("SELECT total_messages FROM conversation_metrics WHERE conversation_id=?",
+                            (moved,)).fetchone()[0] == 2
+
+
+def test_shard_holds_conversation_tables_only():
+    conn = sqlite3.connect(server.shard_router.path_for(TENANT))
+    tables = {r[0] for r in conn.execute("SELECT name FROM sqlite_master WHERE type='table'")}
+    conn.close()
+    assert {"conversations", "messages", "followups", "history"} <= tables
+    assert not tables & {"users", "tenants", "leases", "events"}
+
+
+if __name__ == "__main__":
+    print("=" * 60)
+    print("TENANT ROUTING TEST")
+    print("=" * 60)
+    setup_module()
+    try:
+        for test in (test_visitor_message_reaches_tenant_admin, test_unknown_widget_key_is_refused,
+                     test_sms_to_tenant_number, test_primary_rows_move_into_shard,
+                     test_shard_holds_conversation_tables_only):
+            test()
+            print(f"✅ {test.__name__}")
+    finally:
+        teardown_module()
@@ -0,0 +1,127 @@
+"""
+Epoch-millisecond timestamps.
+
+Time-range, cutoff and ordering queries run on indexed INTEGER ``*_ms``
+columns.  The ISO-8601 ``...Z`` strings are still stored next to them
+because the admin UI, the mobile app and the CSV exports read them, but
+they are only ever produced from the same instant as the integer
+(``ms = now_ms(); iso = to_iso(ms)``) and are never compared or parsed on
+the hot paths.
+
+Columns that existed before are backfilled from their ISO twin when the
+integer column is added; the backfill can be re-run with:
+
+    python timestamps.py --backfill
+"""
+import argparse
+import datetime
+import os
+import sqlite3
+import time
+from pathlib import Path
+from typing import Optional
+
+EPOCH = datetime.datetime(1970, 1, 1)
+
+# (table, ISO column, integer column)
+COLUMNS = [
+    ("conversations", "updated_at", "updated_at_ms"),
+    ("messages", "ts", "ts_ms"),
+    ("followups", "ts", "ts_ms"),
+    ("history", "migrated_at", "migrated_at_ms"),
+]
+
+INDEXES = [
+    "CREATE INDEX IF NOT EXISTS idx_conversations_open_updated_ms ON conversations(open, updated_at_ms)",
+    "CREATE INDEX IF NOT EXISTS idx_messages_ts_ms ON messages(ts_ms)",
+    "CREATE INDEX IF NOT EXISTS idx_followups_ts_ms ON followups(ts_ms)",
+    "CREATE INDEX IF NOT EXISTS idx_history_migrated_at_ms ON history(migrated_at_ms)",
+]
+
+
+def now_ms() -> int:
+    return time.time_ns() // 1_000_000
+
+
+def to_iso(ms: Optional[int]) -> Optional[str]:
+    """API representation, same shape as ``datetime.utcnow().isoformat() + "Z"``"""
+    if ms is None:
+        return None
+    return (EPOCH + datetime.timedelta(milliseconds=ms)).isoformat() + "Z"
+
+
+def now_iso() -> str:
+    """``to_iso(now_ms())``, for payloads that are sent but not stored"""
+    return to_iso(now_ms())
+
+
+def from_iso(value: Optional[str]) -> Optional[int]:
+    if not value:
+        return None
+    try:
+        dt = datetime.datetime.fromisoformat(value.replace("Z", "").replace(" ", "T"))
+    except ValueError:
+        return None
+    if dt.tzinfo is not None:
+        dt = dt.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    return (dt - EPOCH) // datetime.timedelta(milliseconds=1)
+
+
+def ago_ms(**delta) -> int:
+    """Cutoff ``delta`` before now, e.g. ``ago_ms(days=30)``"""
+    return now_ms() - datetime.timedelta(**delta) // datetime.timedelta(milliseconds=1)
+
+
+def iso_to_ms_sql(column: str) -> str:
+    """SQL expression converting an ISO-8601 column (with or without ``Z``) to epoch ms"""
+    return f"CAST(ROUND((julianday({column}) - 2440587.5) * 86400000) AS INTEGER)"
+
+
+def backfill_column(conn, table: str, iso_column: str, ms_column: str) -> int:
+    cur = conn.execute(f"""UPDATE {table} SET {ms_column} = {iso_to_ms_sql(iso_column)}
+                           WHERE {ms_column} IS NULL AND {iso_column} IS NOT NULL""")
+    return cur.rowcount
+
+
+def init_schema(conn):
+    """Add the integer columns (backfilling the ones just added) and their indexes"""
+    for table, iso_column, ms_column in COLUMNS:
+        try:
+            conn.execute(f"ALTER TABLE {table} ADD COLUMN {ms_column} INTEGER")
+        except sqlite3.OperationalError:
+            continue  # already migrated
+        backfill_column(conn, table, iso_column, ms_column)
+    for sql in INDEXES:
+        conn.execute(sql)
+    # Superseded by idx_conversations_open_updated_ms
+    conn.execute("DROP INDEX IF EXISTS idx_conversations_open_updated")
+
+
+def backfill(conn) -> dict:
+    return {f"{table}.{ms_column}": backfill_column(conn, table, iso_column, ms_column)
+            for table, iso_column, ms_column in COLUMNS}
+
+
+def _default_db_path():
+    if os.path.exists("/data"):
+        return "/data/handoff.sqlite"
+    return str(Path(__file__).parent / "handoff.sqlite")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Epoch-ms timestamp columns")
+    parser.add_argument("--db", default=_default_db_path())
+    parser.add_argument("--backfill", action="store_true", help="fill *_ms columns from their ISO twins")
+    args = parser.parse_args()
+
+    conn = sqlite3.connect(args.db)
+    init_schema(conn)
+    if args.backfill:
+        import archive
+        counts = backfill(conn)
+        archive.attach(conn, args.db)
+        counts["archive.messages.ts_ms"] = backfill_column(conn, f"{archive.ARCHIVE_SCHEMA}.messages", "ts", "ts_ms")
+        for column, n in counts.items():
+            print(f"✅ {column}: {n} rows")
+    conn.commit()
+    conn.close()